@@ -1,179 +1,270 @@
 import os
 import time
 import logging
+import importlib
+import threading
 from flask import Flask, redirect, url_for, render_template, request, g
 from flask_login import login_required, current_user
 from functools import wraps
 
+import mysql.connector
+
+from db import init_db, warm_pool
 from utils.directory_configs import configure_directories
 from utils.template_helpers import register_template_helpers
 from utils.logging_config import setup_logging, log_api_request, log_security_event
+from utils.query_profiler import init_query_profiler
+from utils.metrics import init_metrics
+from routes.availability_materializer import MATERIALIZER_ENABLED, init_availability_materializer, start_materializer
+from routes.api.upcoming_alerts import ALERT_SCHEDULER_ENABLED, alert_scheduler, init_alert_scheduler
+from routes.chat_counters import init_chat_counters
+from routes.booking import init_booking
+from utils.image_derivatives import init_image_derivatives
+from utils.upload_store import init_upload_store
+
+from routes.login import init_login_manager
+from utils.schema_metadata import init_schema_metadata, warm_schema_metadata
+from utils.startup_profile import init_startup_profiler
+
+# Blueprints as (module, attribute, register_blueprint options), registered in this order.
+# The modules are imported by register_blueprints(), not when app.py is imported.
+BLUEPRINTS = [
+    ("routes.login", "login_bp", {}),
+    ("routes.register", "register_bp", {}),
+    ("routes.Admin_Portal.Dashboard", "admin_main", {}),
+    ("routes.Admin_Portal.Admins_Management", "admin_management", {}),
+    ("routes.Admin_Portal.Doctors_Management", "Doctors_Management", {}),
+    ("routes.Admin_Portal.Patient_Management", "patient_management", {}),
+    ("routes.Admin_Portal.Registiration_Approval_System", "registration_approval", {}),
+    ("routes.Admin_Portal.search_users", "search_users_bp", {}),
+    ("routes.Admin_Portal.Appointments", "admin_appointments_bp", {}),
+    ("routes.Doctor_Portal.Dashboard", "doctor_main", {}),
+    ("routes.Doctor_Portal.availability_management", "availability_bp", {}),
+    ("routes.Doctor_Portal.settings_management", "settings_bp", {}),
+    ("routes.Doctor_Portal.patients_management", "patients_bp", {}),
+    ("routes.Doctor_Portal.disease_management", "disease_management_bp", {}),
+    ("routes.Doctor_Portal.diet_plan_management", "diet_plans_bp", {}),
+    ("routes.Doctor_Portal.appointment_management", "appointments_bp", {}),
+    ("routes.Website.home", "home_bp", {}),
+    ("routes.Website.department", "department_bp", {}),
+    ("routes.Website.doctor", "doctor_bp", {}),
+    ("routes.Website.appointments", "appointment_bp", {}),
+    ("routes.Doctor_Portal.messaging", "messaging_bp", {}),
+    ("routes.Doctor_Portal.location_management", "locations_bp", {}),
+    ("routes.Admin_Portal.structure_management", "structure_bp", {}),
+    ("routes.Website.disease_info", "disease_info_bp", {}),
+    ("routes.Doctor_Portal.food_item_management", "food_items_bp", {}),
+    ("routes.Doctor_Portal.vaccine_management", "vaccine_management_bp", {}),
+    ("routes.Patient_Portal.profile", "patient_profile_bp", {}),
+    ("routes.Patient_Portal.medical_info", "patient_medical_info_bp", {}),
+    ("routes.Patient_Portal.patient_messaging", "patient_messaging_bp", {}),
+    ("routes.Website.vaccines", "vaccines_bp", {"url_prefix": "/vaccination-center"}),
+    ("routes.api.user_alerts", "user_alerts_bp", {}),
+    ("routes.Website.nutrition", "nutrition_bp", {"url_prefix": "/nutrition"}),
+]
+
 
-from routes.login import login_bp, init_login_manager
-from routes.register import register_bp
-
-from routes.Website.home import home_bp
-from routes.Website.department import department_bp
-from routes.Website.doctor import doctor_bp
-from routes.Website.appointments import appointment_bp
-from routes.Website.disease_info import disease_info_bp
-
-from routes.Admin_Portal.Dashboard import admin_main
-from routes.Admin_Portal.Admins_Management import admin_management
-from routes.Admin_Portal.Doctors_Management import Doctors_Management
-from routes.Admin_Portal.Patient_Management import patient_management
-from routes.Admin_Portal.Registiration_Approval_System import registration_approval
-from routes.Admin_Portal.search_users import search_users_bp
-from routes.Admin_Portal.Appointments import admin_appointments_bp
-from routes.Admin_Portal.structure_management import structure_bp
-
-from routes.Patient_Portal.profile import patient_profile_bp
-from routes.Patient_Portal.medical_info import patient_medical_info_bp
-from routes.Patient_Portal.patient_messaging import patient_messaging_bp
-from routes.Website.vaccines import vaccines_bp
-from routes.Website.nutrition import nutrition_bp
-
-from routes.Doctor_Portal.Dashboard import doctor_main
-from routes.Doctor_Portal.availability_management import availability_bp
-from routes.Doctor_Portal.settings_management import settings_bp
-from routes.Doctor_Portal.patients_management import patients_bp
-from routes.Doctor_Portal.disease_management import disease_management_bp
-from routes.Doctor_Portal.diet_plan_management import diet_plans_bp
-from routes.Doctor_Portal.appointment_management import appointments_bp
-from routes.Doctor_Portal.messaging import messaging_bp
-from routes.Doctor_Portal.location_management import locations_bp
-from routes.Doctor_Portal.food_item_management import food_items_bp
-from routes.Doctor_Portal.vaccine_management import vaccine_management_bp
-
-from routes.api.user_alerts import user_alerts_bp
-
-app = Flask(__name__)
-
-app.config["SECRET_KEY"] = os.environ.get(
-    "FLASK_SECRET_KEY", "default-insecure-secret-key-change-me!"
-)
-if app.config["SECRET_KEY"] == "default-insecure-secret-key-change-me!":
-    app.logger.warning(
-        "SECURITY WARNING: Using default SECRET_KEY. Please set FLASK_SECRET_KEY environment variable."
+def create_app(config=None):
+    """
+    Builds the application. `config` (a mapping) is applied before the
+    extensions are initialised, so it overrides their environment defaults.
+    BACKGROUND_TASKS=False defers the scheduler threads; a pre-forking server
+    then starts them in each worker with start_background_tasks().
+    LAZY_BLUEPRINTS defers importing the view modules to the first request
+    (see register_blueprints).
+    """
+    app = Flask(__name__)
+
+    app.config["SECRET_KEY"] = os.environ.get(
+        "FLASK_SECRET_KEY", "default-insecure-secret-key-change-me!"
     )
-app.config["PERMANENT_SESSION_LIFETIME"] = int(
-    os.environ.get("FLASK_SESSION_LIFETIME", 1800)
-)
-app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024
-
-configure_directories(app)
-register_template_helpers(app)
-
-setup_logging(app)
-
-init_login_manager(app)
-
-app.register_blueprint(login_bp)
-app.register_blueprint(register_bp)
-app.register_blueprint(admin_main)
-app.register_blueprint(admin_management)
-app.register_blueprint(Doctors_Management)
-app.register_blueprint(patient_management)
-app.register_blueprint(registration_approval)
-app.register_blueprint(search_users_bp)
-app.register_blueprint(admin_appointments_bp)
-app.register_blueprint(doctor_main)
-app.register_blueprint(availability_bp)
-app.register_blueprint(settings_bp)
-app.register_blueprint(patients_bp)
-app.register_blueprint(disease_management_bp)
-app.register_blueprint(diet_plans_bp)
-app.register_blueprint(appointments_bp)
-app.register_blueprint(home_bp)
-app.register_blueprint(department_bp)
-app.register_blueprint(doctor_bp)
-app.register_blueprint(appointment_bp)
-app.register_blueprint(messaging_bp)
-app.register_blueprint(locations_bp)
-app.register_blueprint(structure_bp)
-app.register_blueprint(disease_info_bp)
-app.register_blueprint(food_items_bp)
-app.register_blueprint(vaccine_management_bp)
-app.register_blueprint(patient_profile_bp)
-app.register_blueprint(patient_medical_info_bp)
-app.register_blueprint(patient_messaging_bp)
-app.register_blueprint(vaccines_bp, url_prefix="/vaccination-center")
-app.register_blueprint(user_alerts_bp)
-app.register_blueprint(nutrition_bp, url_prefix="/nutrition")
-
-
-@app.before_request
-def before_request_logging():
-    g.start_time = time.time()
-    g.request_ip = request.environ.get("HTTP_X_FORWARDED_FOR") or request.environ.get(
-        "REMOTE_ADDR"
+    app.config["PERMANENT_SESSION_LIFETIME"] = int(
+        os.environ.get("FLASK_SESSION_LIFETIME", 1800)
     )
+    app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024
+    app.config["BACKGROUND_TASKS"] = True
+    app.config["LAZY_BLUEPRINTS"] = os.environ.get("LAZY_BLUEPRINTS", "True").lower() in ["true", "1", "t"]
+    if config:
+        app.config.from_mapping(config)
 
+    configure_directories(app)
+    register_template_helpers(app)
 
-@app.after_request
-def after_request_logging(response):
-    if hasattr(g, "start_time"):
-        duration = (time.time() - g.start_time) * 1000
-        user_id = current_user.get_id() if current_user.is_authenticated else None
-        log_api_request(
-            method=request.method,
-            path=request.path,
-            status_code=response.status_code,
-            duration_ms=duration,
-            user_id=user_id,
-            ip_address=getattr(g, "request_ip", None),
+    setup_logging(app)
+    if app.config["SECRET_KEY"] == "default-insecure-secret-key-change-me!":
+        app.logger.warning(
+            "SECURITY WARNING: Using default SECRET_KEY. Please set FLASK_SECRET_KEY environment variable."
         )
-    return response
+    init_sentry(app)
 
+    init_db(app)
+    init_query_profiler(app)
+    init_metrics(app)
+    init_login_manager(app)
+    init_availability_materializer(app)
+    init_alert_scheduler(app)
+    init_chat_counters(app)
+    init_booking(app)
+    init_image_derivatives(app)
+    init_upload_store(app)
+    init_schema_metadata(app)
 
-@app.errorhandler(404)
-def handle_not_found(e):
-    return {"error": "Not Found"}, 404
+    init_startup_profiler(app)
 
+    app.extensions["blueprints_lock"] = threading.Lock()
+    if app.config["LAZY_BLUEPRINTS"]:
+        app.wsgi_app = _LazyBlueprintLoader(app, app.wsgi_app)
+    else:
+        register_blueprints(app)
 
-@app.errorhandler(Exception)
-def handle_exception(e):
-    app.logger.exception(f"Unhandled exception: {e}")
-    log_security_event(
-        event_type="UNHANDLED_EXCEPTION",
-        user_id=current_user.get_id() if current_user.is_authenticated else None,
-        ip_address=request.environ.get("REMOTE_ADDR"),
-        details={"error": str(e), "path": request.path},
-    )
-    return {"error": "Internal Server Error"}, 500
+    register_core_routes(app)
+    return app
 
 
-@app.route("/health")
-def health_check():
-    return "OK", 200
+def register_blueprints(app):
+    """
+    Imports the BLUEPRINTS modules and registers them; later calls do nothing.
+    With LAZY_BLUEPRINTS this runs just before the first request is
+    dispatched, so a process that only runs CLI commands or is still starting
+    up never pays for the view imports. warm_up() calls it to load them ahead
+    of traffic.
+    """
+    if app.extensions.get("blueprints_loaded"):
+        return
+    with app.extensions["blueprints_lock"]:
+        if app.extensions.get("blueprints_loaded"):
+            return
+        started = time.perf_counter()
+        for module_name, attribute, options in BLUEPRINTS:
+            app.register_blueprint(getattr(importlib.import_module(module_name), attribute), **options)
+        app.extensions["blueprints_loaded"] = True
+    app.logger.info(f"Registered {len(BLUEPRINTS)} blueprints in {time.perf_counter() - started:.2f}s")
 
 
-@app.route("/api/0/organizations/health-guide/heartbeat_check/<uuid>")
-@app.route("/api/0/organizations/health-guide/heartbeat_check/<uuid>/")
-def heartbeat_check(uuid):
-    return {"status": "ok", "uuid": uuid}, 200
+class _LazyBlueprintLoader:
+    """WSGI middleware that registers the blueprints before the first request reaches Flask, then steps aside."""
 
+    def __init__(self, app, wsgi_app):
+        self.app = app
+        self.wsgi_app = wsgi_app
 
-if __name__ == "__main__":
+    def __call__(self, environ, start_response):
+        register_blueprints(self.app)
+        self.app.wsgi_app = self.wsgi_app
+        return self.wsgi_app(environ, start_response)
+
+
+def register_core_routes(app):
+    @app.before_request
+    def before_request_logging():
+        g.start_time = time.time()
+        g.request_ip = request.environ.get("HTTP_X_FORWARDED_FOR") or request.environ.get(
+            "REMOTE_ADDR"
+        )
+
+    @app.after_request
+    def after_request_logging(response):
+        if hasattr(g, "start_time"):
+            duration = (time.time() - g.start_time) * 1000
+            user_id = current_user.get_id() if current_user.is_authenticated else None
+            log_api_request(
+                method=request.method,
+                path=request.path,
+                status_code=response.status_code,
+                duration_ms=duration,
+                user_id=user_id,
+                ip_address=getattr(g, "request_ip", None),
+            )
+        return response
+
+    @app.errorhandler(404)
+    def handle_not_found(e):
+        return {"error": "Not Found"}, 404
+
+    @app.errorhandler(Exception)
+    def handle_exception(e):
+        app.logger.exception(f"Unhandled exception: {e}")
+        log_security_event(
+            event_type="UNHANDLED_EXCEPTION",
+            user_id=current_user.get_id() if current_user.is_authenticated else None,
+            ip_address=request.environ.get("REMOTE_ADDR"),
+            details={"error": str(e), "path": request.path},
+        )
+        return {"error": "Internal Server Error"}, 500
+
+    @app.route("/health")
+    def health_check():
+        return "OK", 200
+
+    @app.route("/api/0/organizations/health-guide/heartbeat_check/<uuid>")
+    @app.route("/api/0/organizations/health-guide/heartbeat_check/<uuid>/")
+    def heartbeat_check(uuid):
+        return {"status": "ok", "uuid": uuid}, 200
+
+
+def init_sentry(app):
     sentry_dsn = os.environ.get("SENTRY_DSN")
-    if sentry_dsn:
+    if not sentry_dsn:
+        return
+    try:
+        import sentry_sdk
+        from sentry_sdk.integrations.flask import FlaskIntegration
+
+        sentry_sdk.init(
+            dsn=sentry_dsn,
+            integrations=[FlaskIntegration()],
+            traces_sample_rate=0.01,
+            environment=os.environ.get("SENTRY_ENVIRONMENT", "production"),
+            auto_session_tracking=False,
+        )
+        app.logger.info(f"Sentry initialized: {sentry_dsn}")
+    except ImportError:
+        app.logger.warning("Sentry SDK not installed")
+
+
+# --- Serving lifecycle (see wsgi.py / gunicorn.conf.py) ---
+def start_background_tasks(app):
+    """Starts the scheduler threads deferred by BACKGROUND_TASKS=False; call once per worker process."""
+    if MATERIALIZER_ENABLED:
+        start_materializer(app)
+    if ALERT_SCHEDULER_ENABLED:
+        alert_scheduler.start()
+
+
+def warm_up(app):
+    """
+    Work done once before serving, in the master when the server preloads the
+    app, so forked workers share the result: imports the view modules,
+    loads the ENUM column definitions and compiles every template.
+    """
+    register_blueprints(app)
+    warm_schema_metadata()
+    started = time.perf_counter()
+    compiled = 0
+    for name in app.jinja_env.list_templates(filter_func=lambda name: name.endswith(".html")):
         try:
-            import sentry_sdk
-            from sentry_sdk.integrations.flask import FlaskIntegration
-
-            sentry_sdk.init(
-                dsn=sentry_dsn,
-                integrations=[FlaskIntegration()],
-                traces_sample_rate=0.01,
-                environment=os.environ.get("SENTRY_ENVIRONMENT", "production"),
-                auto_session_tracking=False,
-            )
-            app.logger.info(f"Sentry initialized: {sentry_dsn}")
-        except ImportError:
-            app.logger.warning("Sentry SDK not installed")
+            app.jinja_env.get_template(name)
+            compiled += 1
+        except Exception as e:
+            app.logger.warning(f"Warm-up: template {name} failed to compile: {e}")
+    app.logger.info(f"Warm-up: compiled {compiled} templates in {time.perf_counter() - started:.2f}s")
+
 
+def warm_up_worker(app, db_connections=2):
+    """Per-worker warm-up after fork: opens `db_connections` pooled connections ahead of the first requests."""
+    try:
+        opened = warm_pool(db_connections)
+    except mysql.connector.Error as e:
+        app.logger.warning(f"Warm-up: could not open DB connections: {e}")
+        return
+    app.logger.info(f"Warm-up: {opened} DB connections ready in worker {os.getpid()}")
+
+
+if __name__ == "__main__":
+    # Development server; production runs wsgi:app under gunicorn (see gunicorn.conf.py).
+    app = create_app()
     host = os.environ.get("FLASK_RUN_HOST", "0.0.0.0")
     port = int(os.environ.get("FLASK_RUN_PORT", 54321))
-    debug = os.environ.get("FLASK_DEBUG", "True").lower() in ["true", "1", "t"]
+    debug = os.environ.get("FLASK_DEBUG", "False").lower() in ["true", "1", "t"]
     app.logger.info(f"Starting Flask app on {host}:{port} (Debug: {debug})")
     app.run(debug=debug, host=host, port=port)
@@ -0,0 +1,110 @@
+# benchmarks/bench_intervals.py
+"""
+Microbenchmark: slot conflict subtraction, legacy datetime loops vs IntervalSet.
+
+Compares the original per-day calculation (every booking checked against every
+candidate slot with datetime.combine + timedelta) with
+routes.availability_engine.compute_day_slots, which merges bookings and
+blocking overrides into IntervalSets and tests each slot with one bisect.
+No database is needed; inputs are generated in memory.
+
+Run from the repository root:
+    python -m benchmarks.bench_intervals [--repeat 200]
+"""
+import argparse
+import random
+import timeit
+from datetime import date, datetime, time, timedelta
+
+from routes.availability_engine import compute_day_slots, minutes_to_str, python_dow_to_db_dow
+
+DAY = date(2030, 1, 7)
+
+
+def _t(minutes):
+    return time(minutes // 60, minutes % 60)
+
+
+def _legacy_generate(start_t, end_t, interval):
+    slots = []
+    current = datetime.combine(date.min, start_t)
+    end = datetime.combine(date.min, end_t)
+    while current + timedelta(minutes=interval) <= end:
+        slots.append(current.time())
+        current += timedelta(minutes=interval)
+    return slots
+
+
+def legacy_day_slots(periods, overrides, bookings, interval):
+    """The original per-day algorithm with the database reads removed."""
+    slots = set()
+    for start, end in periods:
+        slots.update(_legacy_generate(_t(start), _t(end), interval))
+    for o_start, o_end, is_unavailable in overrides:
+        if is_unavailable:
+            o_start_t, o_end_t = _t(o_start), _t(o_end)
+            slots.difference_update({
+                s for s in slots
+                if s >= o_start_t and (datetime.combine(date.min, s) + timedelta(minutes=interval)).time() <= o_end_t
+            })
+    for b_start, b_end in bookings:
+        b_start_t, b_end_t = _t(b_start), _t(b_end)
+        to_remove = set()
+        for s in slots:
+            slot_end = datetime.combine(date.min, s) + timedelta(minutes=interval)
+            if s < b_end_t and slot_end.time() > b_start_t:
+                to_remove.add(s)
+        slots.difference_update(to_remove)
+    for o_start, o_end, is_unavailable in overrides:
+        if not is_unavailable:
+            slots.update(_legacy_generate(_t(o_start), _t(o_end), interval))
+    return [s.strftime('%H:%M') for s in sorted(slots)]
+
+
+def build_day(interval, n_bookings, n_overrides, rng):
+    periods = [(7 * 60, 12 * 60), (13 * 60, 21 * 60)]
+    overrides = []
+    for _ in range(n_overrides):
+        start = rng.randrange(8 * 60, 19 * 60, 5)
+        overrides.append((start, start + rng.choice([30, 60, 90]), True))
+    bookings = []
+    for _ in range(n_bookings):
+        start = rng.randrange(7 * 60, 21 * 60 - interval, interval)
+        bookings.append((start, start + interval))
+    return periods, overrides, bookings
+
+
+def run(repeat):
+    rng = random.Random(42)
+    dow = python_dow_to_db_dow(DAY.weekday())
+    scenarios = [
+        ("30-min slots, 5 bookings", 30, 5, 1),
+        ("15-min slots, 40 bookings", 15, 40, 3),
+        ("10-min slots, 80 bookings", 10, 80, 5),
+        ("5-min slots, 160 bookings", 5, 160, 10),
+    ]
+    print(f"{'scenario':<30}{'legacy ms':>12}{'interval ms':>14}{'speedup':>10}")
+    for label, interval, n_bookings, n_overrides in scenarios:
+        periods, overrides, bookings = build_day(interval, n_bookings, n_overrides, rng)
+        inputs = {
+            'periods_by_dow': {dow: periods},
+            'overrides_by_date': {DAY: overrides},
+            'bookings_by_date': {DAY: bookings},
+            'caps_by_dow': {},
+        }
+        legacy = legacy_day_slots(periods, overrides, bookings, interval)
+        current = [minutes_to_str(m) for m in compute_day_slots(DAY, inputs, interval)]
+        if legacy != current:
+            raise SystemExit(f"{label}: results differ ({len(legacy)} vs {len(current)} slots)")
+
+        legacy_s = min(timeit.repeat(lambda: legacy_day_slots(periods, overrides, bookings, interval), number=repeat, repeat=3))
+        current_s = min(timeit.repeat(lambda: compute_day_slots(DAY, inputs, interval), number=repeat, repeat=3))
+        legacy_ms = legacy_s / repeat * 1000
+        current_ms = current_s / repeat * 1000
+        print(f"{label:<30}{legacy_ms:>12.3f}{current_ms:>14.3f}{legacy_ms / current_ms:>9.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=200, help='calls per timing sample')
+    run(parser.parse_args().repeat)
@@ -0,0 +1,165 @@
+# benchmarks/bench_wsgi.py
+"""
+Load benchmark: the development server (python app.py) against the
+production entry point (gunicorn -c gunicorn.conf.py wsgi:app).
+
+Each server is started as a subprocess on its own port and polled on
+/health until it answers. Then it is loaded for --duration seconds by
+--concurrency client threads, which request --paths round-robin over
+keep-alive connections. The report gives throughput, error count and
+latency percentiles per server.
+
+/health needs nothing else. Pages that read the database need the usual
+MYSQL_* variables, e.g. --paths /health,/,/departments. gunicorn must be
+installed (requirements.txt).
+
+Run from the repository root:
+    python -m benchmarks.bench_wsgi [--duration 20] [--concurrency 32] [--paths /health,/]
+"""
+import argparse
+import http.client
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Dev server vs gunicorn throughput")
+    parser.add_argument('--paths', default='/health', help='comma-separated paths requested round-robin')
+    parser.add_argument('--duration', type=float, default=15.0, help='seconds of load per server')
+    parser.add_argument('--concurrency', type=int, default=32, help='client threads')
+    parser.add_argument('--port', type=int, default=54400, help='first port; the second server uses port + 1')
+    parser.add_argument('--workers', type=int, default=None, help='GUNICORN_WORKERS (default: gunicorn.conf.py)')
+    parser.add_argument('--threads', type=int, default=None, help='GUNICORN_THREADS (default: gunicorn.conf.py)')
+    parser.add_argument('--only', choices=['dev', 'gunicorn'], help='benchmark a single server')
+    return parser.parse_args()
+
+
+def server_commands(args):
+    yield 'dev', [sys.executable, 'app.py'], {}
+    overrides = {}
+    if args.workers:
+        overrides['GUNICORN_WORKERS'] = str(args.workers)
+    if args.threads:
+        overrides['GUNICORN_THREADS'] = str(args.threads)
+    yield 'gunicorn', [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'], overrides
+
+
+def wait_until_ready(port, process, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode} before answering")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+        except OSError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"server on port {port} not ready after {timeout:.0f}s")
+
+
+def load(port, paths, duration, concurrency):
+    """Runs the client threads; returns (latencies in ms, errors, elapsed seconds)."""
+    deadline = time.monotonic() + duration
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client(offset):
+        local_latencies = []
+        local_errors = 0
+        path_cycle = itertools.islice(itertools.cycle(paths), offset % len(paths), None)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.monotonic() < deadline:
+            path = next(path_cycle)
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 500:
+                    local_errors += 1
+                else:
+                    local_latencies.append((time.perf_counter() - started) * 1000)
+                if response.will_close:
+                    conn.close()
+                    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.monotonic() - started
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run_server(name, command, overrides, port, args, paths):
+    env = dict(os.environ, FLASK_RUN_PORT=str(port), FLASK_RUN_HOST='127.0.0.1', FLASK_DEBUG='False', **overrides)
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(port, process)
+        load(port, paths, min(2.0, args.duration), args.concurrency)  # warm-up, not reported
+        latencies, errors, elapsed = load(port, paths, args.duration, args.concurrency)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    latencies.sort()
+    return {
+        'name': name,
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+    }
+
+
+def main():
+    args = parse_args()
+    paths = [path.strip() for path in args.paths.split(',') if path.strip()]
+    results = []
+    for offset, (name, command, overrides) in enumerate(server_commands(args)):
+        if args.only and args.only != name:
+            continue
+        print(f"{name}: {' '.join(command[1:])} ...", flush=True)
+        results.append(run_server(name, command, overrides, args.port + offset, args, paths))
+
+    print(f"\npaths={','.join(paths)} concurrency={args.concurrency} duration={args.duration:.0f}s")
+    print(f"{'server':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for result in results:
+        print(f"{result['name']:<10} {result['requests']:>9} {result['errors']:>7} {result['rps']:>9.1f} "
+              f"{result['p50']:>8.2f} {result['p95']:>8.2f} {result['p99']:>8.2f}")
+    if len(results) == 2 and results[0]['rps']:
+        print(f"\ngunicorn / dev throughput: {results[1]['rps'] / results[0]['rps']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
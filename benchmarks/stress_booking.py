@@ -0,0 +1,161 @@
+# benchmarks/stress_booking.py
+"""
+Concurrency stress test for routes.booking.book_appointment.
+
+Fires hundreds of parallel bookings at the same doctor/location/slot, with a
+share of them re-submitting an earlier idempotency key, and then checks that:
+
+  * exactly one appointment was inserted for the slot,
+  * every other fresh submission was rejected as slot_taken,
+  * every re-submitted key returned the appointment of its first submission
+    (or the same rejection) and never inserted a second row.
+
+It talks to the database configured by the usual MYSQL_* variables and needs
+the tables from migrations/001_booking_locks.sql. The doctor, location,
+patient and appointment type must already exist; the slot should be free.
+Rows created by the run are deleted afterwards unless --keep is given.
+
+Run from the repository root:
+    python -m benchmarks.stress_booking --doctor-id 43 --location-id 2 \\
+        --patient-id 46 --type-id 7 --date 2030-01-07 --time 10:00
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import date, datetime
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Parallel booking stress test")
+    parser.add_argument('--doctor-id', type=int, required=True)
+    parser.add_argument('--location-id', type=int, required=True)
+    parser.add_argument('--patient-id', type=int, required=True)
+    parser.add_argument('--type-id', type=int, required=True)
+    parser.add_argument('--date', type=date.fromisoformat, required=True, help='YYYY-MM-DD, in the future')
+    parser.add_argument('--time', required=True, help='HH:MM slot start')
+    parser.add_argument('--bookings', type=int, default=300, help='total submissions')
+    parser.add_argument('--concurrency', type=int, default=50, help='worker threads')
+    parser.add_argument('--duplicate-every', type=int, default=4,
+                        help='every Nth submission re-uses an earlier idempotency key (0 disables)')
+    parser.add_argument('--keep', action='store_true', help='leave created rows in the database')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # Every worker holds a pooled connection while it waits on the day lock.
+    os.environ.setdefault('MYSQL_POOL_SIZE', str(args.concurrency + 2))
+    os.environ.setdefault('MYSQL_POOL_TIMEOUT', '60')
+
+    import db
+    from routes.booking import BookingError, book_appointment
+
+    start_time = datetime.strptime(args.time, '%H:%M').time()
+    run_id = uuid.uuid4().hex[:12]
+    keys = []
+    for i in range(args.bookings):
+        if args.duplicate_every and i and i % args.duplicate_every == 0:
+            keys.append(keys[i - 1])
+        else:
+            keys.append(f"stress-{run_id}-{i}")
+
+    outcomes = [None] * args.bookings
+    latencies = [0.0] * args.bookings
+    next_index = iter(range(args.bookings))
+    index_lock = threading.Lock()
+    barrier = threading.Barrier(args.concurrency)
+
+    def worker():
+        barrier.wait()
+        while True:
+            with index_lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            started = time.perf_counter()
+            try:
+                appointment_id, replayed = book_appointment(
+                    patient_id=args.patient_id, doctor_id=args.doctor_id, location_id=args.location_id,
+                    appointment_date=args.date, start_time=start_time, appointment_type_id=args.type_id,
+                    reason='booking stress test', idempotency_key=keys[i]
+                )
+                outcomes[i] = ('replayed' if replayed else 'booked', appointment_id)
+            except BookingError as be:
+                outcomes[i] = (be.reason, None)
+            except Exception as e:
+                outcomes[i] = ('error', repr(e))
+            latencies[i] = (time.perf_counter() - started) * 1000
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    wall_started = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall_ms = (time.perf_counter() - wall_started) * 1000
+
+    counts = Counter(kind for kind, _ in outcomes)
+    booked_ids = {value for kind, value in outcomes if kind == 'booked'}
+    failures = []
+
+    if counts['booked'] != 1:
+        failures.append(f"expected exactly 1 booking, got {counts['booked']}: {sorted(booked_ids)}")
+    for kind, value in outcomes:
+        if kind == 'error':
+            failures.append(f"unexpected error: {value}")
+        elif kind not in ('booked', 'replayed', 'slot_taken'):
+            failures.append(f"submission rejected as {kind}, expected slot_taken")
+    first_outcome_by_key = {}
+    kinds_by_key = {}
+    for key, (kind, value) in zip(keys, outcomes):
+        kinds_by_key.setdefault(key, Counter())[kind] += 1
+        if kind == 'replayed' and value not in booked_ids:
+            failures.append(f"key {key} replayed unknown appointment {value}")
+        if kind in ('booked', 'replayed'):
+            previous = first_outcome_by_key.setdefault(key, value)
+            if previous != value:
+                failures.append(f"key {key} returned both {previous} and {value}")
+    # A key's submissions either all lost the slot, or one booked it and the rest replayed that booking.
+    for key, kinds in kinds_by_key.items():
+        if kinds['slot_taken'] and (kinds['booked'] or kinds['replayed']):
+            failures.append(f"key {key} was both rejected and booked: {dict(kinds)}")
+        elif kinds['replayed'] and not kinds['booked']:
+            failures.append(f"key {key} replayed a booking none of its submissions made: {dict(kinds)}")
+
+    with db.connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT COUNT(*) AS n FROM appointments
+            WHERE doctor_id = %s AND doctor_location_id = %s AND appointment_date = %s
+            AND start_time = %s AND status NOT IN ('canceled', 'rescheduled', 'no-show')
+        """, (args.doctor_id, args.location_id, args.date, start_time))
+        active_rows = cursor.fetchone()['n']
+        if active_rows != 1:
+            failures.append(f"expected 1 active appointment row for the slot, found {active_rows}")
+
+        if not args.keep:
+            if booked_ids:
+                placeholders = ', '.join(['%s'] * len(booked_ids))
+                cursor.execute(f"DELETE FROM appointments WHERE appointment_id IN ({placeholders})", tuple(booked_ids))
+            cursor.execute("DELETE FROM appointment_booking_requests WHERE patient_id = %s AND idempotency_key LIKE %s",
+                           (args.patient_id, f"stress-{run_id}-%"))
+            conn.commit()
+        cursor.close()
+
+    ordered = sorted(latencies)
+    print(f"submissions: {args.bookings}  threads: {args.concurrency}  wall: {wall_ms:.0f} ms")
+    print("outcomes:    " + ", ".join(f"{kind}={n}" for kind, n in sorted(counts.items())))
+    print(f"latency ms:  p50={ordered[len(ordered) // 2]:.1f}  p95={ordered[int(len(ordered) * 0.95) - 1]:.1f}  max={ordered[-1]:.1f}")
+    print(f"pool:        {db.pool_stats()}")
+    if failures:
+        print("FAILED")
+        for failure in failures[:20]:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("OK: one appointment, no duplicates")
+
+
+if __name__ == '__main__':
+    main()
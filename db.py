@@ -1,18 +1,708 @@
 import os
+import time
+import logging
+import threading
+import itertools
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
 import mysql.connector
 from mysql.connector import Error
+from urllib.parse import urlparse, unquote
+from flask import g, has_request_context, session
+
+from utils.metrics import Counter, Gauge, Histogram, register_collector
+from utils.query_profiler import profile_cursor
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_bool(name, default):
+    return str(os.environ.get(name, default)).lower() in ["true", "1", "t", "yes"]
+
+
+DB_CONFIG = {
+    "host": os.environ.get("MYSQL_HOST", "127.0.0.1"),
+    "port": _env_int("MYSQL_PORT", 3306),
+    "database": os.environ.get("MYSQL_DATABASE", "Health_Guide"),
+    "user": os.environ.get("MYSQL_USER", "root"),
+    "password": os.environ.get("MYSQL_PASSWORD", ""),
+}
+
+# --- Pool Settings (overridable through the environment) ---
+POOL_SIZE = _env_int("MYSQL_POOL_SIZE", 10)
+POOL_TIMEOUT_SECONDS = _env_float("MYSQL_POOL_TIMEOUT", 10.0)
+POOL_MAX_LIFETIME_SECONDS = _env_float("MYSQL_POOL_MAX_LIFETIME", 1800.0)
+POOL_PRE_PING = _env_bool("MYSQL_POOL_PRE_PING", "True")
+POOL_SLOW_CHECKOUT_MS = _env_float("MYSQL_POOL_SLOW_CHECKOUT_MS", 250.0)
+
+# --- Read Replicas ---
+# Comma-separated DSNs, e.g. "mysql://reader:pw@replica1:3306/Health_Guide,replica2:3307".
+# Any part left out of a DSN falls back to the primary's DB_CONFIG value.
+REPLICA_URLS = os.environ.get("MYSQL_REPLICA_URLS", "")
+REPLICA_STRATEGY = os.environ.get("MYSQL_REPLICA_STRATEGY", "round_robin")  # or "least_latency"
+REPLICA_POOL_SIZE = _env_int("MYSQL_REPLICA_POOL_SIZE", POOL_SIZE)
+REPLICA_RETRY_SECONDS = _env_float("MYSQL_REPLICA_RETRY_SECONDS", 30.0)
+# A replica whose pool is exhausted is passed over after this long instead of
+# holding the request for the full MYSQL_POOL_TIMEOUT; the next replica or the
+# primary serves the read.
+REPLICA_CHECKOUT_TIMEOUT_SECONDS = _env_float("MYSQL_REPLICA_CHECKOUT_TIMEOUT", 0.25)
+# After a commit on the primary, reads from the same session stay on the primary
+# for this long so users always see their own writes despite replication lag.
+REPLICA_STICKY_SECONDS = _env_float("MYSQL_REPLICA_STICKY_SECONDS", 5.0)
+
+DB_CONNECTIONS_OPENED = Counter("db_connections_opened_total", "MySQL connections opened, by pool.", ["pool"])
+DB_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection, by pool.", ["pool"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 1.0, 5.0),
+)
+DB_POOL_CONNECTIONS = Gauge("db_pool_connections", "Open pooled connections, by pool and state (idle, in_use).",
+                            ["pool", "state"])
+
+
+class PoolTimeoutError(Error):
+    """Raised when no pooled connection becomes free within the checkout timeout."""
+
+
+class PooledConnection:
+    """
+    Thin proxy around a mysql.connector connection borrowed from a ConnectionPool.
+
+    Everything is delegated to the real connection except close(), which hands
+    the connection back to the pool instead of tearing down the socket. After
+    close() the proxy reports is_connected() == False, so the usual
+    `if conn and conn.is_connected(): conn.close()` cleanup stays a no-op when
+    repeated.
+    """
+
+    _own_attrs = ("_pool", "_raw", "_created_at", "_released")
+
+    def __init__(self, pool, raw_connection, created_at):
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "_raw", raw_connection)
+        object.__setattr__(self, "_created_at", created_at)
+        object.__setattr__(self, "_released", False)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __setattr__(self, name, value):
+        if name in self._own_attrs:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._raw, name, value)
+
+    def is_connected(self):
+        if self._released:
+            return False
+        return self._raw.is_connected()
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        self._pool.release(self._raw, self._created_at)
+
+    def discard(self):
+        """Closes the underlying connection instead of returning it to the pool."""
+        if self._released:
+            return
+        self._released = True
+        self._pool.release(self._raw, self._created_at, discard=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class ConnectionPool:
+    """
+    Process-wide, thread-safe pool of MySQL connections.
+
+    - size: maximum number of connections open at once (idle + checked out).
+    - timeout: seconds a caller waits for a free connection before PoolTimeoutError.
+    - max_lifetime: connections older than this are closed and replaced on borrow.
+    - pre_ping: ping idle connections on borrow and replace dead ones.
+    """
+
+    def __init__(self, config, size=POOL_SIZE, timeout=POOL_TIMEOUT_SECONDS,
+                 max_lifetime=POOL_MAX_LIFETIME_SECONDS, pre_ping=POOL_PRE_PING, name="primary",
+                 init_statements=None):
+        self.config = dict(config)
+        self.init_statements = list(init_statements or [])
+        self.latency_ms = None  # EWMA of connect/ping round trips, used for replica selection
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.pre_ping = pre_ping
+        self.name = name
+        self.pid = os.getpid()
+        self._idle = deque()  # (raw_connection, created_at)
+        self._open_count = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._stats = {
+            "connections_opened": 0,
+            "connections_closed": 0,
+            "checkouts": 0,
+            "reused": 0,
+            "ping_failures": 0,
+            "expired": 0,
+            "timeouts": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+        }
+
+    # --- Internal helpers ---
+    def _observe_latency(self, elapsed_ms):
+        with self._cond:
+            if self.latency_ms is None:
+                self.latency_ms = elapsed_ms
+            else:
+                self.latency_ms = 0.8 * self.latency_ms + 0.2 * elapsed_ms
+
+    def _open_raw(self):
+        started = time.monotonic()
+        raw = mysql.connector.connect(**self.config)
+        if self.init_statements:
+            cursor = raw.cursor()
+            try:
+                for statement in self.init_statements:
+                    cursor.execute(statement)
+            finally:
+                cursor.close()
+        self._observe_latency((time.monotonic() - started) * 1000)
+        with self._cond:
+            self._stats["connections_opened"] += 1
+        DB_CONNECTIONS_OPENED.inc(pool=self.name)
+        return raw
+
+    def _close_raw(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats["connections_closed"] += 1
+
+    def _forget_slot(self):
+        with self._cond:
+            self._open_count -= 1
+            self._cond.notify()
+
+    def _is_usable(self, raw, created_at):
+        if self.max_lifetime and (time.monotonic() - created_at) > self.max_lifetime:
+            with self._cond:
+                self._stats["expired"] += 1
+            return False
+        if self.pre_ping:
+            started = time.monotonic()
+            try:
+                if not raw.is_connected():
+                    raise Error("ping failed")
+                self._observe_latency((time.monotonic() - started) * 1000)
+            except Exception:
+                with self._cond:
+                    self._stats["ping_failures"] += 1
+                return False
+        return True
+
+    # --- Public API ---
+    def acquire(self, timeout=None):
+        """Borrows a connection, waiting up to `timeout` seconds for a free slot."""
+        timeout = self.timeout if timeout is None else timeout
+        wait_started = time.monotonic()
+        deadline = wait_started + timeout
+
+        while True:
+            candidate = None
+            with self._cond:
+                while not self._idle and self._open_count >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            msg=f"Timed out after {timeout:.1f}s waiting for a '{self.name}' DB connection "
+                                f"(pool size {self.size})."
+                        )
+                    self._cond.wait(remaining)
+                if self._idle:
+                    candidate = self._idle.pop()
+                else:
+                    self._open_count += 1
+
+            if candidate is not None:
+                raw, created_at = candidate
+                if not self._is_usable(raw, created_at):
+                    self._close_raw(raw)
+                    self._forget_slot()
+                    continue
+                reused = True
+            else:
+                try:
+                    raw = self._open_raw()
+                except Exception:
+                    self._forget_slot()
+                    raise
+                created_at = time.monotonic()
+                reused = False
+
+            waited_ms = (time.monotonic() - wait_started) * 1000
+            with self._cond:
+                self._stats["checkouts"] += 1
+                if reused:
+                    self._stats["reused"] += 1
+                self._stats["wait_ms_total"] += waited_ms
+                self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], waited_ms)
+            DB_CHECKOUT_WAIT.observe(waited_ms / 1000, pool=self.name)
+            if waited_ms > POOL_SLOW_CHECKOUT_MS:
+                logger.warning(f"Slow DB connection checkout from '{self.name}' pool: {waited_ms:.1f}ms")
+            return PooledConnection(self, raw, created_at)
+
+    def release(self, raw, created_at, discard=False):
+        """Returns a connection to the pool, resetting any transaction state left behind."""
+        if not discard:
+            try:
+                if raw.in_transaction:
+                    raw.rollback()
+                if raw.autocommit:
+                    raw.autocommit = False
+            except Exception as e:
+                logger.warning(f"Discarding '{self.name}' DB connection that failed to reset: {e}")
+                discard = True
+        if discard or os.getpid() != self.pid:
+            self._close_raw(raw)
+            self._forget_slot()
+            return
+        with self._cond:
+            self._idle.append((raw, created_at))
+            self._cond.notify()
+
+    def dispose(self):
+        """Closes every idle connection (checked-out ones are closed on release)."""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open_count -= len(idle)
+            self._cond.notify_all()
+        for raw, _ in idle:
+            self._close_raw(raw)
+
+    def stats(self):
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot.update(
+                name=self.name,
+                size=self.size,
+                open=self._open_count,
+                idle=len(self._idle),
+                in_use=self._open_count - len(self._idle),
+                latency_ms=self.latency_ms,
+            )
+        return snapshot
+
+
+class RequestConnection:
+    """
+    The connection shared by every helper running inside one HTTP request.
+
+    Transaction semantics:
+    - Helpers keep calling commit()/rollback() exactly as before; those act on
+      the single shared transaction.
+    - get_db_connection() and connection() hand each helper its own
+      RequestConnectionHandle. Closing a handle does not return the
+      connection to the pool; it stays checked out until the request's
+      teardown hook releases it.
+    - When the last open handle is closed, anything still uncommitted is
+      rolled back. That matches the old behaviour of a helper closing its own
+      connection without committing, so a helper that returned early or failed
+      cannot leave writes for the next helper's commit() to pick up. Anything
+      still uncommitted at teardown is rolled back as well.
+    - start_transaction() ends an implicitly open transaction first. If no
+      other helper holds a handle, it is rolled back: it is either plain
+      SELECTs or stray writes nobody will commit. If another helper is still
+      using the connection, its pending work is committed, which is what
+      MySQL's START TRANSACTION does.
+    - Cursors default to buffered=True so a helper that leaves rows unread
+      cannot break the next helper's query, and are wrapped by the SQL
+      profiler when SQL_PROFILING is on.
+    """
+
+    _own_attrs = ("_pooled", "read_only", "_open_handles")
+
+    def __init__(self, pooled_connection, read_only=False):
+        object.__setattr__(self, "_pooled", pooled_connection)
+        object.__setattr__(self, "read_only", read_only)
+        object.__setattr__(self, "_open_handles", 0)
+
+    def __getattr__(self, name):
+        return getattr(self._pooled, name)
+
+    def __setattr__(self, name, value):
+        if name in self._own_attrs:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._pooled, name, value)
+
+    def cursor(self, *args, **kwargs):
+        if not args and not kwargs.get("prepared"):
+            kwargs.setdefault("buffered", True)
+        return profile_cursor(self._pooled.cursor(*args, **kwargs))
+
+    def commit(self):
+        self._pooled.commit()
+        if not self.read_only:
+            _note_primary_write()
+
+    def start_transaction(self, *args, **kwargs):
+        if self._pooled.in_transaction:
+            if self._open_handles > 1:
+                self.commit()
+            else:
+                self._pooled.rollback()
+        return self._pooled.start_transaction(*args, **kwargs)
+
+    def is_connected(self):
+        return self._pooled.is_connected()
+
+    def close(self):
+        pass
 
+    def handle(self):
+        self._open_handles += 1
+        return RequestConnectionHandle(self)
 
-def get_db_connection():
+    def _handle_closed(self):
+        self._open_handles -= 1
+        if self._open_handles > 0:
+            return
+        try:
+            if self._pooled.in_transaction:
+                self._pooled.rollback()
+        except Error as e:
+            logger.warning(f"Rolling back the request connection failed: {e}")
+
+    def release(self):
+        # The pool rolls back whatever is still uncommitted before reuse.
+        self._pooled.close()
+
+
+class RequestConnectionHandle:
+    """
+    One helper's view of the request's RequestConnection. Everything is
+    delegated to it. close() only marks this handle closed, and only once,
+    so the usual `if conn and conn.is_connected(): conn.close()` cleanup can
+    be repeated safely. After close(), is_connected() reports False.
+    """
+
+    _own_attrs = ("_shared", "_closed")
+
+    def __init__(self, shared):
+        object.__setattr__(self, "_shared", shared)
+        object.__setattr__(self, "_closed", False)
+
+    def __getattr__(self, name):
+        return getattr(self._shared, name)
+
+    def __setattr__(self, name, value):
+        if name in self._own_attrs:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._shared, name, value)
+
+    def is_connected(self):
+        return not self._closed and self._shared.is_connected()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._shared._handle_closed()
+
+
+class ReplicaSet:
+    """
+    Read replicas behind the primary. pick() returns the pools in the order
+    they should be tried: round-robin, or lowest observed latency first.
+    A replica that cannot be connected to is skipped for
+    REPLICA_RETRY_SECONDS. One whose pool is merely busy (PoolTimeoutError
+    after REPLICA_CHECKOUT_TIMEOUT_SECONDS) stays in rotation; that read
+    just moves on to the next replica or the primary.
+    """
+
+    def __init__(self, pools, strategy=REPLICA_STRATEGY):
+        self.pools = pools
+        self.strategy = strategy
+        self._cursor = itertools.count()
+        self._down_until = {}
+
+    def pick(self):
+        now = time.monotonic()
+        healthy = [p for p in self.pools if self._down_until.get(p.name, 0) <= now]
+        if not healthy:
+            return []
+        if self.strategy == "least_latency":
+            return sorted(healthy, key=lambda p: p.latency_ms if p.latency_ms is not None else 0.0)
+        start = next(self._cursor) % len(healthy)
+        return healthy[start:] + healthy[:start]
+
+    def acquire(self):
+        for pool in self.pick():
+            try:
+                return pool.acquire()
+            except PoolTimeoutError as e:
+                logger.info(f"Read replica '{pool.name}' busy, trying the next one: {e}")
+            except Error as e:
+                logger.warning(f"Read replica '{pool.name}' unavailable, skipping for {REPLICA_RETRY_SECONDS:.0f}s: {e}")
+                self._down_until[pool.name] = time.monotonic() + REPLICA_RETRY_SECONDS
+        return None
+
+    def stats(self):
+        now = time.monotonic()
+        return [dict(p.stats(), healthy=self._down_until.get(p.name, 0) <= now) for p in self.pools]
+
+
+def parse_replica_urls(urls, base_config=DB_CONFIG):
+    """Turns the MYSQL_REPLICA_URLS value into a list of connect() configs."""
+    configs = []
+    for raw_url in urls.split(","):
+        raw_url = raw_url.strip()
+        if not raw_url:
+            continue
+        parsed = urlparse(raw_url if "://" in raw_url else f"mysql://{raw_url}")
+        config = dict(base_config)
+        if parsed.hostname:
+            config["host"] = parsed.hostname
+        if parsed.port:
+            config["port"] = parsed.port
+        if parsed.username:
+            config["user"] = unquote(parsed.username)
+        if parsed.password is not None:
+            config["password"] = unquote(parsed.password)
+        if parsed.path.strip("/"):
+            config["database"] = parsed.path.strip("/")
+        configs.append(config)
+    return configs
+
+
+_pool = None
+_replicas = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the process-wide pool, recreating it after a fork."""
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = ConnectionPool(DB_CONFIG)
+    return _pool
+
+
+def get_replicas():
+    """Returns the process-wide ReplicaSet, or None when no replicas are configured."""
+    global _replicas
+    if not REPLICA_URLS:
+        return None
+    if _replicas is None or _replicas.pools[0].pid != os.getpid():
+        with _pool_lock:
+            if _replicas is None or _replicas.pools[0].pid != os.getpid():
+                pools = [
+                    ConnectionPool(config, size=REPLICA_POOL_SIZE, timeout=REPLICA_CHECKOUT_TIMEOUT_SECONDS,
+                                   name=f"replica{i + 1}",
+                                   init_statements=["SET SESSION TRANSACTION READ ONLY"])
+                    for i, config in enumerate(parse_replica_urls(REPLICA_URLS))
+                ]
+                _replicas = ReplicaSet(pools) if pools else None
+    return _replicas
+
+
+def pool_stats():
+    stats = get_pool().stats()
+    replicas = get_replicas()
+    if replicas:
+        stats["replicas"] = replicas.stats()
+    return stats
+
+
+def warm_pool(connections):
+    """Opens up to `connections` primary connections ahead of the first requests; returns how many were borrowed."""
+    pool = get_pool()
+    borrowed = []
     try:
-        connection = mysql.connector.connect(
-            host=os.environ.get("MYSQL_HOST", "127.0.0.1"),
-            database=os.environ.get("MYSQL_DATABASE", "Health_Guide"),
-            user=os.environ.get("MYSQL_USER", "root"),
-            password=os.environ.get("MYSQL_PASSWORD", ""),
-        )
+        for _ in range(min(connections, pool.size)):
+            borrowed.append(pool.acquire())
+    finally:
+        for conn in borrowed:
+            conn.close()
+    return len(borrowed)
+
+
+@register_collector
+def _collect_pool_metrics():
+    # Only pools this process has already created; a scrape never opens connections.
+    pools = [_pool] if _pool is not None and _pool.pid == os.getpid() else []
+    if _replicas is not None and _replicas.pools[0].pid == os.getpid():
+        pools.extend(_replicas.pools)
+    for pool in pools:
+        stats = pool.stats()
+        DB_POOL_CONNECTIONS.set(stats["idle"], pool=pool.name, state="idle")
+        DB_POOL_CONNECTIONS.set(stats["in_use"], pool=pool.name, state="in_use")
+
+
+# --- Read-your-writes bookkeeping ---
+def _note_primary_write():
+    if not has_request_context() or not REPLICA_URLS:
+        return
+    g._db_wrote = True
+    try:
+        session["_db_last_write"] = time.time()
+    except RuntimeError:
+        pass  # No secret key / session unavailable; the per-request flag still applies.
+
+
+def _must_read_primary():
+    if g.get("_db_wrote"):
+        return True
+    try:
+        last_write = session.get("_db_last_write")
+    except RuntimeError:
+        last_write = None
+    return bool(last_write) and (time.time() - last_write) < REPLICA_STICKY_SECONDS
+
+
+def read_only(view):
+    """
+    Marks a view as read-only: every helper that runs during the request gets
+    a replica connection from get_db_connection() unless the session has just
+    written to the primary.
+    """
+    @wraps(view)
+    def decorated_view(*args, **kwargs):
+        g._db_read_only = True
+        return view(*args, **kwargs)
+    return decorated_view
+
+
+def _get_request_connection(read_only=None):
+    if read_only is None:
+        read_only = g.get("_db_read_only", False)
+    if read_only and get_replicas() and not _must_read_primary():
+        conn = g.get("_db_read_connection")
+        if conn is None:
+            pooled = get_replicas().acquire()
+            if pooled is not None:
+                conn = RequestConnection(pooled, read_only=True)
+                g._db_read_connection = conn
+        if conn is not None:
+            return conn
+    conn = g.get("_db_connection")
+    if conn is None:
+        conn = RequestConnection(get_pool().acquire())
+        g._db_connection = conn
+    return conn
+
+
+def close_request_connection(exc=None):
+    """Teardown hook: returns the request's connections (if any were opened) to their pools."""
+    for key in ("_db_connection", "_db_read_connection"):
+        conn = g.pop(key, None)
+        if conn is not None:
+            conn.release()
+
+
+def init_db(app):
+    app.teardown_request(close_request_connection)
+
+
+def _acquire_dedicated(read_only=False):
+    if read_only and get_replicas():
+        pooled = get_replicas().acquire()
+        if pooled is not None:
+            return pooled
+    return get_pool().acquire()
+
+
+def get_db_connection(read_only=None):
+    """
+    Returns a connection, or None if the database is unreachable.
+
+    read_only=True routes the connection to a read replica when replicas are
+    configured (falling back to the primary after a write in the same session
+    or when no replica is reachable). Inside a view decorated with
+    @db.read_only the default is read_only=True.
+    """
+    try:
+        if has_request_context():
+            return _get_request_connection(read_only).handle()
+        connection = _acquire_dedicated(bool(read_only))
         if connection.is_connected():
             return connection
+        connection.discard()
     except Error as e:
-        print(f"Error connecting to MySQL: {e}")
-        return None
+        logger.error(f"Error connecting to MySQL: {e}")
+    return None
+
+
+@contextmanager
+def connection(dedicated=False, read_only=None):
+    """
+    Context-managed connection:
+
+        with db.connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            ...
+            conn.commit()
+
+    Inside a request this yields a handle on the request-scoped connection
+    (see RequestConnection), counted like the ones get_db_connection() hands
+    out and closed when the block ends; pass dedicated=True for a separate
+    pooled connection, e.g. for long-lived streaming responses. Outside a
+    request, or when dedicated, work not committed inside the block is rolled
+    back when the connection goes back to the pool. read_only behaves as in
+    get_db_connection(). Raises mysql.connector.Error (including
+    PoolTimeoutError) instead of returning None like get_db_connection().
+    """
+    if has_request_context() and not dedicated:
+        conn = _get_request_connection(read_only).handle()
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            conn.close()
+        return
+
+    conn = _acquire_dedicated(bool(read_only))
+    try:
+        yield conn
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            conn.discard()
+        raise
+    finally:
+        conn.close()
@@ -0,0 +1,75 @@
+# gunicorn.conf.py
+"""
+gunicorn settings for the production entry point:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+  * gthread workers: GUNICORN_WORKERS processes, each with GUNICORN_THREADS
+    threads for ordinary requests plus GUNICORN_STREAM_THREADS for
+    Server-Sent Events streams. Every open chat or alert stream holds a
+    thread for up to five minutes, so a worker holds at most
+    GUNICORN_STREAM_THREADS streams (MAX_OPEN_STREAMS, utils/stream_slots.py).
+    Across the site that is at most GUNICORN_WORKERS x GUNICORN_STREAM_THREADS
+    streams. Beyond that, streams fall back to polling instead of starving
+    other requests. A stream holds a DB connection only while it is set up,
+    so MYSQL_POOL_SIZE (per process) should be at least GUNICORN_THREADS plus
+    a few, not the total thread count.
+  * preload_app: the app is imported and warmed up once in the master, and
+    workers fork from it.
+  * Recycling: each worker is replaced after GUNICORN_MAX_REQUESTS requests
+    (plus up to GUNICORN_MAX_REQUESTS_JITTER, so workers do not all restart
+    together). A worker being replaced finishes its in-flight requests
+    within graceful_timeout.
+  * Hooks: post_worker_init starts the scheduler threads and opens
+    WARMUP_DB_CONNECTIONS pooled connections in each worker. child_exit
+    folds a dead worker's metrics into the archive file (utils/metrics.py).
+"""
+import multiprocessing
+import os
+
+bind = f"{os.environ.get('FLASK_RUN_HOST', '0.0.0.0')}:{os.environ.get('FLASK_RUN_PORT', 54321)}"
+worker_class = "gthread"
+workers = int(os.environ.get("GUNICORN_WORKERS", min(multiprocessing.cpu_count() * 2 + 1, 8)))
+request_threads = int(os.environ.get("GUNICORN_THREADS", 4))
+stream_threads = int(os.environ.get("GUNICORN_STREAM_THREADS", 64))
+threads = request_threads + stream_threads
+# Read by utils/stream_slots.py in the app, which gunicorn loads after this file.
+os.environ.setdefault("MAX_OPEN_STREAMS", str(stream_threads))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "True").lower() in ["true", "1", "t"]
+
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 200))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+# The app writes its own access log (logs/access.log); gunicorn's errors go to stderr.
+accesslog = None
+errorlog = "-"
+loglevel = os.environ.get("LOG_LEVEL", "INFO").lower()
+
+WARMUP_DB_CONNECTIONS = int(os.environ.get("WARMUP_DB_CONNECTIONS", 2))
+
+# Stale per-process metrics files from an earlier run would be summed into this one's.
+# The marker keeps a config reload (SIGHUP) from wiping the live workers' files.
+if os.environ.get("METRICS_MULTIPROC_DIR") and not os.environ.get("_METRICS_MULTIPROC_DIR_CLEARED"):
+    os.makedirs(os.environ["METRICS_MULTIPROC_DIR"], exist_ok=True)
+    for file_name in os.listdir(os.environ["METRICS_MULTIPROC_DIR"]):
+        if file_name.startswith("metrics_") and file_name.endswith(".db"):
+            os.remove(os.path.join(os.environ["METRICS_MULTIPROC_DIR"], file_name))
+    os.environ["_METRICS_MULTIPROC_DIR_CLEARED"] = "1"
+
+
+def post_worker_init(worker):
+    from app import start_background_tasks, warm_up_worker
+    from wsgi import app
+
+    start_background_tasks(app)
+    if WARMUP_DB_CONNECTIONS > 0:
+        warm_up_worker(app, WARMUP_DB_CONNECTIONS)
+
+
+def child_exit(server, worker):
+    from utils.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
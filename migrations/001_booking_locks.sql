@@ -0,0 +1,30 @@
+-- migrations/001_booking_locks.sql
+-- Per-day booking lock rows and idempotency keys for routes/booking.py.
+-- Safe to re-run.
+
+--
+-- One row per (doctor, location, date) that has ever been booked. The booking
+-- transaction takes an exclusive lock on it with INSERT ... ON DUPLICATE KEY
+-- UPDATE, which serializes bookings for that day without locking anything else.
+--
+CREATE TABLE IF NOT EXISTS `appointment_day_locks` (
+  `doctor_id` int(11) NOT NULL,
+  `doctor_location_id` int(11) NOT NULL,
+  `lock_date` date NOT NULL,
+  `last_locked_at` timestamp NOT NULL DEFAULT current_timestamp(),
+  PRIMARY KEY (`doctor_id`,`doctor_location_id`,`lock_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+--
+-- Idempotency keys for booking submissions. A row is written in the same
+-- transaction as the appointment, so it only exists for bookings that succeeded.
+--
+CREATE TABLE IF NOT EXISTS `appointment_booking_requests` (
+  `patient_id` int(11) NOT NULL,
+  `idempotency_key` varchar(64) NOT NULL,
+  `appointment_id` int(11) DEFAULT NULL,
+  `created_at` timestamp NOT NULL DEFAULT current_timestamp(),
+  PRIMARY KEY (`patient_id`,`idempotency_key`),
+  KEY `idx_booking_requests_appointment` (`appointment_id`),
+  KEY `idx_booking_requests_created` (`created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
@@ -0,0 +1,112 @@
+-- migrations/002_doctor_daily_availability.sql
+-- Materialized per-day availability (routes/availability_materializer.py).
+-- Safe to re-run.
+
+--
+-- One row per doctor location and date inside the projection horizon.
+-- free_slot_bitmap: 180 bytes, little-endian; bit N set = a free slot starting
+-- N minutes after midnight. slot_interval records the interval it was built with.
+--
+CREATE TABLE IF NOT EXISTS `doctor_daily_availability` (
+  `doctor_id` int(11) NOT NULL,
+  `doctor_location_id` int(11) NOT NULL,
+  `avail_date` date NOT NULL,
+  `free_slot_bitmap` varbinary(180) NOT NULL,
+  `free_slot_count` smallint(5) UNSIGNED NOT NULL DEFAULT 0,
+  `booked_count` smallint(5) UNSIGNED NOT NULL DEFAULT 0,
+  `slot_interval` smallint(5) UNSIGNED NOT NULL,
+  `computed_at` timestamp NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp(),
+  PRIMARY KEY (`doctor_id`,`doctor_location_id`,`avail_date`),
+  KEY `idx_daily_availability_date` (`avail_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+--
+-- Change log filled by the triggers below and drained by the materializer.
+-- NULL doctor_location_id = every location of the doctor; NULL dirty_date = every date.
+--
+CREATE TABLE IF NOT EXISTS `availability_refresh_queue` (
+  `queue_id` bigint(20) UNSIGNED NOT NULL AUTO_INCREMENT,
+  `doctor_id` int(11) NOT NULL,
+  `doctor_location_id` int(11) DEFAULT NULL,
+  `dirty_date` date DEFAULT NULL,
+  `queued_at` timestamp NOT NULL DEFAULT current_timestamp(),
+  PRIMARY KEY (`queue_id`),
+  KEY `idx_refresh_queue_doctor` (`doctor_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --- appointments ---
+DROP TRIGGER IF EXISTS `trg_appointments_availability_ins`;
+CREATE TRIGGER `trg_appointments_availability_ins` AFTER INSERT ON `appointments` FOR EACH ROW
+  INSERT INTO `availability_refresh_queue` (`doctor_id`, `doctor_location_id`, `dirty_date`)
+  VALUES (NEW.doctor_id, NEW.doctor_location_id, NEW.appointment_date);
+
+DROP TRIGGER IF EXISTS `trg_appointments_availability_upd`;
+CREATE TRIGGER `trg_appointments_availability_upd` AFTER UPDATE ON `appointments` FOR EACH ROW
+  INSERT INTO `availability_refresh_queue` (`doctor_id`, `doctor_location_id`, `dirty_date`)
+  SELECT OLD.doctor_id, OLD.doctor_location_id, OLD.appointment_date FROM DUAL
+   WHERE NOT (OLD.status <=> NEW.status AND OLD.doctor_id <=> NEW.doctor_id
+              AND OLD.doctor_location_id <=> NEW.doctor_location_id AND OLD.appointment_date <=> NEW.appointment_date
+              AND OLD.start_time <=> NEW.start_time AND OLD.end_time <=> NEW.end_time)
+  UNION ALL
+  SELECT NEW.doctor_id, NEW.doctor_location_id, NEW.appointment_date FROM DUAL
+   WHERE NOT (OLD.status <=> NEW.status AND OLD.doctor_id <=> NEW.doctor_id
+              AND OLD.doctor_location_id <=> NEW.doctor_location_id AND OLD.appointment_date <=> NEW.appointment_date
+              AND OLD.start_time <=> NEW.start_time AND OLD.end_time <=> NEW.end_time);
+
+DROP TRIGGER IF EXISTS `trg_appointments_availability_del`;
+CREATE TRIGGER `trg_appointments_availability_del` AFTER DELETE ON `appointments` FOR EACH ROW
+  INSERT INTO `availability_refresh_queue` (`doctor_id`, `doctor_location_id`, `dirty_date`)
+  VALUES (OLD.doctor_id, OLD.doctor_location_id, OLD.appointment_date);
+
+-- --- doctor_location_availability (weekly slots: every date of that location) ---
+DROP TRIGGER IF EXISTS `trg_location_availability_ins`;
+CREATE TRIGGER `trg_location_availability_ins` AFTER INSERT ON `doctor_location_availability` FOR EACH ROW
+  INSERT INTO `availability_refresh_queue` (`doctor_id`, `doctor_location_id`, `dirty_date`)
+  SELECT dl.doctor_id, dl.doctor_location_id, NULL FROM `doctor_locations` dl
+   WHERE dl.doctor_location_id = NEW.doctor_location_id;
+
+DROP TRIGGER IF EXISTS `trg_location_availability_upd`;
+CREATE TRIGGER `trg_location_availability_upd` AFTER UPDATE ON `doctor_location_availability` FOR EACH ROW
+  INSERT INTO `availability_refresh_queue` (`doctor_id`, `doctor_location_id`, `dirty_date`)
+  SELECT dl.doctor_id, dl.doctor_location_id, NULL FROM `doctor_locations` dl
+   WHERE dl.doctor_location_id IN (OLD.doctor_location_id, NEW.doctor_location_id);
+
+DROP TRIGGER IF EXISTS `trg_location_availability_del`;
+CREATE TRIGGER `trg_location_availability_del` AFTER DELETE ON `doctor_location_availability` FOR EACH ROW
+  INSERT INTO `availability_refresh_queue` (`doctor_id`, `doctor_location_id`, `dirty_date`)
+  SELECT dl.doctor_id, dl.doctor_location_id, NULL FROM `doctor_locations` dl
+   WHERE dl.doctor_location_id = OLD.doctor_location_id;
+
+-- --- doctor_availability_overrides ---
+DROP TRIGGER IF EXISTS `trg_availability_overrides_ins`;
+CREATE TRIGGER `trg_availability_overrides_ins` AFTER INSERT ON `doctor_availability_overrides` FOR EACH ROW
+  INSERT INTO `availability_refresh_queue` (`doctor_id`, `doctor_location_id`, `dirty_date`)
+  VALUES (NEW.doctor_id, NEW.doctor_location_id, NEW.override_date);
+
+DROP TRIGGER IF EXISTS `trg_availability_overrides_upd`;
+CREATE TRIGGER `trg_availability_overrides_upd` AFTER UPDATE ON `doctor_availability_overrides` FOR EACH ROW
+  INSERT INTO `availability_refresh_queue` (`doctor_id`, `doctor_location_id`, `dirty_date`)
+  VALUES (OLD.doctor_id, OLD.doctor_location_id, OLD.override_date),
+         (NEW.doctor_id, NEW.doctor_location_id, NEW.override_date);
+
+DROP TRIGGER IF EXISTS `trg_availability_overrides_del`;
+CREATE TRIGGER `trg_availability_overrides_del` AFTER DELETE ON `doctor_availability_overrides` FOR EACH ROW
+  INSERT INTO `availability_refresh_queue` (`doctor_id`, `doctor_location_id`, `dirty_date`)
+  VALUES (OLD.doctor_id, OLD.doctor_location_id, OLD.override_date);
+
+-- --- doctor_location_daily_caps (every date of that location) ---
+DROP TRIGGER IF EXISTS `trg_daily_caps_ins`;
+CREATE TRIGGER `trg_daily_caps_ins` AFTER INSERT ON `doctor_location_daily_caps` FOR EACH ROW
+  INSERT INTO `availability_refresh_queue` (`doctor_id`, `doctor_location_id`, `dirty_date`)
+  VALUES (NEW.doctor_id, NEW.doctor_location_id, NULL);
+
+DROP TRIGGER IF EXISTS `trg_daily_caps_upd`;
+CREATE TRIGGER `trg_daily_caps_upd` AFTER UPDATE ON `doctor_location_daily_caps` FOR EACH ROW
+  INSERT INTO `availability_refresh_queue` (`doctor_id`, `doctor_location_id`, `dirty_date`)
+  VALUES (OLD.doctor_id, OLD.doctor_location_id, NULL),
+         (NEW.doctor_id, NEW.doctor_location_id, NULL);
+
+DROP TRIGGER IF EXISTS `trg_daily_caps_del`;
+CREATE TRIGGER `trg_daily_caps_del` AFTER DELETE ON `doctor_location_daily_caps` FOR EACH ROW
+  INSERT INTO `availability_refresh_queue` (`doctor_id`, `doctor_location_id`, `dirty_date`)
+  VALUES (OLD.doctor_id, OLD.doctor_location_id, NULL);
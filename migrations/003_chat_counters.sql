@@ -0,0 +1,44 @@
+-- migrations/003_chat_counters.sql
+-- Denormalized unread counters and last-message snapshot on `chats`
+-- (routes/chat_counters.py). Safe to re-run.
+
+--
+-- doctor_unread_count:  unread messages the doctor has not seen (sender_type != 'doctor')
+-- patient_unread_count: unread messages from the doctor (sender_type = 'doctor')
+-- last_message_*:       the newest message of the chat
+--
+SET @chat_counters_missing := (SELECT COUNT(*) = 0 FROM information_schema.COLUMNS
+  WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'chats' AND COLUMN_NAME = 'doctor_unread_count');
+SET @ddl := IF(@chat_counters_missing,
+  'ALTER TABLE `chats`
+     ADD COLUMN `doctor_unread_count` int(11) NOT NULL DEFAULT 0,
+     ADD COLUMN `patient_unread_count` int(11) NOT NULL DEFAULT 0,
+     ADD COLUMN `last_message_id` int(11) DEFAULT NULL,
+     ADD COLUMN `last_message_snippet` varchar(255) DEFAULT NULL,
+     ADD COLUMN `last_message_at` timestamp NULL DEFAULT NULL,
+     ADD KEY `idx_chats_doctor_updated` (`doctor_id`,`updated_at`),
+     ADD KEY `idx_chats_patient_updated` (`patient_id`,`updated_at`)',
+  'DO 0');
+PREPARE chat_counters_ddl FROM @ddl;
+EXECUTE chat_counters_ddl;
+DEALLOCATE PREPARE chat_counters_ddl;
+
+--
+-- Backfill (the same statement `flask --app app chat-counters repair` runs).
+-- updated_at is assigned to itself so the inbox order is not disturbed.
+--
+UPDATE `chats` c
+LEFT JOIN (
+  SELECT `chat_id`,
+         SUM(`read_at` IS NULL AND `sender_type` != 'doctor') AS doctor_unread,
+         SUM(`read_at` IS NULL AND `sender_type` = 'doctor') AS patient_unread,
+         MAX(`message_id`) AS last_id
+  FROM `chat_messages` GROUP BY `chat_id`
+) agg ON agg.chat_id = c.chat_id
+LEFT JOIN `chat_messages` last_cm ON last_cm.message_id = agg.last_id
+SET c.doctor_unread_count = COALESCE(agg.doctor_unread, 0),
+    c.patient_unread_count = COALESCE(agg.patient_unread, 0),
+    c.last_message_id = last_cm.message_id,
+    c.last_message_snippet = LEFT(last_cm.message_text, 255),
+    c.last_message_at = last_cm.sent_at,
+    c.updated_at = c.updated_at;
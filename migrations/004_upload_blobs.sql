@@ -0,0 +1,19 @@
+-- migrations/004_upload_blobs.sql
+-- Reference counts for content-addressed uploads (utils/upload_store.py).
+-- Safe to re-run.
+
+--
+-- One row per stored file, keyed by its path under static/uploads
+-- (e.g. 'department_images/<sha256>.jpg'). ref_count is the number of
+-- database rows pointing at the file; the file is unlinked when it drops to 0.
+-- Files uploaded before this table existed have no row and are deleted as before.
+--
+CREATE TABLE IF NOT EXISTS `upload_blobs` (
+  `storage_path` varchar(255) NOT NULL,
+  `sha256` char(64) NOT NULL,
+  `size_bytes` bigint(20) unsigned NOT NULL,
+  `ref_count` int(11) NOT NULL DEFAULT 0,
+  `created_at` timestamp NOT NULL DEFAULT current_timestamp(),
+  `updated_at` timestamp NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp(),
+  PRIMARY KEY (`storage_path`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin;
@@ -4,6 +4,8 @@ from flask import Blueprint, render_template, request, flash, redirect, url_for,
 from flask_login import login_required, current_user
 from werkzeug.security import generate_password_hash # Added for password hashing
 from db import get_db_connection
+from routes.principal_cache import invalidate_principal
+from utils.schema_metadata import get_enum_values
 from math import ceil
 import mysql.connector # For specific error handling
 import re # Import regular expressions for parsing
@@ -19,68 +21,6 @@ DEFAULT_ACCOUNT_STATUSES = ['active', 'inactive', 'suspended', 'pending']
 
 # --- Helper Functions ---
 
-def get_enum_values(table_name, column_name):
-    """Fetches possible ENUM values for a given table and column."""
-    connection = None
-    cursor = None
-    enum_values = []
-    try:
-        connection = get_db_connection()
-        if not connection or not connection.is_connected():
-            current_app.logger.error(f"DB connection object invalid or not connected for ENUM fetch {table_name}.{column_name}")
-            raise ConnectionError("DB connection failed for ENUM fetch")
-
-        cursor = connection.cursor()
-        db_name = connection.database
-        if not db_name:
-            db_name = current_app.config.get('MYSQL_DB')
-        if not db_name:
-            current_app.logger.warning("Could not determine database name to fetch ENUMs.")
-            if table_name == 'admins' and column_name == 'admin_level': return DEFAULT_ADMIN_LEVELS
-            if table_name == 'users' and column_name == 'account_status': return DEFAULT_ACCOUNT_STATUSES
-            return []
-
-        cursor.execute("""
-            SELECT COLUMN_TYPE
-            FROM INFORMATION_SCHEMA.COLUMNS
-            WHERE TABLE_SCHEMA = %s
-              AND TABLE_NAME = %s
-              AND COLUMN_NAME = %s
-        """, (db_name, table_name, column_name))
-        result = cursor.fetchone()
-
-        if result and result[0]:
-            enum_def = result[0]
-            if enum_def.lower().startswith("enum("):
-                content = enum_def[5:-1]
-                enum_values = [val.strip().strip("'").strip('"') for val in content.split(',')]
-            else:
-                 current_app.logger.warning(f"Could not parse ENUM string: {result[0]} for {table_name}.{column_name}")
-        else:
-            current_app.logger.warning(f"Could not find ENUM definition for {table_name}.{column_name}")
-
-    except mysql.connector.Error as db_err:
-        current_app.logger.error(f"Database error fetching ENUM values for {table_name}.{column_name}: {db_err}")
-        enum_values = []
-    except ConnectionError as conn_err:
-        current_app.logger.error(f"Connection error during ENUM fetch for {table_name}.{column_name}: {conn_err}")
-        enum_values = []
-    except Exception as e:
-        current_app.logger.error(f"General error fetching ENUM values for {table_name}.{column_name}: {e}")
-        enum_values = []
-    finally:
-        if cursor: cursor.close()
-        if connection and connection.is_connected(): connection.close()
-
-    if not enum_values:
-        if table_name == 'admins' and column_name == 'admin_level':
-            current_app.logger.warning("ENUM fetch failed for admin_level, using defaults.")
-            return DEFAULT_ADMIN_LEVELS
-        if table_name == 'users' and column_name == 'account_status':
-            current_app.logger.warning("ENUM fetch failed for account_status, using defaults.")
-            return DEFAULT_ACCOUNT_STATUSES
-    return enum_values
-
 def get_admin_or_404(admin_id):
     """Fetches admin details (user + admin level) or returns None."""
     connection = None
@@ -637,6 +577,7 @@ def edit_admin(admin_id):
 
         if user_rows_affected > 0 or admin_rows_affected > 0:
             connection.commit()
+            invalidate_principal(admin_id)
             flash_msg_parts = ["Admin updated successfully"]
             if update_password: flash_msg_parts.append("(Password Changed)")
             if account_status != current_admin_data.get('account_status'):
@@ -745,6 +686,7 @@ def delete_admin(admin_id):
         user_rows_deleted = cursor.rowcount
 
         connection.commit()
+        invalidate_principal(admin_id)
 
         if user_rows_deleted == 0:
              flash("Admin user record not found, was not an admin type, or already deleted.", "warning")
@@ -7,7 +7,7 @@ from flask import (
     Blueprint, render_template, request, flash, redirect, url_for, current_app
 )
 from flask_login import login_required, current_user
-from db import get_db_connection
+from db import get_db_connection, read_only
 from functools import wraps
 import re 
 
@@ -133,6 +133,7 @@ def configure_appointment_types():
 # --- Reports ---
 @admin_appointments_bp.route('/reports', methods=['GET'])
 @require_admin
+@read_only
 def view_reports():
     report_type = request.args.get('type', 'summary').lower()
     report_date_from_str = request.args.get('report_date_from', (datetime.date.today() - datetime.timedelta(days=30)).strftime('%Y-%m-%d'))
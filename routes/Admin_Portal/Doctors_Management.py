@@ -7,10 +7,12 @@ from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename as werkzeug_secure_filename # Use werkzeug's for basic cleaning
 from werkzeug.security import generate_password_hash, check_password_hash
 from db import get_db_connection
+from routes.principal_cache import invalidate_principal
+from utils.schema_metadata import get_enum_values as get_schema_enum_values
+from utils.upload_store import release_upload, store_upload, upload_extension
 from math import ceil
 import mysql.connector
 import re
-import uuid # For generating unique filenames
 
 # Assuming directory_configs.py is in a 'utils' package accessible from here
 # If Doctors_Management.py is in routes/Admin_Portal/ and utils is ../../utils/
@@ -37,45 +39,14 @@ VALID_DOCUMENT_TYPES = ['license', 'certification', 'identity', 'education', 'ot
 DEFAULT_ACCOUNT_STATUSES = ['active', 'inactive', 'suspended', 'pending']
 DEFAULT_VERIFICATION_STATUSES = ['pending', 'approved', 'rejected', 'pending_info']
 
-# --- Utility for secure filenames (can be moved to a shared utils.py) ---
-def generate_secure_filesystem_name(original_filename):
-    """Generates a secure and unique filename for storing on the filesystem."""
-    cleaned_filename = werkzeug_secure_filename(original_filename)
-    base, ext = os.path.splitext(cleaned_filename)
-    # Limit base name length to prevent issues, ensure it's not empty
-    base = base[:100] if base else "file" 
-    return f"{uuid.uuid4().hex}_{base}{ext}"
-
 # --- Helper Functions ---
 # (get_enum_values, get_all_specializations, get_all_departments, get_doctor_details, get_user_basic_info, get_current_user_id_int, is_valid_email - remain largely the same)
 # Minor adjustment in get_doctor_details for profile_photo_url consistency.
 
 def get_enum_values(table_name, column_name):
-    connection = None; cursor = None; enum_values = []
-    try:
-        connection = get_db_connection()
-        if not connection or not connection.is_connected(): raise ConnectionError("DB connection failed for ENUM fetch")
-        cursor = connection.cursor()
-        db_name = connection.database or current_app.config.get('MYSQL_DB')
-        if not db_name:
-            current_app.logger.warning("Could not determine database name to fetch ENUMs.")
-            if table_name == 'users' and column_name == 'account_status': return DEFAULT_ACCOUNT_STATUSES
-            if table_name == 'doctors' and column_name == 'verification_status': return DEFAULT_VERIFICATION_STATUSES
-            if table_name == 'doctor_documents' and column_name == 'document_type': return VALID_DOCUMENT_TYPES # Fallback for doc types
-            return []
-
-        cursor.execute("SELECT COLUMN_TYPE FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s",
-                       (db_name, table_name, column_name))
-        result = cursor.fetchone()
-        if result and result[0] and result[0].lower().startswith("enum("):
-            enum_values = [val.strip().strip("'\"") for val in result[0][5:-1].split(',')]
-    except mysql.connector.Error as db_err: current_app.logger.error(f"DB error fetching ENUMs for {table_name}.{column_name}: {db_err}")
-    except Exception as e: current_app.logger.error(f"General error fetching ENUMs for {table_name}.{column_name}: {e}")
-    finally:
-        if cursor: cursor.close()
-        if connection and connection.is_connected(): connection.close()
-    
-    if not enum_values: 
+    """ENUM values from the schema metadata cache, or this module's defaults when the schema cannot be read."""
+    enum_values = get_schema_enum_values(table_name, column_name)
+    if not enum_values:
         if table_name == 'users' and column_name == 'account_status': return DEFAULT_ACCOUNT_STATUSES
         if table_name == 'doctors' and column_name == 'verification_status': return DEFAULT_VERIFICATION_STATUSES
         if table_name == 'doctor_documents' and column_name == 'document_type': return VALID_DOCUMENT_TYPES
@@ -512,6 +483,7 @@ def add_doctor_step2_submit(user_id):
             except Exception as audit_err: raise RuntimeError(f"Failed to add audit log: {audit_err}")
         
         connection.commit()
+        invalidate_principal(user_id)
         flash_msg = "Doctor professional details saved successfully."
         if user_status_updated: flash_msg += " User account is now active."
         flash(flash_msg, "success")
@@ -704,6 +676,7 @@ def edit_doctor(doctor_id):
                 except Exception as audit_err: raise RuntimeError(f"Audit log failed: {audit_err}")
         
         connection.commit()
+        invalidate_principal(doctor_id)
         flash_msg = "Doctor updated successfully" if user_rows_affected > 0 or doctor_rows_affected > 0 else "No changes detected."
         if password_to_update_hashed: flash_msg += " (Password Changed)"
         if profile_photo_url_to_update: flash_msg += " (Profile Photo URL updated)"
@@ -776,17 +749,11 @@ def upload_doctor_document(doctor_id):
         # then:
         # doctor_specific_subdir_abs = os.path.join(upload_dir_docs_base_absolute, str(doctor_id))
         # os.makedirs(doctor_specific_subdir_abs, exist_ok=True)
-        # filesystem_secure_name = generate_secure_filesystem_name(original_filename_cleaned)
-        # saved_doc_absolute_path = os.path.join(doctor_specific_subdir_abs, filesystem_secure_name)
-        # file.save(saved_doc_absolute_path)
+        # saved_doc_absolute_path = store_upload(file, doctor_specific_subdir_abs, upload_extension(original_filename_cleaned))
         # db_storage_path = get_relative_path_for_db(saved_doc_absolute_path) # will be "uploads/doctor_docs/<doctor_id>/unique_name.ext"
 
-        # Current simpler approach: save directly into UPLOAD_FOLDER_DOCS
-        os.makedirs(upload_dir_docs_base_absolute, exist_ok=True) # Ensure base dir exists
-        filesystem_secure_name = generate_secure_filesystem_name(original_filename_cleaned)
-        saved_doc_absolute_path = os.path.join(upload_dir_docs_base_absolute, filesystem_secure_name)
-        
-        file.save(saved_doc_absolute_path)
+        # Current simpler approach: save directly into UPLOAD_FOLDER_DOCS (content-addressed, shared by identical uploads)
+        saved_doc_absolute_path = store_upload(file, upload_dir_docs_base_absolute, upload_extension(original_filename_cleaned))
         file_size = os.path.getsize(saved_doc_absolute_path)
         current_app.logger.info(f"Admin uploaded doc for Dr {doctor_id}: {saved_doc_absolute_path}")
 
@@ -819,8 +786,8 @@ def upload_doctor_document(doctor_id):
         flash(f"Error uploading document: {str(err)}", "danger")
         current_app.logger.error(f"Doc upload error by admin for Dr {doctor_id}: {err}", exc_info=True)
         if saved_doc_absolute_path and os.path.exists(saved_doc_absolute_path):
-            try: os.remove(saved_doc_absolute_path); current_app.logger.info(f"Cleaned up {saved_doc_absolute_path}")
-            except OSError as e_clean: current_app.logger.error(f"Cleanup failed for {saved_doc_absolute_path}: {e_clean}")
+            try: release_upload(saved_doc_absolute_path); current_app.logger.info(f"Cleaned up {saved_doc_absolute_path}")
+            except (OSError, mysql.connector.Error) as e_clean: current_app.logger.error(f"Cleanup failed for {saved_doc_absolute_path}: {e_clean}")
     finally:
         if cursor: cursor.close()
         if connection and connection.is_connected():
@@ -877,13 +844,13 @@ def delete_doctor_document(document_id):
                 file_to_delete_absolute = os.path.join(current_app.static_folder, db_file_path_relative_to_static)
                 try:
                     if os.path.exists(file_to_delete_absolute): 
-                        os.remove(file_to_delete_absolute)
+                        release_upload(file_to_delete_absolute) # Unlinks only when no other document row shares the file
                         flash("Document deleted successfully (Record and File).", "success")
                         current_app.logger.info(f"Admin deleted doc file: {file_to_delete_absolute}")
                     else:
                         flash("Document record deleted, but file not found on disk.", "warning")
                         current_app.logger.warning(f"Doc file for deletion not found on disk: {file_to_delete_absolute}")
-                except OSError as e: 
+                except (OSError, mysql.connector.Error) as e: 
                     flash(f"Record deleted, but error deleting file: {e}", "warning")
                     current_app.logger.error(f"File delete error for {file_to_delete_absolute}: {e}")
             else: 
@@ -973,6 +940,7 @@ def delete_doctor(doctor_id):
             return redirect(url_for('Doctors_Management.index'))
 
         connection.commit() # Commit DB changes first
+        invalidate_principal(doctor_id)
         
         # Now, delete files from filesystem
         static_folder_abs = current_app.static_folder
@@ -984,9 +952,9 @@ def delete_doctor(doctor_id):
                 doc_absolute_path = os.path.join(static_folder_abs, doc_relative_path)
                 try:
                     if os.path.exists(doc_absolute_path): 
-                        os.remove(doc_absolute_path)
+                        release_upload(doc_absolute_path)
                         current_app.logger.info(f"Deleted document file: {doc_absolute_path}")
-                except OSError as e: 
+                except (OSError, mysql.connector.Error) as e: 
                     current_app.logger.error(f"Error deleting document file {doc_absolute_path}: {e}")
         
         # Delete associated profile photo
@@ -994,9 +962,9 @@ def delete_doctor(doctor_id):
             profile_photo_absolute_path = os.path.join(static_folder_abs, profile_photo_db_path)
             try:
                 if os.path.exists(profile_photo_absolute_path): 
-                    os.remove(profile_photo_absolute_path)
+                    release_upload(profile_photo_absolute_path)
                     current_app.logger.info(f"Deleted profile photo file: {profile_photo_absolute_path}")
-            except OSError as e: 
+            except (OSError, mysql.connector.Error) as e: 
                 current_app.logger.error(f"Error deleting profile photo file {profile_photo_absolute_path}: {e}")
 
         flash(f"Doctor '{doctor_username}' and associated data deleted successfully.", "success")
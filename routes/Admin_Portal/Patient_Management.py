@@ -7,6 +7,8 @@ from flask import (Blueprint, render_template, request, session, flash,
 from flask_login import login_required, current_user
 from werkzeug.security import generate_password_hash
 from db import get_db_connection
+from routes.principal_cache import invalidate_principal
+from utils.schema_metadata import get_enum_values
 from math import ceil
 import mysql.connector # Import the base connector
 from mysql.connector import Error as MySQLError # Import the specific Error class
@@ -47,53 +49,6 @@ def get_patient_base_info(patient_id):
         if connection and connection.is_connected(): connection.close()
     return patient
 
-# --- Helper to get ENUM values ---
-# patient_management.py
-
-# ... (other imports and code) ...
-
-# --- Helper to get ENUM values ---
-def get_enum_values(cursor, table_name, column_name):
-    # This function now expects an active cursor to be passed in
-    try:
-        db_name_query = "SELECT DATABASE()" # Keep this for clarity if you want
-        cursor.execute(db_name_query)
-        db_name_result = cursor.fetchone()
-
-        # --- CORRECTED KEY ACCESS ---
-        # The key in the dictionary result for "SELECT DATABASE()" is "DATABASE()"
-        current_db_name = None
-        if db_name_result and 'DATABASE()' in db_name_result:
-            current_db_name = db_name_result['DATABASE()']
-        
-        if not current_db_name:
-             current_app.logger.error("Could not determine current database name for ENUM fetch. 'SELECT DATABASE()' returned None or no 'DATABASE()' key.")
-             return []
-        # --- END CORRECTION ---
-
-        cursor.execute("""
-            SELECT COLUMN_TYPE FROM INFORMATION_SCHEMA.COLUMNS
-            WHERE TABLE_SCHEMA = %s 
-              AND TABLE_NAME = %s
-              AND COLUMN_NAME = %s
-        """, (current_db_name, table_name, column_name))
-        result = cursor.fetchone() # This will also be a dictionary
-
-        if result and result.get('COLUMN_TYPE'): # Use .get() for safer dictionary access
-            type_str = result['COLUMN_TYPE']
-            if type_str.lower().startswith("enum("):
-                raw_values = type_str[5:-1] # Strip 'enum(' and ')'
-                values = [val.strip("'") for val in raw_values.split(',')]
-                return values
-        current_app.logger.warning(f"ENUM values not found or not an ENUM type for {table_name}.{column_name} in DB {current_db_name}.")
-        return []
-    except MySQLError as db_err: # Use MySQLError if defined
-        current_app.logger.error(f"MySQL error fetching ENUM for {table_name}.{column_name}: {db_err}")
-    except Exception as e:
-        current_app.logger.error(f"Generic error fetching ENUM for {table_name}.{column_name}: {e}")
-    return []
-
-# ... (rest of Patient_Management.py) ...
 # --- Helper to get Current User ID ---
 def get_current_user_id():
     # Ensure current_user.id (or user_id) is an integer
@@ -207,9 +162,9 @@ def add_patient_form():
         cursor = connection.cursor(dictionary=True)
         cursor.execute("SELECT id, provider_name FROM insurance_providers WHERE is_active = TRUE ORDER BY provider_name")
         insurance_providers = cursor.fetchall()
-        gender_options = get_enum_values(cursor, 'patients', 'gender') # Pass active cursor
-        blood_types = get_enum_values(cursor, 'patients', 'blood_type') # Pass active cursor
-        marital_statuses = get_enum_values(cursor, 'patients', 'marital_status') # Pass active cursor
+        gender_options = get_enum_values('patients', 'gender')
+        blood_types = get_enum_values('patients', 'blood_type')
+        marital_statuses = get_enum_values('patients', 'marital_status')
     except MySQLError as db_err:
         flash(f"Database error loading form data: {db_err.msg}", "danger")
         current_app.logger.error(f"MySQL error loading patient add form data: {db_err}")
@@ -292,9 +247,9 @@ def add_patient():
                 cursor_form = connection_form.cursor(dictionary=True)
                 cursor_form.execute("SELECT id, provider_name FROM insurance_providers WHERE is_active = TRUE ORDER BY provider_name")
                 insurance_providers_form = cursor_form.fetchall()
-                gender_options_form = get_enum_values(cursor_form, 'patients', 'gender')
-                blood_types_form = get_enum_values(cursor_form, 'patients', 'blood_type')
-                marital_statuses_form = get_enum_values(cursor_form, 'patients', 'marital_status')
+                gender_options_form = get_enum_values('patients', 'gender')
+                blood_types_form = get_enum_values('patients', 'blood_type')
+                marital_statuses_form = get_enum_values('patients', 'marital_status')
         except Exception as e_form: current_app.logger.error(f"Error reloading form data for add_patient error: {e_form}")
         finally:
             if cursor_form: cursor_form.close()
@@ -419,9 +374,9 @@ def add_patient():
             cursor_form_err = connection_form_err.cursor(dictionary=True)
             cursor_form_err.execute("SELECT id, provider_name FROM insurance_providers WHERE is_active = TRUE ORDER BY provider_name")
             insurance_providers_form_err = cursor_form_err.fetchall()
-            gender_options_form_err = get_enum_values(cursor_form_err, 'patients', 'gender')
-            blood_types_form_err = get_enum_values(cursor_form_err, 'patients', 'blood_type')
-            marital_statuses_form_err = get_enum_values(cursor_form_err, 'patients', 'marital_status')
+            gender_options_form_err = get_enum_values('patients', 'gender')
+            blood_types_form_err = get_enum_values('patients', 'blood_type')
+            marital_statuses_form_err = get_enum_values('patients', 'marital_status')
     except Exception as e_form_err: current_app.logger.error(f"Error reloading form data for add_patient final redirect: {e_form_err}")
     finally:
         if cursor_form_err: cursor_form_err.close()
@@ -541,9 +496,9 @@ def edit_patient_form(patient_id):
 
         cursor.execute("SELECT id, provider_name FROM insurance_providers WHERE is_active = TRUE ORDER BY provider_name")
         insurance_providers = cursor.fetchall()
-        gender_options = get_enum_values(cursor, 'patients', 'gender')
-        blood_types = get_enum_values(cursor, 'patients', 'blood_type')
-        marital_statuses = get_enum_values(cursor, 'patients', 'marital_status')
+        gender_options = get_enum_values('patients', 'gender')
+        blood_types = get_enum_values('patients', 'blood_type')
+        marital_statuses = get_enum_values('patients', 'marital_status')
 
         # Formatting for date inputs in the form
         if patient.get('date_of_birth') and isinstance(patient.get('date_of_birth'), datetime.date):
@@ -689,6 +644,7 @@ def edit_patient(patient_id):
         """, (patient_id, current_admin_id, patient_id))
 
         connection.commit()
+        invalidate_principal(patient_id)
         flash_msg = "Patient updated successfully"
         if update_password: flash_msg += " (Password Changed)"
         flash(flash_msg, "success")
@@ -759,6 +715,7 @@ def delete_patient(patient_id):
                 VALUES (%s, 'patient_deleted', %s, %s, 'users', %s)
             """, (patient_id, action_details, current_admin_id, patient_id))
             connection.commit()
+            invalidate_principal(patient_id)
             flash("Patient and associated records deleted successfully.", "success")
         else:
             if connection.in_transaction: connection.rollback()
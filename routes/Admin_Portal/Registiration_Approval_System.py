@@ -4,6 +4,7 @@ from flask import (Blueprint, render_template, request, flash,
                    redirect, url_for, current_app, jsonify)
 from flask_login import login_required, current_user
 from db import get_db_connection
+from routes.principal_cache import invalidate_principal
 from math import ceil
 import datetime # For setting approval/processed dates and getting current time
 import mysql.connector # Specifically for error handling
@@ -325,6 +326,7 @@ def approve_registration(reg_id):
         cursor.execute(audit_sql, (new_user_id, 'doctor_registration_approved', audit_details, current_admin_id, 'users', new_user_id))
 
         connection.commit()
+        invalidate_principal(new_user_id)
         current_app.logger.info(f"Successfully approved registration {reg_id}, activated user {new_user_id}.")
         flash(f"Doctor '{reg_data['username']}' approved and user account activated successfully.", "success")
         return redirect(url_for('registration_approval.index', status='approved'))
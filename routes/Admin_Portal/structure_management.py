@@ -1,14 +1,14 @@
 # routes/Admin_Portal/structure_management.py
 
 import os
-import uuid
 from flask import (
     Blueprint, render_template, request, flash, redirect, url_for, current_app
 )
 from flask_login import login_required # Assuming you have an admin_required decorator or similar
 import mysql.connector
-from werkzeug.utils import secure_filename as werkzeug_secure_filename # Renamed for clarity
 from db import get_db_connection
+from utils.image_derivatives import derive_uploaded_image
+from utils.upload_store import release_upload, store_upload, upload_extension
 
 # Import the helper from directory_configs
 # Adjust the import path based on your project structure if utils is not directly accessible
@@ -48,13 +48,6 @@ def allowed_file(filename, allowed_extensions_set): # Takes a set now
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in allowed_extensions_set
 
-def generate_unique_filesystem_name(original_filename): # Renamed for clarity
-    """Generates a secure and unique filename for storing on the filesystem."""
-    cleaned_filename = werkzeug_secure_filename(original_filename)
-    base, ext = os.path.splitext(cleaned_filename)
-    base = base[:100] if base else "image" # Ensure base is not empty and limit length
-    return f"{uuid.uuid4().hex}_{base}{ext}"
-
 def delete_existing_image_file(db_relative_path):
     """
     Safely deletes an existing image file.
@@ -74,7 +67,7 @@ def delete_existing_image_file(db_relative_path):
         full_absolute_path = os.path.normpath(full_absolute_path) # Normalize
 
         if os.path.exists(full_absolute_path) and os.path.isfile(full_absolute_path):
-            os.remove(full_absolute_path)
+            release_upload(full_absolute_path) # Unlinks only when no other department shares the stored file
             current_app.logger.info(f"Deleted existing file: {full_absolute_path}")
             return True
         else:
@@ -208,12 +201,9 @@ def add_department():
             upload_error = True
         elif allowed_extensions and allowed_file(image_file.filename, allowed_extensions):
             try:
-                filesystem_secure_name = generate_unique_filesystem_name(image_file.filename)
-                saved_file_absolute_path = os.path.join(upload_folder_absolute, filesystem_secure_name)
-                
-                os.makedirs(upload_folder_absolute, exist_ok=True) # Ensure dir exists
-                image_file.save(saved_file_absolute_path)
+                saved_file_absolute_path = store_upload(image_file, upload_folder_absolute, upload_extension(image_file.filename))
                 current_app.logger.info(f"Department image saved to: {saved_file_absolute_path}")
+                derive_uploaded_image(saved_file_absolute_path)
 
                 # Generate path for DB relative to static folder
                 saved_filename_db_path = get_relative_path_for_db(saved_file_absolute_path)
@@ -223,6 +213,7 @@ def add_department():
             except Exception as e:
                 current_app.logger.error(f"Error saving department image: {e}", exc_info=True)
                 flash(f"Error saving uploaded image: {str(e)}", "danger")
+                if saved_file_absolute_path: release_upload(saved_file_absolute_path)
                 upload_error = True
         else:
             flash("Invalid image file type. Allowed types: {}".format(', '.join(allowed_extensions or [])), "danger")
@@ -305,13 +296,11 @@ def edit_department(dept_id):
                 return render_template('Admin_Portal/structure/edit_department.html', department=current_department_data)
             
             if allowed_extensions and allowed_file(image_file.filename, allowed_extensions):
+                saved_file_absolute_path = None
                 try:
-                    filesystem_secure_name = generate_unique_filesystem_name(image_file.filename)
-                    saved_file_absolute_path = os.path.join(upload_folder_absolute, filesystem_secure_name)
-                    
-                    os.makedirs(upload_folder_absolute, exist_ok=True)
-                    image_file.save(saved_file_absolute_path)
+                    saved_file_absolute_path = store_upload(image_file, upload_folder_absolute, upload_extension(image_file.filename))
                     current_app.logger.info(f"New department image for {dept_id} saved: {saved_file_absolute_path}")
+                    derive_uploaded_image(saved_file_absolute_path)
                     
                     temp_db_path = get_relative_path_for_db(saved_file_absolute_path)
                     if not temp_db_path:
@@ -324,6 +313,7 @@ def edit_department(dept_id):
                 except Exception as e:
                     current_app.logger.error(f"Error saving updated department image for {dept_id}: {e}", exc_info=True)
                     flash(f"Error saving uploaded image: {str(e)}", "danger")
+                    if saved_file_absolute_path: release_upload(saved_file_absolute_path)
                     # Don't change new_image_db_path, keep the old one
                     return render_template('Admin_Portal/structure/edit_department.html', department=current_department_data)
             else:
@@ -343,7 +333,7 @@ def edit_department(dept_id):
             conn.commit()
 
             # If DB update was successful, now delete the old physical file if it was replaced or marked for deletion
-            if old_image_to_delete_if_replaced and old_image_to_delete_if_replaced != new_image_db_path:
+            if old_image_to_delete_if_replaced: # Releases the old row's reference even if the same file was re-uploaded
                 delete_existing_image_file(old_image_to_delete_if_replaced)
             
             flash(f"Department '{name}' updated successfully.", "success")
@@ -4,6 +4,7 @@ from flask import Blueprint, render_template, flash, redirect, url_for, current_
 from flask_login import login_required, current_user
 from db import get_db_connection
 from utils.template_helpers import format_timedelta_as_time # Assuming this is correctly registered
+from routes.availability_projection import READ_PROJECTION, get_open_slot_summary
 from datetime import timedelta, datetime, date, time
 
 from .utils import (
@@ -35,6 +36,7 @@ def dashboard():
         'patient_count': 0,
         'unread_messages': 0,
         'appointments_today_count': 0,
+        'open_slots_week': None,
     }
 
     conn = None
@@ -106,6 +108,11 @@ def dashboard():
         result_messages = cursor.fetchone()
         dashboard_data['unread_messages'] = result_messages['count'] if result_messages else 0
 
+        # Open Slots This Week (from the materialized availability projection)
+        if READ_PROJECTION:
+            today = date.today()
+            dashboard_data['open_slots_week'] = get_open_slot_summary(cursor, doctor_user_id, today, today + timedelta(days=6))
+
     except mysql.connector.Error as err:
         current_app.logger.error(f"DB error on doctor dashboard (User ID: {doctor_user_id}): {err}")
         flash("An error occurred loading some dashboard data.", "danger")
@@ -20,6 +20,9 @@ from flask_login import current_user, login_required
 import mysql.connector
 
 from db import get_db_connection
+from utils.pagination import count_rows
+from utils.schema_metadata import get_enum_values
+from routes.availability_cache import invalidate_availability
 
 # Configure logger
 logger = logging.getLogger(__name__)
@@ -34,7 +37,6 @@ try:
     from .utils import (
         check_doctor_authorization,
         get_provider_id,
-        get_enum_values as get_enum_values_util, # Renamed to avoid conflict
         get_all_simple,
         can_modify_appointment
     )
@@ -52,7 +54,6 @@ except (ImportError, ValueError) as e1:
         from .utils import (
             check_doctor_authorization,
             get_provider_id,
-            get_enum_values as get_enum_values_util,
             get_all_simple,
             can_modify_appointment
         )
@@ -84,52 +85,12 @@ VALID_SORT_COLUMNS = {
 }
 DEFAULT_SORT_COLUMN = 'date'
 DEFAULT_SORT_DIRECTION = 'ASC'
-ENUM_CACHE_APPT = {} # Specific cache for this blueprint's ENUM needs
 
 TERMINAL_APPT_STATUSES = ['completed', 'canceled', 'no-show', 'rescheduled']
 
 
 # --- Helper Functions ---
 
-def get_enum_values_appt_specific(table_name, column_name):
-    """Fetches and caches ENUM values (e.g., for 'appointments.status')."""
-    cache_key = f"{table_name}_{column_name}"
-    if cache_key in ENUM_CACHE_APPT:
-        return ENUM_CACHE_APPT[cache_key]
-
-    conn = None
-    cursor = None
-    values = []
-    try:
-        conn = get_db_connection()
-        if not conn:
-            logger.error(f"DB connection failed for ENUM fetch: {table_name}.{column_name}")
-            return [] # Return empty on connection failure
-        cursor = conn.cursor()
-        db_name = conn.database # Get the current database name
-        query = """
-            SELECT COLUMN_TYPE
-            FROM information_schema.COLUMNS
-            WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s
-        """
-        cursor.execute(query, (db_name, table_name, column_name))
-        result = cursor.fetchone()
-        if result and result[0] and result[0].lower().startswith("enum("):
-            enum_str = result[0]
-            # Correctly parse ENUM string: "enum('val1','val2','val3')"
-            enum_content = enum_str[enum_str.find("(")+1:enum_str.rfind(")")]
-            values = [val.strip().strip("'\"") for val in enum_content.split(",")]
-        ENUM_CACHE_APPT[cache_key] = values
-        return values
-    except (mysql.connector.Error, ConnectionError, IndexError, TypeError) as e:
-        logger.error(f"Error getting ENUM values for {table_name}.{column_name}: {e}", exc_info=True)
-        return [] # Return empty list on error
-    finally:
-        if cursor:
-            cursor.close()
-        if conn and conn.is_connected():
-            conn.close()
-
 def get_all_appointment_types():
     """Fetches all active appointment types (id, name, duration) from the database."""
     conn = None
@@ -270,9 +231,9 @@ def get_paginated_appointments(provider_user_id_int, page=1, per_page=ITEMS_PER_
 
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True, buffered=True) # buffered for FOUND_ROWS
+        cursor = conn.cursor(dictionary=True, buffered=True)
         sql_select = """
-            SELECT SQL_CALC_FOUND_ROWS
+            SELECT
                    a.appointment_id, a.patient_id, a.doctor_id, a.appointment_date,
                    a.start_time, a.end_time, a.status, a.reason, a.notes,
                    a.doctor_location_id, a.created_at, a.updated_at,
@@ -325,6 +286,8 @@ def get_paginated_appointments(provider_user_id_int, page=1, per_page=ITEMS_PER_
             sql_where += " AND a.doctor_location_id = %s"
             params.append(filter_location_id)
 
+        result['total'] = count_rows(cursor, f"SELECT COUNT(*) AS total{sql_from}{sql_where}", params)
+
         query = f"{sql_select}{sql_from}{sql_where} ORDER BY {sort_column_sql} {sort_dir_sql} LIMIT %s OFFSET %s"
         params.extend([per_page, offset])
 
@@ -339,10 +302,6 @@ def get_paginated_appointments(provider_user_id_int, page=1, per_page=ITEMS_PER_
             item['location_name'] = item.get('location_name', 'N/A')
         result['items'] = items
 
-        cursor.execute("SELECT FOUND_ROWS() as total")
-        total_row = cursor.fetchone()
-        result['total'] = total_row['total'] if total_row else 0
-
     except Exception as err:
         logger.error(f"Error fetching paginated appointments for provider {provider_user_id_int}: {err}", exc_info=True)
     finally:
@@ -477,7 +436,7 @@ def list_appointments():
 
     # Data for filter dropdowns
     all_appointment_types_list = get_all_appointment_types()
-    appointment_statuses_enum = get_enum_values_appt_specific('appointments', 'status')
+    appointment_statuses_enum = get_enum_values('appointments', 'status')
     # Critical: get_all_provider_locations MUST be the real, database-backed function
     provider_locations_list = get_all_provider_locations(provider_user_id)
     if not provider_locations_list:
@@ -509,7 +468,7 @@ def view_appointment(appointment_id):
         flash("Appointment not found or access denied.", "warning")
         return redirect(url_for('.list_appointments'))
 
-    appointment_statuses_enum = get_enum_values_appt_specific('appointments', 'status')
+    appointment_statuses_enum = get_enum_values('appointments', 'status')
     is_editable = details.get('status') not in TERMINAL_APPT_STATUSES
 
     return render_template('Doctor_Portal/Appointments/appointment_detail.html',
@@ -564,6 +523,7 @@ def cancel_appointment(appointment_id):
                 conn.commit()
             
             if cursor.rowcount > 0:
+                invalidate_availability(provider_user_id, dates=[appt['appointment_date']])
                 flash("Appointment canceled successfully.", "success")
                 success = True
             else:
@@ -707,6 +667,7 @@ def reschedule_appointment(appointment_id):
                             flash("Update failed. The appointment status might have changed or it no longer exists.", "warning")
                         else:
                             conn.commit()
+                            invalidate_availability(provider_user_id, dates=[appointment['appointment_date'], new_date])
                             flash("Appointment rescheduled successfully.", "success")
                             return redirect(url_for('.view_appointment', appointment_id=appointment_id))
 
@@ -762,7 +723,7 @@ def update_appointment_status(appointment_id):
         return jsonify(success=False, message="Provider not found."), 400
 
     new_status = request.json.get('status')
-    available_statuses = get_enum_values_appt_specific('appointments', 'status')
+    available_statuses = get_enum_values('appointments', 'status')
     if not new_status or new_status not in available_statuses:
         return jsonify(success=False, message="Invalid status provided."), 400
 
@@ -776,7 +737,7 @@ def update_appointment_status(appointment_id):
 
         # Fetch current status
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT status FROM appointments WHERE appointment_id = %s AND doctor_id = %s",
+        cursor.execute("SELECT status, appointment_date FROM appointments WHERE appointment_id = %s AND doctor_id = %s",
                        (appointment_id, provider_user_id))
         appt = cursor.fetchone()
         cursor.close() # Close this cursor
@@ -802,6 +763,7 @@ def update_appointment_status(appointment_id):
         
         if cursor.rowcount > 0:
             conn.commit() # Commit the transaction started by the UPDATE
+            invalidate_availability(provider_user_id, dates=[appt['appointment_date']])
             return jsonify(success=True, message="Appointment status updated successfully.", new_status=new_status)
         else:
             # No rows affected could mean appointment not found with that doctor_id, or status was already as desired
@@ -9,6 +9,10 @@ from db import get_db_connection
 from datetime import time, date, datetime, timedelta
 import logging
 
+from routes.availability_cache import invalidate_availability
+from routes.availability_engine import MINUTES_PER_DAY, to_minutes
+from utils.intervals import IntervalSet
+
 try:
     from routes.Doctor_Portal.utils import check_doctor_authorization, get_provider_id 
 except (ImportError, ValueError) as e:
@@ -134,7 +138,6 @@ def get_overrides(provider_id, start_date_str=None, end_date_str=None):
     return overrides
 
 def check_location_weekly_slot_overlap(doctor_location_id, day_of_week, new_start_time_str, new_end_time_str, exclude_id=None):
-    # Unchanged
     conn = None; cursor = None; overlap = True 
     try:
         new_start_time = time.fromisoformat(new_start_time_str)
@@ -146,16 +149,15 @@ def check_location_weekly_slot_overlap(doctor_location_id, day_of_week, new_star
         conn = get_db_connection()
         if not conn: raise ConnectionError("DB Connection failed for overlap check.")
         with conn.cursor() as cursor_check: 
-            query = """SELECT 1 FROM doctor_location_availability
-                       WHERE doctor_location_id = %s AND day_of_week = %s
-                       AND (%s < end_time AND %s > start_time)"""
-            params = [doctor_location_id, day_of_week, new_start_time, new_end_time]
+            query = """SELECT start_time, end_time FROM doctor_location_availability
+                       WHERE doctor_location_id = %s AND day_of_week = %s"""
+            params = [doctor_location_id, day_of_week]
             if exclude_id:
                 query += " AND location_availability_id != %s"
                 params.append(exclude_id)
-            query += " LIMIT 1"
             cursor_check.execute(query, tuple(params))
-            overlap = cursor_check.fetchone() is not None
+            existing = IntervalSet((to_minutes(s), to_minutes(e)) for s, e in cursor_check.fetchall())
+        overlap = existing.overlaps(to_minutes(new_start_time), to_minutes(new_end_time))
     except ValueError as ve: 
         logger.warning(f"Validation error during weekly overlap check for DL_ID:{doctor_location_id}: {ve}")
     except (mysql.connector.Error, ConnectionError) as db_err:
@@ -167,13 +169,12 @@ def check_location_weekly_slot_overlap(doctor_location_id, day_of_week, new_star
     return overlap
 
 def check_override_overlap(provider_id, override_date_str, doctor_location_id=None, start_time_str=None, end_time_str=None, exclude_id=None):
-    # Unchanged
     conn = None; cursor = None; overlap = True
     try:
         override_date_obj = date.fromisoformat(override_date_str)
-        start_time_obj = time.fromisoformat(start_time_str) if start_time_str else time.min 
-        end_time_obj = time.fromisoformat(end_time_str) if end_time_str else time.max     
-        if start_time_str and end_time_str and start_time_obj >= end_time_obj:
+        start_min = to_minutes(time.fromisoformat(start_time_str)) if start_time_str else 0
+        end_min = to_minutes(time.fromisoformat(end_time_str)) if end_time_str else MINUTES_PER_DAY
+        if start_time_str and end_time_str and start_min >= end_min:
              raise ValueError("Start time must be before end time for override.")
         current_location_id_int = int(doctor_location_id) if doctor_location_id is not None else None
         conn = get_db_connection()
@@ -181,22 +182,24 @@ def check_override_overlap(provider_id, override_date_str, doctor_location_id=No
         with conn.cursor() as cursor_check:
             params = {
                 'provider_id': provider_id, 'override_date': override_date_obj,
-                'start_time': start_time_obj, 'end_time': end_time_obj,
                 'current_loc_id': current_location_id_int
             }
             query = """
-                SELECT 1 FROM doctor_availability_overrides dao
+                SELECT dao.start_time, dao.end_time FROM doctor_availability_overrides dao
                 WHERE dao.doctor_id = %(provider_id)s
                   AND dao.override_date = %(override_date)s
-                  AND ( (dao.start_time IS NULL OR dao.end_time IS NULL) OR (%(start_time)s < COALESCE(dao.end_time, TIME('23:59:59')) AND %(end_time)s > COALESCE(dao.start_time, TIME('00:00:00'))) )
                   AND ( dao.doctor_location_id IS NULL OR %(current_loc_id)s IS NULL OR dao.doctor_location_id = %(current_loc_id)s )
             """
             if exclude_id:
                 query += " AND dao.override_id != %(exclude_id)s"
                 params['exclude_id'] = exclude_id
-            query += " LIMIT 1"
             cursor_check.execute(query, params)
-            overlap = cursor_check.fetchone() is not None
+            # An override with no start or end blocks the whole day.
+            existing = IntervalSet(
+                (to_minutes(s), to_minutes(e)) if s is not None and e is not None else (0, MINUTES_PER_DAY)
+                for s, e in cursor_check.fetchall()
+            )
+        overlap = existing.overlaps(start_min, end_min)
     except ValueError as ve:
         logger.warning(f"Validation error: override overlap P:{provider_id} L:{doctor_location_id} D:{override_date_str}: {ve}")
     except (mysql.connector.Error, ConnectionError) as db_err:
@@ -276,6 +279,7 @@ def add_or_update_location_daily_cap(provider_id, doctor_location_id, day_of_wee
         cursor.execute("SELECT cap_id, max_appointments FROM doctor_location_daily_caps WHERE doctor_id = %s AND doctor_location_id = %s AND day_of_week = %s", (provider_id, doc_loc_id_int, day_of_week_int))
         result_cap_data = cursor.fetchone()
         conn.commit()
+        invalidate_availability(provider_id, doc_loc_id_int)
         operation_successful = True
         message = "Daily appointment cap saved successfully."
         if result_cap_data:
@@ -319,6 +323,7 @@ def delete_location_daily_cap_by_details(provider_id, doctor_location_id, day_of
         cursor.execute(query, (provider_id, doc_loc_id_int, day_of_week_int))
         rows_affected = cursor.rowcount
         conn.commit()
+        if rows_affected > 0: invalidate_availability(provider_id, doc_loc_id_int)
         operation_successful = True
         message = "Daily cap for this day and location cleared." if rows_affected > 0 else "No daily cap was set for this day and location to clear."
     except ValueError as ve: message = str(ve)
@@ -514,6 +519,7 @@ def add_weekly_slot_page_route():
         
         conn.commit() # Commit the transaction for this operation
         operation_successful = True # Mark as successful for the finally block
+        invalidate_availability(provider_id, doctor_location_id)
         flash("Weekly slot added successfully.", "success")
 
     except ValueError as ve:
@@ -570,6 +576,7 @@ def delete_weekly_slot_page_route(location_availability_id):
         else:
             flash("Weekly slot deleted successfully.", "success")
         conn.commit()
+        invalidate_availability(provider_id)
     except (mysql.connector.Error, ConnectionError) as err:
         if conn and conn.is_connected() and conn.in_transaction: conn.rollback()
         logger.error(f"DB Error deleting weekly slot ID {location_availability_id} P:{provider_id}: {err}", exc_info=True)
@@ -683,6 +690,7 @@ def add_override_page_route():
         params = (provider_id, doctor_location_id, override_date_str, start_time_str, end_time_str, is_unavailable, reason)
         cursor.execute(query, params)
         conn.commit()
+        invalidate_availability(provider_id, doctor_location_id, [date.fromisoformat(override_date_str)])
         flash("Date override added successfully.", "success")
 
     except ValueError as ve:
@@ -726,6 +734,7 @@ def delete_override_page_route(override_id):
         else:
             flash("Date override deleted successfully.", "success")
         conn.commit()
+        invalidate_availability(provider_id)
     except (mysql.connector.Error, ConnectionError) as err:
         if conn and conn.is_connected() and conn.in_transaction: conn.rollback()
         logger.error(f"DB Error deleting override ID {override_id} P:{provider_id}: {err}", exc_info=True)
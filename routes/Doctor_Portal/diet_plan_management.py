@@ -7,6 +7,9 @@ from flask import (
 )
 from flask_login import login_required, current_user
 from db import get_db_connection
+from utils.pagination import count_rows
+from utils.schema_metadata import get_enum_values
+from routes.shared_utils import get_diet_plan_with_meals
 from datetime import date, datetime, time, timedelta
 import math
 import json
@@ -77,26 +80,6 @@ def format_timedelta_as_time(delta):
 
 
 # --- INTERNALIZED Helper Functions ---
-def get_enum_values(table_name, column_name):
-    conn = None; cursor = None; enum_values = []
-    try:
-        conn = get_db_connection(); cursor = conn.cursor(dictionary=True)
-        safe_table_name = '`' + re.sub(r'[^a-zA-Z0-9_]', '', table_name) + '`'
-        safe_column_name = re.sub(r'[^a-zA-Z0-9_]', '', column_name)
-        query = f"SHOW COLUMNS FROM {safe_table_name} LIKE '{safe_column_name}'"
-        cursor.execute(query); result = cursor.fetchone()
-        if result and 'Type' in result:
-            type_info = result['Type']
-            match = re.match(r"enum\((.*?)\)$", type_info, re.IGNORECASE)
-            if match:
-                enum_values = [val.strip().strip("'").strip('"') for val in match.group(1).split(',')]
-    except Exception as e: 
-        current_app.logger.error(f"Error getting ENUM {table_name}.{column_name}: {e}", exc_info=True)
-    finally:
-        if cursor: cursor.close()
-        if conn and conn.is_connected(): conn.close()
-    return enum_values
-
 def validate_numeric(value, field_name, errors, allow_negative=False, is_float=False, required=False):
     if value is None and not required: return None
     if value is None and required:
@@ -333,7 +316,7 @@ def get_paginated_diet_plans(page=1, per_page=ITEMS_PER_PAGE, search_term=None,
         if not conn: raise ConnectionError("DB Connection failed")
         cursor = conn.cursor(dictionary=True)
         sql_select = """
-            SELECT SQL_CALC_FOUND_ROWS dp.*,
+            SELECT dp.*,
                    u.user_id as creator_user_id, u.first_name as creator_first_name, u.last_name as creator_last_name
         """
         sql_from = " FROM diet_plans dp LEFT JOIN users u ON dp.creator_id = u.user_id "
@@ -350,15 +333,13 @@ def get_paginated_diet_plans(page=1, per_page=ITEMS_PER_PAGE, search_term=None,
             sql_where += " AND dp.is_public = %s"
             params.append(1 if valid_filters['is_public'] else 0)
 
+        result['total'] = count_rows(cursor, f"SELECT COUNT(*) AS total{sql_from}{sql_where}", params)
+
         query = f"{sql_select}{sql_from}{sql_where} ORDER BY {sort_column_sql} {sort_dir_sql} LIMIT %s OFFSET %s"
         params.extend([per_page, offset])
         cursor.execute(query, tuple(params))
         result['items'] = cursor.fetchall()
 
-        cursor.execute("SELECT FOUND_ROWS() as total")
-        total_row = cursor.fetchone()
-        result['total'] = total_row['total'] if total_row else 0
-
     except (mysql.connector.Error, ConnectionError) as err:
         current_app.logger.error(f"Error fetching paginated diet plans: {err}")
     finally:
@@ -367,58 +348,10 @@ def get_paginated_diet_plans(page=1, per_page=ITEMS_PER_PAGE, search_term=None,
     return result
 
 def get_diet_plan_details(plan_id):
-    conn = None; cursor = None; details = {'plan': None, 'meals': []}
     try:
-        conn = get_db_connection();
-        if not conn: raise ConnectionError("DB Connection failed")
-        cursor = conn.cursor(dictionary=True)
-        query_plan = """SELECT dp.*, u.first_name as creator_first_name, u.last_name as creator_last_name
-                        FROM diet_plans dp LEFT JOIN users u ON dp.creator_id = u.user_id WHERE dp.plan_id = %s"""
-        cursor.execute(query_plan, (plan_id,))
-        details['plan'] = cursor.fetchone()
-        if not details['plan']: return None
-
-        query_meals = """SELECT * FROM diet_plan_meals WHERE plan_id = %s
-                         ORDER BY FIELD(meal_type, 'breakfast', 'lunch', 'dinner', 'snack', 'other'), time_of_day, meal_id"""
-        cursor.execute(query_meals, (plan_id,))
-        meals_raw = cursor.fetchall()
-        
-        meals_processed = []
-        if meals_raw:
-            meal_ids = [meal['meal_id'] for meal in meals_raw]
-            placeholders = ', '.join(['%s'] * len(meal_ids))
-            query_items = f"SELECT * FROM diet_plan_food_items WHERE meal_id IN ({placeholders}) ORDER BY meal_id, item_id"
-            cursor.execute(query_items, tuple(meal_ids))
-            all_items_raw = cursor.fetchall()
-            
-            items_by_meal = {}
-            for item_raw in all_items_raw:
-                item = item_raw.copy() # Work on a copy
-                for key, value in item.items():
-                     if isinstance(value, decimal.Decimal):
-                         item[key] = float(value) 
-                meal_id = item['meal_id']
-                if meal_id not in items_by_meal: items_by_meal[meal_id] = []
-                items_by_meal[meal_id].append(item)
-
-            for meal_raw in meals_raw:
-                meal = meal_raw.copy() # Work on a copy
-                # Use the timedelta_to_time_filter for consistent time object handling
-                meal['time_of_day_obj'] = timedelta_to_time_filter(meal.get('time_of_day'))
-                
-                # If you also want a formatted string directly in the meal dict (optional)
-                # meal['time_of_day_formatted'] = format_timedelta_as_time(meal.get('time_of_day'))
-                
-                meal['food_items'] = items_by_meal.get(meal['meal_id'], [])
-                meals_processed.append(meal)
-            details['meals'] = meals_processed
-
+        return get_diet_plan_with_meals(plan_id)
     except (mysql.connector.Error, ConnectionError) as err:
         current_app.logger.error(f"Error fetching diet plan details for ID {plan_id}: {err}"); return None
-    finally:
-        if cursor: cursor.close()
-        if conn and conn.is_connected(): conn.close()
-    return details
 
 
 # --- Routes ---
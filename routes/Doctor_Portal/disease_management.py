@@ -4,12 +4,16 @@ import mysql.connector
 import re
 from flask import (
     Blueprint, render_template, request, flash, redirect, url_for,
-    jsonify, current_app, abort, send_from_directory
+    jsonify, current_app, abort
 )
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
 import os
 from db import get_db_connection
+from utils.pagination import count_rows
+from utils.schema_metadata import get_enum_values
+from utils.media_serving import send_media
+from utils.image_derivatives import derive_uploaded_image
+from utils.upload_store import release_upload, store_upload, upload_extension
 from datetime import date, datetime
 import math
 
@@ -17,25 +21,6 @@ import math
 def check_doctor_authorization(user):
     return user.is_authenticated and getattr(user, 'user_type', None) == 'doctor'
 
-def get_enum_values(table_name, column_name):
-    conn = None; cursor = None; enum_values = []
-    try:
-        conn = get_db_connection(); cursor = conn.cursor(dictionary=True)
-        safe_table_name = '`' + table_name.replace('`', '``') + '`'
-        safe_column_name = column_name.replace("'", "''")
-        query = f"SHOW COLUMNS FROM {safe_table_name} LIKE '{safe_column_name}'"
-        cursor.execute(query); result = cursor.fetchone()
-        if result and 'Type' in result:
-            type_info = result['Type']
-            match = re.match(r"enum\((.*)\)", type_info, re.IGNORECASE)
-            if match:
-                enum_values = [val.strip().strip("'") for val in match.group(1).split(',')]
-    except Exception as e: current_app.logger.error(f"Error getting ENUM {table_name}.{column_name}: {e}", exc_info=True)
-    finally:
-        if cursor: cursor.close()
-        if conn and conn.is_connected(): conn.close()
-    return enum_values
-
 def get_all_simple(table_name, id_column, name_column, order_by_name=True):
     conn = None; cursor = None; results = []
     if not re.match(r'^[a-zA-Z0-9_]+$', table_name) or \
@@ -66,6 +51,7 @@ disease_management_bp = Blueprint(
 
 # --- Configuration / Constants ---
 ITEMS_PER_PAGE = 15
+CONDITION_MEDIA_MAX_AGE = 3600 # Seconds browsers may reuse condition images/videos before revalidating
 VALID_SORT_COLUMNS = {
     'name': 'c.condition_name', 'code': 'c.icd_code', 'type': 'c.condition_type',
     'urgency': 'c.urgency_level', 'id': 'c.condition_id', 
@@ -94,16 +80,9 @@ def _save_file_generic(file_storage_object, upload_folder_config_key, allowed_ex
     if not _allowed_file_generic(file_storage_object.filename, allowed_extensions_config_key):
         allowed_ext_str = ", ".join(current_app.config.get(allowed_extensions_config_key, {'N/A'}))
         return None, f"File type not allowed. Allowed: {allowed_ext_str}."
-    original_filename = secure_filename(file_storage_object.filename)
-    ext = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else ''
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
-    base_name_part = original_filename.rsplit('.',1)[0][:50] if '.' in original_filename else original_filename[:50]
-    unique_filename_stem = f"{timestamp}_{secure_filename(base_name_part)}" 
-    unique_filename = f"{unique_filename_stem}.{ext}" if ext else unique_filename_stem
-    filepath_abs = os.path.join(upload_folder_abs, unique_filename)
+    filepath_abs = None
     try:
-        os.makedirs(upload_folder_abs, exist_ok=True)
-        file_storage_object.save(filepath_abs)
+        filepath_abs = store_upload(file_storage_object, upload_folder_abs, upload_extension(file_storage_object.filename))
         static_base_uploads = current_app.config.get('UPLOAD_FOLDER_BASE')
         if not static_base_uploads: raise Exception("UPLOAD_FOLDER_BASE not configured.")
         relative_to_base = os.path.relpath(filepath_abs, static_base_uploads)
@@ -111,10 +90,10 @@ def _save_file_generic(file_storage_object, upload_folder_config_key, allowed_ex
         current_app.logger.info(f"File saved. Absolute: {filepath_abs}, DB_Path: {db_path}")
         return db_path, None
     except Exception as e:
-        current_app.logger.error(f"File save failed for {unique_filename}: {e}", exc_info=True)
-        if os.path.exists(filepath_abs):
-            try: os.remove(filepath_abs)
-            except OSError: pass
+        current_app.logger.error(f"File save failed for {file_storage_object.filename}: {e}", exc_info=True)
+        if filepath_abs:
+            try: release_upload(filepath_abs)
+            except Exception: pass
         return None, f"File save operation failed: {str(e)}"
 
 def _delete_file_generic(db_path_relative_to_static):
@@ -133,7 +112,7 @@ def _delete_file_generic(db_path_relative_to_static):
         return False, "Security error: Path is outside designated static folder."
     try:
         if os.path.exists(filepath_abs) and os.path.isfile(filepath_abs):
-            os.remove(filepath_abs)
+            release_upload(filepath_abs) # Unlinks only when no other row shares the stored file
             current_app.logger.info(f"File deleted: {filepath_abs}")
             return True, "File deleted successfully."
         else:
@@ -143,7 +122,10 @@ def _delete_file_generic(db_path_relative_to_static):
         current_app.logger.error(f"Error deleting file {filepath_abs}: {e}", exc_info=True)
         return False, f"Error during file deletion: {str(e)}"
 
-def save_condition_image(file_storage): return _save_file_generic(file_storage, 'UPLOAD_FOLDER_CONDITIONS', 'ALLOWED_IMAGE_EXTENSIONS')
+def save_condition_image(file_storage):
+    db_path, error = _save_file_generic(file_storage, 'UPLOAD_FOLDER_CONDITIONS', 'ALLOWED_IMAGE_EXTENSIONS')
+    if db_path: derive_uploaded_image(os.path.join(current_app.static_folder, db_path))
+    return db_path, error
 def delete_condition_image(db_path): return _delete_file_generic(db_path)
 def save_condition_video(file_storage): return _save_file_generic(file_storage, 'UPLOAD_FOLDER_CONDITION_VIDEOS', 'ALLOWED_VIDEO_EXTENSIONS')
 def delete_condition_video(db_path): return _delete_file_generic(db_path)
@@ -204,7 +186,7 @@ def get_paginated_diseases(page=1, per_page=ITEMS_PER_PAGE, search_term=None,
     sort_dir_sql = 'DESC' if sort_dir.upper() == 'DESC' else 'ASC'
     try:
         conn = get_db_connection(); cursor = conn.cursor(dictionary=True, buffered=True)
-        sql_select = """SELECT SQL_CALC_FOUND_ROWS
+        sql_select = """SELECT
                             c.condition_id, c.condition_name, c.icd_code,
                             c.condition_type, c.urgency_level, d.name as department_name,
                             s.name as specialization_name, 
@@ -235,10 +217,10 @@ def get_paginated_diseases(page=1, per_page=ITEMS_PER_PAGE, search_term=None,
         if valid_filters.get('urgency'): sql_where += " AND c.urgency_level = %s"; params.append(valid_filters['urgency'])
         if valid_filters.get('type'): sql_where += " AND c.condition_type = %s"; params.append(valid_filters['type'])
 
+        result['total'] = count_rows(cursor, f"SELECT COUNT(*) AS total{sql_from}{sql_where}", params)
         query = f"{sql_select}{sql_from}{sql_where} ORDER BY {sort_column_sql} {sort_dir_sql} LIMIT %s OFFSET %s"
         params.extend([per_page, offset]); cursor.execute(query, tuple(params))
         result['items'] = cursor.fetchall()
-        cursor.execute("SELECT FOUND_ROWS() as total"); result['total'] = cursor.fetchone()['total']
     except Exception as err: current_app.logger.error(f"Error in get_paginated_diseases: {err}", exc_info=True)
     finally:
         if cursor: cursor.close()
@@ -610,7 +592,7 @@ def edit_disease(condition_id): # Unchanged from previous version regarding dept
                 newly_saved_image_db_path, file_error = save_condition_image(image_file)
                 if file_error: errors.append(f"Image upload failed: {file_error}")
                 else:
-                    if current_image_db_path and current_image_db_path != newly_saved_image_db_path:
+                    if current_image_db_path:
                         delete_condition_image(current_image_db_path)
                     image_path_for_db_update = newly_saved_image_db_path
             
@@ -626,7 +608,7 @@ def edit_disease(condition_id): # Unchanged from previous version regarding dept
                 newly_saved_video_db_path, video_error = save_condition_video(video_file)
                 if video_error: errors.append(f"Video upload failed: {video_error}")
                 else:
-                    if current_video_db_path and current_video_db_path != newly_saved_video_db_path:
+                    if current_video_db_path:
                         delete_condition_video(current_video_db_path)
                     video_path_for_db_update = newly_saved_video_db_path
             
@@ -672,13 +654,13 @@ def edit_disease(condition_id): # Unchanged from previous version regarding dept
             for e_msg in errors: flash(e_msg, 'danger')
         except (mysql.connector.Error, ConnectionError, IOError) as err:
             if conn and conn.is_connected() and conn.in_transaction: conn.rollback()
-            if newly_saved_image_db_path and newly_saved_image_db_path != current_image_db_path: delete_condition_image(newly_saved_image_db_path)
-            if newly_saved_video_db_path and newly_saved_video_db_path != current_video_db_path: delete_condition_video(newly_saved_video_db_path)
+            if newly_saved_image_db_path: delete_condition_image(newly_saved_image_db_path)
+            if newly_saved_video_db_path: delete_condition_video(newly_saved_video_db_path)
             current_app.logger.error(f"DB/IO Error Edit Cond {condition_id}: {err}", exc_info=True); flash("DB/File error.", "danger")
         except Exception as e:
             if conn and conn.is_connected() and conn.in_transaction: conn.rollback()
-            if newly_saved_image_db_path and newly_saved_image_db_path != current_image_db_path: delete_condition_image(newly_saved_image_db_path)
-            if newly_saved_video_db_path and newly_saved_video_db_path != current_video_db_path: delete_condition_video(newly_saved_video_db_path)
+            if newly_saved_image_db_path: delete_condition_image(newly_saved_image_db_path)
+            if newly_saved_video_db_path: delete_condition_video(newly_saved_video_db_path)
             current_app.logger.error(f"Unexpected Error Edit Cond {condition_id}: {e}", exc_info=True); flash("Error.", "danger")
         finally:
             if cursor: cursor.close()
@@ -734,13 +716,13 @@ def delete_disease(condition_id): # Unchanged
     return redirect(url_for('.list_diseases'))
 
 
-# --- File Serving Routes (Unchanged) ---
+# --- File Serving Routes (public; Range/ETag handling in utils.media_serving) ---
 @disease_management_bp.route('/images/<path:image_filename_in_db>')
 def serve_condition_image(image_filename_in_db):
     static_dir_abs = current_app.config.get('STATIC_FOLDER')
     if not static_dir_abs: abort(500)
     if '..' in image_filename_in_db or image_filename_in_db.startswith(('/', '\\')): abort(400)
-    try: return send_from_directory(static_dir_abs, image_filename_in_db, as_attachment=False)
+    try: return send_media(static_dir_abs, image_filename_in_db, max_age=CONDITION_MEDIA_MAX_AGE, public=True)
     except FileNotFoundError: abort(404)
     except Exception as e: current_app.logger.error(f"Error serving image {image_filename_in_db}: {e}", exc_info=True); abort(500)
 
@@ -749,7 +731,7 @@ def serve_condition_video(video_filename_in_db):
     static_dir_abs = current_app.config.get('STATIC_FOLDER')
     if not static_dir_abs: abort(500)
     if '..' in video_filename_in_db or video_filename_in_db.startswith(('/', '\\')): abort(400)
-    try: return send_from_directory(static_dir_abs, video_filename_in_db, as_attachment=False)
+    try: return send_media(static_dir_abs, video_filename_in_db, max_age=CONDITION_MEDIA_MAX_AGE, public=True)
     except FileNotFoundError: abort(404)
     except Exception as e: current_app.logger.error(f"Error serving video {video_filename_in_db}: {e}", exc_info=True); abort(500)
 
@@ -7,6 +7,7 @@ from flask import (
 )
 from flask_login import login_required, current_user
 from db import get_db_connection
+from utils.pagination import count_rows, seek_page
 import math
 import decimal # Import Decimal for handling potential DB types
 import datetime # <--- ADD THIS IMPORT
@@ -59,16 +60,22 @@ def validate_numeric_food_item(value, field_name, errors, allow_negative=False,
 
 # --- Data Fetching Functions ---
 
-def get_paginated_food_items(page=1, per_page=ITEMS_PER_PAGE, search_term=None, sort_by=DEFAULT_SORT_COLUMN, sort_dir=DEFAULT_SORT_DIRECTION):
-    """Fetches paginated food items from the library."""
+def get_paginated_food_items(page=1, per_page=ITEMS_PER_PAGE, search_term=None, sort_by=DEFAULT_SORT_COLUMN, sort_dir=DEFAULT_SORT_DIRECTION,
+                             after=None, before=None):
+    """
+    Fetches paginated food items from the library.
+    Prev/Next use the keyset cursors `after`/`before` (see utils.pagination); numbered pages fall back to OFFSET.
+    """
     conn = None
     cursor = None
-    result = {'items': [], 'total': 0}
+    result = {'items': [], 'total': 0, 'next_cursor': None, 'prev_cursor': None}
     offset = (page - 1) * per_page
 
     # Validate sort parameters
     sort_column_sql = VALID_SORT_COLUMNS.get(sort_by, VALID_SORT_COLUMNS[DEFAULT_SORT_COLUMN])
     sort_dir_sql = 'DESC' if sort_dir.upper() == 'DESC' else 'ASC'
+    # Ties (and the id sort itself) are broken by food_item_id so every row has a unique position.
+    sort_column = None if sort_column_sql == 'fi.food_item_id' else sort_column_sql
 
     try:
         conn = get_db_connection()
@@ -76,10 +83,10 @@ def get_paginated_food_items(page=1, per_page=ITEMS_PER_PAGE, search_term=None,
             raise ConnectionError("Database connection failed")
         cursor = conn.cursor(dictionary=True)
 
-        sql_select = "SELECT SQL_CALC_FOUND_ROWS fi.*"
+        sql_select = "SELECT fi.*"
         sql_from = " FROM food_item_library fi "
         # Only show active items in the main list
-        sql_where = " WHERE fi.is_active = TRUE "
+        sql_where = "fi.is_active = TRUE"
         params = []
 
         if search_term:
@@ -88,16 +95,16 @@ def get_paginated_food_items(page=1, per_page=ITEMS_PER_PAGE, search_term=None,
             sql_where += " AND (fi.item_name LIKE %s OR fi.notes LIKE %s)"
             params.extend([search_like, search_like])
 
-        query = f"{sql_select}{sql_from}{sql_where} ORDER BY {sort_column_sql} {sort_dir_sql} LIMIT %s OFFSET %s"
-        params.extend([per_page, offset])
-
-        cursor.execute(query, tuple(params))
-        result['items'] = cursor.fetchall()
+        page_result = seek_page(cursor, f"{sql_select}{sql_from}", sql_where, params,
+                                'fi.food_item_id', 'food_item_id', per_page,
+                                sort_column=sort_column, sort_key=sort_column.split('.', 1)[1] if sort_column else None,
+                                descending=sort_dir_sql == 'DESC', after=after, before=before, offset=offset)
+        result['items'] = page_result.items
+        result['next_cursor'] = page_result.next_cursor
+        result['prev_cursor'] = page_result.prev_cursor
 
-        # Get total count matching the WHERE clause (ignoring LIMIT)
-        cursor.execute("SELECT FOUND_ROWS() as total")
-        total_row = cursor.fetchone()
-        result['total'] = total_row['total'] if total_row else 0
+        # Total count matching the WHERE clause (cached briefly; only used for the numbered links)
+        result['total'] = count_rows(cursor, f"SELECT COUNT(*) AS total{sql_from} WHERE {sql_where}", params)
 
     except (mysql.connector.Error, ConnectionError) as err:
         current_app.logger.error(f"Error fetching paginated food items: {err}")
@@ -142,7 +149,9 @@ def list_food_items():
          # Redirect to a safe place, e.g., dashboard
          return redirect(url_for('doctor_main.dashboard'))
 
-    page = request.args.get('page', 1, type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
+    after = request.args.get('after')
+    before = request.args.get('before')
     search_term = request.args.get('search', '').strip()
     sort_by = request.args.get('sort_by', DEFAULT_SORT_COLUMN).lower()
     sort_dir = request.args.get('sort_dir', DEFAULT_SORT_DIRECTION).upper()
@@ -154,7 +163,7 @@ def list_food_items():
         sort_dir = DEFAULT_SORT_DIRECTION
 
     # Fetch data using the helper function
-    result = get_paginated_food_items(page, ITEMS_PER_PAGE, search_term, sort_by, sort_dir)
+    result = get_paginated_food_items(page, ITEMS_PER_PAGE, search_term, sort_by, sort_dir, after, before)
     items = result['items']
     total_items = result['total']
     total_pages = math.ceil(total_items / ITEMS_PER_PAGE) if ITEMS_PER_PAGE > 0 else 0
@@ -168,6 +177,8 @@ def list_food_items():
         search_term=search_term,
         current_page=page,
         total_pages=total_pages,
+        next_cursor=result['next_cursor'],
+        prev_cursor=result['prev_cursor'],
         sort_by=sort_by,
         sort_dir=sort_dir,
         valid_sort_columns=VALID_SORT_COLUMNS,
@@ -3,15 +3,24 @@
 import mysql.connector
 from flask import (
     Blueprint, render_template, request, flash, redirect, url_for,
-    jsonify, current_app, abort, send_from_directory, session
+    jsonify, current_app, abort, session
 )
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 import os
-from db import get_db_connection
-from datetime import datetime
+from db import get_db_connection, read_only
 import math
 
+from utils.pagination import count_rows, seek_page
+from routes.chat_counters import record_messages_read, record_new_message, unread_sender_condition
+from routes.chat_search import search_messages, search_terms
+from utils.media_serving import cached_authorization, send_media
+from utils.upload_store import release_upload, store_upload, upload_extension
+from routes.chat_events import (
+    chat_stream_response, fetch_message, fetch_messages_page, get_chat_participants,
+    publish_message, publish_read, requested_since_id
+)
+
 from .utils import (
     check_doctor_authorization
 )
@@ -40,25 +49,18 @@ def allowed_attachment_file(filename):
            filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
 def save_chat_attachment(file, uploader_user_id):
-    """Saves an uploaded chat attachment securely (reads path from config)."""
+    """Stores an uploaded chat attachment (content-addressed, reads path from config); returns the stored filename."""
     upload_folder = current_app.config.get('UPLOAD_FOLDER_ATTACHMENTS')
     if not upload_folder:
         current_app.logger.error("UPLOAD_FOLDER_ATTACHMENTS not configured in Flask app.")
         return None, "Server configuration error (upload path)."
 
     if file and allowed_attachment_file(file.filename):
-        original_filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
-        unique_filename = secure_filename(f"{uploader_user_id}_{timestamp}_{original_filename}")
-        filepath = os.path.join(upload_folder, unique_filename)
         try:
-            file.save(filepath)
-            return unique_filename, None # Success
+            filepath = store_upload(file, upload_folder, upload_extension(file.filename))
+            return os.path.basename(filepath), None # Success
         except Exception as e:
-            current_app.logger.error(f"Failed to save attachment {unique_filename} to {filepath}: {e}")
-            if os.path.exists(filepath):
-                try: os.remove(filepath)
-                except OSError: pass
+            current_app.logger.error(f"Failed to save attachment {file.filename} from user {uploader_user_id}: {e}")
             return None, "Failed to save file."
     elif file:
         return None, "File type not allowed."
@@ -129,32 +131,34 @@ def get_doctor_chats(doctor_id, page, per_page, search_term=None, status_filter=
     result = {'items': [], 'total': 0}
     try:
         conn = get_db_connection(); cursor = conn.cursor(dictionary=True)
-        sql_select = """SELECT SQL_CALC_FOUND_ROWS c.chat_id, c.subject, c.status, c.updated_at,
+        sql_select = """SELECT c.chat_id, c.subject, c.status, c.updated_at,
                         p.user_id as patient_user_id, p_user.first_name as patient_first_name, p_user.last_name as patient_last_name,
-                        (SELECT COUNT(*) FROM chat_messages cm WHERE cm.chat_id = c.chat_id AND cm.read_at IS NULL AND cm.sender_id != %s) as unread_count,
-                        (SELECT cm_last.message_text FROM chat_messages cm_last WHERE cm_last.chat_id = c.chat_id ORDER BY cm_last.sent_at DESC LIMIT 1) as last_message_snippet"""
+                        c.doctor_unread_count as unread_count, c.last_message_snippet, c.last_message_at"""
         sql_from = " FROM chats c JOIN patients p ON c.patient_id = p.user_id JOIN users p_user ON p.user_id = p_user.user_id"
-        sql_where = " WHERE c.doctor_id = %s"; params = [doctor_id, doctor_id]
+        sql_where = " WHERE c.doctor_id = %s"; where_params = [doctor_id]
         if search_term:
             search_like = f"%{search_term}%"; sql_where += " AND (c.subject LIKE %s OR p_user.first_name LIKE %s OR p_user.last_name LIKE %s)"
-            params.extend([search_like, search_like, search_like])
+            where_params.extend([search_like, search_like, search_like])
         if status_filter and status_filter in ['active', 'pending', 'closed']:
-            sql_where += " AND c.status = %s"; params.append(status_filter)
-        sql_order = " ORDER BY c.updated_at DESC"; sql_limit = " LIMIT %s OFFSET %s"; params.extend([per_page, offset])
+            sql_where += " AND c.status = %s"; where_params.append(status_filter)
+        sql_order = " ORDER BY c.updated_at DESC"; sql_limit = " LIMIT %s OFFSET %s"
         query = f"{sql_select}{sql_from}{sql_where}{sql_order}{sql_limit}"
-        cursor.execute(query, tuple(params)); result['items'] = cursor.fetchall()
-        cursor.execute("SELECT FOUND_ROWS() as total"); total_row = cursor.fetchone()
-        result['total'] = total_row['total'] if total_row else 0
+        cursor.execute(query, tuple(where_params + [per_page, offset])); result['items'] = cursor.fetchall()
+        result['total'] = count_rows(cursor, f"SELECT COUNT(*) AS total{sql_from}{sql_where}", where_params)
     except Exception as e: current_app.logger.error(f"Error fetching chats for doctor {doctor_id}: {e}")
     finally:
         if cursor: cursor.close();
         if conn and conn.is_connected(): conn.close()
     return result
 
-def get_chat_messages(chat_id, user_id, user_type, page, per_page):
-    """ Fetches messages for a specific chat, handling authorization and pagination. """
-    conn = None; cursor = None; offset = (page - 1) * per_page
-    result = {'chat_info': None, 'messages': [], 'total_messages': 0, 'authorized': False}
+def get_chat_messages(chat_id, user_id, user_type, per_page, older_than=None, newer_than=None):
+    """
+    Fetches one page of a chat, handling authorization. Pages are keyset cursors:
+    the newest messages by default, older_than/newer_than step through history.
+    Messages come back oldest first; 'older_cursor' / 'newer_cursor' are None at either end.
+    """
+    conn = None; cursor = None
+    result = {'chat_info': None, 'messages': [], 'older_cursor': None, 'newer_cursor': None, 'authorized': False}
     transaction_active = False # Flag to track if connection should be closed by this function
     try:
         conn = get_db_connection();
@@ -174,18 +178,18 @@ def get_chat_messages(chat_id, user_id, user_type, page, per_page):
         if not (is_doctor or is_patient): return result # Unauthorized
         result['authorized'] = True
 
-        # 2. Get Paginated Messages
-        query_messages = """SELECT SQL_CALC_FOUND_ROWS cm.*, att.attachment_id, att.file_name as attachment_filename, att.file_type as attachment_filetype
-                            FROM chat_messages cm LEFT JOIN message_attachments att ON cm.message_id = att.message_id AND cm.has_attachment = TRUE
-                            WHERE cm.chat_id = %s AND cm.is_deleted = FALSE ORDER BY cm.sent_at ASC LIMIT %s OFFSET %s"""
-        cursor.execute(query_messages, (chat_id, per_page, offset)); result['messages'] = cursor.fetchall()
-        cursor.execute("SELECT FOUND_ROWS() as total"); total_row = cursor.fetchone()
-        result['total_messages'] = total_row['total'] if total_row else 0
+        # 2. Get one page of messages, newest first on the index, then flipped for display
+        query_messages = """SELECT cm.*, att.attachment_id, att.file_name as attachment_filename, att.file_type as attachment_filetype
+                            FROM chat_messages cm LEFT JOIN message_attachments att ON cm.message_id = att.message_id AND cm.has_attachment = TRUE"""
+        page = seek_page(cursor, query_messages, "cm.chat_id = %s AND cm.is_deleted = FALSE", [chat_id],
+                         'cm.message_id', 'message_id', per_page, descending=True, after=older_than, before=newer_than)
+        result['messages'] = list(reversed(page.items))
+        result['older_cursor'] = page.next_cursor; result['newer_cursor'] = page.prev_cursor
 
         # 3. Mark messages as read (if authorized and messages exist)
         if result['messages']:
             # Assume mark_messages_as_read might commit if needed
-            mark_messages_as_read(chat_id, user_id, conn)
+            mark_messages_as_read(chat_id, user_id, conn, 'doctor' if is_doctor else 'patient')
             # We don't set transaction_active=True because mark_messages handles its own commit if necessary
 
     except Exception as e:
@@ -197,8 +201,8 @@ def get_chat_messages(chat_id, user_id, user_type, page, per_page):
              conn.close()
     return result
 
-def mark_messages_as_read(chat_id, reader_user_id, db_connection):
-    """ Marks messages in a chat as read by the reader. Uses provided connection. """
+def mark_messages_as_read(chat_id, reader_user_id, db_connection, reader_type='doctor'):
+    """ Marks messages in a chat as read by the reader and updates the chat's unread counter. Uses provided connection. """
     cursor = None;
     try:
         # Ensure connection is valid before proceeding
@@ -207,14 +211,17 @@ def mark_messages_as_read(chat_id, reader_user_id, db_connection):
             return False # Indicate failure
 
         cursor = db_connection.cursor()
-        query = "UPDATE chat_messages SET read_at = NOW() WHERE chat_id = %s AND sender_id != %s AND read_at IS NULL"
+        query = f"UPDATE chat_messages SET read_at = NOW() WHERE chat_id = %s AND sender_id != %s AND {unread_sender_condition(reader_type)} AND read_at IS NULL"
         cursor.execute(query, (chat_id, reader_user_id))
         rows_affected = cursor.rowcount
+        record_messages_read(cursor, chat_id, reader_type, rows_affected)
 
         # Commit if rows were updated and autocommit is off
         if rows_affected > 0 and db_connection.autocommit is False:
             db_connection.commit()
             # current_app.logger.debug(f"Committed message read update for chat {chat_id}, user {reader_user_id}")
+        if rows_affected > 0:
+            publish_read(chat_id, reader_user_id)
         return True # Indicate success even if 0 rows updated
 
     except Exception as e:
@@ -225,8 +232,9 @@ def mark_messages_as_read(chat_id, reader_user_id, db_connection):
         if cursor: cursor.close()
 
 
-def add_message(chat_id, sender_id, sender_type, message_text, attachment_filename=None, attachment_filetype=None, attachment_size=None):
-    """ Adds a message and optional attachment to the database. """
+def add_message(chat_id, sender_id, sender_type, message_text, attachment_filename=None, attachment_filetype=None, attachment_size=None,
+                attachment_display_name=None):
+    """ Adds a message and optional attachment to the database. attachment_filename is the stored file's name. """
     conn = None; cursor = None
     try:
         conn = get_db_connection(); conn.start_transaction(); cursor = conn.cursor()
@@ -238,34 +246,47 @@ def add_message(chat_id, sender_id, sender_type, message_text, attachment_filena
         if not message_id: raise mysql.connector.Error("Failed to insert message.")
         # 2. Insert Attachment
         if has_attachment:
-            # Ensure file_path stores only the filename, not the full path
+            # file_path stores only the stored filename, not the full path; file_name is what the user uploaded
             sql_att = "INSERT INTO message_attachments (message_id, file_name, file_type, file_size, file_path, uploaded_at) VALUES (%s, %s, %s, %s, %s, NOW())"
-            cursor.execute(sql_att, (message_id, attachment_filename, attachment_filetype, attachment_size, attachment_filename)) # file_path = filename
+            cursor.execute(sql_att, (message_id, attachment_display_name or attachment_filename, attachment_filetype, attachment_size, attachment_filename))
             if not cursor.lastrowid: raise mysql.connector.Error("Failed to insert attachment.")
-        # 3. Update chat timestamp
-        sql_update_chat = "UPDATE chats SET updated_at = NOW() WHERE chat_id = %s"
-        cursor.execute(sql_update_chat, (chat_id,))
-        conn.commit(); return message_id
+        # 3. Update chat timestamp, unread counter and last-message snapshot
+        record_new_message(cursor, chat_id, message_id, sender_type, message_text)
+        conn.commit()
+        _publish_new_message(conn, chat_id, message_id)
+        return message_id
     except Exception as e:
         if conn: conn.rollback(); current_app.logger.error(f"Error adding message to chat {chat_id}: {e}"); return None
     finally:
         if cursor: cursor.close();
         if conn and conn.is_connected(): conn.close()
 
+def _publish_new_message(conn, chat_id, message_id):
+    """ Pushes a committed message to live chat streams. Failures only cost live delivery. """
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        message = fetch_message(cursor, message_id)
+        if message: publish_message(chat_id, message)
+    except Exception as e:
+        current_app.logger.warning(f"Could not publish message {message_id} for chat {chat_id}: {e}")
+    finally:
+        if cursor: cursor.close()
+
 def get_attachment_info_for_download(attachment_id, user_id, user_type):
-    """ Gets attachment filename and verifies user authorization to download. """
+    """ Gets (stored filename, download name) and verifies user authorization to download. """
     conn = None; cursor = None
     try:
         conn = get_db_connection(); cursor = conn.cursor(dictionary=True)
-        query = """SELECT ma.file_name, c.doctor_id, c.patient_id FROM message_attachments ma
+        query = """SELECT ma.file_name, ma.file_path, c.doctor_id, c.patient_id FROM message_attachments ma
                    JOIN chat_messages cm ON ma.message_id = cm.message_id JOIN chats c ON cm.chat_id = c.chat_id
                    WHERE ma.attachment_id = %s"""
         cursor.execute(query, (attachment_id,)); info = cursor.fetchone()
         if not info: return None
         is_doctor = user_type == 'doctor' and info['doctor_id'] == user_id
         is_patient = user_type == 'patient' and info['patient_id'] == user_id
-        # Return the filename stored in DB (which should NOT be a full path)
-        return info['file_name'] if (is_doctor or is_patient) else None
+        # file_path is the filename stored in DB (which should NOT be a full path)
+        return (info['file_path'], info['file_name']) if (is_doctor or is_patient) else None
     except Exception as e:
         current_app.logger.error(f"Error getting attachment info for download (ID: {attachment_id}): {e}"); return None
     finally:
@@ -303,6 +324,31 @@ def message_list():
     return render_template('Doctor_Portal/Messaging/message_list.html', chats=result['items'],
                            current_page=page, total_pages=total_pages, search_term=search_term, status_filter=status_filter)
 
+@messaging_bp.route('/search', methods=['GET'])
+@login_required
+@read_only
+def message_search():
+    """Full-text search across the logged-in doctor's conversations."""
+    if not check_doctor_authorization(current_user): abort(403)
+    query_text = request.args.get('q', '').strip()
+    page = None
+    if query_text and not search_terms(query_text):
+        flash("Enter at least one word of 3 or more characters to search messages.", "info")
+    elif query_text:
+        conn = None; cursor = None
+        try:
+            conn = get_db_connection(); cursor = conn.cursor(dictionary=True)
+            page, _ = search_messages(cursor, 'doctor', current_user.id, query_text,
+                                      after=request.args.get('after'), before=request.args.get('before'))
+        except mysql.connector.Error as err:
+            current_app.logger.error(f"Error searching messages for doctor {current_user.id}: {err}")
+            flash("Message search failed. Please try again.", "danger")
+        finally:
+            if cursor: cursor.close()
+            if conn and conn.is_connected(): conn.close()
+    return render_template('Doctor_Portal/Messaging/message_search.html', query_text=query_text,
+                           results=page.items if page else [], page=page)
+
 @messaging_bp.route('/start', methods=['GET', 'POST'])
 @messaging_bp.route('/start/<int:patient_user_id>', methods=['GET', 'POST'])
 @login_required
@@ -366,8 +412,8 @@ def start_chat(patient_user_id=None):
 def view_chat(chat_id):
     """Display a specific chat thread."""
     if not check_doctor_authorization(current_user): abort(403) # Check basic role
-    page = request.args.get('page', 1, type=int)
-    result = get_chat_messages(chat_id, current_user.id, current_user.user_type, page, MESSAGES_PER_PAGE)
+    older_than = request.args.get('older'); newer_than = request.args.get('newer')
+    result = get_chat_messages(chat_id, current_user.id, current_user.user_type, MESSAGES_PER_PAGE, older_than, newer_than)
 
     # Handle results from get_chat_messages
     if not result['chat_info']:
@@ -375,9 +421,47 @@ def view_chat(chat_id):
     if not result['authorized']:
         flash("You are not authorized to view this chat.", "danger"); return redirect(url_for('.message_list'))
 
-    total_pages = math.ceil(result['total_messages'] / MESSAGES_PER_PAGE) if MESSAGES_PER_PAGE > 0 else 0
     return render_template('Doctor_Portal/Messaging/chat_view.html', chat=result['chat_info'], messages=result['messages'],
-                           current_page=page, total_pages=total_pages, chat_id=chat_id)
+                           older_cursor=result['older_cursor'], newer_cursor=result['newer_cursor'], chat_id=chat_id)
+
+@messaging_bp.route('/chat/<int:chat_id>/stream', methods=['GET'])
+@login_required
+def chat_stream(chat_id):
+    """Live feed (Server-Sent Events) of new messages and read receipts."""
+    if not check_doctor_authorization(current_user): abort(403)
+    conn = None; cursor = None
+    try:
+        conn = get_db_connection(); cursor = conn.cursor(dictionary=True)
+        chat = get_chat_participants(cursor, chat_id)
+        if not chat or chat['doctor_id'] != current_user.id: abort(404)
+        return chat_stream_response(chat_id, requested_since_id())
+    finally:
+        if cursor: cursor.close()
+        if conn and conn.is_connected(): conn.close()
+
+@messaging_bp.route('/chat/<int:chat_id>/messages', methods=['GET'])
+@login_required
+def chat_messages_since(chat_id):
+    """Messages newer than ?since=<message_id> (JSON); marks the patient's messages as read."""
+    if not check_doctor_authorization(current_user): abort(403)
+    conn = None; cursor = None
+    try:
+        conn = get_db_connection(); cursor = conn.cursor(dictionary=True)
+        chat = get_chat_participants(cursor, chat_id)
+        if not chat or chat['doctor_id'] != current_user.id:
+            return jsonify({"success": False, "message": "Chat not found."}), 404
+        since_id = requested_since_id()
+        messages, has_more = fetch_messages_page(cursor, chat_id, since_id)
+        if any(m['sender_id'] != current_user.id and not m['read_at'] for m in messages):
+            mark_messages_as_read(chat_id, current_user.id, conn)
+        last_id = messages[-1]['message_id'] if messages else since_id
+        return jsonify({"success": True, "messages": messages, "last_message_id": last_id, "has_more": has_more})
+    except mysql.connector.Error as err:
+        current_app.logger.error(f"Error fetching new messages for chat {chat_id}: {err}")
+        return jsonify({"success": False, "message": "Database error."}), 500
+    finally:
+        if cursor: cursor.close()
+        if conn and conn.is_connected(): conn.close()
 
 @messaging_bp.route('/chat/<int:chat_id>/send', methods=['POST'])
 @login_required
@@ -446,10 +530,13 @@ def send_message(chat_id):
 
     # --- Add Message to DB ---
     message_id = add_message(chat_id, current_user.id, 'doctor', message_text,
-                             attachment_filename, attachment_filetype, attachment_size)
+                             attachment_filename, attachment_filetype, attachment_size,
+                             attachment_display_name=secure_filename(attachment_file.filename) if attachment_filename else None)
 
     if message_id: pass # Redirect will show the new message
-    else: flash("Failed to send message.", "danger")
+    else:
+        flash("Failed to send message.", "danger")
+        if attachment_filename: release_upload(get_attachment_filepath(attachment_filename))
 
     return redirect(url_for('.view_chat', chat_id=chat_id))
 
@@ -475,9 +562,11 @@ def update_chat_status_route(chat_id):
 def download_attachment(attachment_id):
     """Securely serves an attachment file after checking authorization."""
     user_id = current_user.id; user_type = current_user.user_type
-    filename = get_attachment_info_for_download(attachment_id, user_id, user_type)
+    # Cached briefly: viewers fetch large attachments as a series of range requests
+    attachment = cached_authorization(('attachment', user_type, user_id, attachment_id),
+                                      lambda: get_attachment_info_for_download(attachment_id, user_id, user_type))
 
-    if not filename:
+    if not attachment:
         flash("Attachment not found or unauthorized.", "danger"); return redirect(url_for('doctor_main.dashboard'))
 
     directory = current_app.config.get('UPLOAD_FOLDER_ATTACHMENTS')
@@ -485,9 +574,10 @@ def download_attachment(attachment_id):
         current_app.logger.error("UPLOAD_FOLDER_ATTACHMENTS not configured for download.")
         abort(500)
 
+    filename, download_name = attachment
     try:
-        # Use send_from_directory for security
-        return send_from_directory(directory, filename, as_attachment=True)
+        # send_media confines the path to the directory and handles Range/conditional requests
+        return send_media(directory, filename, as_attachment=True, download_name=download_name)
     except FileNotFoundError:
          current_app.logger.warning(f"Attachment file not found on disk: {filename} in {directory}"); abort(404)
     except Exception as e:
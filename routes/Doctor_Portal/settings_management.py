@@ -2,27 +2,29 @@
 import sys
 import mysql.connector
 import os
-import uuid # Keep for generate_secure_filename if it uses it
 from flask import (
     Blueprint, render_template, request, flash, redirect, url_for,
-    jsonify, current_app, session, send_from_directory, abort
+    jsonify, current_app, session, abort
 )
 from flask_login import login_required, current_user
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 from db import get_db_connection
+from routes.principal_cache import invalidate_principal
+from utils.media_serving import cached_authorization, invalidate_authorization, send_media
 from datetime import time, date, datetime, timedelta
 import logging
 import json
 
 from utils.directory_configs import get_relative_path_for_db
+from utils.image_derivatives import derive_uploaded_image
+from utils.upload_store import release_upload, store_upload, upload_extension
 
 try:
     from .utils import ( # Changed to relative import assuming utils.py is in Doctor_Portal
         check_doctor_authorization,
         get_provider_id,
         allowed_file,
-        generate_secure_filename,
     )
 except ImportError as e:
     # If utils.py is at the root of 'routes' or in a global 'utils' package, adjust import
@@ -33,7 +35,6 @@ except ImportError as e:
     def check_doctor_authorization(user): return False
     def get_provider_id(user): return None
     def allowed_file(f, ext_set): return True
-    def generate_secure_filename(original_filename): return f"error_{original_filename}"
 
 
 logger = logging.getLogger(__name__)
@@ -292,6 +293,7 @@ def profile_settings():
                     cursor.execute(sql_update_doctor, tuple(params_doctor_list))
 
                 conn.commit()
+                invalidate_principal(doctor_id)
                 operation_successful = True
                 flash("Profile updated successfully.", "success")
 
@@ -386,6 +388,7 @@ def security_settings():
                     new_password_hash = generate_password_hash(new_password)
                     cursor.execute("UPDATE users SET password = %s, updated_at = NOW() WHERE user_id = %s", (new_password_hash, doctor_id))
                     conn.commit()
+                    invalidate_principal(doctor_id)
                     operation_successful = True
                     flash("Password updated successfully.", "success")
 
@@ -433,11 +436,9 @@ def photo_settings():
                      raise ValueError("UPLOAD_FOLDER_PROFILE not configured.")
 
                 if file and allowed_file(file.filename, allowed_extensions):
-                    secure_file_name = generate_secure_filename(file.filename)
-                    saved_file_absolute_path = os.path.join(upload_dir_profile_absolute, secure_file_name)
-                    os.makedirs(upload_dir_profile_absolute, exist_ok=True)
-                    file.save(saved_file_absolute_path)
+                    saved_file_absolute_path = store_upload(file, upload_dir_profile_absolute, upload_extension(file.filename))
                     logger.info(f"Profile photo for P:{doctor_id} saved to: {saved_file_absolute_path}")
+                    derive_uploaded_image(saved_file_absolute_path)
 
                     db_storage_path = get_relative_path_for_db(saved_file_absolute_path)
                     if not db_storage_path:
@@ -461,14 +462,14 @@ def photo_settings():
                     operation_successful = True
                     flash('Profile photo updated successfully.', 'success')
 
-                    if old_photo_db_path and old_photo_db_path != db_storage_path:
+                    if old_photo_db_path: # Releases the old reference even when the same photo was re-uploaded
                         try:
                             # old_photo_db_path is relative to static folder
                             old_photo_absolute_path_on_disk = os.path.join(current_app.static_folder, old_photo_db_path)
                             if os.path.exists(old_photo_absolute_path_on_disk):
-                                 os.remove(old_photo_absolute_path_on_disk)
+                                 release_upload(old_photo_absolute_path_on_disk)
                                  logger.info(f"Deleted old profile photo file for P:{doctor_id}: {old_photo_absolute_path_on_disk}")
-                        except OSError as e_os:
+                        except (OSError, mysql.connector.Error) as e_os:
                              logger.error(f"Error deleting old photo file {old_photo_db_path} for P:{doctor_id}: {e_os}")
                 else:
                     flash('Invalid file type. Allowed: {}.'.format(', '.join(allowed_extensions)), 'danger')
@@ -476,15 +477,15 @@ def photo_settings():
         except (mysql.connector.Error, ConnectionError, OSError, IOError, ValueError) as err:
             logger.error(f"Error uploading photo P:{doctor_id}: {err}", exc_info=True)
             flash(f'An error occurred uploading photo: {str(err)}', 'danger')
-            if saved_file_absolute_path and os.path.exists(saved_file_absolute_path):
-                try: os.remove(saved_file_absolute_path)
-                except OSError: logger.error(f"Failed to cleanup photo on error for P:{doctor_id}: {saved_file_absolute_path}")
+            if saved_file_absolute_path and not operation_successful:
+                try: release_upload(saved_file_absolute_path)
+                except Exception: logger.error(f"Failed to cleanup photo on error for P:{doctor_id}: {saved_file_absolute_path}")
         except Exception as e:
             logger.error(f"Unexpected error uploading photo P:{doctor_id}: {e}", exc_info=True)
             flash('An unexpected error occurred during photo upload.', 'danger')
-            if saved_file_absolute_path and os.path.exists(saved_file_absolute_path):
-                try: os.remove(saved_file_absolute_path)
-                except OSError: logger.error(f"Failed to cleanup photo on error for P:{doctor_id}: {saved_file_absolute_path}")
+            if saved_file_absolute_path and not operation_successful:
+                try: release_upload(saved_file_absolute_path)
+                except Exception: logger.error(f"Failed to cleanup photo on error for P:{doctor_id}: {saved_file_absolute_path}")
         finally:
             if cursor: cursor.close()
             if conn and conn.is_connected():
@@ -545,13 +546,13 @@ def delete_photo_action():
                 # old_photo_db_path is relative to static folder
                 old_photo_absolute_path_on_disk = os.path.join(current_app.static_folder, old_photo_db_path)
                 if os.path.exists(old_photo_absolute_path_on_disk):
-                    os.remove(old_photo_absolute_path_on_disk)
+                    release_upload(old_photo_absolute_path_on_disk)
                     logger.info(f"Deleted old profile photo file for P:{doctor_id}: {old_photo_absolute_path_on_disk}")
                 else:
                     message += ' (File not found on server for deletion.)'
                     flash_category = 'warning'
                     logger.warning(f"Profile photo file not found for P:{doctor_id}: {old_photo_absolute_path_on_disk}")
-            except OSError as e_os:
+            except (OSError, mysql.connector.Error) as e_os:
                 message = 'Photo record updated, but failed to delete the image file.'
                 flash_category = 'warning'
                 logger.error(f"Error deleting photo file {old_photo_absolute_path_on_disk} for P:{doctor_id}: {e_os}")
@@ -603,10 +604,7 @@ def documents_settings():
 
                 if file and allowed_file(file.filename, allowed_extensions):
                     original_filename = secure_filename(file.filename)
-                    unique_secure_filesystem_name = generate_secure_filename(original_filename)
-                    saved_doc_absolute_path = os.path.join(upload_dir_docs_absolute, unique_secure_filesystem_name)
-                    os.makedirs(upload_dir_docs_absolute, exist_ok=True)
-                    file.save(saved_doc_absolute_path)
+                    saved_doc_absolute_path = store_upload(file, upload_dir_docs_absolute, upload_extension(original_filename))
                     file_size = os.path.getsize(saved_doc_absolute_path)
                     logger.info(f"Document for P:{doctor_id} saved to: {saved_doc_absolute_path}")
 
@@ -633,15 +631,15 @@ def documents_settings():
         except (mysql.connector.Error, ConnectionError, OSError, IOError, ValueError) as err:
             logger.error(f"Error uploading document P:{doctor_id}: {err}", exc_info=True)
             flash(f'An error occurred uploading the document: {str(err)}', 'danger')
-            if saved_doc_absolute_path and os.path.exists(saved_doc_absolute_path):
-                try: os.remove(saved_doc_absolute_path)
-                except OSError: logger.error(f"Failed to cleanup doc on error P:{doctor_id}: {saved_doc_absolute_path}")
+            if saved_doc_absolute_path and not operation_successful:
+                try: release_upload(saved_doc_absolute_path)
+                except Exception: logger.error(f"Failed to cleanup doc on error P:{doctor_id}: {saved_doc_absolute_path}")
         except Exception as e:
             logger.error(f"Unexpected error uploading document P:{doctor_id}: {e}", exc_info=True)
             flash('An unexpected error occurred during document upload.', 'danger')
-            if saved_doc_absolute_path and os.path.exists(saved_doc_absolute_path):
-                try: os.remove(saved_doc_absolute_path)
-                except OSError: logger.error(f"Failed to cleanup doc on error P:{doctor_id}: {saved_doc_absolute_path}")
+            if saved_doc_absolute_path and not operation_successful:
+                try: release_upload(saved_doc_absolute_path)
+                except Exception: logger.error(f"Failed to cleanup doc on error P:{doctor_id}: {saved_doc_absolute_path}")
         finally:
             if cursor: cursor.close()
             if conn and conn.is_connected():
@@ -692,6 +690,7 @@ def delete_document_action(document_id):
             cursor.execute("DELETE FROM doctor_documents WHERE document_id = %s AND doctor_id = %s", (document_id, doctor_id))
             conn.commit()
             operation_successful = True
+            invalidate_authorization(('document', doctor_id, old_doc_db_path))
 
             message = 'Document record deleted successfully.'
             flash_category = 'success'
@@ -700,13 +699,13 @@ def delete_document_action(document_id):
                     # old_doc_db_path is relative to static folder
                     old_doc_absolute_path_on_disk = os.path.join(current_app.static_folder, old_doc_db_path)
                     if os.path.exists(old_doc_absolute_path_on_disk):
-                        os.remove(old_doc_absolute_path_on_disk)
+                        release_upload(old_doc_absolute_path_on_disk) # Unlinks only when no other document row shares the file
                         logger.info(f"Deleted document file for P:{doctor_id}: {old_doc_absolute_path_on_disk}")
                     else:
                         message += ' (File not found on server for deletion.)'
                         flash_category = 'warning'
                         logger.warning(f"Document file not found for P:{doctor_id}: {old_doc_absolute_path_on_disk}")
-                except OSError as e_os:
+                except (OSError, mysql.connector.Error) as e_os:
                     message = 'Document record updated, but failed to delete the file.'
                     flash_category = 'warning'
                     logger.error(f"Error deleting document file {old_doc_absolute_path_on_disk} for P:{doctor_id}: {e_os}")
@@ -728,50 +727,47 @@ def delete_document_action(document_id):
     return redirect(url_for('.documents_settings'))
 
 
-@settings_bp.route('/documents/view/<path:file_path_from_url>')
-@login_required
-def view_uploaded_document(file_path_from_url): # Changed URL variable name for clarity
-    if not check_doctor_authorization(current_user): abort(403)
-    doctor_id = current_user.id
+def doctor_owns_document(doctor_id, file_path):
+    """True if file_path (relative to the static folder) is one of the doctor's documents."""
     conn = None; cursor = None
-
     try:
         conn = get_db_connection()
         if not conn: raise ConnectionError("DB Connection failed for viewing document.")
-
         cursor = conn.cursor(dictionary=True)
-        query = "SELECT document_id, file_path FROM doctor_documents WHERE doctor_id = %s AND file_path = %s"
-        cursor.execute(query, (doctor_id, file_path_from_url))
-        doc_data = cursor.fetchone()
-
-        if not doc_data:
-            logger.warning(f"Doc access denied or not found: User {doctor_id}, Path {file_path_from_url}")
-            flash("Document not found or you do not have permission.", "danger")
-            abort(404)
+        cursor.execute("SELECT document_id FROM doctor_documents WHERE doctor_id = %s AND file_path = %s", (doctor_id, file_path))
+        return cursor.fetchone() is not None
+    finally:
+        if cursor: cursor.close()
+        if conn and conn.is_connected(): conn.close()
 
-        # file_path_from_url (which is doc_data['file_path']) is relative to current_app.static_folder
-        absolute_static_path = current_app.static_folder
-        full_file_path_on_disk = os.path.join(absolute_static_path, file_path_from_url)
 
-        if not os.path.exists(full_file_path_on_disk):
-            logger.error(f"File not found on disk: {full_file_path_on_disk} (DB path: {file_path_from_url})")
-            flash("File not found on server.", "danger")
-            abort(404)
+@settings_bp.route('/documents/view/<path:file_path_from_url>')
+@login_required
+def view_uploaded_document(file_path_from_url): # Changed URL variable name for clarity
+    if not check_doctor_authorization(current_user): abort(403)
+    doctor_id = current_user.id
 
-        return send_from_directory(directory=absolute_static_path, path=file_path_from_url, as_attachment=False)
+    try:
+        # Cached briefly: PDF viewers fetch a document as a series of range requests
+        allowed = cached_authorization(('document', doctor_id, file_path_from_url),
+                                       lambda: doctor_owns_document(doctor_id, file_path_from_url))
+    except (mysql.connector.Error, ConnectionError) as err:
+        logger.error(f"DB/Conn Error serving doc Path:{file_path_from_url} D:{doctor_id}: {err}", exc_info=True)
+        flash("Error accessing document due to a database issue.", "danger")
+        abort(500)
+    if not allowed:
+        logger.warning(f"Doc access denied or not found: User {doctor_id}, Path {file_path_from_url}")
+        flash("Document not found or you do not have permission.", "danger")
+        abort(404)
 
-    except FileNotFoundError: # Should be caught by os.path.exists now
-        logger.error(f"FileNotFound (should be caught by os.path.exists): Path {file_path_from_url}")
+    try:
+        # file_path_from_url is relative to current_app.static_folder; send_media keeps it inside that folder
+        return send_media(current_app.static_folder, file_path_from_url)
+    except FileNotFoundError:
+        logger.error(f"File not found on disk: {file_path_from_url} in {current_app.static_folder}")
         flash("The requested document file could not be found on the server.", "danger")
         abort(404)
-    except (mysql.connector.Error, ConnectionError) as err:
-         logger.error(f"DB/Conn Error serving doc Path:{file_path_from_url} D:{doctor_id}: {err}", exc_info=True)
-         flash("Error accessing document due to a database issue.", "danger")
-         abort(500)
     except Exception as e:
         logger.error(f"Unexpected error serving doc Path:{file_path_from_url} D:{doctor_id}: {e}", exc_info=True)
         flash("Could not serve document due to an unexpected error.", "danger")
-        abort(500)
-    finally:
-       if cursor: cursor.close()
-       if conn and conn.is_connected(): conn.close()
\ No newline at end of file
+        abort(500)
\ No newline at end of file
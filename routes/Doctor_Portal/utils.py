@@ -10,6 +10,8 @@ import os   # Not used in this snippet
 import uuid
 import logging
 
+from utils.schema_metadata import get_enum_values # Re-exported for the Doctor Portal views
+
 # Configure logger - Ensure this is configured at your app's entry point for consistency
 logger = logging.getLogger(__name__)
 # Example basic config if not done elsewhere:
@@ -158,50 +160,6 @@ def get_provider_id(user):
 
 # --- Database Interaction Utilities ---
 
-ENUM_CACHE = {} # Simple cache for ENUM values
-def get_enum_values(table_name, column_name):
-    """ Fetches and caches ENUM values from DB schema. """
-    cache_key = f"{table_name}_{column_name}"
-    if cache_key in ENUM_CACHE:
-        return ENUM_CACHE[cache_key]
-
-    conn = None; cursor = None; values = []
-    try:
-        conn = get_db_connection()
-        if not conn:
-            logger.error(f"DB connection failed for ENUM fetch: {table_name}.{column_name}")
-            return []
-        cursor = conn.cursor()
-        db_name = conn.database # Get the current database name
-        query = """
-            SELECT COLUMN_TYPE FROM information_schema.COLUMNS
-            WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s
-        """
-        cursor.execute(query, (db_name, table_name, column_name))
-        result = cursor.fetchone()
-        if result and result[0]:
-            enum_str = result[0]
-            if isinstance(enum_str, bytes): # Handle if connector returns bytes
-                enum_str = enum_str.decode('utf-8')
-
-            if enum_str.lower().startswith('enum(') and enum_str.endswith(')'):
-                 # Extract content between parentheses: e.g., "'val1','val2','val3'"
-                 enum_content = enum_str[enum_str.lower().find("(")+1:enum_str.rfind(")")]
-                 # Split by comma, then strip whitespace and quotes from each value
-                 values = [val.strip().strip("'\"") for val in enum_content.split(",")]
-            else:
-                logger.warning(f"Column {table_name}.{column_name} type format unexpected: {enum_str}")
-        else:
-            logger.warning(f"Could not retrieve ENUM definition for {table_name}.{column_name}")
-        ENUM_CACHE[cache_key] = values
-        return values
-    except (mysql.connector.Error, ConnectionError, IndexError, TypeError) as e:
-        logger.error(f"Error getting ENUM values for {table_name}.{column_name}: {e}", exc_info=True)
-        return [] # Return empty list on error
-    finally:
-        if cursor: cursor.close()
-        if conn and conn.is_connected(): conn.close()
-
 def get_all_simple(table_name, id_column_name, name_column_expression, where_clause=None, order_by=None, params=None):
     """
     Fetches ID and a name/display expression from a table, with optional WHERE and ORDER BY.
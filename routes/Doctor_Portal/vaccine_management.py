@@ -1,16 +1,17 @@
 # your_project/routes/Doctor_Portal/vaccine_management.py
 
 import mysql.connector
-import re
 from flask import (
     Blueprint, render_template, request, flash, redirect, url_for,
     current_app, abort
 )
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
 import os
 from db import get_db_connection
-from datetime import datetime
+from utils.pagination import count_rows
+from utils.schema_metadata import get_enum_values
+from utils.image_derivatives import derive_uploaded_image
+from utils.upload_store import release_upload, store_upload, upload_extension
 import math
 import logging
 
@@ -34,32 +35,6 @@ except ImportError as e:
 def is_doctor():
     return current_user.is_authenticated and getattr(current_user, 'user_type', None) == 'doctor'
 
-# --- Custom Helper for Filename Generation ---
-def generate_custom_secure_filename(original_filename, prefix=""):
-    filename = secure_filename(original_filename)
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
-    return f"{prefix}{timestamp}_{filename}"
-
-def get_enum_values(table_name, column_name):
-    conn = None; cursor = None; enum_values = []
-    try:
-        conn = get_db_connection(); cursor = conn.cursor(dictionary=True)
-        safe_table_name = '`' + re.sub(r'[^a-zA-Z0-9_]', '', table_name) + '`'
-        safe_column_name = re.sub(r'[^a-zA-Z0-9_]', '', column_name)
-        query = f"SHOW COLUMNS FROM {safe_table_name} LIKE '{safe_column_name}'"
-        cursor.execute(query); result = cursor.fetchone()
-        if result and 'Type' in result:
-            type_info = result['Type']
-            match = re.match(r"enum\((.*?)\)$", type_info, re.IGNORECASE)
-            if match:
-                enum_values = [val.strip().strip("'").strip('"') for val in match.group(1).split(',')]
-    except Exception as e: 
-        current_app.logger.error(f"Error getting ENUM {table_name}.{column_name}: {e}", exc_info=True)
-    finally:
-        if cursor: cursor.close()
-        if conn and conn.is_connected(): conn.close()
-    return enum_values
-
 vaccine_management_bp = Blueprint(
     'vaccine_management',
     __name__,
@@ -127,7 +102,7 @@ def get_paginated_vaccines(page=1, per_page=ITEMS_PER_PAGE, search_term=None,
 
     try:
         conn = get_db_connection(); cursor = conn.cursor(dictionary=True, buffered=True)
-        sql_select = "SELECT SQL_CALC_FOUND_ROWS v.vaccine_id, v.vaccine_name, v.abbreviation, v.vaccine_type, v.manufacturer, vc.category_name"
+        sql_select = "SELECT v.vaccine_id, v.vaccine_name, v.abbreviation, v.vaccine_type, v.manufacturer, vc.category_name"
         sql_from = " FROM vaccines v LEFT JOIN vaccine_categories vc ON v.category_id = vc.category_id"
         sql_where = " WHERE v.is_active = TRUE" 
         params = []
@@ -146,12 +121,12 @@ def get_paginated_vaccines(page=1, per_page=ITEMS_PER_PAGE, search_term=None,
         if valid_filters.get('vaccine_type'):
             sql_where += " AND v.vaccine_type = %s"; params.append(valid_filters['vaccine_type'])
 
+        result['total'] = count_rows(cursor, f"SELECT COUNT(*) AS total{sql_from}{sql_where}", params)
+
         query = f"{sql_select}{sql_from}{sql_where} ORDER BY {sort_column_sql} {sort_dir_sql} LIMIT %s OFFSET %s"
         params.extend([per_page, offset])
         cursor.execute(query, tuple(params))
         result['items'] = cursor.fetchall()
-
-        cursor.execute("SELECT FOUND_ROWS() as total"); result['total'] = cursor.fetchone()['total']
     except Exception as err:
         current_app.logger.error(f"Error in get_paginated_vaccines: {err}", exc_info=True)
     finally:
@@ -215,11 +190,10 @@ def add_vaccine_category():
                     errors.append("Server error: Upload folder for category images not configured.")
                     current_app.logger.error("UPLOAD_FOLDER_VACCINE_CATEGORY_IMAGES not configured in app.config.")
                 else:
-                    filename = generate_custom_secure_filename(image_file.filename, prefix="cat_") 
                     try:
-                        os.makedirs(upload_folder, exist_ok=True)
-                        image_file.save(os.path.join(upload_folder, filename))
-                        image_filename_for_db = filename 
+                        saved_path = store_upload(image_file, upload_folder, upload_extension(image_file.filename))
+                        derive_uploaded_image(saved_path)
+                        image_filename_for_db = os.path.basename(saved_path)
                     except Exception as e:
                         errors.append(f"Could not save image: {str(e)}")
                         current_app.logger.error(f"Error saving category image: {e}", exc_info=True)
@@ -250,10 +224,12 @@ def add_vaccine_category():
                 if conn: conn.rollback() 
                 flash(f"Database error adding category: {err.msg}", "danger")
                 current_app.logger.error(f"DB error adding category: {err}", exc_info=True)
+                if image_filename_for_db: release_upload(os.path.join(upload_folder, image_filename_for_db))
             except Exception as e: 
                 if conn: conn.rollback()
                 flash(f"An unexpected error occurred: {str(e)}", "danger")
                 current_app.logger.error(f"Unexpected error adding category: {e}", exc_info=True)
+                if image_filename_for_db: release_upload(os.path.join(upload_folder, image_filename_for_db))
             finally:
                 if cursor: cursor.close()
                 if conn and conn.is_connected(): conn.close()
@@ -297,16 +273,15 @@ def edit_vaccine_category(category_id):
                     errors.append("Server error: Upload folder for category images not configured.")
                     current_app.logger.error("UPLOAD_FOLDER_VACCINE_CATEGORY_IMAGES not configured in app.config.")
                 else:
-                    filename = generate_custom_secure_filename(image_file.filename, prefix="cat_")
                     try:
-                        os.makedirs(upload_folder, exist_ok=True)
-                        image_file.save(os.path.join(upload_folder, filename))
-                        new_image_filename = filename
-                        if current_image_filename and current_image_filename != new_image_filename:
+                        saved_path = store_upload(image_file, upload_folder, upload_extension(image_file.filename))
+                        derive_uploaded_image(saved_path)
+                        new_image_filename = os.path.basename(saved_path)
+                        if current_image_filename:
                             old_path = os.path.join(upload_folder, current_image_filename)
                             if os.path.exists(old_path): 
-                                try: os.remove(old_path)
-                                except OSError as oe: current_app.logger.error(f"Error deleting old image {old_path}: {oe}")
+                                try: release_upload(old_path)
+                                except (OSError, mysql.connector.Error) as oe: current_app.logger.error(f"Error deleting old image {old_path}: {oe}")
                     except Exception as e:
                         errors.append(f"Could not save new image: {str(e)}")
                         current_app.logger.error(f"Error saving new category image: {e}", exc_info=True)
@@ -6,6 +6,9 @@ from flask import (
 )
 from flask_login import login_required, current_user
 from db import get_db_connection
+from utils.pagination import count_rows
+from utils.schema_metadata import get_enum_values
+from routes.shared_utils import get_diet_plan_with_meals
 # Assuming utils.auth_helpers.py exists in your utils folder
 from utils.auth_helpers import check_patient_authorization 
 from datetime import datetime, date, time, timedelta 
@@ -27,49 +30,6 @@ patient_medical_info_bp = Blueprint(
 
 ITEMS_PER_PAGE = 10
 
-# --- Helper to get ENUMs (Keep as is) ---
-ENUM_CACHE = {}
-def get_enum_values(table_name, column_name):
-    cache_key = f"{table_name}_{column_name}"
-    if cache_key in ENUM_CACHE: return ENUM_CACHE[cache_key]
-    conn = None; cursor = None; values = []
-    try:
-        conn = get_db_connection();
-        if not conn:
-            current_app.logger.error(f"Failed to get DB connection for ENUM {table_name}.{column_name}")
-            return []
-        cursor = conn.cursor()
-        db_name = None
-        if hasattr(conn, 'database') and conn.database: 
-            db_name = conn.database
-        else: 
-            db_name_query = "SELECT DATABASE()"
-            cursor.execute(db_name_query)
-            db_name_result = cursor.fetchone()
-            if db_name_result and db_name_result[0]:
-                db_name = db_name_result[0]
-        if not db_name: 
-            db_name = current_app.config.get('MYSQL_DB')
-        if not db_name:
-            current_app.logger.error(f"Could not determine database name for ENUM {table_name}.{column_name}")
-            return []
-        query = "SELECT COLUMN_TYPE FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s"
-        cursor.execute(query, (db_name, table_name, column_name))
-        result = cursor.fetchone()
-        if result and result[0]:
-            enum_str = result[0]
-            if isinstance(enum_str, bytes): enum_str = enum_str.decode('utf-8')
-            if enum_str.lower().startswith('enum(') and enum_str.endswith(')'):
-                 values = [v.strip("'") for v in enum_str[len("enum("):-1].split(',')]
-            ENUM_CACHE[cache_key] = values
-    except Exception as e:
-        current_app.logger.error(f"Error fetching ENUM {table_name}.{column_name}: {e}", exc_info=True)
-    finally:
-        if cursor: cursor.close()
-        if conn and conn.is_connected(): conn.close()
-    return values
-
-
 # --- Custom Jinja Filter (as defined before) ---
 @patient_medical_info_bp.app_template_filter()
 def format_timedelta_as_time(delta):
@@ -86,131 +46,21 @@ def format_timedelta_as_time(delta):
     return "N/A"
 
 
-# --- Function to get full diet plan details (similar to the one in diet_plan_management.py) ---
-# You might want to move this to a shared service/helper if used in multiple blueprints
+# --- Function to get full diet plan details (shared loader in routes/shared_utils.py) ---
 def get_full_diet_plan_details_for_patient(plan_id):
-    conn = None; cursor = None; details = {'plan': None, 'meals': []}
     try:
-        conn = get_db_connection();
-        if not conn: 
-            logger.error(f"DB Connection failed for get_full_diet_plan_details_for_patient (Plan ID: {plan_id})")
-            return None
-        cursor = conn.cursor(dictionary=True)
-        
-        query_plan = """
-            SELECT dp.plan_id, dp.plan_name, dp.description, dp.plan_type, dp.calories, 
-                   dp.protein_grams, dp.carbs_grams, dp.fat_grams, dp.fiber_grams, dp.sodium_mg,
-                   dp.target_conditions, u.username as creator_username
-            FROM diet_plans dp
-            LEFT JOIN users u ON dp.creator_id = u.user_id
-            WHERE dp.plan_id = %s 
-            LIMIT 1 
-        """
-        cursor.execute(query_plan, (plan_id,))
-        details['plan'] = cursor.fetchone()
-
-        if not details['plan']: 
-            logger.warning(f"No plan details found for plan_id {plan_id} in get_full_diet_plan_details_for_patient.")
-            return None
-
-        query_meals = """
-            SELECT meal_id, meal_name, meal_type, description, calories, 
-                   protein_grams, carbs_grams, fat_grams, fiber_grams, sodium_mg, 
-                   time_of_day
-            FROM diet_plan_meals 
-            WHERE plan_id = %s 
-            ORDER BY FIELD(meal_type, 'breakfast', 'lunch', 'dinner', 'snack', 'other'), time_of_day, meal_id
-        """
-        cursor.execute(query_meals, (plan_id,))
-        meals_raw = cursor.fetchall() # List of dicts, each dict has meal properties
-        
-        meals_processed = [] # This will become details['meals']
-        if meals_raw:
-            meal_ids = [meal_raw_item['meal_id'] for meal_raw_item in meals_raw] # Corrected variable name
-            if meal_ids:
-                placeholders = ', '.join(['%s'] * len(meal_ids))
-                query_items = f"""SELECT item_id, food_name, serving_size, calories, 
-                                protein_grams, carbs_grams, fat_grams, 
-                                notes, alternatives, meal_id 
-                                FROM diet_plan_food_items WHERE meal_id IN ({placeholders}) 
-                                ORDER BY meal_id, item_id"""
-                cursor.execute(query_items, tuple(meal_ids))
-                all_items_raw = cursor.fetchall()
-                
-                items_by_meal = {}
-                for item_raw in all_items_raw:
-                    item = item_raw.copy()
-                    for key, value in item.items():
-                        if isinstance(value, decimal.Decimal):
-                            item[key] = float(value) 
-                    meal_id_fk = item['meal_id']
-                    if meal_id_fk not in items_by_meal: items_by_meal[meal_id_fk] = []
-                    items_by_meal[meal_id_fk].append(item)
-
-                # *** MODIFIED SECTION TO CREATE THE CORRECT STRUCTURE FOR THE TEMPLATE ***
-                for meal_properties_raw in meals_raw:
-                    # meal_info will store all properties of the meal itself
-                    meal_info_dict = meal_properties_raw.copy() 
-
-                    # Convert timedelta to time object and add to meal_info_dict
-                    original_time = meal_info_dict.get('time_of_day')
-                    if isinstance(original_time, timedelta):
-                        total_seconds = int(original_time.total_seconds())
-                        hours = total_seconds // 3600
-                        minutes = (total_seconds % 3600) // 60
-                        try:
-                            meal_info_dict['time_of_day_obj'] = time(hours % 24, minutes)
-                        except ValueError: 
-                            logger.warning(f"Could not convert timedelta {original_time} to time for meal_id {meal_info_dict.get('meal_id')}. Storing as string.")
-                            meal_info_dict['time_of_day_obj'] = None 
-                            meal_info_dict['time_of_day'] = str(original_time) # Ensure template has a string if conversion fails
-                    elif isinstance(original_time, time):
-                         meal_info_dict['time_of_day_obj'] = original_time
-                    else:
-                        meal_info_dict['time_of_day_obj'] = None
-                    
-                    # Construct the meal_entry structure expected by the template
-                    meal_entry_for_template = {
-                        'meal_info': meal_info_dict, # All meal properties are here
-                        'food_items_list': items_by_meal.get(meal_info_dict['meal_id'], []) # Food items for this meal
-                    }
-                    meals_processed.append(meal_entry_for_template)
-            else: # Case where there are meals but meal_ids list is empty (should not happen if meals_raw is not empty)
-                 for meal_properties_raw in meals_raw:
-                    meal_info_dict = meal_properties_raw.copy()
-                    # Process time_of_day_obj as above
-                    original_time = meal_info_dict.get('time_of_day')
-                    if isinstance(original_time, timedelta):
-                        total_seconds = int(original_time.total_seconds())
-                        hours = total_seconds // 3600
-                        minutes = (total_seconds % 3600) // 60
-                        try:
-                            meal_info_dict['time_of_day_obj'] = time(hours % 24, minutes)
-                        except ValueError:
-                            meal_info_dict['time_of_day_obj'] = None
-                            meal_info_dict['time_of_day'] = str(original_time)
-                    elif isinstance(original_time, time):
-                        meal_info_dict['time_of_day_obj'] = original_time
-                    else:
-                        meal_info_dict['time_of_day_obj'] = None
-                    
-                    meal_entry_for_template = {
-                        'meal_info': meal_info_dict,
-                        'food_items_list': [] # No food items if meal_ids was empty
-                    }
-                    meals_processed.append(meal_entry_for_template)
-
-        details['meals'] = meals_processed
-
+        details = get_diet_plan_with_meals(plan_id)
     except (mysql.connector.Error, ConnectionError) as err:
         logger.error(f"DB/Conn Error in get_full_diet_plan_details_for_patient for plan_id {plan_id}: {err}", exc_info=True)
         return None
     except Exception as e:
         logger.error(f"Unexpected error in get_full_diet_plan_details_for_patient for plan_id {plan_id}: {e}", exc_info=True)
         return None
-    finally:
-        if cursor: cursor.close()
-        if conn and conn.is_connected(): conn.close()
+    if not details:
+        logger.warning(f"No plan details found for plan_id {plan_id} in get_full_diet_plan_details_for_patient.")
+        return None
+    # Template expects each meal as {'meal_info': ..., 'food_items_list': ...}
+    details['meals'] = [{'meal_info': meal, 'food_items_list': meal['food_items']} for meal in details['meals']]
     return details
 
 
@@ -395,7 +245,7 @@ def manage_symptoms():
     total_items = 0
     try:
         conn = get_db_connection(); cursor = conn.cursor(dictionary=True)
-        query_history = """SELECT SQL_CALC_FOUND_ROWS 
+        query_history = """SELECT 
                                ps.patient_symptom_id, ps.reported_date, ps.onset_date, 
                                ps.severity, ps.duration, ps.frequency, ps.notes,
                                ps.triggers, ps.alleviating_factors, ps.worsening_factors,
@@ -407,8 +257,7 @@ def manage_symptoms():
                            LIMIT %s OFFSET %s"""
         cursor.execute(query_history, (patient_id, ITEMS_PER_PAGE, offset))
         symptom_history = cursor.fetchall()
-        cursor.execute("SELECT FOUND_ROWS() as total"); total_row = cursor.fetchone()
-        total_items = total_row['total'] if total_row else 0
+        total_items = count_rows(cursor, "SELECT COUNT(*) AS total FROM patient_symptoms WHERE patient_id = %s", [patient_id])
         cursor.execute("SELECT symptom_id, symptom_name FROM symptoms ORDER BY symptom_name")
         all_symptoms_list = cursor.fetchall()
     except Exception as e:
@@ -510,7 +359,7 @@ def manage_vitals():
         conn = get_db_connection(); cursor = conn.cursor(dictionary=True)
         cursor.execute("SELECT height_cm, weight_kg FROM patients WHERE user_id = %s", (patient_id,))
         current_patient_data = cursor.fetchone() or {} 
-        query_history = """SELECT SQL_CALC_FOUND_ROWS 
+        query_history = """SELECT 
                                log_id, log_date, weight_kg, calories_consumed, water_consumed_ml, 
                                notes, mood, energy_level
                            FROM user_nutrition_logs
@@ -519,8 +368,7 @@ def manage_vitals():
                            LIMIT %s OFFSET %s"""
         cursor.execute(query_history, (patient_id, ITEMS_PER_PAGE, offset))
         vitals_history = cursor.fetchall()
-        cursor.execute("SELECT FOUND_ROWS() as total"); total_row = cursor.fetchone()
-        total_items = total_row['total'] if total_row else 0
+        total_items = count_rows(cursor, "SELECT COUNT(*) AS total FROM user_nutrition_logs WHERE user_id = %s", [patient_id])
     except Exception as e:
         current_app.logger.error(f"Error fetching nutrition/vitals log for P:{patient_id}: {e}")
         flash("Error loading log history.", "danger")
@@ -7,11 +7,19 @@ from flask import (
 )
 from flask_login import login_required, current_user
 # import os # No longer needed
-from db import get_db_connection
+from db import get_db_connection, read_only
 from datetime import datetime, date, time, timedelta
 import math
 import logging
 
+from utils.pagination import count_rows, seek_page
+from routes.chat_counters import record_messages_read, record_new_message, unread_sender_condition
+from routes.chat_search import search_messages, search_terms
+from routes.chat_events import (
+    chat_stream_response, fetch_message, fetch_messages_page, get_chat_participants,
+    publish_message, publish_read, requested_since_id
+)
+
 module_logger = logging.getLogger(__name__)
 
 try:
@@ -39,27 +47,25 @@ def get_patient_chats(patient_id, page, per_page, search_term=None, status_filte
     log = current_app.logger if has_app_context() else module_logger
     try:
         conn = get_db_connection(); cursor = conn.cursor(dictionary=True)
-        sql_select = """SELECT SQL_CALC_FOUND_ROWS c.chat_id, c.subject, c.status, c.updated_at,
+        sql_select = """SELECT c.chat_id, c.subject, c.status, c.updated_at,
                         d.user_id as doctor_user_id, d_user.first_name as doctor_first_name, d_user.last_name as doctor_last_name,
-                        (SELECT COUNT(*) FROM chat_messages cm WHERE cm.chat_id = c.chat_id AND cm.read_at IS NULL AND cm.sender_id != %s AND cm.sender_type = 'doctor') as unread_count,
-                        (SELECT cm_last.message_text FROM chat_messages cm_last WHERE cm_last.chat_id = c.chat_id ORDER BY cm_last.sent_at DESC LIMIT 1) as last_message_snippet"""
+                        c.patient_unread_count as unread_count, c.last_message_snippet, c.last_message_at"""
         sql_from = " FROM chats c JOIN doctors d ON c.doctor_id = d.user_id JOIN users d_user ON d.user_id = d_user.user_id"
-        sql_where = " WHERE c.patient_id = %s"; params = [patient_id, patient_id]
+        sql_where = " WHERE c.patient_id = %s"; where_params = [patient_id]
 
         if search_term:
             search_like = f"%{search_term}%"
             sql_where += " AND (c.subject LIKE %s OR d_user.first_name LIKE %s OR d_user.last_name LIKE %s OR CONCAT(d_user.first_name, ' ', d_user.last_name) LIKE %s)"
-            params.extend([search_like, search_like, search_like, search_like])
+            where_params.extend([search_like, search_like, search_like, search_like])
         if status_filter and status_filter in ['active', 'pending', 'closed']:
-            sql_where += " AND c.status = %s"; params.append(status_filter)
+            sql_where += " AND c.status = %s"; where_params.append(status_filter)
 
-        sql_order = " ORDER BY c.status = 'active' DESC, c.status = 'pending' DESC, unread_count DESC, c.updated_at DESC";
-        sql_limit = " LIMIT %s OFFSET %s"; params.extend([per_page, offset])
+        sql_order = " ORDER BY c.status = 'active' DESC, c.status = 'pending' DESC, c.patient_unread_count DESC, c.updated_at DESC";
+        sql_limit = " LIMIT %s OFFSET %s"; params = where_params + [per_page, offset]
         query = f"{sql_select}{sql_from}{sql_where}{sql_order}{sql_limit}"
         
         cursor.execute(query, tuple(params)); result['items'] = cursor.fetchall()
-        cursor.execute("SELECT FOUND_ROWS() as total"); total_row = cursor.fetchone()
-        result['total'] = total_row['total'] if total_row else 0
+        result['total'] = count_rows(cursor, f"SELECT COUNT(*) AS total{sql_from}{sql_where}", where_params)
     except Exception as e:
         log.error(f"Error fetching chats for patient {patient_id}: {e}", exc_info=True)
     finally:
@@ -67,9 +73,10 @@ def get_patient_chats(patient_id, page, per_page, search_term=None, status_filte
         if conn and conn.is_connected(): conn.close()
     return result
 
-def get_chat_messages_for_patient(chat_id, patient_user_id, page, per_page):
-    conn = None; cursor = None; offset = (page - 1) * per_page
-    result = {'chat_info': None, 'messages': [], 'total_messages': 0, 'authorized': False}
+def get_chat_messages_for_patient(chat_id, patient_user_id, per_page, older_than=None, newer_than=None):
+    """Newest page of a chat by default; older_than/newer_than are keyset cursors. Messages come back oldest first."""
+    conn = None; cursor = None
+    result = {'chat_info': None, 'messages': [], 'older_cursor': None, 'newer_cursor': None, 'authorized': False}
     log = current_app.logger if has_app_context() else module_logger
     db_conn_for_mark = None
     try:
@@ -85,12 +92,10 @@ def get_chat_messages_for_patient(chat_id, patient_user_id, page, per_page):
         if not chat_info: return result
         result['chat_info'] = chat_info; result['authorized'] = True
 
-        query_messages = """SELECT SQL_CALC_FOUND_ROWS cm.* 
-                            FROM chat_messages cm
-                            WHERE cm.chat_id = %s AND cm.is_deleted = FALSE ORDER BY cm.sent_at ASC LIMIT %s OFFSET %s"""
-        cursor.execute(query_messages, (chat_id, per_page, offset)); result['messages'] = cursor.fetchall()
-        cursor.execute("SELECT FOUND_ROWS() as total"); total_row = cursor.fetchone()
-        result['total_messages'] = total_row['total'] if total_row else 0
+        page = seek_page(cursor, "SELECT cm.* FROM chat_messages cm", "cm.chat_id = %s AND cm.is_deleted = FALSE", [chat_id],
+                         'cm.message_id', 'message_id', per_page, descending=True, after=older_than, before=newer_than)
+        result['messages'] = list(reversed(page.items))
+        result['older_cursor'] = page.next_cursor; result['newer_cursor'] = page.prev_cursor
 
         if result['messages']:
             # Use a separate connection for marking messages to avoid transaction conflicts
@@ -120,28 +125,21 @@ def mark_messages_as_read_pm(chat_id, reader_user_id, db_connection):
             log.error("Mark messages read (patient) failed: Invalid DB connection provided.")
             return False
         
-        # Ensure autocommit is suitable or manage transaction explicitly if needed for this operation
-        # For a single UPDATE, if autocommit is True on the passed connection, it's fine.
-        # If autocommit is False, the caller of mark_messages_as_read_pm or this function needs to commit.
-        # Here, we assume the passed db_connection might have autocommit=False, so we commit.
-
-        original_autocommit = db_connection.autocommit # Store original state
-        db_connection.autocommit = True # Temporarily set to True for this simple update
-
+        # The read marks and the chat's unread counter change in one transaction.
+        db_connection.start_transaction()
         cursor = db_connection.cursor()
-        query = "UPDATE chat_messages SET read_at = NOW() WHERE chat_id = %s AND sender_id != %s AND sender_type = 'doctor' AND read_at IS NULL"
+        query = f"UPDATE chat_messages SET read_at = NOW() WHERE chat_id = %s AND sender_id != %s AND {unread_sender_condition('patient')} AND read_at IS NULL"
         cursor.execute(query, (chat_id, reader_user_id))
-        
-        # No explicit commit needed if autocommit was set to True for this operation
-        # if cursor.rowcount > 0 and not db_connection.autocommit: # CORRECTED: access as attribute
-        #     db_connection.commit() # This commit would apply if autocommit was False
-
-        db_connection.autocommit = original_autocommit # Restore original autocommit state
+        marked = cursor.rowcount
+        record_messages_read(cursor, chat_id, 'patient', marked)
+        db_connection.commit()
+        if marked > 0:
+            publish_read(chat_id, reader_user_id)
 
         return True
     except Exception as e:
         log.error(f"Error marking messages as read (patient) chat {chat_id}, user {reader_user_id}: {e}", exc_info=True)
-        # Do not rollback here, let the caller handle its connection's transaction state if necessary
+        if db_connection and db_connection.is_connected() and db_connection.in_transaction: db_connection.rollback()
         return False
     finally:
         if cursor: cursor.close()
@@ -162,10 +160,15 @@ def add_message_from_patient(chat_id, patient_id, message_text):
         message_id = cursor.lastrowid
         if not message_id: raise mysql.connector.Error("Failed to insert patient message, no message_id returned.")
         
-        # CORRECTED: Removed 'last_message_at' assuming it's not in 'chats' table or 'updated_at' is sufficient
-        sql_update_chat = "UPDATE chats SET updated_at = NOW() WHERE chat_id = %s"
-        cursor.execute(sql_update_chat, (chat_id,))
+        record_new_message(cursor, chat_id, message_id, 'patient', message_text)
         conn.commit()
+        try:
+            cursor_msg = conn.cursor(dictionary=True)
+            message = fetch_message(cursor_msg, message_id)
+            cursor_msg.close()
+            if message: publish_message(chat_id, message)
+        except Exception as e:
+            log.warning(f"Could not publish patient message {message_id} for chat {chat_id}: {e}")
         return message_id, None
     except mysql.connector.Error as db_err:
         if conn and conn.in_transaction: conn.rollback() # Ensure rollback if in transaction
@@ -203,29 +206,94 @@ def list_my_chats():
                            status_filter=status_filter,
                            chat_statuses=chat_statuses)
 
+@patient_messaging_bp.route('/search', methods=['GET'])
+@login_required
+@read_only
+def patient_message_search():
+    if not check_patient_authorization(current_user): abort(403)
+    log = current_app.logger if has_app_context() else module_logger
+    query_text = request.args.get('q', '').strip()
+    page = None
+    if query_text and not search_terms(query_text):
+        flash("Enter at least one word of 3 or more characters to search messages.", "info")
+    elif query_text:
+        conn = None; cursor = None
+        try:
+            conn = get_db_connection(); cursor = conn.cursor(dictionary=True)
+            page, _ = search_messages(cursor, 'patient', current_user.id, query_text,
+                                      after=request.args.get('after'), before=request.args.get('before'))
+        except mysql.connector.Error as err:
+            log.error(f"Error searching messages for patient {current_user.id}: {err}", exc_info=True)
+            flash("Message search failed. Please try again.", "danger")
+        finally:
+            if cursor: cursor.close()
+            if conn and conn.is_connected(): conn.close()
+    return render_template('Patient_Portal/Messaging/patient_message_search.html', query_text=query_text,
+                           results=page.items if page else [], page=page)
+
 @patient_messaging_bp.route('/chat/<int:chat_id>', methods=['GET'])
 @login_required
 def view_patient_chat(chat_id):
     if not check_patient_authorization(current_user): abort(403)
     patient_id = current_user.id
-    page = request.args.get('page', 1, type=int)
+    older_than = request.args.get('older'); newer_than = request.args.get('newer')
 
-    result = get_chat_messages_for_patient(chat_id, patient_id, page, MESSAGES_PER_PAGE)
+    result = get_chat_messages_for_patient(chat_id, patient_id, MESSAGES_PER_PAGE, older_than, newer_than)
 
     if not result['chat_info'] or not result['authorized']:
         flash("Chat not found or you are not authorized to view it.", "warning")
         return redirect(url_for('.list_my_chats'))
 
-    total_message_pages = math.ceil(result['total_messages'] / MESSAGES_PER_PAGE) if MESSAGES_PER_PAGE > 0 and result['total_messages'] > 0 else 0
-    
     return render_template('Patient_Portal/Messaging/patient_chat_view.html',
                            chat=result['chat_info'],
                            messages=result['messages'],
-                           current_message_page=page,
-                           total_message_pages=total_message_pages,
+                           older_cursor=result['older_cursor'],
+                           newer_cursor=result['newer_cursor'],
                            chat_id=chat_id)
 
 
+@patient_messaging_bp.route('/chat/<int:chat_id>/stream', methods=['GET'])
+@login_required
+def patient_chat_stream(chat_id):
+    """Live feed (Server-Sent Events) of new messages and read receipts."""
+    if not check_patient_authorization(current_user): abort(403)
+    conn = None; cursor = None
+    try:
+        conn = get_db_connection(); cursor = conn.cursor(dictionary=True)
+        chat = get_chat_participants(cursor, chat_id)
+        if not chat or chat['patient_id'] != current_user.id: abort(404)
+        return chat_stream_response(chat_id, requested_since_id())
+    finally:
+        if cursor: cursor.close()
+        if conn and conn.is_connected(): conn.close()
+
+
+@patient_messaging_bp.route('/chat/<int:chat_id>/messages', methods=['GET'])
+@login_required
+def patient_chat_messages_since(chat_id):
+    """Messages newer than ?since=<message_id> (JSON); marks the doctor's messages as read."""
+    if not check_patient_authorization(current_user):
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    conn = None; cursor = None
+    try:
+        conn = get_db_connection(); cursor = conn.cursor(dictionary=True)
+        chat = get_chat_participants(cursor, chat_id)
+        if not chat or chat['patient_id'] != current_user.id:
+            return jsonify({"success": False, "message": "Chat not found."}), 404
+        since_id = requested_since_id()
+        messages, has_more = fetch_messages_page(cursor, chat_id, since_id)
+        if any(m['sender_type'] == 'doctor' and not m['read_at'] for m in messages):
+            mark_messages_as_read_pm(chat_id, current_user.id, conn)
+        last_id = messages[-1]['message_id'] if messages else since_id
+        return jsonify({"success": True, "messages": messages, "last_message_id": last_id, "has_more": has_more})
+    except mysql.connector.Error as err:
+        module_logger.error(f"Error fetching new messages for chat {chat_id}: {err}")
+        return jsonify({"success": False, "message": "Database error."}), 500
+    finally:
+        if cursor: cursor.close()
+        if conn and conn.is_connected(): conn.close()
+
+
 @patient_messaging_bp.route('/chat/<int:chat_id>/send', methods=['POST'])
 @login_required
 def send_patient_message(chat_id):
@@ -6,9 +6,11 @@ from flask import (
     current_app, abort
 )
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
 import os
 from db import get_db_connection
+from routes.principal_cache import invalidate_principal
+from utils.image_derivatives import derive_uploaded_image
+from utils.upload_store import release_upload, store_upload, upload_extension
 from utils.auth_helpers import check_patient_authorization # Import the helper
 import mysql.connector
 
@@ -41,14 +43,12 @@ def save_profile_picture(file, user_id):
             return None, "Server error: Cannot create upload directory."
 
     if file and allowed_profile_pic(file.filename):
-        original_filename = secure_filename(file.filename)
-        ext = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else 'jpg'
-        unique_filename = secure_filename(f"user_{user_id}_profile_{int(datetime.now().timestamp())}.{ext}")
-        filepath_absolute = os.path.join(upload_folder, unique_filename)
-        
+        filepath_absolute = None
         try:
-            file.save(filepath_absolute)
+            filepath_absolute = store_upload(file, upload_folder, upload_extension(file.filename) or 'jpg')
+            unique_filename = os.path.basename(filepath_absolute)
             current_app.logger.info(f"Profile picture saved to: {filepath_absolute}")
+            derive_uploaded_image(filepath_absolute)
 
             relative_db_path = None
             if upload_folder.startswith(current_app.static_folder):
@@ -86,10 +86,10 @@ def save_profile_picture(file, user_id):
 
             return relative_db_path, None
         except Exception as e:
-            current_app.logger.error(f"Failed to save profile picture {unique_filename} to {filepath_absolute}: {e}", exc_info=True)
-            if os.path.exists(filepath_absolute):
-                try: os.remove(filepath_absolute)
-                except OSError as e_rem: current_app.logger.error(f"Failed to remove orphaned file {filepath_absolute}: {e_rem}")
+            current_app.logger.error(f"Failed to save profile picture for user {user_id} to {upload_folder}: {e}", exc_info=True)
+            if filepath_absolute:
+                try: release_upload(filepath_absolute)
+                except Exception as e_rem: current_app.logger.error(f"Failed to remove orphaned file {filepath_absolute}: {e_rem}")
             return None, "Failed to save uploaded file."
     elif file:
         default_extensions = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
@@ -110,7 +110,7 @@ def delete_profile_picture(filename_db_path):
             current_app.logger.warning(f"Path traversal attempt detected for profile picture deletion: {filepath_absolute}")
             return False
         if os.path.exists(filepath_absolute) and os.path.isfile(filepath_absolute):
-            os.remove(filepath_absolute)
+            release_upload(filepath_absolute) # Unlinks only when no other user shares the stored file
             current_app.logger.info(f"Deleted existing profile picture: {filepath_absolute}")
             return True
         else:
@@ -267,6 +267,7 @@ def manage_profile():
                 # *** END OF MODIFIED SECTION ***
 
                 conn.commit()
+                invalidate_principal(user_id)
                 flash("Profile updated successfully!", "success")
                 return redirect(url_for('.manage_profile'))
 
@@ -385,12 +386,11 @@ def upload_photo():
          
          cursor.execute("UPDATE users SET profile_picture = %s, updated_at=NOW() WHERE user_id = %s", (relative_path_db, user_id))
          conn.commit()
+         invalidate_principal(user_id)
 
          if old_pic_data and old_pic_data.get('profile_picture'):
-            if old_pic_data['profile_picture'] != relative_path_db:
-                 delete_profile_picture(old_pic_data['profile_picture'])
-            elif file.content_length > 0:
-                current_app.logger.info(f"New profile picture uploaded with same relative path as old for user {user_id}. Old file overwritten/managed by save.")
+            # Releases the old row's reference; the new upload holds its own even if it is the same stored file
+            delete_profile_picture(old_pic_data['profile_picture'])
 
          flash("Profile picture updated successfully.", "success")
     except mysql.connector.Error as db_err:
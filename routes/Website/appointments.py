@@ -1,22 +1,28 @@
 # your_project/routes/Website/appointment_routes.py
-import sys
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_required, current_user
 from datetime import datetime, date, time, timedelta
 import calendar
 import mysql.connector
 import os 
-from db import get_db_connection
+import uuid
+from db import get_db_connection, read_only
 
-_project_root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-if _project_root_path not in sys.path:
-    sys.path.append(_project_root_path)
 from utils.template_helpers import map_status_to_badge_class 
+from routes.availability_cache import invalidate_availability
+from routes.booking import BookingError, book_appointment
+from routes.availability_engine import earliest_slots, get_availability_for_dates, iter_location_slots
+from routes.Website.doctor import (
+    get_all_departments_for_filter, get_filtered_doctors, get_specializations_by_department_for_filter
+)
 
 appointment_bp = Blueprint('appointment', __name__, url_prefix='/appointments', template_folder='../../templates/Website')
 
 PYTHON_DOW_MAP = {0: 'Monday', 1: 'Tuesday', 2: 'Wednesday', 3: 'Thursday', 4: 'Friday', 5: 'Saturday', 6: 'Sunday'}
 DB_DOW_MAP = {0: 'Sunday', 1: 'Monday', 2: 'Tuesday', 3: 'Wednesday', 4: 'Thursday', 5: 'Friday', 6: 'Saturday'}
+EARLIEST_SEARCH_DEFAULT_DAYS = 30
+EARLIEST_SEARCH_MAX_DAYS = 90
+EARLIEST_SEARCH_MAX_RESULTS = 50
 
 def python_dow_to_db_dow(py_dow):
     return (py_dow + 1) % 7
@@ -184,9 +190,6 @@ def format_time_for_display(time_obj_or_str):
     return str(time_obj_or_str)
 
 def get_doctor_available_slots(doctor_id, target_date_str, selected_location_id=None):
-    conn = None; cursor = None
-    slot_interval = current_app.config.get('APPOINTMENT_SLOT_INTERVAL_MINUTES', 30)
-
     try:
         target_date_obj = datetime.strptime(target_date_str, '%Y-%m-%d').date()
         if target_date_obj < date.today():
@@ -194,127 +197,125 @@ def get_doctor_available_slots(doctor_id, target_date_str, selected_location_id=
     except ValueError:
         return {"error": "Invalid date format.", "available_slots": [], "slot_count": 0}
 
-    db_day_of_week_for_query = python_dow_to_db_dow(target_date_obj.weekday())
-
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True, buffered=True)
-        all_potential_slots_for_location = []
-
-        loc_availability_query = """
-            SELECT dla.start_time, dla.end_time
-            FROM doctor_location_availability dla
-            WHERE dla.doctor_location_id = %s AND dla.day_of_week = %s;
-        """
-        cursor.execute(loc_availability_query, (selected_location_id, db_day_of_week_for_query))
-        base_avail_periods = cursor.fetchall()
-
-        for avail_period in base_avail_periods:
-            start_t, end_t = avail_period['start_time'], avail_period['end_time']
-            if isinstance(start_t, timedelta): start_t = (datetime.min + start_t).time()
-            if isinstance(end_t, timedelta): end_t = (datetime.min + end_t).time()
-            all_potential_slots_for_location.extend(generate_time_slots(start_t, end_t, slot_interval))
-        
-        if not all_potential_slots_for_location:
-             return {"available_slots": [], "slot_count": 0}
-
-        cursor.execute("""
-            SELECT start_time, end_time FROM appointments
-            WHERE doctor_id = %s AND appointment_date = %s AND doctor_location_id = %s
-            AND status NOT IN ('canceled', 'rescheduled', 'no-show')
-        """, (doctor_id, target_date_str, selected_location_id))
-        booked_slots_info = cursor.fetchall()
-
-        cursor.execute("""
-            SELECT start_time, end_time, is_unavailable FROM doctor_availability_overrides
-            WHERE doctor_id = %s AND override_date = %s
-            AND (doctor_location_id = %s OR doctor_location_id IS NULL)
-        """, (doctor_id, target_date_str, selected_location_id))
-        overrides = cursor.fetchall()
-
-        current_location_slots_set = set(all_potential_slots_for_location)
-
-        for override in overrides: 
-            if override['is_unavailable']:
-                o_start_t, o_end_t = override['start_time'], override['end_time']
-                if o_start_t is None and o_end_t is None:
-                    current_location_slots_set.clear(); break
-                if o_start_t and o_end_t:
-                    if isinstance(o_start_t, timedelta): o_start_t = (datetime.min + o_start_t).time()
-                    if isinstance(o_end_t, timedelta): o_end_t = (datetime.min + o_end_t).time()
-                    slots_to_remove = {s for s in current_location_slots_set if s >= o_start_t and (datetime.combine(date.min, s) + timedelta(minutes=slot_interval)).time() <= o_end_t}
-                    current_location_slots_set.difference_update(slots_to_remove)
-        
-        if not current_location_slots_set: return {"available_slots": [], "slot_count": 0}
-
-        for booked in booked_slots_info: 
-            b_start_t, b_end_t = booked['start_time'], booked['end_time']
-            if isinstance(b_start_t, timedelta): b_start_t = (datetime.min + b_start_t).time()
-            if isinstance(b_end_t, timedelta): b_end_t = (datetime.min + b_end_t).time()
-            slots_to_remove = set()
-            for slot_start_time in current_location_slots_set:
-                slot_end_datetime = datetime.combine(date.min, slot_start_time) + timedelta(minutes=slot_interval)
-                if slot_start_time < b_end_t and slot_end_datetime.time() > b_start_t:
-                    slots_to_remove.add(slot_start_time)
-            current_location_slots_set.difference_update(slots_to_remove)
-
-        for override in overrides: 
-            if not override['is_unavailable'] and override['start_time'] and override['end_time']:
-                o_start_t, o_end_t = override['start_time'], override['end_time']
-                if isinstance(o_start_t, timedelta): o_start_t = (datetime.min + o_start_t).time()
-                if isinstance(o_end_t, timedelta): o_end_t = (datetime.min + o_end_t).time()
-                current_location_slots_set.update(generate_time_slots(o_start_t, o_end_t, slot_interval))
-        
-        cursor.execute("""
-            SELECT max_appointments FROM doctor_location_daily_caps
-            WHERE doctor_id = %s AND doctor_location_id = %s AND day_of_week = %s
-        """, (doctor_id, selected_location_id, db_day_of_week_for_query))
-        daily_cap_row = cursor.fetchone()
-        if daily_cap_row:
-            cursor.execute("""
-                SELECT COUNT(*) as count FROM appointments
-                WHERE doctor_id = %s AND doctor_location_id = %s AND appointment_date = %s
-                AND status NOT IN ('canceled', 'rescheduled', 'no-show')
-            """, (doctor_id, selected_location_id, target_date_str))
-            current_booking_count = cursor.fetchone()['count']
-            if current_booking_count >= daily_cap_row['max_appointments']:
-                current_location_slots_set.clear()
-        
-        final_slots_list = sorted(list(current_location_slots_set))
-        return {
-            "available_slots": [s.strftime('%H:%M') for s in final_slots_list],
-            "slot_count": len(final_slots_list)
-        }
+        slots = get_availability_for_dates(doctor_id, selected_location_id, [target_date_obj])[target_date_obj]
+        return {"available_slots": slots, "slot_count": len(slots)}
     except Exception as e:
         current_app.logger.error(f"Error in get_doctor_available_slots for Dr {doctor_id}, Date {target_date_str}, Loc {selected_location_id}: {e}", exc_info=True)
         return {"error": "Could not retrieve slots.", "available_slots": [], "slot_count": 0}
-    finally:
-        if cursor: cursor.close()
-        if conn and conn.is_connected(): conn.close()
 
 def get_upcoming_dates_for_dow(doctor_id, db_day_of_week_target, selected_location_id, limit=10):
     if not (0 <= db_day_of_week_target <= 6): return []
     if not selected_location_id: return []
 
     py_dow_target = db_dow_to_python_dow(db_day_of_week_target)
-    upcoming_dates_with_status = []
-    check_date = date.today()
-    days_to_add = (py_dow_target - check_date.weekday() + 7) % 7
-    current_valid_date = check_date + timedelta(days=days_to_add)
-
-    for _ in range(limit):
-        if current_valid_date >= date.today():
-            date_str = current_valid_date.strftime('%Y-%m-%d')
-            slot_data = get_doctor_available_slots(doctor_id, date_str, selected_location_id)
-            has_slots = slot_data.get("slot_count", 0) > 0
-            
-            upcoming_dates_with_status.append({
-                "date": date_str,
-                "has_slots": has_slots,
-                "is_today": date_str == date.today().strftime('%Y-%m-%d')
-            })
-        current_valid_date += timedelta(weeks=1)
-    return upcoming_dates_with_status
+    today = date.today()
+    days_to_add = (py_dow_target - today.weekday() + 7) % 7
+    first_date = today + timedelta(days=days_to_add)
+    candidate_dates = [first_date + timedelta(weeks=i) for i in range(limit)]
+
+    try:
+        slots_by_date = get_availability_for_dates(doctor_id, selected_location_id, candidate_dates)
+    except Exception as e:
+        current_app.logger.error(f"Error in get_upcoming_dates_for_dow for Dr {doctor_id}, Loc {selected_location_id}: {e}", exc_info=True)
+        slots_by_date = {}
+
+    return [{
+        "date": d.strftime('%Y-%m-%d'),
+        "has_slots": bool(slots_by_date.get(d)),
+        "is_today": d == today
+    } for d in candidate_dates]
+
+def get_bookable_locations_for_doctors(doctor_ids, city=None):
+    """Active locations that have at least one weekly slot, for a set of doctors."""
+    if not doctor_ids: return []
+    conn = None; cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        placeholders = ', '.join(['%s'] * len(doctor_ids))
+        query = f"""
+            SELECT dl.doctor_location_id, dl.doctor_id, dl.location_name, dl.city
+            FROM doctor_locations dl
+            WHERE dl.doctor_id IN ({placeholders}) AND dl.is_active = TRUE
+            AND EXISTS (SELECT 1 FROM doctor_location_availability dla
+                        WHERE dla.doctor_location_id = dl.doctor_location_id)
+        """
+        params = list(doctor_ids)
+        if city:
+            query += " AND LOWER(dl.city) = LOWER(%s)"
+            params.append(city)
+        cursor.execute(query, tuple(params))
+        return cursor.fetchall()
+    finally:
+        if cursor: cursor.close()
+        if conn and conn.is_connected(): conn.close()
+
+def find_earliest_available_slots(department_id=None, specialization_id=None, city=None,
+                                  start_date=None, end_date=None, limit=10):
+    """
+    The `limit` earliest open slots across all approved doctors matching the
+    filters, ranked by time. Each doctor location is an ordered slot stream;
+    the streams are heap-merged so the search stops as soon as `limit` slots
+    are known instead of computing every doctor's whole window.
+    """
+    today = date.today()
+    start_date = max(start_date or today, today)
+    end_date = end_date or (start_date + timedelta(days=EARLIEST_SEARCH_DEFAULT_DAYS))
+    end_date = min(end_date, start_date + timedelta(days=EARLIEST_SEARCH_MAX_DAYS))
+    if end_date < start_date: return []
+
+    doctors = get_filtered_doctors(specialization_id=specialization_id, department_id=department_id)
+    doctors_by_id = {doc['user_id']: doc for doc in doctors}
+    locations = get_bookable_locations_for_doctors(list(doctors_by_id), city=city)
+    locations_by_id = {loc['doctor_location_id']: loc for loc in locations}
+
+    streams = [
+        iter_location_slots(loc['doctor_id'], loc['doctor_location_id'], start_date, end_date)
+        for loc in locations
+    ]
+    results = []
+    for slot_dt, doctor_id, location_id in earliest_slots(streams, limit):
+        doctor = doctors_by_id[doctor_id]
+        location = locations_by_id[location_id]
+        results.append({
+            'doctor_id': doctor_id,
+            'doctor_name': f"Dr. {doctor['first_name']} {doctor['last_name']}",
+            'specialization_name': doctor.get('specialization_name'),
+            'department_name': doctor.get('department_name'),
+            'location_id': location_id,
+            'location_name': location['location_name'],
+            'city': location.get('city'),
+            'date': slot_dt.date().isoformat(),
+            'time': slot_dt.strftime('%H:%M'),
+            'display_date': slot_dt.strftime('%a, %b %d, %Y'),
+            'display_time': slot_dt.strftime('%I:%M %p'),
+            'booking_url': url_for('.schedule_with_doc', doctor_id=doctor_id, location_id=location_id,
+                                   day_db=python_dow_to_db_dow(slot_dt.weekday()),
+                                   date=slot_dt.date().isoformat(), time=slot_dt.strftime('%H:%M')),
+        })
+    return results
+
+def _parse_earliest_search_args(args):
+    errors = []
+    def parse_date(name):
+        value = args.get(name, '').strip()
+        if not value: return None
+        try: return date.fromisoformat(value)
+        except ValueError:
+            errors.append(f"Invalid {name.replace('_', ' ')}.")
+            return None
+    criteria = {
+        'department_id': args.get('department_id', type=int),
+        'specialization_id': args.get('specialization_id', type=int),
+        'city': args.get('city', '').strip() or None,
+        'start_date': parse_date('start_date'),
+        'end_date': parse_date('end_date'),
+        'limit': min(max(args.get('limit', 10, type=int), 1), EARLIEST_SEARCH_MAX_RESULTS),
+    }
+    if not criteria['department_id'] and not criteria['specialization_id']:
+        errors.append("Select a department or specialization.")
+    return criteria, errors
 
 @appointment_bp.route('/schedule/with/<int:doctor_id>', methods=['GET'])
 @login_required
@@ -360,7 +361,8 @@ def schedule_with_doc(doctor_id):
         is_reschedule=is_reschedule,
         original_appointment_id=original_appointment_id,
         page_title=page_title,
-        form_data_initial=form_data_from_query 
+        form_data_initial=form_data_from_query,
+        idempotency_key=uuid.uuid4().hex
     )
 
 @appointment_bp.route('/dates-for-day/<int:doctor_id>/<int:db_day_of_week>', methods=['GET'])
@@ -395,6 +397,47 @@ def get_availability_ajax(doctor_id, date_str):
     return jsonify(availability)
 
 
+@appointment_bp.route('/earliest', methods=['GET'])
+@login_required
+@read_only
+def earliest_available_page():
+    criteria, errors = _parse_earliest_search_args(request.args)
+    searched = bool(request.args)
+    slots = []
+    if searched and not errors:
+        try:
+            slots = find_earliest_available_slots(**criteria)
+        except Exception as e:
+            current_app.logger.error(f"Error in earliest slot search {criteria}: {e}", exc_info=True)
+            errors.append("Could not search availability. Please try again.")
+    for error_msg in (errors if searched else []): flash(error_msg, 'danger')
+
+    specializations = get_specializations_by_department_for_filter(criteria['department_id'])
+    return render_template(
+        'Website/Appointments/earliest_slots.html',
+        departments=get_all_departments_for_filter(),
+        specializations=specializations,
+        criteria=criteria,
+        slots=slots,
+        searched=searched and not errors,
+        today_date_iso=date.today().isoformat()
+    )
+
+@appointment_bp.route('/earliest/search', methods=['GET'])
+@login_required
+@read_only
+def earliest_available_api():
+    criteria, errors = _parse_earliest_search_args(request.args)
+    if errors:
+        return jsonify({'error': ' '.join(errors), 'slots': []}), 400
+    try:
+        slots = find_earliest_available_slots(**criteria)
+    except Exception as e:
+        current_app.logger.error(f"Error in earliest slot search {criteria}: {e}", exc_info=True)
+        return jsonify({'error': 'Could not search availability.', 'slots': []}), 500
+    return jsonify({'slots': slots, 'slot_count': len(slots)})
+
+
 @appointment_bp.route('/schedule/confirm/<int:doctor_id>', methods=['POST'])
 @login_required
 def schedule_appointment_datetime(doctor_id):
@@ -444,9 +487,11 @@ def schedule_appointment_datetime(doctor_id):
     
     if not patient_phone: errors.append("Phone number is required.")
 
-    if errors:
-        for error_msg in errors: flash(error_msg, 'danger')
-        redirect_url_params = {'doctor_id': doctor_id, 'errors': errors}
+    idempotency_key = (form_data.get('idempotency_key') or '').strip()[:64] or None
+
+    def redirect_to_form(error_list=None):
+        redirect_url_params = {'doctor_id': doctor_id}
+        if error_list: redirect_url_params['errors'] = error_list
         if original_appointment_id_from_form:
             redirect_url_params['original_appointment_id'] = original_appointment_id_from_form
         
@@ -460,65 +505,20 @@ def schedule_appointment_datetime(doctor_id):
         
         return redirect(url_for('.schedule_with_doc', **redirect_url_params))
 
-    conn = None; cursor = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True, buffered=True)
-
-        cursor.execute("SELECT default_duration_minutes FROM appointment_types WHERE type_id = %s AND is_active = TRUE", (appointment_type_id,))
-        type_details = cursor.fetchone()
-        if not type_details:
-            flash("Selected appointment type is invalid or inactive.", "danger")
-            return redirect(url_for('.schedule_with_doc', doctor_id=doctor_id, original_appointment_id=original_appointment_id_from_form, **form_data))
-
-        duration = type_details['default_duration_minutes']
-        end_time_obj = calculate_end_time(appointment_time_obj, duration)
-
-        clash_check_params = (doctor_id, location_id, appointment_date_obj, end_time_obj, appointment_time_obj) 
-        cursor.execute("""
-            SELECT appointment_id FROM appointments
-            WHERE doctor_id = %s AND doctor_location_id = %s AND appointment_date = %s
-            AND status NOT IN ('canceled', 'rescheduled', 'no-show')
-            AND (start_time < %s AND end_time > %s) 
-            LIMIT 1 
-        """, clash_check_params)
-        if cursor.fetchone():
-            flash("The selected time slot is no longer available. Please choose a different time.", "warning")
-            return redirect(url_for('.schedule_with_doc', doctor_id=doctor_id, original_appointment_id=original_appointment_id_from_form, **form_data))
-        
-        db_day_of_week_for_cap = python_dow_to_db_dow(appointment_date_obj.weekday())
-        cursor.execute("""
-            SELECT max_appointments FROM doctor_location_daily_caps
-            WHERE doctor_id = %s AND doctor_location_id = %s AND day_of_week = %s
-        """, (doctor_id, location_id, db_day_of_week_for_cap))
-        cap_row = cursor.fetchone()
-        if cap_row:
-            cursor.execute("""
-                SELECT COUNT(*) as count FROM appointments
-                WHERE doctor_id = %s AND doctor_location_id = %s AND appointment_date = %s
-                AND status NOT IN ('canceled', 'rescheduled', 'no-show')
-            """, (doctor_id, location_id, appointment_date_obj))
-            current_booking_count = cursor.fetchone()['count']
-            if current_booking_count >= cap_row['max_appointments']:
-                flash(f"The doctor's daily appointment cap for this location/day has been reached.", "warning")
-                return redirect(url_for('.schedule_with_doc', doctor_id=doctor_id, original_appointment_id=original_appointment_id_from_form, **form_data))
-
-        insert_query = """
-            INSERT INTO appointments (patient_id, doctor_id, appointment_date, start_time, end_time,
-                                      appointment_type_id, status, reason, doctor_location_id, created_by, updated_by, reschedule_count)
-            VALUES (%s, %s, %s, %s, %s, %s, 'scheduled', %s, %s, %s, %s, %s)
-        """
-        reschedule_count = 0 
-        cursor.execute(insert_query, (current_user.id, doctor_id, appointment_date_obj, appointment_time_obj,
-                                      end_time_obj, appointment_type_id, reason, location_id,
-                                      current_user.id, current_user.id, reschedule_count))
-        new_appointment_id = cursor.lastrowid
-        
-        if patient_phone and patient_phone != (current_user.phone or ""): 
-            cursor.execute("UPDATE users SET phone = %s WHERE user_id = %s", (patient_phone, current_user.id))
-
-        conn.commit()
+    if errors:
+        for error_msg in errors: flash(error_msg, 'danger')
+        return redirect_to_form(errors)
 
+    try:
+        new_appointment_id, replayed = book_appointment(
+            patient_id=current_user.id, doctor_id=doctor_id, location_id=location_id,
+            appointment_date=appointment_date_obj, start_time=appointment_time_obj,
+            appointment_type_id=appointment_type_id, reason=reason, created_by=current_user.id,
+            idempotency_key=idempotency_key,
+            patient_phone=patient_phone if patient_phone and patient_phone != (current_user.phone or "") else None
+        )
+        if replayed:
+            current_app.logger.info(f"Duplicate booking submission for patient {current_user.id} (key {idempotency_key}) -> appointment {new_appointment_id}")
         if original_appointment_id_from_form:
             flash(f"Appointment successfully rescheduled! New Appointment ID: {new_appointment_id}.", "success")
         else:
@@ -526,19 +526,16 @@ def schedule_appointment_datetime(doctor_id):
         
         return redirect(url_for('.view_appointment_detail', appointment_id=new_appointment_id))
 
+    except BookingError as be:
+        flash(be.message, "danger" if be.reason == BookingError.REASON_INVALID_TYPE else "warning")
     except mysql.connector.Error as err:
-        if conn: conn.rollback()
         current_app.logger.error(f"DB error scheduling for Dr {doctor_id}: {err}", exc_info=True)
         flash(f"A database error occurred: {err}. Please try again.", "danger")
     except Exception as e:
-        if conn: conn.rollback()
         current_app.logger.error(f"Unexpected error scheduling for Dr {doctor_id}: {e}", exc_info=True)
         flash("An unexpected error occurred. Please try again.", "danger")
-    finally:
-        if cursor: cursor.close()
-        if conn and conn.is_connected(): conn.close()
     
-    return redirect(url_for('.schedule_with_doc', doctor_id=doctor_id, original_appointment_id=original_appointment_id_from_form, **form_data))
+    return redirect_to_form()
 
 def get_appointment_details_for_view(appointment_id, user_id, user_type):
     conn = None; cursor = None
@@ -736,6 +733,7 @@ def cancel_appointment(appointment_id):
         
         cursor.execute("UPDATE appointments SET status = 'canceled', updated_by = %s, updated_at = CURRENT_TIMESTAMP WHERE appointment_id = %s", (current_user.id, appointment_id))
         conn.commit()
+        invalidate_availability(appointment['doctor_id'], dates=[appointment['appointment_date']])
         flash("Appointment canceled successfully.", "success")
     except mysql.connector.Error as err:
         if conn: conn.rollback()
@@ -753,7 +751,7 @@ def reschedule_appointment_start(appointment_id):
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True, buffered=True)
         cursor.execute("""
-            SELECT a.appointment_id, a.patient_id, a.doctor_id, a.status,
+            SELECT a.appointment_id, a.patient_id, a.doctor_id, a.status, a.appointment_date,
                    a.doctor_location_id, a.appointment_type_id, a.reason
             FROM appointments a
             WHERE a.appointment_id = %s
@@ -780,6 +778,8 @@ def reschedule_appointment_start(appointment_id):
             WHERE appointment_id = %s
         """, (current_user.id, appointment_id))
         conn.commit()
+        invalidate_availability(original_appointment['doctor_id'], original_appointment.get('doctor_location_id'),
+                                [original_appointment['appointment_date']])
         flash("Original appointment marked for reschedule. Please book a new appointment time.", "info")
 
         return redirect(url_for('.schedule_with_doc',
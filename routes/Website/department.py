@@ -5,15 +5,12 @@ import mysql.connector
 import sys
 import os
 
-_project_root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-if _project_root_path not in sys.path:
-    sys.path.append(_project_root_path)
-
 try:
-    from db import get_db_connection
+    from db import get_db_connection, read_only
 except ImportError:
     print("CRITICAL ERROR: Failed to import get_db_connection in department.py.", file=sys.stderr)
-    def get_db_connection(): return None
+    def get_db_connection(read_only=None): return None
+    def read_only(view): return view
 
 try:
     from utils.directory_configs import get_relative_path_for_db
@@ -135,6 +132,7 @@ def get_conditions_by_department(dept_id, search_term=None):
                 relative_image_path = get_relative_path_for_db(full_image_path) # This should give path relative to static
                 if relative_image_path:
                     cond_data['image_url'] = url_for('static', filename=relative_image_path)
+                    cond_data['image_path'] = relative_image_path # For image_srcset()
                 else:
                     cond_data['image_url'] = url_for('static', filename="images/conditions/disease_placeholder.png")
             else:
@@ -223,6 +221,7 @@ def get_condition_details_by_id(condition_id):
     return condition
 
 @department_bp.route('/')
+@read_only
 def list_departments():
     all_departments_raw = get_all_departments_from_db()
     departments_to_display = []
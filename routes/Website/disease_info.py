@@ -7,10 +7,6 @@ from flask import (
 import sys
 import os
 
-_project_root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-if _project_root_path not in sys.path:
-    sys.path.append(_project_root_path)
-
 try:
     from db import get_db_connection
 except ImportError:
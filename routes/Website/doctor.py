@@ -6,7 +6,7 @@ from flask import (
 )
 from flask_login import current_user
 import mysql.connector
-from db import get_db_connection
+from db import get_db_connection, read_only
 # from math import ceil # Only if you implement pagination directly here
 
 # Define the blueprint
@@ -238,6 +238,7 @@ def get_full_doctor_profile(doctor_id):
 # --- Routes ---
 @doctor_bp.route('/')
 @doctor_bp.route('/list')
+@read_only
 def list_doctors():
     search_name = request.args.get('search_name', '').strip()
     department_id_str = request.args.get('department_id', '')
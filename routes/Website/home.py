@@ -2,7 +2,7 @@
 
 from flask import Blueprint, render_template, current_app
 import mysql.connector
-from db import get_db_connection # Assuming db.py has this function
+from db import get_db_connection, read_only # Assuming db.py has this function
 
 # Define the blueprint
 home_bp = Blueprint(
@@ -72,6 +72,7 @@ def get_all_departments_from_db():
 
 # --- Main Homepage Route ---
 @home_bp.route('/')
+@read_only
 def index():
     """
     Renders the public homepage.
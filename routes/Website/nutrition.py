@@ -1,7 +1,9 @@
 # your_project/routes/Website/nutrition.py
 
 from flask import Blueprint, render_template, request, jsonify, abort, current_app, url_for
+from werkzeug.exceptions import HTTPException
 from db import get_db_connection
+from routes.shared_utils import get_diet_plan_with_meals
 import random
 import logging
 from datetime import datetime, time, timedelta 
@@ -120,78 +122,23 @@ def list_diet_plans():
 
 @nutrition_bp.route('/diet-plan/<int:plan_id>')
 def plan_details(plan_id):
-    conn = None
-    cursor = None
     plan = None
     meal_data = []
     nutrition_specialists = [] # Initialize
     try:
-        conn = get_db_connection()
-        if not conn:
-            raise Exception("Database connection failed")
-        cursor = conn.cursor(dictionary=True)
-        
-        query_plan = """
-            SELECT dp.plan_id, dp.plan_name, dp.description, dp.plan_type, dp.calories, 
-                   dp.protein_grams, dp.carbs_grams, dp.fat_grams, dp.fiber_grams, dp.sodium_mg,
-                   dp.target_conditions, u.username as creator_username 
-            FROM diet_plans dp
-            LEFT JOIN users u ON dp.creator_id = u.user_id
-            WHERE dp.plan_id = %s AND dp.is_public = 1 
-            LIMIT 1
-        """
-        cursor.execute(query_plan, (plan_id,))
-        plan = cursor.fetchone()
-
-        if not plan:
+        details = get_diet_plan_with_meals(plan_id, public_only=True)
+        if not details:
             abort(404, description="Diet plan not found or not public.")
+        plan = details['plan']
+        meal_data = [{'meal_info': meal, 'food_items_list': meal['food_items']} for meal in details['meals']]
 
-        query_meals = """
-            SELECT meal_id, meal_name, meal_type, description, calories, 
-                   protein_grams, carbs_grams, fat_grams, fiber_grams, sodium_mg, 
-                   time_of_day
-            FROM diet_plan_meals 
-            WHERE plan_id = %s 
-            ORDER BY FIELD(meal_type, 'breakfast', 'lunch', 'dinner', 'snack', 'other'), time_of_day
-        """
-        cursor.execute(query_meals, (plan_id,))
-        meals = cursor.fetchall()
-
-        for meal in meals:
-            if isinstance(meal.get('time_of_day'), timedelta):
-                total_seconds = int(meal['time_of_day'].total_seconds())
-                hours = total_seconds // 3600
-                minutes = (total_seconds % 3600) // 60
-                seconds = total_seconds % 60
-                meal['time_of_day_obj'] = time(hours, minutes, seconds) 
-            elif isinstance(meal.get('time_of_day'), time):
-                meal['time_of_day_obj'] = meal['time_of_day']
-            else:
-                meal['time_of_day_obj'] = None
-            
-            query_food_items = """
-                SELECT item_id, food_name, serving_size, calories, 
-                       protein_grams, carbs_grams, fat_grams, 
-                       notes, alternatives
-                FROM diet_plan_food_items 
-                WHERE meal_id = %s
-            """
-            cursor.execute(query_food_items, (meal['meal_id'],))
-            food_items_for_meal = cursor.fetchall()
-            meal_data.append({'meal_info': meal, 'food_items_list': food_items_for_meal})
-        
         nutrition_specialists = get_nutrition_specialists() # Fetch specialists for this page too
-            
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching diet plan details for ID {plan_id}: {e}", exc_info=True)
         abort(500, description="Error retrieving diet plan details.")
-    finally:
-        if cursor: cursor.close()
-        if conn and conn.is_connected(): conn.close()
-    
-    if not plan: # This check should be redundant if the first one aborts
-        abort(404, description="Diet plan not found.")
-        
+
     return render_template('plan_details.html', plan=plan, meal_data=meal_data, specialists=nutrition_specialists)
 
 # ... (food_search_page, api_search_food_library, api_bot_chat, _get_diet_plan_recommendations, api_recommend_diet_plans_endpoint, bmr_calculator_page remain the same) ...
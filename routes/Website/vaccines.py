@@ -1,5 +1,5 @@
 from flask import Blueprint, render_template, abort, current_app
-from db import get_db_connection
+from db import get_db_connection, read_only
 import math
 
 vaccines_bp = Blueprint(
@@ -122,6 +122,7 @@ def get_category_details_and_vaccines_by_id_from_db(category_id):
 
 
 @vaccines_bp.route('/')
+@read_only
 def vaccine_landing():
     categories = get_vaccine_categories_from_db()
     common_vaccines = get_common_vaccines_from_db()
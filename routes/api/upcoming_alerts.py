@@ -0,0 +1,320 @@
+# routes/api/upcoming_alerts.py
+"""
+Data side of the upcoming-appointment alerts (routes/api/user_alerts.py).
+
+Appointments are looked up with a range on (appointment_date, start_time) so
+idx_appointments_datetime can be used, instead of comparing CONCAT() strings.
+Rows are cached per user for ALERTS_CACHE_TTL_SECONDS, and "time left" is
+recomputed from the cached rows on every request, so a burst of polls from
+one browser costs one query. A booking or cancellation shows up once the
+entry expires.
+
+AlertScheduler is an optional in-process loop (ALERT_SCHEDULER=True). Every
+ALERT_SCHEDULER_INTERVAL seconds it runs a single query for every
+appointment starting in the next 24 hours (plus one interval), groups the
+rows by patient and doctor, and pushes a fresh alert list to Server-Sent
+Events subscribers whose list changed: an appointment entered the 24-hour
+window or has started. While it runs, polls are answered from the same
+snapshot, so the database sees one query per interval per worker no matter
+how many browsers are open. The snapshot counts only while the last
+successful tick is at most ALERT_SNAPSHOT_STALE_INTERVALS intervals old. After
+that, e.g. while the database is unreachable, polls go back to the per-user
+query path and open streams end, so no one is served a frozen list.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+import mysql.connector
+
+import db
+
+logger = logging.getLogger(__name__)
+
+ALERT_WINDOW = timedelta(hours=24)
+ALERTS_CACHE_TTL_SECONDS = float(os.environ.get('ALERTS_CACHE_TTL_SECONDS', 30))
+ALERT_SCHEDULER_ENABLED = os.environ.get('ALERT_SCHEDULER', 'False').lower() in ['true', '1', 't']
+ALERT_SCHEDULER_INTERVAL_SECONDS = float(os.environ.get('ALERT_SCHEDULER_INTERVAL', 30))
+ALERT_SNAPSHOT_STALE_INTERVALS = 2
+
+_UPCOMING_QUERY = """
+    SELECT
+        a.appointment_id, a.patient_id, a.doctor_id,
+        a.appointment_date, a.start_time,
+        apt.type_name AS appointment_type,
+        dl.location_name
+    FROM appointments a
+    LEFT JOIN appointment_types apt ON a.appointment_type_id = apt.type_id
+    LEFT JOIN doctor_locations dl ON a.doctor_location_id = dl.doctor_location_id
+    WHERE a.status IN ('scheduled', 'confirmed')
+      AND a.appointment_date BETWEEN %s AND %s
+      AND (a.appointment_date > %s OR a.start_time >= %s)
+      AND (a.appointment_date < %s OR a.start_time <= %s)
+"""
+
+
+# --- Queries ---
+def _time_of_day(value):
+    """TIME columns come back as timedelta; returns a time."""
+    if isinstance(value, timedelta):
+        total_seconds = int(value.total_seconds())
+        return (datetime.min + timedelta(seconds=total_seconds % 86400)).time()
+    return value
+
+
+def appointment_start(row):
+    appointment_date = row['appointment_date']
+    if isinstance(appointment_date, datetime):
+        appointment_date = appointment_date.date()
+    return datetime.combine(appointment_date, _time_of_day(row['start_time']))
+
+
+def fetch_upcoming_rows(cursor, window_start, window_end, patient_id=None, doctor_id=None):
+    """Active appointments starting in [window_start, window_end], oldest first."""
+    start_time = window_start.time().replace(microsecond=0)
+    end_time = window_end.time().replace(microsecond=0)
+    query = _UPCOMING_QUERY
+    params = [window_start.date(), window_end.date(),
+              window_start.date(), start_time, window_end.date(), end_time]
+    if patient_id is not None:
+        query += " AND a.patient_id = %s"
+        params.append(patient_id)
+    if doctor_id is not None:
+        query += " AND a.doctor_id = %s"
+        params.append(doctor_id)
+    cursor.execute(query + " ORDER BY a.appointment_date, a.start_time", tuple(params))
+    return cursor.fetchall()
+
+
+# --- Formatting ---
+def format_time_left(td):
+    """Formats a timedelta into a human-readable string like 'X hours, Y minutes'."""
+    if not isinstance(td, timedelta) or td.total_seconds() < 0:
+        return "Now or Past"
+
+    days = td.days
+    hours, remainder = divmod(td.seconds, 3600)
+    minutes, _ = divmod(remainder, 60)
+
+    parts = []
+    if days > 0:
+        parts.append(f"{days} day{'s' if days > 1 else ''}")
+    if hours > 0:
+        parts.append(f"{hours} hour{'s' if hours > 1 else ''}")
+    if minutes > 0 or (not parts and hours == 0 and days == 0) : # Show minutes if it's the only unit or if < 1hr
+        parts.append(f"{minutes} min{'s' if minutes > 1 else ''}")
+
+    if not parts: # Less than a minute
+        return "Soon"
+
+    return ", ".join(parts) + " left"
+
+
+def build_alerts(rows, now):
+    """Alert dicts for the rows that start after `now` and within the 24-hour window."""
+    alerts = []
+    for row in rows:
+        starts_at = appointment_start(row)
+        if not (now < starts_at <= now + ALERT_WINDOW):
+            continue
+        time_left = starts_at - now
+        alerts.append({
+            "appointment_id": row['appointment_id'],
+            "type": row.get('appointment_type') or 'Appointment',
+            "location": row.get('location_name') or 'N/A',
+            "datetime_iso": starts_at.isoformat(), # For JS to parse
+            "time_left_str": format_time_left(time_left),
+            "time_left_seconds": time_left.total_seconds() # For JS countdown
+        })
+    return alerts
+
+
+def _user_filter(user_type, user_id):
+    if user_type == 'patient':
+        return {'patient_id': user_id}
+    if user_type == 'doctor':
+        return {'doctor_id': user_id}
+    return None
+
+
+# --- Per-User Cache ---
+class _UpcomingRowsCache:
+    """user key -> (expires_at, rows). Rows cover now .. now + window + TTL so they stay valid until expiry."""
+
+    def __init__(self, ttl=ALERTS_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def set(self, key, rows):
+        if self.ttl <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) > 10000:
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+            self._entries[key] = (now + self.ttl, rows)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+_rows_cache = _UpcomingRowsCache()
+
+
+def get_upcoming_alerts(user_type, user_id, now=None):
+    """
+    Alert list for one user. Served from the scheduler snapshot when it is
+    running, else from the per-user cache, else with one query.
+    Raises mysql.connector.Error on database failure.
+    """
+    now = now or datetime.now()
+    user_filter = _user_filter(user_type, user_id)
+    if user_filter is None:
+        return []
+    key = (user_type, user_id)
+    if alert_scheduler.running:
+        rows = alert_scheduler.rows_for(key)
+        if rows is not None:
+            return build_alerts(rows, now)
+    rows = _rows_cache.get(key)
+    if rows is None:
+        with db.connection(read_only=True) as conn:
+            cursor = conn.cursor(dictionary=True, buffered=True)
+            try:
+                rows = fetch_upcoming_rows(cursor, now, now + ALERT_WINDOW + timedelta(seconds=_rows_cache.ttl),
+                                           **user_filter)
+            finally:
+                cursor.close()
+        _rows_cache.set(key, rows)
+    return build_alerts(rows, now)
+
+
+# --- Push Scheduler ---
+class AlertScheduler:
+    def __init__(self, interval=ALERT_SCHEDULER_INTERVAL_SECONDS):
+        self.interval = interval
+        self._last_tick = None       # time.monotonic() of the last successful tick
+        self._rows_by_user = {}      # ('patient'|'doctor', user_id) -> rows
+        self._subscribers = {}       # user key -> set of queue.Queue
+        self._last_pushed = {}       # user key -> tuple of appointment ids
+        self._lock = threading.Lock()
+        self._thread = None
+        self.ticks = 0
+
+    def start(self):
+        if self._thread is not None:
+            return self._thread
+        self._thread = threading.Thread(target=self._run, name='alert-scheduler', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    @property
+    def running(self):
+        """True while the snapshot is fresh enough to answer from."""
+        last_tick = self._last_tick
+        return last_tick is not None and \
+            time.monotonic() - last_tick <= self.interval * ALERT_SNAPSHOT_STALE_INTERVALS
+
+    def rows_for(self, key):
+        """Snapshot rows for a user ([] if they have nothing upcoming), or None when there is no fresh snapshot."""
+        with self._lock:
+            if not self.running:
+                return None
+            return self._rows_by_user.get(key, [])
+
+    def subscribe(self, key):
+        """Registers an SSE stream; returns the queue alert lists are pushed to."""
+        subscriber = queue.Queue(maxsize=10)
+        with self._lock:
+            self._subscribers.setdefault(key, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, key, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(key)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[key]
+                    self._last_pushed.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'running': self.running,
+                'snapshot_age_seconds': time.monotonic() - self._last_tick if self._last_tick is not None else None,
+                'ticks': self.ticks,
+                'users_with_alerts': len(self._rows_by_user),
+                'stream_subscribers': sum(len(s) for s in self._subscribers.values()),
+            }
+
+    def tick(self, now=None):
+        """One refresh: a single query, then pushes to subscribers whose alert list changed."""
+        now = now or datetime.now()
+        with db.connection(dedicated=True, read_only=True) as conn:
+            cursor = conn.cursor(dictionary=True, buffered=True)
+            try:
+                rows = fetch_upcoming_rows(cursor, now, now + ALERT_WINDOW + timedelta(seconds=self.interval))
+            finally:
+                cursor.close()
+        rows_by_user = {}
+        for row in rows:
+            rows_by_user.setdefault(('patient', row['patient_id']), []).append(row)
+            rows_by_user.setdefault(('doctor', row['doctor_id']), []).append(row)
+
+        with self._lock:
+            self._rows_by_user = rows_by_user
+            self._last_tick = time.monotonic()
+            self.ticks += 1
+            subscribed = {key: list(subscribers) for key, subscribers in self._subscribers.items()}
+        for key, subscribers in subscribed.items():
+            self.push_if_changed(key, subscribers, now)
+
+    def push_if_changed(self, key, subscribers, now):
+        alerts = build_alerts(self.rows_for(key) or [], now)
+        signature = tuple(alert['appointment_id'] for alert in alerts)
+        with self._lock:
+            if self._last_pushed.get(key) == signature:
+                return
+            self._last_pushed[key] = signature
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(alerts)
+            except queue.Full:
+                pass  # slow client; it gets the next change
+
+    def _run(self):
+        while True:
+            try:
+                self.tick()
+            except mysql.connector.Error as err:
+                logger.error(f"Alert scheduler query failed: {err}")
+            except Exception as e:
+                logger.error(f"Alert scheduler tick failed: {e}", exc_info=True)
+            time.sleep(self.interval)
+
+
+alert_scheduler = AlertScheduler()
+
+
+def init_alert_scheduler(app):
+    # With BACKGROUND_TASKS off (pre-forking servers) each worker starts it after fork instead.
+    if ALERT_SCHEDULER_ENABLED and app.config.get('BACKGROUND_TASKS', True):
+        alert_scheduler.start()
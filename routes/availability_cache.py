@@ -0,0 +1,148 @@
+# routes/availability_cache.py
+"""
+In-process cache of computed appointment slots.
+
+Entries are keyed by (doctor_id, location_id, date) and hold the list of free
+'HH:MM' slot strings for that day. They expire after a TTL and are dropped
+explicitly whenever something that shapes availability changes: a booking,
+cancellation or reschedule, or an edit to weekly slots, overrides or daily
+caps. Call invalidate_availability() after the change has been committed.
+
+Each doctor has a generation counter that invalidation bumps. A reader notes
+the generation before loading from the database and only stores its result if
+the generation is unchanged, so a computation that raced with a booking can
+never overwrite the invalidation with stale slots. Counters are only kept for
+the AVAILABILITY_CACHE_MAX_ENTRIES most recently invalidated doctors
+(utils/generations.py).
+
+The cache lives in one worker process. Other workers only see an
+invalidation when their own entry expires, so the TTL bounds how stale a
+slot list can be; the booking path always re-checks clashes against the
+database before inserting.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utils.generations import Generations
+from utils.metrics import CACHE_ENTRIES, CACHE_LOOKUPS, register_collector
+
+CACHE_TTL_SECONDS = float(os.environ.get('AVAILABILITY_CACHE_TTL_SECONDS', 60))
+CACHE_MAX_ENTRIES = int(os.environ.get('AVAILABILITY_CACHE_MAX_ENTRIES', 20000))
+
+
+class AvailabilityCache:
+    def __init__(self, ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (doctor_id, location_id, date) -> (expires_at, slots)
+        self._keys_by_doctor = {}
+        self._generations = Generations(max_entries)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def generation(self, doctor_id):
+        with self._lock:
+            return self._generations.get(doctor_id)
+
+    def get_many(self, doctor_id, location_id, dates):
+        """Cached slot lists for the dates that have a live entry: {date: slots}."""
+        found = {}
+        if not self.enabled:
+            return found
+        now = time.monotonic()
+        with self._lock:
+            for day in dates:
+                key = (doctor_id, location_id, day)
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] <= now:
+                    self._remove(key)
+                    continue
+                found[day] = entry[1]
+            self.hits += len(found)
+            self.misses += len(dates) - len(found)
+        CACHE_LOOKUPS.inc(len(found), cache='availability', result='hit')
+        CACHE_LOOKUPS.inc(len(dates) - len(found), cache='availability', result='miss')
+        return found
+
+    def set_many(self, doctor_id, location_id, slots_by_date, generation):
+        """Stores results computed while `generation` was current; dropped if it has moved on."""
+        if not self.enabled:
+            return
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            if self._generations.get(doctor_id) != generation:
+                return
+            doctor_keys = self._keys_by_doctor.setdefault(doctor_id, set())
+            for day, slots in slots_by_date.items():
+                key = (doctor_id, location_id, day)
+                self._entries[key] = (expires_at, list(slots))
+                self._entries.move_to_end(key)
+                doctor_keys.add(key)
+            while len(self._entries) > self.max_entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def invalidate(self, doctor_id, location_id=None, dates=None):
+        """
+        Drops a doctor's entries, optionally narrowed to one location and/or a
+        collection of dates. location_id=None means every location.
+        """
+        wanted_dates = set(dates) if dates is not None else None
+        with self._lock:
+            self._generations.bump(doctor_id)
+            for key in list(self._keys_by_doctor.get(doctor_id, ())):
+                _, key_location, key_date = key
+                if location_id is not None and key_location != location_id:
+                    continue
+                if wanted_dates is not None and key_date not in wanted_dates:
+                    continue
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_doctor.clear()
+            self._generations.bump_all()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'ttl_seconds': self.ttl,
+            }
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        doctor_keys = self._keys_by_doctor.get(key[0])
+        if doctor_keys is not None:
+            doctor_keys.discard(key)
+            if not doctor_keys:
+                del self._keys_by_doctor[key[0]]
+
+
+availability_cache = AvailabilityCache()
+
+
+@register_collector
+def _collect_cache_metrics():
+    CACHE_ENTRIES.set(availability_cache.stats()['entries'], cache='availability')
+
+
+def invalidate_availability(doctor_id, location_id=None, dates=None):
+    """Call after committing any change to a doctor's bookings, slots, overrides or caps."""
+    if doctor_id is None:
+        return
+    if location_id is not None:
+        location_id = int(location_id)
+    availability_cache.invalidate(int(doctor_id), location_id, dates)
@@ -0,0 +1,288 @@
+# routes/availability_engine.py
+"""
+Batch appointment-availability engine.
+
+Loads everything that shapes a doctor's bookable slots at one location
+(weekly availability periods, date overrides, active bookings and daily caps)
+for a whole date range in four queries, then computes every day's free slots
+in one pass. Times are handled as integer minutes since midnight; bookings and
+blocking overrides are merged into IntervalSets (utils/intervals.py) so each
+candidate slot is tested with one O(log n) lookup instead of a loop over
+every booking with datetime objects.
+
+Slot rules (same as the original per-day calculation):
+  1. Slots are generated every `slot_interval` minutes from the start of each
+     weekly period for that weekday and must end inside the period.
+  2. A whole-day "unavailable" override removes every slot; timed ones are
+     merged and remove the slots that fall entirely inside the blocked time.
+  3. "Available" overrides add extra slots.
+  4. Slots that overlap an active booking are removed. This is applied after
+     step 3 so override slots can no longer be offered on top of a booking.
+  5. If the day's booking count has reached the daily cap, no slots remain.
+"""
+import heapq
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+
+from flask import current_app
+
+import db
+from routes import availability_projection
+from routes.availability_cache import availability_cache
+from utils.intervals import IntervalSet
+
+MINUTES_PER_DAY = 24 * 60
+
+
+# --- Conversions ---
+def python_dow_to_db_dow(py_dow):
+    return (py_dow + 1) % 7
+
+
+def to_minutes(value):
+    """Minutes since midnight for a TIME column value (timedelta) or a datetime.time."""
+    if value is None:
+        return None
+    if isinstance(value, timedelta):
+        return int(value.total_seconds()) // 60
+    if isinstance(value, time):
+        return value.hour * 60 + value.minute
+    if isinstance(value, str):
+        fmt = '%H:%M:%S' if value.count(':') == 2 else '%H:%M'
+        parsed = datetime.strptime(value, fmt).time()
+        return parsed.hour * 60 + parsed.minute
+    raise TypeError(f"Unsupported time value: {value!r}")
+
+
+def minutes_to_str(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+# --- Slot Generation ---
+def slot_starts(start_min, end_min, slot_interval):
+    """Slot start minutes every `slot_interval` from start_min that end by end_min."""
+    if slot_interval <= 0:
+        return range(0)
+    last_start = end_min - slot_interval
+    return range(start_min, last_start + 1, slot_interval)
+
+
+# --- Data Loading ---
+def load_availability_inputs(doctor_id, location_id, start_date, end_date, cursor=None):
+    """
+    Fetches weekly periods, overrides, bookings and caps for the date range.
+    Returns a dict keyed by input type; bookings and overrides grouped by date.
+    """
+    conn = None
+    own_cursor = cursor is None
+    if own_cursor:
+        conn = db.get_db_connection(read_only=True)
+        if not conn:
+            raise ConnectionError("DB connection failed")
+        cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        cursor.execute("""
+            SELECT day_of_week, start_time, end_time
+            FROM doctor_location_availability
+            WHERE doctor_location_id = %s
+        """, (location_id,))
+        periods_by_dow = {}
+        for row in cursor.fetchall():
+            periods_by_dow.setdefault(row['day_of_week'], []).append(
+                (to_minutes(row['start_time']), to_minutes(row['end_time']))
+            )
+
+        cursor.execute("""
+            SELECT override_date, start_time, end_time, is_unavailable
+            FROM doctor_availability_overrides
+            WHERE doctor_id = %s AND override_date BETWEEN %s AND %s
+            AND (doctor_location_id = %s OR doctor_location_id IS NULL)
+        """, (doctor_id, start_date, end_date, location_id))
+        overrides_by_date = {}
+        for row in cursor.fetchall():
+            overrides_by_date.setdefault(row['override_date'], []).append(
+                (to_minutes(row['start_time']), to_minutes(row['end_time']), bool(row['is_unavailable']))
+            )
+
+        cursor.execute("""
+            SELECT appointment_date, start_time, end_time
+            FROM appointments
+            WHERE doctor_id = %s AND doctor_location_id = %s
+            AND appointment_date BETWEEN %s AND %s
+            AND status NOT IN ('canceled', 'rescheduled', 'no-show')
+        """, (doctor_id, location_id, start_date, end_date))
+        bookings_by_date = {}
+        for row in cursor.fetchall():
+            bookings_by_date.setdefault(row['appointment_date'], []).append(
+                (to_minutes(row['start_time']), to_minutes(row['end_time']))
+            )
+
+        cursor.execute("""
+            SELECT day_of_week, max_appointments
+            FROM doctor_location_daily_caps
+            WHERE doctor_id = %s AND doctor_location_id = %s
+        """, (doctor_id, location_id))
+        caps_by_dow = {row['day_of_week']: row['max_appointments'] for row in cursor.fetchall()}
+    finally:
+        if own_cursor:
+            cursor.close()
+            if conn and conn.is_connected(): conn.close()
+
+    return {
+        'periods_by_dow': periods_by_dow,
+        'overrides_by_date': overrides_by_date,
+        'bookings_by_date': bookings_by_date,
+        'caps_by_dow': caps_by_dow,
+    }
+
+
+# --- Computation ---
+def compute_day_slots(day, inputs, slot_interval):
+    """Free slot start minutes for one date, given inputs from load_availability_inputs()."""
+    db_dow = python_dow_to_db_dow(day.weekday())
+
+    offered = set()
+    for start_min, end_min in inputs['periods_by_dow'].get(db_dow, []):
+        offered.update(slot_starts(start_min, end_min, slot_interval))
+    if not offered:
+        return []
+
+    overrides = inputs['overrides_by_date'].get(day, [])
+    blocked = []
+    extra = []
+    for o_start, o_end, is_unavailable in overrides:
+        if is_unavailable:
+            if o_start is None and o_end is None:
+                return []
+            if o_start is not None and o_end is not None:
+                blocked.append((o_start, o_end))
+        elif o_start is not None and o_end is not None:
+            extra.append((o_start, o_end))
+
+    if blocked:
+        blocked = IntervalSet(blocked)
+        offered = {s for s in offered if not blocked.contains(s, s + slot_interval)}
+        if not offered:
+            return []
+
+    for o_start, o_end in extra:
+        offered.update(slot_starts(o_start, o_end, slot_interval))
+
+    bookings = inputs['bookings_by_date'].get(day, [])
+    cap = inputs['caps_by_dow'].get(db_dow)
+    if cap is not None and len(bookings) >= cap:
+        return []
+
+    if bookings:
+        booked = IntervalSet(bookings)
+        offered = [s for s in offered if not booked.overlaps(s, s + slot_interval)]
+    return sorted(offered)
+
+
+@contextmanager
+def _fresh_snapshot_connection():
+    """
+    A read connection whose next query starts a new REPEATABLE READ snapshot,
+    i.e. one taken after the caller read the cache generation. Slots loaded
+    from an older snapshot could miss a booking committed (and invalidated)
+    in between, and would be cached as free.
+
+    The request connection qualifies when no transaction is open on it. A
+    replica connection's read transaction is simply ended. A primary
+    connection with a transaction open may carry this request's uncommitted
+    writes, so the load runs on a dedicated primary connection instead.
+    """
+    conn = db.get_db_connection(read_only=True)
+    if not conn:
+        raise ConnectionError("DB connection failed")
+    try:
+        if conn.in_transaction and not getattr(conn, 'read_only', False):
+            with db.connection(dedicated=True) as dedicated:
+                yield dedicated
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        yield conn
+    finally:
+        if conn.is_connected(): conn.close()
+
+
+def get_availability_for_dates(doctor_id, location_id, dates, slot_interval=None):
+    """
+    Free slots for every date in `dates` at one location. Dates already in the
+    availability cache are served from it; the rest come from the
+    materialized projection when AVAILABILITY_READ_PROJECTION is on, and
+    otherwise from a single batch load. Results are cached. Past dates map to
+    an empty list.
+    Returns {date: ['HH:MM', ...]}.
+    """
+    if slot_interval is None:
+        slot_interval = current_app.config.get('APPOINTMENT_SLOT_INTERVAL_MINUTES', 30)
+    today = date.today()
+    wanted = sorted({d for d in dates if d >= today})
+    result = {d: [] for d in dates}
+    if not wanted or not location_id:
+        return result
+
+    doctor_id, location_id = int(doctor_id), int(location_id)
+    cached = availability_cache.get_many(doctor_id, location_id, wanted)
+    result.update(cached)
+    missing = [d for d in wanted if d not in cached]
+    if not missing:
+        return result
+
+    generation = availability_cache.generation(doctor_id)
+    with _fresh_snapshot_connection() as conn:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        try:
+            projected = {}
+            if availability_projection.READ_PROJECTION:
+                projected = availability_projection.read_projected_slots(
+                    cursor, doctor_id, location_id, missing, slot_interval)
+            computed = {day: [minutes_to_str(m) for m in minutes] for day, minutes in projected.items()}
+            live = [d for d in missing if d not in projected]
+            if live:
+                inputs = load_availability_inputs(doctor_id, location_id, live[0], live[-1], cursor=cursor)
+                for day in live:
+                    computed[day] = [minutes_to_str(m) for m in compute_day_slots(day, inputs, slot_interval)]
+        finally:
+            cursor.close()
+    availability_cache.set_many(doctor_id, location_id, computed, generation)
+    result.update(computed)
+    return result
+
+
+# --- Earliest-slot Search ---
+def iter_location_slots(doctor_id, location_id, start_date, end_date, slot_interval=None, first_chunk_days=3):
+    """
+    Lazily yields (slot_datetime, doctor_id, location_id) in time order for one
+    doctor location. Days are loaded in chunks that double in size, so a
+    consumer that stops after the first few slots only pays for a few days.
+    Slots earlier than now are skipped.
+    """
+    if slot_interval is None:
+        slot_interval = current_app.config.get('APPOINTMENT_SLOT_INTERVAL_MINUTES', 30)
+    now = datetime.now()
+    chunk_start = max(start_date, now.date())
+    chunk_days = max(first_chunk_days, 1)
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end_date)
+        days = [chunk_start + timedelta(days=i) for i in range((chunk_end - chunk_start).days + 1)]
+        slots_by_date = get_availability_for_dates(doctor_id, location_id, days, slot_interval)
+        for day in days:
+            for slot in slots_by_date.get(day, []):
+                slot_dt = datetime.combine(day, datetime.strptime(slot, '%H:%M').time())
+                if slot_dt >= now:
+                    yield slot_dt, doctor_id, location_id
+        chunk_start = chunk_end + timedelta(days=1)
+        chunk_days *= 2
+
+
+def earliest_slots(streams, limit):
+    """
+    The `limit` earliest items across already-sorted slot streams. heapq.merge
+    only advances the stream that produced the current minimum, so streams
+    that never reach the front are never read past their first chunk.
+    """
+    return list(islice(heapq.merge(*streams), limit))
@@ -0,0 +1,338 @@
+# routes/availability_materializer.py
+"""
+Background materializer for the doctor_daily_availability projection.
+
+Triggers from migrations/002_doctor_daily_availability.sql append a row to
+availability_refresh_queue whenever an appointment, weekly slot, override or
+daily cap changes. process_queue() drains that queue and recomputes only the
+affected (doctor, location, date) rows with the batch availability engine.
+extend_horizon() keeps the projection covering today .. today +
+AVAILABILITY_PROJECTION_WEEKS and drops past dates. The same daily step
+purges expired booking idempotency keys (routes/booking.py).
+
+Only one process materializes at a time (MySQL GET_LOCK), so the background
+thread can run in every worker. Queue rows are deleted by id once processed,
+so changes queued while a refresh is running are picked up by the next pass.
+
+CLI (registered on the app):
+    flask --app app availability-projection rebuild
+    flask --app app availability-projection verify
+    flask --app app availability-projection refresh
+"""
+import logging
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+import click
+from flask import current_app
+
+import db
+from routes import availability_projection
+from routes.booking import purge_booking_requests
+from routes.availability_engine import compute_day_slots, load_availability_inputs
+
+logger = logging.getLogger(__name__)
+
+MATERIALIZER_ENABLED = os.environ.get('AVAILABILITY_MATERIALIZER', 'False').lower() in ['true', '1', 't']
+MATERIALIZER_INTERVAL_SECONDS = float(os.environ.get('AVAILABILITY_MATERIALIZER_INTERVAL', 5))
+QUEUE_BATCH_SIZE = 500
+_LOCK_NAME = 'availability_materializer'
+
+
+# --- Helpers ---
+def _slot_interval():
+    return current_app.config.get('APPOINTMENT_SLOT_INTERVAL_MINUTES', 30)
+
+
+def projection_window(today=None):
+    today = today or date.today()
+    return today, today + timedelta(weeks=availability_projection.PROJECTION_WEEKS) - timedelta(days=1)
+
+
+def _active_locations(cursor, doctor_ids=None):
+    """{doctor_id: [location_id, ...]} for active locations, optionally limited to some doctors."""
+    query = "SELECT doctor_id, doctor_location_id FROM doctor_locations WHERE is_active = TRUE"
+    params = ()
+    if doctor_ids:
+        query += f" AND doctor_id IN ({', '.join(['%s'] * len(doctor_ids))})"
+        params = tuple(doctor_ids)
+    cursor.execute(query, params)
+    locations = {}
+    for row in cursor.fetchall():
+        locations.setdefault(row['doctor_id'], []).append(row['doctor_location_id'])
+    return locations
+
+
+def refresh_location(cursor, doctor_id, location_id, dates, slot_interval):
+    """Recomputes and upserts projection rows for one doctor location."""
+    if not dates:
+        return 0
+    dates = sorted(dates)
+    inputs = load_availability_inputs(doctor_id, location_id, dates[0], dates[-1], cursor=cursor)
+    rows = [
+        (doctor_id, location_id, day, compute_day_slots(day, inputs, slot_interval),
+         len(inputs['bookings_by_date'].get(day, [])), slot_interval)
+        for day in dates
+    ]
+    availability_projection.upsert_rows(cursor, rows)
+    return len(rows)
+
+
+def _all_dates(start, end):
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+class _MaterializerLock:
+    """Holds the MySQL named lock for the duration of a with-block; .acquired tells whether we got it."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.acquired = False
+
+    def __enter__(self):
+        self.cursor.execute("SELECT GET_LOCK(%s, 0) AS got", (_LOCK_NAME,))
+        row = self.cursor.fetchone()
+        self.acquired = bool(row and row['got'])
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.acquired:
+            self.cursor.execute("SELECT RELEASE_LOCK(%s) AS released", (_LOCK_NAME,))
+            self.cursor.fetchone()
+        return False
+
+
+# --- Incremental Refresh ---
+def process_queue(batch_size=QUEUE_BATCH_SIZE):
+    """
+    Drains up to batch_size queue rows. Returns how many queue rows were
+    consumed, or None if another process holds the materializer lock.
+    """
+    slot_interval = _slot_interval()
+    window_start, window_end = projection_window()
+    with db.connection(dedicated=True) as conn:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        try:
+            with _MaterializerLock(cursor) as lock:
+                if not lock.acquired:
+                    return None
+                cursor.execute("""
+                    SELECT queue_id, doctor_id, doctor_location_id, dirty_date
+                    FROM availability_refresh_queue ORDER BY queue_id LIMIT %s
+                """, (batch_size,))
+                entries = cursor.fetchall()
+                conn.commit()
+                if not entries:
+                    return 0
+
+                # (doctor_id, location_id or None) -> set of dates, or None for the whole window
+                targets = {}
+                for entry in entries:
+                    key = (entry['doctor_id'], entry['doctor_location_id'])
+                    day = entry['dirty_date']
+                    if day is None:
+                        targets[key] = None
+                    elif window_start <= day <= window_end and targets.get(key, set()) is not None:
+                        targets.setdefault(key, set()).add(day)
+
+                locations = _active_locations(cursor, sorted({doctor_id for doctor_id, _ in targets}))
+                expanded = {}
+                for (doctor_id, location_id), days in targets.items():
+                    location_ids = locations.get(doctor_id, []) if location_id is None else [location_id]
+                    for loc_id in location_ids:
+                        current = expanded.get((doctor_id, loc_id), set())
+                        if current is None or days is None:
+                            expanded[(doctor_id, loc_id)] = None
+                        else:
+                            expanded[(doctor_id, loc_id)] = current | days
+
+                for (doctor_id, location_id), days in expanded.items():
+                    dates = _all_dates(window_start, window_end) if days is None else days
+                    refresh_location(cursor, doctor_id, location_id, dates, slot_interval)
+
+                queue_ids = [entry['queue_id'] for entry in entries]
+                cursor.execute(
+                    f"DELETE FROM availability_refresh_queue WHERE queue_id IN ({', '.join(['%s'] * len(queue_ids))})",
+                    tuple(queue_ids)
+                )
+                conn.commit()
+                return len(entries)
+        finally:
+            cursor.close()
+
+
+def extend_horizon(today=None):
+    """Adds rows for dates that entered the window and deletes rows for past dates."""
+    slot_interval = _slot_interval()
+    window_start, window_end = projection_window(today)
+    with db.connection(dedicated=True) as conn:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        try:
+            with _MaterializerLock(cursor) as lock:
+                if not lock.acquired:
+                    return None
+                cursor.execute("DELETE FROM doctor_daily_availability WHERE avail_date < %s", (window_start,))
+                cursor.execute("""
+                    SELECT doctor_id, doctor_location_id, MAX(avail_date) AS last_date
+                    FROM doctor_daily_availability GROUP BY doctor_id, doctor_location_id
+                """)
+                last_dates = {(r['doctor_id'], r['doctor_location_id']): r['last_date'] for r in cursor.fetchall()}
+                written = 0
+                for doctor_id, location_ids in _active_locations(cursor).items():
+                    for location_id in location_ids:
+                        last = last_dates.get((doctor_id, location_id))
+                        first_missing = max(window_start, last + timedelta(days=1)) if last else window_start
+                        if first_missing <= window_end:
+                            written += refresh_location(cursor, doctor_id, location_id,
+                                                        _all_dates(first_missing, window_end), slot_interval)
+                conn.commit()
+                return written
+        finally:
+            cursor.close()
+
+
+# --- Full Rebuild / Verification ---
+def rebuild_projection():
+    """Recomputes every active location over the whole window. Returns rows written."""
+    slot_interval = _slot_interval()
+    window_start, window_end = projection_window()
+    dates = _all_dates(window_start, window_end)
+    with db.connection(dedicated=True) as conn:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        try:
+            with _MaterializerLock(cursor) as lock:
+                if not lock.acquired:
+                    raise RuntimeError("Another process is materializing availability; try again shortly.")
+                # Only the queue rows visible now are covered by this rebuild; later ones stay for process_queue().
+                cursor.execute("SELECT queue_id FROM availability_refresh_queue")
+                queue_ids = [row['queue_id'] for row in cursor.fetchall()]
+                cursor.execute("DELETE FROM doctor_daily_availability")
+                written = 0
+                for doctor_id, location_ids in _active_locations(cursor).items():
+                    for location_id in location_ids:
+                        written += refresh_location(cursor, doctor_id, location_id, dates, slot_interval)
+                for i in range(0, len(queue_ids), QUEUE_BATCH_SIZE):
+                    chunk = queue_ids[i:i + QUEUE_BATCH_SIZE]
+                    cursor.execute(
+                        f"DELETE FROM availability_refresh_queue WHERE queue_id IN ({', '.join(['%s'] * len(chunk))})",
+                        tuple(chunk)
+                    )
+                conn.commit()
+                return written
+        finally:
+            cursor.close()
+
+
+def verify_projection():
+    """Compares every projected row with a live computation. Returns a list of mismatch descriptions."""
+    slot_interval = _slot_interval()
+    window_start, window_end = projection_window()
+    dates = _all_dates(window_start, window_end)
+    problems = []
+    with db.connection(dedicated=True) as conn:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        try:
+            cursor.execute("SELECT COUNT(*) AS pending FROM availability_refresh_queue")
+            pending = cursor.fetchone()['pending']
+            if pending:
+                problems.append(f"{pending} change(s) still queued; rows for those doctors may be legitimately stale")
+            for doctor_id, location_ids in _active_locations(cursor).items():
+                for location_id in location_ids:
+                    cursor.execute("""
+                        SELECT avail_date, free_slot_bitmap, booked_count, slot_interval
+                        FROM doctor_daily_availability
+                        WHERE doctor_id = %s AND doctor_location_id = %s AND avail_date BETWEEN %s AND %s
+                    """, (doctor_id, location_id, window_start, window_end))
+                    stored = {row['avail_date']: row for row in cursor.fetchall()}
+                    inputs = load_availability_inputs(doctor_id, location_id, window_start, window_end, cursor=cursor)
+                    for day in dates:
+                        row = stored.get(day)
+                        label = f"doctor {doctor_id} location {location_id} {day}"
+                        if row is None:
+                            problems.append(f"{label}: missing row")
+                            continue
+                        if row['slot_interval'] != slot_interval:
+                            problems.append(f"{label}: built with {row['slot_interval']}-minute slots")
+                            continue
+                        live = compute_day_slots(day, inputs, slot_interval)
+                        projected = availability_projection.decode_slots(row['free_slot_bitmap'])
+                        if projected != live:
+                            problems.append(f"{label}: projected {len(projected)} free slots, live {len(live)}")
+                        booked = len(inputs['bookings_by_date'].get(day, []))
+                        if row['booked_count'] != booked:
+                            problems.append(f"{label}: booked_count {row['booked_count']}, live {booked}")
+            conn.commit()
+        finally:
+            cursor.close()
+    return problems
+
+
+# --- Background Thread ---
+def _materializer_loop(app):
+    last_horizon_day = None
+    while True:
+        with app.app_context():
+            try:
+                today = date.today()
+                if today != last_horizon_day:
+                    if extend_horizon(today) is not None:
+                        last_horizon_day = today
+                        purge_booking_requests()
+                process_queue()
+            except Exception as e:
+                logger.error(f"Availability materializer pass failed: {e}", exc_info=True)
+        time.sleep(MATERIALIZER_INTERVAL_SECONDS)
+
+
+def start_materializer(app):
+    thread = threading.Thread(target=_materializer_loop, args=(app,), name='availability-materializer', daemon=True)
+    thread.start()
+    return thread
+
+
+# --- CLI ---
+@click.group('availability-projection')
+def availability_projection_cli():
+    """Maintain the doctor_daily_availability projection."""
+
+
+@availability_projection_cli.command('rebuild')
+def rebuild_command():
+    """Recompute the whole projection from scratch."""
+    started = time.perf_counter()
+    written = rebuild_projection()
+    click.echo(f"Rebuilt {written} rows in {time.perf_counter() - started:.1f}s.")
+
+
+@availability_projection_cli.command('verify')
+def verify_command():
+    """Compare projected rows against the live computation."""
+    problems = verify_projection()
+    for problem in problems[:200]:
+        click.echo(problem)
+    if len(problems) > 200:
+        click.echo(f"... and {len(problems) - 200} more")
+    if problems:
+        raise SystemExit(1)
+    click.echo("Projection matches the live computation.")
+
+
+@availability_projection_cli.command('refresh')
+def refresh_command():
+    """Drain the change queue once and extend the window."""
+    extended = extend_horizon()
+    total = 0
+    while True:
+        consumed = process_queue()
+        if not consumed:
+            break
+        total += consumed
+    click.echo(f"Extended window by {extended or 0} rows; applied {total} queued changes.")
+
+
+def init_availability_materializer(app):
+    app.cli.add_command(availability_projection_cli)
+    if MATERIALIZER_ENABLED and app.config.get('BACKGROUND_TASKS', True):
+        start_materializer(app)
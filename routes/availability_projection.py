@@ -0,0 +1,87 @@
+# routes/availability_projection.py
+"""
+Read/write access to the doctor_daily_availability projection.
+
+Each row stores one day's free slot starts as a minute bitmap (bit N = a slot
+starting N minutes after midnight) packed into 180 little-endian bytes. The
+rows are written by routes/availability_materializer.py; readers only trust a
+row when it was built with the current slot interval and the doctor has no
+pending entries in availability_refresh_queue.
+"""
+import os
+
+BITMAP_BYTES = 24 * 60 // 8
+PROJECTION_WEEKS = int(os.environ.get('AVAILABILITY_PROJECTION_WEEKS', 8))
+READ_PROJECTION = os.environ.get('AVAILABILITY_READ_PROJECTION', 'False').lower() in ['true', '1', 't']
+
+
+# --- Bitmap Encoding ---
+def encode_slots(minutes):
+    bitmap = 0
+    for minute in minutes:
+        bitmap |= 1 << minute
+    return bitmap.to_bytes(BITMAP_BYTES, 'little')
+
+
+def decode_slots(blob):
+    bitmap = int.from_bytes(bytes(blob), 'little')
+    minutes = []
+    while bitmap:
+        low_bit = bitmap & -bitmap
+        minutes.append(low_bit.bit_length() - 1)
+        bitmap ^= low_bit
+    return minutes
+
+
+# --- Reads ---
+def read_projected_slots(cursor, doctor_id, location_id, dates, slot_interval):
+    """
+    {date: [slot start minutes]} for the dates that have a trustworthy
+    projection row. Dates missing from the result must be computed live.
+    """
+    if not dates:
+        return {}
+    placeholders = ', '.join(['%s'] * len(dates))
+    cursor.execute(f"""
+        SELECT dda.avail_date, dda.free_slot_bitmap
+        FROM doctor_daily_availability dda
+        WHERE dda.doctor_id = %s AND dda.doctor_location_id = %s
+          AND dda.avail_date IN ({placeholders}) AND dda.slot_interval = %s
+          AND NOT EXISTS (SELECT 1 FROM availability_refresh_queue q WHERE q.doctor_id = %s)
+    """, (doctor_id, location_id, *dates, slot_interval, doctor_id))
+    return {
+        row['avail_date']: decode_slots(row['free_slot_bitmap'])
+        for row in cursor.fetchall()
+    }
+
+
+def get_open_slot_summary(cursor, doctor_id, start_date, end_date):
+    """Free slot and booking totals for a doctor over a date range, or None if nothing is projected."""
+    cursor.execute("""
+        SELECT COUNT(*) AS days, COALESCE(SUM(free_slot_count), 0) AS free_slots,
+               COALESCE(SUM(booked_count), 0) AS booked
+        FROM doctor_daily_availability
+        WHERE doctor_id = %s AND avail_date BETWEEN %s AND %s
+    """, (doctor_id, start_date, end_date))
+    row = cursor.fetchone()
+    if not row or not row['days']:
+        return None
+    return {'free_slots': int(row['free_slots']), 'booked': int(row['booked'])}
+
+
+# --- Writes ---
+def upsert_rows(cursor, rows):
+    """rows: (doctor_id, location_id, date, slot_minutes, booked_count, slot_interval) tuples."""
+    if not rows:
+        return
+    cursor.executemany("""
+        INSERT INTO doctor_daily_availability
+            (doctor_id, doctor_location_id, avail_date, free_slot_bitmap, free_slot_count, booked_count, slot_interval)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE free_slot_bitmap = VALUES(free_slot_bitmap), free_slot_count = VALUES(free_slot_count),
+                                booked_count = VALUES(booked_count), slot_interval = VALUES(slot_interval),
+                                computed_at = CURRENT_TIMESTAMP
+    """, [
+        (doctor_id, location_id, day, encode_slots(minutes), len(minutes), booked, interval)
+        for doctor_id, location_id, day, minutes, booked, interval in rows
+    ])
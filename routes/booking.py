@@ -0,0 +1,247 @@
+# routes/booking.py
+"""
+Atomic appointment booking.
+
+book_appointment() runs the whole booking as one transaction:
+
+  1. Record the idempotency key (patient_id, key). A duplicate means this
+     submission already succeeded, so the existing appointment is returned.
+  2. Take an exclusive lock on the (doctor, location, date) row in
+     appointment_day_locks. Every booking for that day queues here, so the
+     checks below can't race with another booking.
+  3. Check for a clashing appointment and for the daily cap.
+  4. Insert the appointment and attach it to the idempotency key.
+
+The lock statement runs before any plain SELECT in the transaction. Under
+REPEATABLE READ the snapshot is taken at the first consistent read, so the
+clash and cap checks see every booking committed before the lock was granted.
+
+Deadlocks and lock wait timeouts are retried a few times before giving up.
+Tables are created by migrations/001_booking_locks.sql.
+
+An idempotency key only matters while the form that carries it can still be
+resubmitted. purge_booking_requests() deletes keys older than
+BOOKING_REQUEST_RETENTION_HOURS, in small batches along the created_at index.
+The availability materializer runs it once a day. Without the materializer,
+run it from cron once a day:
+
+    flask --app app booking purge-requests
+"""
+import logging
+import os
+import time as time_module
+from datetime import date, datetime, timedelta
+
+import click
+import mysql.connector
+from mysql.connector import errorcode
+
+import db
+from routes.availability_cache import invalidate_availability
+from routes.principal_cache import invalidate_principal
+
+logger = logging.getLogger(__name__)
+
+MAX_LOCK_RETRIES = 3
+BOOKING_REQUEST_RETENTION_HOURS = int(os.environ.get('BOOKING_REQUEST_RETENTION_HOURS', 72))
+PURGE_BATCH_SIZE = 1000
+_RETRYABLE_ERRNOS = (errorcode.ER_LOCK_DEADLOCK, errorcode.ER_LOCK_WAIT_TIMEOUT)
+
+
+class BookingError(Exception):
+    """A booking that was rejected. `reason` is one of the REASON_* constants."""
+    REASON_INVALID_TYPE = 'invalid_type'
+    REASON_SLOT_TAKEN = 'slot_taken'
+    REASON_CAP_REACHED = 'cap_reached'
+    REASON_IN_PROGRESS = 'in_progress'
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+
+
+def _python_dow_to_db_dow(py_dow):
+    return (py_dow + 1) % 7
+
+
+def _claim_idempotency_key(cursor, patient_id, idempotency_key):
+    """Returns the appointment_id of an earlier successful submission, or None after claiming the key."""
+    try:
+        cursor.execute(
+            "INSERT INTO appointment_booking_requests (patient_id, idempotency_key) VALUES (%s, %s)",
+            (patient_id, idempotency_key)
+        )
+        return None
+    except mysql.connector.IntegrityError as err:
+        if err.errno != errorcode.ER_DUP_ENTRY:
+            raise
+    cursor.execute(
+        "SELECT appointment_id FROM appointment_booking_requests WHERE patient_id = %s AND idempotency_key = %s",
+        (patient_id, idempotency_key)
+    )
+    row = cursor.fetchone()
+    if not row or not row['appointment_id']:
+        raise BookingError(BookingError.REASON_IN_PROGRESS, "This booking is already being processed.")
+    return row['appointment_id']
+
+
+def lock_booking_day(cursor, doctor_id, location_id, appointment_date):
+    """Exclusively locks the per-day row; held until the transaction ends."""
+    cursor.execute("""
+        INSERT INTO appointment_day_locks (doctor_id, doctor_location_id, lock_date)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE last_locked_at = CURRENT_TIMESTAMP
+    """, (doctor_id, location_id, appointment_date))
+
+
+def _book_once(conn, patient_id, doctor_id, location_id, appointment_date, start_time,
+               appointment_type_id, reason, created_by, idempotency_key, patient_phone, reschedule_count):
+    conn.start_transaction()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        if idempotency_key:
+            existing_id = _claim_idempotency_key(cursor, patient_id, idempotency_key)
+            if existing_id:
+                conn.rollback()
+                return existing_id, True
+
+        lock_booking_day(cursor, doctor_id, location_id, appointment_date)
+
+        cursor.execute(
+            "SELECT default_duration_minutes FROM appointment_types WHERE type_id = %s AND is_active = TRUE",
+            (appointment_type_id,)
+        )
+        type_details = cursor.fetchone()
+        if not type_details:
+            raise BookingError(BookingError.REASON_INVALID_TYPE, "Selected appointment type is invalid or inactive.")
+        end_time = (datetime.combine(date.min, start_time)
+                    + timedelta(minutes=type_details['default_duration_minutes'])).time()
+
+        cursor.execute("""
+            SELECT appointment_id FROM appointments
+            WHERE doctor_id = %s AND doctor_location_id = %s AND appointment_date = %s
+            AND status NOT IN ('canceled', 'rescheduled', 'no-show')
+            AND (start_time < %s AND end_time > %s)
+            LIMIT 1
+        """, (doctor_id, location_id, appointment_date, end_time, start_time))
+        if cursor.fetchone():
+            raise BookingError(BookingError.REASON_SLOT_TAKEN,
+                               "The selected time slot is no longer available. Please choose a different time.")
+
+        cursor.execute("""
+            SELECT max_appointments FROM doctor_location_daily_caps
+            WHERE doctor_id = %s AND doctor_location_id = %s AND day_of_week = %s
+        """, (doctor_id, location_id, _python_dow_to_db_dow(appointment_date.weekday())))
+        cap_row = cursor.fetchone()
+        if cap_row:
+            cursor.execute("""
+                SELECT COUNT(*) as count FROM appointments
+                WHERE doctor_id = %s AND doctor_location_id = %s AND appointment_date = %s
+                AND status NOT IN ('canceled', 'rescheduled', 'no-show')
+            """, (doctor_id, location_id, appointment_date))
+            if cursor.fetchone()['count'] >= cap_row['max_appointments']:
+                raise BookingError(BookingError.REASON_CAP_REACHED,
+                                   "The doctor's daily appointment cap for this location/day has been reached.")
+
+        cursor.execute("""
+            INSERT INTO appointments (patient_id, doctor_id, appointment_date, start_time, end_time,
+                                      appointment_type_id, status, reason, doctor_location_id, created_by, updated_by, reschedule_count)
+            VALUES (%s, %s, %s, %s, %s, %s, 'scheduled', %s, %s, %s, %s, %s)
+        """, (patient_id, doctor_id, appointment_date, start_time, end_time, appointment_type_id,
+              reason, location_id, created_by, created_by, reschedule_count))
+        appointment_id = cursor.lastrowid
+
+        if idempotency_key:
+            cursor.execute(
+                "UPDATE appointment_booking_requests SET appointment_id = %s WHERE patient_id = %s AND idempotency_key = %s",
+                (appointment_id, patient_id, idempotency_key)
+            )
+        if patient_phone is not None:
+            cursor.execute("UPDATE users SET phone = %s WHERE user_id = %s", (patient_phone, patient_id))
+
+        conn.commit()
+        return appointment_id, False
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def book_appointment(patient_id, doctor_id, location_id, appointment_date, start_time, appointment_type_id,
+                     reason=None, created_by=None, idempotency_key=None, patient_phone=None, reschedule_count=0):
+    """
+    Books one appointment atomically. Returns (appointment_id, replayed), where
+    replayed is True when `idempotency_key` matched an earlier successful
+    submission and nothing new was inserted. Raises BookingError when the
+    booking is rejected and mysql.connector.Error on database failure.
+    patient_phone, when given, is saved on the patient's user row in the same
+    transaction.
+    """
+    created_by = created_by if created_by is not None else patient_id
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            with db.connection() as conn:
+                appointment_id, replayed = _book_once(
+                    conn, patient_id, doctor_id, location_id, appointment_date, start_time,
+                    appointment_type_id, reason, created_by, idempotency_key, patient_phone, reschedule_count
+                )
+            break
+        except mysql.connector.Error as err:
+            if err.errno not in _RETRYABLE_ERRNOS or attempt >= MAX_LOCK_RETRIES:
+                raise
+            logger.warning(f"Booking lock conflict for Dr {doctor_id} L:{location_id} {appointment_date} "
+                           f"(attempt {attempt}/{MAX_LOCK_RETRIES}): {err}")
+            time_module.sleep(0.05 * attempt)
+
+    if not replayed:
+        invalidate_availability(doctor_id, location_id, [appointment_date])
+        if patient_phone is not None:
+            invalidate_principal(patient_id)
+    return appointment_id, replayed
+
+
+# --- Idempotency Key Purge ---
+def purge_booking_requests(retention_hours=BOOKING_REQUEST_RETENTION_HOURS, batch_size=PURGE_BATCH_SIZE):
+    """Deletes idempotency keys older than retention_hours, one short transaction per batch. Returns rows deleted."""
+    deleted = 0
+    with db.connection(dedicated=True) as conn:
+        cursor = conn.cursor()
+        try:
+            while True:
+                cursor.execute(
+                    "DELETE FROM appointment_booking_requests WHERE created_at < NOW() - INTERVAL %s HOUR LIMIT %s",
+                    (retention_hours, batch_size)
+                )
+                conn.commit()
+                deleted += cursor.rowcount
+                if cursor.rowcount < batch_size:
+                    break
+        finally:
+            cursor.close()
+    if deleted:
+        logger.info(f"Purged {deleted} booking idempotency keys older than {retention_hours}h.")
+    return deleted
+
+
+# --- CLI ---
+@click.group('booking')
+def booking_cli():
+    """Maintain the booking tables."""
+
+
+@booking_cli.command('purge-requests')
+@click.option('--retention-hours', default=BOOKING_REQUEST_RETENTION_HOURS, show_default=True,
+              help='Keep idempotency keys created within this many hours.')
+def purge_requests_command(retention_hours):
+    """Delete booking idempotency keys that are past the resubmission window."""
+    deleted = purge_booking_requests(retention_hours)
+    click.echo(f"Deleted {deleted} idempotency keys older than {retention_hours}h.")
+
+
+def init_booking(app):
+    app.cli.add_command(booking_cli)
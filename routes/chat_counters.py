@@ -0,0 +1,129 @@
+# routes/chat_counters.py
+"""
+Denormalized per-chat counters for the chat inboxes.
+
+Columns on `chats` (migrations/003_chat_counters.sql):
+
+  doctor_unread_count   unread messages not sent by the doctor
+  patient_unread_count  unread messages sent by the doctor
+  last_message_id / last_message_snippet / last_message_at
+                        snapshot of the newest message
+
+They are written in the same transaction as the change they describe:
+add_message() / add_message_from_patient() call record_new_message(), and
+the mark-as-read helpers call record_messages_read() with the number of rows
+they marked. Reads decrement rather than reset, so a message committed while
+the reader's UPDATE ran is not lost from the count. Marking read leaves
+updated_at alone so opening a chat does not move it in the inbox.
+
+The inboxes then read everything from `chats` with an (owner, updated_at)
+range scan. If the counters ever drift (messages edited by hand, a failed
+deploy), rebuild them from chat_messages with:
+
+    flask --app app chat-counters repair
+"""
+import logging
+import time
+
+import click
+
+import db
+
+logger = logging.getLogger(__name__)
+
+SNIPPET_LENGTH = 255
+REPAIR_BATCH_SIZE = 500
+
+UNREAD_COLUMNS = {'doctor': 'doctor_unread_count', 'patient': 'patient_unread_count'}
+
+
+# --- Write Path ---
+def unread_sender_condition(reader_type):
+    """SQL condition on chat_messages.sender_type for the messages counted as unread for reader_type."""
+    return "sender_type = 'doctor'" if reader_type == 'patient' else "sender_type != 'doctor'"
+
+
+def record_new_message(cursor, chat_id, message_id, sender_type, message_text):
+    """Call inside the transaction that inserted the message; also bumps chats.updated_at."""
+    is_doctor = sender_type == 'doctor'
+    cursor.execute("""
+        UPDATE chats
+        SET updated_at = NOW(),
+            last_message_id = %s, last_message_snippet = %s, last_message_at = NOW(),
+            doctor_unread_count = doctor_unread_count + %s,
+            patient_unread_count = patient_unread_count + %s
+        WHERE chat_id = %s
+    """, (message_id, (message_text or '')[:SNIPPET_LENGTH], 0 if is_doctor else 1, 1 if is_doctor else 0, chat_id))
+
+
+def record_messages_read(cursor, chat_id, reader_type, marked_count):
+    """Call inside the transaction that set read_at on `marked_count` messages for reader_type."""
+    column = UNREAD_COLUMNS.get(reader_type)
+    if column is None or marked_count <= 0:
+        return
+    cursor.execute(f"""
+        UPDATE chats SET {column} = GREATEST({column} - %s, 0), updated_at = updated_at
+        WHERE chat_id = %s
+    """, (marked_count, chat_id))
+
+
+# --- Repair ---
+_REPAIR_QUERY = """
+    UPDATE chats c
+    LEFT JOIN (
+        SELECT chat_id,
+               SUM(read_at IS NULL AND sender_type != 'doctor') AS doctor_unread,
+               SUM(read_at IS NULL AND sender_type = 'doctor') AS patient_unread,
+               MAX(message_id) AS last_id
+        FROM chat_messages WHERE chat_id BETWEEN %s AND %s GROUP BY chat_id
+    ) agg ON agg.chat_id = c.chat_id
+    LEFT JOIN chat_messages last_cm ON last_cm.message_id = agg.last_id
+    SET c.doctor_unread_count = COALESCE(agg.doctor_unread, 0),
+        c.patient_unread_count = COALESCE(agg.patient_unread, 0),
+        c.last_message_id = last_cm.message_id,
+        c.last_message_snippet = LEFT(last_cm.message_text, %s),
+        c.last_message_at = last_cm.sent_at,
+        c.updated_at = c.updated_at
+    WHERE c.chat_id BETWEEN %s AND %s
+"""
+
+
+def repair_chat_counters(batch_size=REPAIR_BATCH_SIZE):
+    """Recomputes every chat's counters from chat_messages, one chat_id range per transaction. Returns rows corrected."""
+    corrected = 0
+    with db.connection(dedicated=True) as conn:
+        cursor = conn.cursor(buffered=True)
+        try:
+            cursor.execute("SELECT MIN(chat_id), MAX(chat_id) FROM chats")
+            low, high = cursor.fetchone()
+            if low is None:
+                return 0
+            for start in range(low, high + 1, batch_size):
+                end = start + batch_size - 1
+                cursor.execute(_REPAIR_QUERY, (start, end, SNIPPET_LENGTH, start, end))
+                corrected += cursor.rowcount  # MySQL counts changed rows only
+                conn.commit()
+        finally:
+            cursor.close()
+    if corrected:
+        logger.warning(f"Chat counters: repaired {corrected} chats that had drifted from chat_messages.")
+    return corrected
+
+
+# --- CLI ---
+@click.group('chat-counters')
+def chat_counters_cli():
+    """Maintain the denormalized chat inbox counters."""
+
+
+@chat_counters_cli.command('repair')
+@click.option('--batch-size', default=REPAIR_BATCH_SIZE, show_default=True, help='Chats per transaction.')
+def repair_command(batch_size):
+    """Recompute unread counters and last-message snapshots from chat_messages."""
+    started = time.perf_counter()
+    corrected = repair_chat_counters(batch_size)
+    click.echo(f"Corrected {corrected} chats in {time.perf_counter() - started:.1f}s.")
+
+
+def init_chat_counters(app):
+    app.cli.add_command(chat_counters_cli)
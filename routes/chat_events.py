@@ -0,0 +1,351 @@
+# routes/chat_events.py
+"""
+Live delivery for doctor/patient chats.
+
+add_message() and add_message_from_patient() publish a 'message' event after
+committing, and the mark-as-read helpers publish a 'read' event. Both portals
+expose the same two endpoints per chat on top of this module:
+
+  .../chat/<chat_id>/stream            Server-Sent Events feed
+  .../chat/<chat_id>/messages?since=N  messages with message_id > N (JSON)
+
+The JSON endpoint returns CHAT_BACKLOG_LIMIT messages at most. When has_more
+is true, ask again from last_message_id.
+
+A stream subscribes first, then sends the backlog after `since` (or the
+Last-Event-ID header the browser sends on reconnect), then relays published
+events. Message events carry the message_id as the SSE id, so a reconnecting
+EventSource resumes where it left off. The backlog is read a page at a time
+on a connection of its own, so its snapshot starts after the subscription.
+If it is longer than CHAT_STREAM_BACKLOG_PAGES pages, or a slow client's
+queue overflows, the stream ends after what it has sent and the browser
+reconnects at once from the last id it got.
+
+Senders commit, and so publish, in any order: message 11 can arrive before
+message 10. A published message is therefore never compared with the last id
+sent. Each one triggers a short re-read of the chat from the lower of the two
+ids, and everything not sent yet goes out. An earlier id sent after a later
+one also moves the browser's Last-Event-ID back, so a reconnect replays the
+later message instead of skipping the earlier one; the pages drop duplicates
+by message_id. The stream holds a database connection only while reading. It
+does hold a server thread, so the number open per process is capped
+(utils/stream_slots.py).
+
+The broker is in-process by default, which is enough for one worker. For
+several workers, set CHAT_PUBSUB_REDIS_URL (needs the redis package): events
+are then published on Redis channels `chat:<chat_id>` and every worker relays
+them to its own subscribers.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import date, datetime
+
+import mysql.connector
+from flask import Response, request
+
+import db
+from utils.stream_slots import stream_slots
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+CHAT_PUBSUB_REDIS_URL = os.environ.get('CHAT_PUBSUB_REDIS_URL', '').strip()
+CHAT_BACKLOG_LIMIT = 100
+CHAT_STREAM_BACKLOG_PAGES = 10
+STREAM_HEARTBEAT_SECONDS = 15
+STREAM_MAX_SECONDS = 300  # EventSource reconnects with Last-Event-ID
+STREAM_BUSY_RETRY_SECONDS = 10
+STREAM_CATCH_UP_RETRY_MS = 250
+
+
+# --- Serialization ---
+def serialize_message(row):
+    """JSON-safe dict for a chat_messages row (optionally joined with message_attachments)."""
+    message = {}
+    for key in ('message_id', 'chat_id', 'sender_id', 'sender_type', 'message_text', 'has_attachment',
+                'sent_at', 'read_at', 'attachment_id', 'attachment_filename', 'attachment_filetype'):
+        value = row.get(key)
+        if isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        message[key] = value
+    message['has_attachment'] = bool(message['has_attachment'])
+    return message
+
+
+# --- Queries ---
+_MESSAGE_SELECT = """
+    SELECT cm.message_id, cm.chat_id, cm.sender_id, cm.sender_type, cm.message_text, cm.has_attachment,
+           cm.sent_at, cm.read_at,
+           att.attachment_id, att.file_name AS attachment_filename, att.file_type AS attachment_filetype
+    FROM chat_messages cm
+    LEFT JOIN message_attachments att ON cm.message_id = att.message_id AND cm.has_attachment = TRUE
+"""
+
+
+def get_chat_participants(cursor, chat_id):
+    cursor.execute("SELECT chat_id, doctor_id, patient_id, status FROM chats WHERE chat_id = %s", (chat_id,))
+    return cursor.fetchone()
+
+
+def fetch_messages_since(cursor, chat_id, since_id, limit=CHAT_BACKLOG_LIMIT):
+    """Serialized messages with message_id > since_id, oldest first (uses the primary key range)."""
+    cursor.execute(_MESSAGE_SELECT + """
+        WHERE cm.chat_id = %s AND cm.message_id > %s AND cm.is_deleted = FALSE
+        ORDER BY cm.message_id ASC LIMIT %s
+    """, (chat_id, since_id or 0, limit))
+    return [serialize_message(row) for row in cursor.fetchall()]
+
+
+def fetch_messages_page(cursor, chat_id, since_id, limit=CHAT_BACKLOG_LIMIT):
+    """(messages, has_more): up to `limit` messages after since_id, and whether more follow them."""
+    messages = fetch_messages_since(cursor, chat_id, since_id, limit + 1)
+    return messages[:limit], len(messages) > limit
+
+
+def fetch_backlog(cursor, chat_id, since_id, max_pages=CHAT_STREAM_BACKLOG_PAGES):
+    """(messages, caught_up): every message after since_id, read page by page, at most max_pages pages."""
+    backlog = []
+    for _ in range(max_pages):
+        page, has_more = fetch_messages_page(cursor, chat_id, backlog[-1]['message_id'] if backlog else since_id)
+        backlog.extend(page)
+        if not has_more:
+            return backlog, True
+    return backlog, False
+
+
+def fetch_message(cursor, message_id):
+    cursor.execute(_MESSAGE_SELECT + " WHERE cm.message_id = %s", (message_id,))
+    row = cursor.fetchone()
+    return serialize_message(row) if row else None
+
+
+# --- Brokers ---
+class ChatSubscriber(queue.Queue):
+    """A stream's event queue. overflowed is set once an event had to be dropped."""
+
+    def __init__(self, maxsize=200):
+        super().__init__(maxsize)
+        self.overflowed = False
+
+
+class LocalChatBroker:
+    """In-process pub/sub: chat_id -> set of subscriber queues."""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, chat_id):
+        subscriber = ChatSubscriber()
+        with self._lock:
+            self._subscribers.setdefault(chat_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, chat_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(chat_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[chat_id]
+
+    def publish(self, chat_id, event):
+        self.deliver(chat_id, event)
+
+    def deliver(self, chat_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(chat_id, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Stalled client: its stream ends and it catches up from Last-Event-ID after reconnecting.
+                subscriber.overflowed = True
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+
+class RedisChatBroker(LocalChatBroker):
+    """Publishes through Redis so subscribers in every worker see the event."""
+    CHANNEL_PREFIX = 'chat:'
+
+    def __init__(self, url):
+        super().__init__()
+        self._client = redis.Redis.from_url(url)
+        self._listener = None
+
+    def publish(self, chat_id, event):
+        try:
+            self._client.publish(f"{self.CHANNEL_PREFIX}{chat_id}", json.dumps(event))
+        except redis.RedisError as err:
+            logger.warning(f"Chat pub/sub: Redis publish failed for chat {chat_id}, delivering locally only: {err}")
+            self.deliver(chat_id, event)
+
+    def subscribe(self, chat_id):
+        self._ensure_listener()
+        return super().subscribe(chat_id)
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, name='chat-pubsub', daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f"{self.CHANNEL_PREFIX}*")
+                for item in pubsub.listen():
+                    channel = item['channel']
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    chat_id = int(channel[len(self.CHANNEL_PREFIX):])
+                    self.deliver(chat_id, json.loads(item['data']))
+            except Exception as e:
+                logger.error(f"Chat pub/sub listener failed, reconnecting: {e}")
+                time.sleep(1)
+
+
+def _build_broker():
+    if CHAT_PUBSUB_REDIS_URL:
+        if redis is not None:
+            return RedisChatBroker(CHAT_PUBSUB_REDIS_URL)
+        logger.warning("CHAT_PUBSUB_REDIS_URL is set but the redis package is not installed; "
+                       "chat events are delivered within this worker only.")
+    return LocalChatBroker()
+
+
+chat_broker = _build_broker()
+
+
+def publish_message(chat_id, message):
+    chat_broker.publish(chat_id, {'type': 'message', 'message': message})
+
+
+def publish_read(chat_id, reader_id):
+    chat_broker.publish(chat_id, {'type': 'read', 'reader_id': reader_id, 'read_at': datetime.now().isoformat()})
+
+
+# --- SSE ---
+def requested_since_id():
+    """
+    The later of the `since` query argument and the Last-Event-ID header a
+    reconnecting EventSource sends (it re-requests the original URL).
+    """
+    since_id = request.args.get('since', 0, type=int)
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        last_event_id = 0
+    return max(since_id, last_event_id, 0)
+
+
+def _sse(event_type, data, event_id=None):
+    lines = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{lines}event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+def _read_backlog(chat_id, since_id):
+    with db.connection(dedicated=True) as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            return fetch_backlog(cursor, chat_id, since_id)
+        finally:
+            cursor.close()
+
+
+def _read_since(chat_id, since_id):
+    """Messages after since_id from a fresh snapshot, or None if the database cannot be read."""
+    try:
+        with db.connection(dedicated=True) as conn:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                return fetch_messages_since(cursor, chat_id, since_id)
+            finally:
+                cursor.close()
+    except mysql.connector.Error as e:
+        logger.warning(f"Chat stream: could not re-read chat {chat_id} after message {since_id}: {e}")
+        return None
+
+
+def chat_stream_response(chat_id, since_id):
+    """
+    SSE response for one chat. Subscribes before reading the backlog so no
+    message published in between is lost; duplicates are dropped by id.
+    When every stream slot of this process is taken (utils/stream_slots.py)
+    only the backlog is sent, and the browser is told to reconnect after
+    STREAM_BUSY_RETRY_SECONDS. A backlog that is not caught up after
+    CHAT_STREAM_BACKLOG_PAGES pages is sent on its own as well, and the
+    browser reconnects right away from its last message.
+    """
+    held = stream_slots.try_acquire('chat')
+    subscriber = chat_broker.subscribe(chat_id) if held else None
+
+    def close():
+        if held:
+            chat_broker.unsubscribe(chat_id, subscriber)
+            stream_slots.release()
+
+    try:
+        backlog, caught_up = _read_backlog(chat_id, since_id)
+    except Exception:
+        close()
+        raise
+    if not held:
+        retry_ms = STREAM_BUSY_RETRY_SECONDS * 1000
+    elif not caught_up:
+        retry_ms = STREAM_CATCH_UP_RETRY_MS
+    else:
+        retry_ms = 3000
+
+    def generate():
+        sent = set()
+        last_id = since_id
+        yield f"retry: {retry_ms}\n\n"
+        for message in backlog:
+            sent.add(message['message_id'])
+            last_id = message['message_id']
+            yield _sse('message', message, last_id)
+        if not held or not caught_up:
+            return
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while time.monotonic() < deadline and not subscriber.overflowed:
+            try:
+                event = subscriber.get(timeout=STREAM_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if event['type'] != 'message':
+                yield _sse(event['type'], event)
+                continue
+            published = event['message']
+            if published['message_id'] in sent:
+                continue
+            # Also picks up messages committed out of order or whose event never reached this worker.
+            messages = _read_since(chat_id, min(last_id, published['message_id'] - 1))
+            if not messages:
+                messages = [published]
+            for message in messages:
+                if message['message_id'] in sent:
+                    continue
+                sent.add(message['message_id'])
+                last_id = max(last_id, message['message_id'])
+                yield _sse('message', message, message['message_id'])
+
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # The server closes the response even when the client goes away before the generator starts.
+    response.call_on_close(close)
+    return response
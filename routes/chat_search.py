@@ -0,0 +1,96 @@
+# routes/chat_search.py
+"""
+Full-text search over chat messages for both portals.
+
+Queries go through the FULLTEXT index idx_message_text with MATCH ... AGAINST
+in boolean mode. Every word the user typed is required and matches as a
+prefix ("diab" finds "diabetes"). The chats join carries the participant
+filter (c.doctor_id or c.patient_id = the current user), so a user can only
+ever get back messages from their own conversations.
+
+Results are newest first and paged with the keyset cursors from
+utils.pagination on message_id. Each hit has a highlighted snippet and a
+`context_cursor` that opens the chat view on the page ending at that
+message.
+
+InnoDB ignores words shorter than innodb_ft_min_token_size (3 by default)
+and its stopwords, so those words are dropped before the query is built.
+"""
+import re
+
+from markupsafe import Markup, escape
+
+from utils.pagination import encode_cursor, seek_page
+
+MIN_TERM_LENGTH = 3    # innodb_ft_min_token_size
+MAX_TERMS = 8
+SNIPPET_WIDTH = 160
+SEARCH_RESULTS_PER_PAGE = 20
+
+_BOOLEAN_OPERATORS = re.compile(r'[+\-<>()~*"@]')
+
+_PARTICIPANTS = {
+    # user_type: (column restricted to the user, column of the other participant)
+    'doctor': ('c.doctor_id', 'c.patient_id'),
+    'patient': ('c.patient_id', 'c.doctor_id'),
+}
+
+
+def search_terms(text):
+    """The words of `text` the full-text index can match, operators removed."""
+    words = _BOOLEAN_OPERATORS.sub(' ', text or '').split()
+    return [word for word in words if len(word) >= MIN_TERM_LENGTH][:MAX_TERMS]
+
+
+def boolean_query(terms):
+    return ' '.join(f'+{term}*' for term in terms)
+
+
+def highlight_snippet(text, terms, width=SNIPPET_WIDTH):
+    """Escaped excerpt of `text` around the first match, with every term wrapped in <mark>."""
+    text = text or ''
+    if not terms:
+        return escape(text[:width])
+    pattern = re.compile('|'.join(rf'{re.escape(term)}\w*' for term in sorted(terms, key=len, reverse=True)),
+                         re.IGNORECASE)
+    first = pattern.search(text)
+    start = max(0, first.start() - width // 3) if first else 0
+    end = min(len(text), start + width)
+    fragment = text[start:end]
+
+    parts = [Markup('&hellip;')] if start > 0 else []
+    position = 0
+    for match in pattern.finditer(fragment):
+        parts.append(escape(fragment[position:match.start()]))
+        parts.append(Markup('<mark>%s</mark>') % match.group())
+        position = match.end()
+    parts.append(escape(fragment[position:]))
+    if end < len(text):
+        parts.append(Markup('&hellip;'))
+    return Markup('').join(parts)
+
+
+def search_messages(cursor, user_type, user_id, text, per_page=SEARCH_RESULTS_PER_PAGE, after=None, before=None):
+    """
+    One page of the user's messages matching `text`, newest first.
+    Returns (page, terms); page is None when no searchable words are left.
+    """
+    terms = search_terms(text)
+    if not terms or user_type not in _PARTICIPANTS:
+        return None, terms
+    owner_column, other_column = _PARTICIPANTS[user_type]
+    select_sql = f"""
+        SELECT cm.message_id, cm.chat_id, cm.sender_type, cm.message_text, cm.sent_at,
+               c.subject, c.status, other_user.first_name AS other_first_name, other_user.last_name AS other_last_name
+        FROM chat_messages cm
+        JOIN chats c ON c.chat_id = cm.chat_id
+        JOIN users other_user ON other_user.user_id = {other_column}
+    """
+    where_sql = f"MATCH(cm.message_text) AGAINST (%s IN BOOLEAN MODE) AND {owner_column} = %s AND cm.is_deleted = FALSE"
+    page = seek_page(cursor, select_sql, where_sql, [boolean_query(terms), user_id],
+                     'cm.message_id', 'message_id', per_page, descending=True, after=after, before=before)
+    for row in page.items:
+        row['snippet'] = highlight_snippet(row['message_text'], terms)
+        # The chat view pages newest first; "older than message_id + 1" is the page ending at this message.
+        row['context_cursor'] = encode_cursor(None, row['message_id'] + 1)
+    return page, terms
@@ -5,7 +5,9 @@ from flask import (
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import check_password_hash
 import mysql.connector
+import db
 from db import get_db_connection
+from routes.principal_cache import principal_cache
 from functools import wraps
 from urllib.parse import urlparse, urljoin
 
@@ -58,42 +60,42 @@ def init_login_manager(app):
     login_manager.login_message = 'Please log in to access this page.'
     login_manager.login_message_category = 'info'
 
-# --- User Loader (Keep As Is) ---
+# --- User Loader ---
 @login_manager.user_loader
 def load_user(user_id_str):
-    connection = None
-    cursor = None
     user = None
     if not user_id_str:
         return None
     try:
         user_id = int(user_id_str)
-        connection = get_db_connection()
-        if connection and connection.is_connected():
-            cursor = connection.cursor(dictionary=True, buffered=True)
-            cursor.execute("""
-                SELECT
-                    u.user_id, u.username, u.email, u.password, u.user_type, u.account_status,
-                    u.first_name, u.last_name, u.profile_picture, u.phone,
-                    d.verification_status AS doctor_verification_status
-                FROM users u
-                LEFT JOIN doctors d ON u.user_id = d.user_id AND u.user_type = 'doctor'
-                WHERE u.user_id = %s
-            """, (user_id,))
-            user_data = cursor.fetchone()
+        cached = principal_cache.get(user_id)
+        if cached is not None:
+            return User(cached)
+        generation = principal_cache.generation(user_id)
+        with db.connection() as conn:
+            cursor = conn.cursor(dictionary=True, buffered=True)
+            try:
+                cursor.execute("""
+                    SELECT
+                        u.user_id, u.username, u.email, u.user_type, u.account_status,
+                        u.first_name, u.last_name, u.profile_picture, u.phone,
+                        d.verification_status AS doctor_verification_status
+                    FROM users u
+                    LEFT JOIN doctors d ON u.user_id = d.user_id AND u.user_type = 'doctor'
+                    WHERE u.user_id = %s
+                """, (user_id,))
+                user_data = cursor.fetchone()
+            finally:
+                cursor.close()
             if user_data:
+                principal_cache.set(user_id, user_data, generation)
                 user = User(user_data)
-        else:
-            current_app.logger.error(f"load_user: Failed to get DB connection for user_id {user_id_str}")
     except ValueError:
         current_app.logger.error(f"ValueError: Invalid user_id format '{user_id_str}' in session for load_user.")
     except mysql.connector.Error as err:
         current_app.logger.error(f"Database error loading user (ID: {user_id_str}): {err}")
     except Exception as e:
         current_app.logger.error(f"Unexpected error loading user (ID: {user_id_str}): {e}", exc_info=True)
-    finally:
-        if cursor: cursor.close()
-        if connection and connection.is_connected(): connection.close()
     return user
 
 # --- Decorators (Keep As Is) ---
@@ -202,6 +204,9 @@ def login_route():
                 if check_password_hash(stored_hashed_password, password_attempt):
                     if user_data_dict['account_status'] == 'active':
                         user_for_login = User(user_data_dict)
+                        # Seed the principal cache with the row just read so the next request skips the lookup.
+                        principal_cache.invalidate(user_for_login.id)
+                        principal_cache.set(user_for_login.id, user_data_dict, principal_cache.generation(user_for_login.id))
                         login_user(user_for_login, remember=remember)
                         current_app.logger.info(f"User {user_for_login.id} ({user_for_login.username}) logged in successfully.")
 
@@ -4,6 +4,7 @@ from flask import (Blueprint, render_template, request, redirect, url_for, flash
 from werkzeug.security import generate_password_hash
 import mysql.connector
 from db import get_db_connection
+from routes.principal_cache import invalidate_principal
 from datetime import datetime, timedelta
 import secrets # For secure token generation
 
@@ -234,6 +235,7 @@ def reset_password_route(token):
                 # Check if the update actually affected a row
                 if cursor.rowcount == 1:
                     connection.commit() # Commit the changes
+                    invalidate_principal(user['user_id'])
                     flash('Your password has been successfully reset! You can now log in.', 'success')
                     current_app.logger.info(f"Password successfully reset for user_id {user['user_id']} using token {token[:6]}...") # Log partial token
                     # Optional: Log the user in automatically here
@@ -0,0 +1,200 @@
+# routes/principal_cache.py
+"""
+Cache of the authenticated principal used by login.load_user().
+
+Flask-Login calls load_user() on every authenticated request, AJAX polls
+included, and without a cache each call runs a users/doctors join. This
+module keeps the loaded row (never the password hash) keyed by user_id:
+
+  * an in-process LRU with a TTL, always on unless the TTL is 0, and
+  * an optional shared backend (Redis, if PRINCIPAL_CACHE_REDIS_URL is set and
+    the redis package is installed) so workers can share loads and
+    invalidations.
+
+Call invalidate_principal(user_id) after committing anything that changes what
+load_user() returns or whether the account may log in: profile edits,
+password changes, account status, doctor verification, deletion.
+
+Without the shared backend, an invalidation only reaches the worker that made
+it; other workers pick the change up when their entry expires, so the TTL
+bounds how long a deactivated account keeps working there. With the shared
+backend, local entries are kept for PRINCIPAL_CACHE_LOCAL_TTL_SECONDS only and
+the shared entry is deleted on invalidation.
+
+A load only fills the local LRU if the user was not invalidated while it ran.
+The generation counters behind that check are bounded like the LRU
+(utils/generations.py).
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utils.generations import Generations
+from utils.metrics import CACHE_ENTRIES, CACHE_LOOKUPS, register_collector
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.environ.get('PRINCIPAL_CACHE_TTL_SECONDS', 60))
+PRINCIPAL_CACHE_LOCAL_TTL_SECONDS = float(os.environ.get('PRINCIPAL_CACHE_LOCAL_TTL_SECONDS', 2))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.environ.get('PRINCIPAL_CACHE_MAX_ENTRIES', 5000))
+PRINCIPAL_CACHE_REDIS_URL = os.environ.get('PRINCIPAL_CACHE_REDIS_URL', '').strip()
+
+PRINCIPAL_FIELDS = (
+    'user_id', 'username', 'email', 'user_type', 'account_status', 'first_name', 'last_name',
+    'profile_picture', 'phone', 'doctor_verification_status',
+)
+
+
+class RedisPrincipalBackend:
+    """Shared tier. Failures are logged and treated as misses so a Redis outage falls back to MySQL."""
+    KEY_PREFIX = 'principal:'
+
+    def __init__(self, url, ttl):
+        self.ttl = ttl
+        self._client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+
+    def get(self, user_id):
+        try:
+            raw = self._client.get(f"{self.KEY_PREFIX}{user_id}")
+        except redis.RedisError as err:
+            logger.warning(f"Principal cache: shared get failed for user {user_id}: {err}")
+            return None
+        return json.loads(raw) if raw else None
+
+    def set(self, user_id, data):
+        try:
+            self._client.set(f"{self.KEY_PREFIX}{user_id}", json.dumps(data), ex=max(1, int(self.ttl)))
+        except redis.RedisError as err:
+            logger.warning(f"Principal cache: shared set failed for user {user_id}: {err}")
+
+    def delete(self, user_id):
+        try:
+            self._client.delete(f"{self.KEY_PREFIX}{user_id}")
+        except redis.RedisError as err:
+            logger.warning(f"Principal cache: shared delete failed for user {user_id}: {err}")
+
+
+class PrincipalCache:
+    def __init__(self, ttl=PRINCIPAL_CACHE_TTL_SECONDS, max_entries=PRINCIPAL_CACHE_MAX_ENTRIES, shared=None,
+                 local_ttl=PRINCIPAL_CACHE_LOCAL_TTL_SECONDS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        # With a shared tier the local copy only absorbs bursts; the shared entry is the one invalidated everywhere.
+        self.local_ttl = min(ttl, local_ttl) if shared is not None else ttl
+        self._entries = OrderedDict()  # user_id -> (expires_at, row dict)
+        self._generations = Generations(max_entries)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def generation(self, user_id):
+        with self._lock:
+            return self._generations.get(user_id)
+
+    def get(self, user_id):
+        """The cached row for user_id, or None."""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    CACHE_LOOKUPS.inc(cache='principal', result='hit')
+                    return entry[1]
+                del self._entries[user_id]
+            generation = self._generations.get(user_id)
+        if self.shared is not None:
+            data = self.shared.get(user_id)
+            if data is not None:
+                self._store_local(user_id, data, generation)
+                with self._lock:
+                    self.shared_hits += 1
+                CACHE_LOOKUPS.inc(cache='principal', result='shared_hit')
+                return data
+        with self._lock:
+            self.misses += 1
+        CACHE_LOOKUPS.inc(cache='principal', result='miss')
+        return None
+
+    def set(self, user_id, data, generation):
+        """Stores a row loaded while `generation` was current; dropped if it has been invalidated since."""
+        if not self.enabled:
+            return
+        data = {field: data.get(field) for field in PRINCIPAL_FIELDS}
+        if self._store_local(user_id, data, generation) and self.shared is not None:
+            self.shared.set(user_id, data)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generations.bump(user_id)
+            self._entries.pop(user_id, None)
+        if self.shared is not None:
+            self.shared.delete(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.bump_all()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'ttl_seconds': self.ttl,
+                'shared_backend': self.shared is not None,
+            }
+
+    def _store_local(self, user_id, data, generation):
+        with self._lock:
+            if self._generations.get(user_id) != generation:
+                return False
+            self._entries[user_id] = (time.monotonic() + self.local_ttl, data)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True
+
+
+def _build_shared_backend():
+    if not PRINCIPAL_CACHE_REDIS_URL:
+        return None
+    if redis is None:
+        logger.warning("PRINCIPAL_CACHE_REDIS_URL is set but the redis package is not installed; "
+                       "using the in-process principal cache only.")
+        return None
+    return RedisPrincipalBackend(PRINCIPAL_CACHE_REDIS_URL, PRINCIPAL_CACHE_TTL_SECONDS)
+
+
+principal_cache = PrincipalCache(shared=_build_shared_backend())
+
+
+@register_collector
+def _collect_cache_metrics():
+    CACHE_ENTRIES.set(principal_cache.stats()['entries'], cache='principal')
+
+
+def invalidate_principal(user_id):
+    """Call after committing any change to a user's row, account status or doctor verification."""
+    if user_id is None:
+        return
+    principal_cache.invalidate(int(user_id))
@@ -1,11 +1,14 @@
 # routes/shared_utils.py
 
 import mysql.connector
+import db
 from flask import current_app, flash
 from datetime import datetime, date, time, timedelta
 import uuid
 import os
+import decimal
 from werkzeug.utils import secure_filename
+from utils.schema_metadata import get_enum_values
 
 # --- Authorization ---
 def check_provider_authorization(user):
@@ -32,54 +35,89 @@ def get_provider_id(user):
         return None
 
 # --- Generic DB Helpers ---
-ENUM_CACHE = {}
-
-def get_enum_values(table_name, column_name):
-    """Fetches and caches ENUM values for a given table and column."""
-    cache_key = f"{table_name}_{column_name}"
-    if cache_key in ENUM_CACHE: return ENUM_CACHE[cache_key]
-    conn = None; cursor = None; values = []
-    try:
-        conn = get_db_connection();
-        if not conn: raise ConnectionError("DB connection failed")
-        cursor = conn.cursor(); db_name = conn.database
-        query = "SELECT COLUMN_TYPE FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s"
-        cursor.execute(query, (db_name, table_name, column_name))
-        result = cursor.fetchone()
-        if result:
-            enum_str = result[0]
-            enum_content = enum_str[enum_str.find("(")+1:enum_str.rfind(")")]
-            values = [val.strip().strip("'\"") for val in enum_content.split(",")]
-        ENUM_CACHE[cache_key] = values; return values
-    except (mysql.connector.Error, ConnectionError, IndexError) as e:
-        current_app.logger.error(f"Error fetching ENUM values for {table_name}.{column_name}: {e}"); return []
-    finally:
-        if cursor: cursor.close()
-        if conn and conn.is_connected(): conn.close()
-
 def get_all_simple(table_name, id_col, name_col, order_by=None, where_clause=None, params=None):
     """Fetches simple ID/Name pairs from a table."""
-    conn = None; cursor = None; items = []
+    items = []
     order_clause = f"ORDER BY {order_by}" if order_by else f"ORDER BY {name_col}"
     where_sql = f" WHERE {where_clause}" if where_clause else ""
     try:
-        conn = get_db_connection();
-        if not conn: raise ConnectionError("DB connection failed")
-        cursor = conn.cursor(dictionary=True)
-        query = f"SELECT {id_col}, {name_col} FROM {table_name} {where_sql} {order_clause}"
-        cursor.execute(query, params or [])
-        items = cursor.fetchall()
-    except (mysql.connector.Error, ConnectionError) as e:
+        with db.connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                query = f"SELECT {id_col}, {name_col} FROM {table_name} {where_sql} {order_clause}"
+                cursor.execute(query, params or [])
+                items = cursor.fetchall()
+            finally:
+                cursor.close()
+    except mysql.connector.Error as e:
         current_app.logger.error(f"Error fetching from {table_name}: {e}")
-    finally:
-        if cursor: cursor.close()
-        if conn and conn.is_connected(): conn.close()
     return items
 
 def get_specializations():
     """Fetches active specializations for dropdowns."""
     return get_all_simple('specializations', 'specialization_id', 'name', where_clause="is_active = TRUE", order_by="name")
 
+# --- Diet Plan Loader ---
+DIET_PLAN_MEAL_ORDER = "FIELD(meal_type, 'breakfast', 'lunch', 'dinner', 'snack', 'other'), time_of_day, meal_id"
+
+def _timedelta_to_time(value):
+    """Converts a TIME column value (timedelta) into a datetime.time, or None."""
+    if isinstance(value, time): return value
+    if isinstance(value, timedelta):
+        total_seconds = int(value.total_seconds())
+        try: return time((total_seconds // 3600) % 24, (total_seconds % 3600) // 60, total_seconds % 60)
+        except ValueError: return None
+    return None
+
+def get_diet_plan_with_meals(plan_id, public_only=False):
+    """
+    Loads a diet plan with all of its meals and food items in a fixed three
+    queries (plan, meals, then every food item through one IN-list) and nests
+    them in Python. Returns {'plan': {...}, 'meals': [...]} where each meal
+    dict also carries 'time_of_day_obj' and 'food_items', or None when the
+    plan does not exist (or is not public when public_only=True).
+    Database errors are raised so callers keep their own error handling.
+    """
+    conn = db.get_db_connection()
+    if not conn: raise ConnectionError("DB connection failed")
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        query_plan = """
+            SELECT dp.*, u.username AS creator_username,
+                   u.first_name AS creator_first_name, u.last_name AS creator_last_name
+            FROM diet_plans dp
+            LEFT JOIN users u ON dp.creator_id = u.user_id
+            WHERE dp.plan_id = %s
+        """
+        if public_only: query_plan += " AND dp.is_public = 1"
+        cursor.execute(query_plan, (plan_id,))
+        plan = cursor.fetchone()
+        if not plan: return None
+
+        cursor.execute(f"SELECT * FROM diet_plan_meals WHERE plan_id = %s ORDER BY {DIET_PLAN_MEAL_ORDER}", (plan_id,))
+        meals = cursor.fetchall()
+
+        items_by_meal = {}
+        if meals:
+            meal_ids = [meal['meal_id'] for meal in meals]
+            placeholders = ', '.join(['%s'] * len(meal_ids))
+            cursor.execute(
+                f"SELECT * FROM diet_plan_food_items WHERE meal_id IN ({placeholders}) ORDER BY meal_id, item_id",
+                tuple(meal_ids)
+            )
+            for item in cursor.fetchall():
+                for key, value in item.items():
+                    if isinstance(value, decimal.Decimal): item[key] = float(value)
+                items_by_meal.setdefault(item['meal_id'], []).append(item)
+
+        for meal in meals:
+            meal['time_of_day_obj'] = _timedelta_to_time(meal.get('time_of_day'))
+            meal['food_items'] = items_by_meal.get(meal['meal_id'], [])
+        return {'plan': plan, 'meals': meals}
+    finally:
+        cursor.close()
+        if conn and conn.is_connected(): conn.close()
+
 # --- Location Helper ---
 def get_all_provider_locations(provider_id):
      """
@@ -89,7 +127,7 @@ def get_all_provider_locations(provider_id):
      """
      conn = None; cursor = None; locations = []
      try:
-         conn = get_db_connection();
+         conn = db.get_db_connection();
          if not conn: raise ConnectionError("DB Connection failed")
          cursor = conn.cursor(dictionary=True)
          # Ideal: SELECT l.location_id, l.name FROM locations l JOIN provider_locations pl ON l.location_id = pl.location_id WHERE pl.provider_id = %s AND l.is_active = TRUE ORDER BY l.name
@@ -46,14 +46,15 @@ def configure_directories(app):
         UPLOAD_FOLDER_DEPARTMENTS, UPLOAD_FOLDER_CONDITIONS, UPLOAD_FOLDER_CONDITION_VIDEOS,
         UPLOAD_FOLDER_ATTACHMENTS, UPLOAD_FOLDER_PATIENT_REPORTS, UPLOAD_FOLDER_VACCINE_CATEGORY_IMAGES
     ]
-    logger.info("--- Configuring Upload Directories ---")
+    # Usually all present already: one stat each, and only a missing directory is created and logged.
     for dir_path in upload_dirs:
+        if os.path.isdir(dir_path):
+            continue
         try:
             os.makedirs(dir_path, exist_ok=True)
-            logger.info(f"Ensured directory exists: {dir_path}")
+            logger.info(f"Created upload directory: {dir_path}")
         except OSError as e:
             logger.error(f"Error creating directory '{dir_path}': {e}", exc_info=True)
-    logger.info("--- Upload Directory Configuration Complete ---")
 
 def get_relative_path_for_db(absolute_filepath):
     if not current_app:
@@ -0,0 +1,47 @@
+# utils/generations.py
+"""
+Bounded per-key generation counters for the invalidating caches
+(routes/availability_cache.py, routes/principal_cache.py).
+
+A reader notes get(key) before loading from the database and stores its
+result only if get(key) still returns the same value. bump(key) makes every
+such load in flight for that key fail the check.
+
+Only the max_keys most recently bumped keys are tracked. Values come from one
+counter shared by all keys. An evicted key's value is folded into a floor,
+and get() returns that floor for every key it no longer tracks. A key's value
+therefore never goes back to one a reader may already hold. The worst case is
+that a load which overlapped an eviction is not stored, which only costs one
+extra cache miss.
+
+Not thread-safe: callers hold their cache's lock.
+"""
+from collections import OrderedDict
+
+
+class Generations:
+    def __init__(self, max_keys):
+        self.max_keys = max(1, max_keys)
+        self._values = OrderedDict()  # key -> value, least recently bumped first
+        self._counter = 0
+        self._floor = 0
+
+    def get(self, key):
+        return self._values.get(key, self._floor)
+
+    def bump(self, key):
+        self._counter += 1
+        self._values[key] = self._counter
+        self._values.move_to_end(key)
+        while len(self._values) > self.max_keys:
+            _, value = self._values.popitem(last=False)
+            self._floor = max(self._floor, value)
+
+    def bump_all(self):
+        """Invalidates every key, tracked or not."""
+        self._counter += 1
+        self._values.clear()
+        self._floor = self._counter
+
+    def __len__(self):
+        return len(self._values)
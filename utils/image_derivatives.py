@@ -0,0 +1,329 @@
+# utils/image_derivatives.py
+"""
+Resized and WebP copies of uploaded pictures: profile photos, department,
+condition and vaccine-category images.
+
+When an image is uploaded, generate_derivatives() writes one variant per width
+in IMAGE_DERIVATIVE_WIDTHS that is narrower than the source. Each width is
+written twice: once in the source format (JPEG/PNG) and once as WebP. A WebP
+at the source's own width is also written. File names come from the SHA-256
+of the source bytes:
+
+    static/uploads/derivatives/3f/3f9a...c1.w320.webp
+
+Re-uploading the same picture, or running the backfill twice, therefore
+reuses files that already exist instead of encoding them again. A small JSON
+manifest per source (derivatives/_manifests/<path under static>.json)
+records which variants exist. It also stores the source's mtime and size, so
+a replaced file is not paired with stale variants.
+
+Templates call image_srcset(path) with the path relative to static/ (the
+value stored in the database). It returns srcset/sizes attributes to add to
+the existing <img>; the src attribute stays the original, so pictures
+without derivatives render exactly as before. Generation runs only at upload
+time or from the CLI, never while rendering a page. Manifests are cached in
+memory and re-read only when the source or the manifest changes on disk.
+
+Pillow is optional. Without it, uploads are stored as before and
+image_srcset() returns nothing. For files uploaded before this existed:
+
+    flask --app app image-derivatives backfill [--force] [--prune]
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import click
+from flask import url_for
+from markupsafe import Markup
+
+from utils.directory_configs import (
+    BASE_DIR, UPLOAD_FOLDER_BASE, UPLOAD_FOLDER_CONDITIONS, UPLOAD_FOLDER_DEPARTMENTS, UPLOAD_FOLDER_PROFILE,
+    UPLOAD_FOLDER_VACCINE_CATEGORY_IMAGES,
+)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow not installed: derivatives are disabled
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_DERIVATIVES_ENABLED = os.environ.get('IMAGE_DERIVATIVES_ENABLED', 'True').lower() in ['true', '1', 't']
+IMAGE_DERIVATIVE_WIDTHS = sorted({
+    int(width) for width in os.environ.get('IMAGE_DERIVATIVE_WIDTHS', '160,320,640,1280').split(',') if width.strip()
+})
+IMAGE_WEBP_QUALITY = int(os.environ.get('IMAGE_WEBP_QUALITY', 80))
+IMAGE_JPEG_QUALITY = int(os.environ.get('IMAGE_JPEG_QUALITY', 82))
+# 'webp' puts the WebP variants in srcset; 'original' the source-format ones (for very old browsers)
+IMAGE_SRCSET_FORMAT = os.environ.get('IMAGE_SRCSET_FORMAT', 'webp').strip().lower()
+
+STATIC_FOLDER = os.path.join(BASE_DIR, 'static')
+DERIVATIVES_FOLDER = os.path.join(UPLOAD_FOLDER_BASE, 'derivatives')
+MANIFESTS_FOLDER = os.path.join(DERIVATIVES_FOLDER, '_manifests')
+# Only public picture folders; doctor documents and chat attachments are served behind authorization.
+SOURCE_FOLDERS = [
+    UPLOAD_FOLDER_PROFILE, UPLOAD_FOLDER_DEPARTMENTS, UPLOAD_FOLDER_CONDITIONS, UPLOAD_FOLDER_VACCINE_CATEGORY_IMAGES,
+]
+SOURCE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+MANIFEST_CACHE_MAX_ENTRIES = 5000
+
+# Pillow format -> (format the fixed-width variants are written in, extension)
+_ORIGINAL_FORMATS = {'JPEG': ('JPEG', 'jpg'), 'PNG': ('PNG', 'png'), 'GIF': ('PNG', 'png'), 'WEBP': ('WEBP', 'webp')}
+
+
+# --- Paths ---
+def _static_relative(abs_path):
+    return os.path.relpath(os.path.abspath(abs_path), STATIC_FOLDER).replace(os.path.sep, '/')
+
+
+def _is_source_path(abs_path):
+    real_path = os.path.realpath(abs_path)
+    if real_path.startswith(os.path.realpath(DERIVATIVES_FOLDER) + os.sep):
+        return False
+    if real_path.rsplit('.', 1)[-1].lower() not in SOURCE_EXTENSIONS:
+        return False
+    return any(real_path.startswith(os.path.realpath(folder) + os.sep) for folder in SOURCE_FOLDERS)
+
+
+def _manifest_path(static_path):
+    return os.path.join(MANIFESTS_FOLDER, *static_path.split('/')) + '.json'
+
+
+def _write_atomically(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# --- Generation ---
+def _save_variant(image, width, pillow_format, extension, digest, force):
+    file_name = f"{digest[:32]}.w{width}.{extension}"
+    abs_path = os.path.join(DERIVATIVES_FOLDER, digest[:2], file_name)
+    if force or not os.path.isfile(abs_path):
+        variant = image if width == image.width else image.resize(
+            (width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        if pillow_format == 'JPEG':
+            variant = variant.convert('RGB')
+            options = {'quality': IMAGE_JPEG_QUALITY, 'optimize': True, 'progressive': True}
+        elif pillow_format == 'WEBP':
+            options = {'quality': IMAGE_WEBP_QUALITY, 'method': 4}
+        else:
+            options = {'optimize': True}
+        _write_atomically(abs_path, lambda temp_path: variant.save(temp_path, pillow_format, **options))
+    return [width, _static_relative(abs_path)]
+
+
+def generate_derivatives(abs_path, force=False):
+    """
+    Writes the variants and manifest for the uploaded image at `abs_path` and
+    returns the manifest. Returns None when Pillow is missing, the feature is
+    off, or the file is not a public upload or a still image.
+    """
+    if Image is None or not IMAGE_DERIVATIVES_ENABLED or not IMAGE_DERIVATIVE_WIDTHS:
+        return None
+    if not _is_source_path(abs_path):
+        return None
+    stat = os.stat(abs_path)
+    digest = _file_digest(abs_path)
+
+    with Image.open(abs_path) as opened:
+        if getattr(opened, 'is_animated', False):
+            return None  # resizing would keep only the first frame
+        source_format = opened.format
+        image = ImageOps.exif_transpose(opened)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode == 'P' else 'RGB')
+
+    widths = [width for width in IMAGE_DERIVATIVE_WIDTHS if width < image.width]
+    original_format, original_extension = _ORIGINAL_FORMATS.get(source_format, ('PNG', 'png'))
+    manifest = {
+        'source': _static_relative(abs_path),
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': digest,
+        'width': image.width,
+        'height': image.height,
+        'webp': [_save_variant(image, width, 'WEBP', 'webp', digest, force) for width in widths + [image.width]],
+        'original': [_save_variant(image, width, original_format, original_extension, digest, force)
+                     for width in widths],
+    }
+    _write_atomically(_manifest_path(manifest['source']),
+                      lambda temp_path: _write_json(temp_path, manifest))
+    return manifest
+
+
+def _write_json(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+
+
+def derive_uploaded_image(abs_path):
+    """Upload-time hook: generate_derivatives() with every failure logged, never raised."""
+    try:
+        manifest = generate_derivatives(abs_path)
+        if manifest:
+            logger.info(f"Image derivatives for {manifest['source']}: {len(manifest['webp'])} WebP, "
+                        f"{len(manifest['original'])} resized.")
+        return manifest
+    except Exception as e:
+        logger.error(f"Could not generate image derivatives for {abs_path}: {e}", exc_info=True)
+        return None
+
+
+# --- Lookup ---
+_manifest_cache = {}
+_manifest_cache_lock = threading.Lock()
+
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def derivative_manifest(static_path):
+    """The manifest for `static_path` (relative to static/), or None if it has no current derivatives."""
+    if not static_path or '..' in static_path:
+        return None
+    static_path = static_path.lstrip('/')
+    try:
+        source_stat = os.stat(os.path.join(STATIC_FOLDER, static_path))
+    except OSError:
+        return None
+    manifest_path = _manifest_path(static_path)
+    key = (source_stat.st_mtime_ns, source_stat.st_size, _mtime_ns(manifest_path))
+    with _manifest_cache_lock:
+        cached = _manifest_cache.get(static_path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    manifest = None
+    if key[2] is not None:
+        try:
+            with open(manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unreadable image derivative manifest {manifest_path}: {e}")
+        if manifest and (manifest.get('mtime_ns'), manifest.get('size')) != key[:2]:
+            manifest = None  # source replaced since the variants were made
+    with _manifest_cache_lock:
+        if len(_manifest_cache) >= MANIFEST_CACHE_MAX_ENTRIES:
+            _manifest_cache.clear()
+        _manifest_cache[static_path] = (key, manifest)
+    return manifest
+
+
+def image_srcset(static_path, sizes='100vw'):
+    """
+    srcset and sizes attributes for an <img> showing `static_path`, e.g.
+        <img src="{{ url_for('static', filename=path) }}" {{ image_srcset(path, '(max-width: 600px) 100vw, 320px') }}>
+    Empty when the image has no derivatives.
+    """
+    manifest = derivative_manifest(static_path)
+    if not manifest:
+        return Markup('')
+    if IMAGE_SRCSET_FORMAT == 'original':
+        candidates = manifest['original'] + [[manifest['width'], manifest['source']]]
+    else:
+        candidates = manifest['webp']
+    if not candidates:
+        return Markup('')
+    srcset = ', '.join(f"{url_for('static', filename=path)} {width}w" for width, path in candidates)
+    return Markup('srcset="%s" sizes="%s"') % (srcset, sizes)
+
+
+# --- Backfill ---
+def _source_files():
+    for folder in SOURCE_FOLDERS:
+        for root, _dirs, files in os.walk(folder):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if _is_source_path(path):
+                    yield path
+
+
+def prune_derivatives():
+    """Removes manifests whose source is gone and variant files no manifest refers to. Returns files removed."""
+    referenced = set()
+    removed = 0
+    for root, _dirs, files in os.walk(MANIFESTS_FOLDER):
+        for name in files:
+            manifest_path = os.path.join(root, name)
+            try:
+                with open(manifest_path, encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = None
+            if manifest is None or not os.path.isfile(os.path.join(STATIC_FOLDER, manifest.get('source', ''))):
+                os.remove(manifest_path)
+                removed += 1
+                continue
+            referenced.update(path for _width, path in manifest['webp'] + manifest['original'])
+    for root, dirs, files in os.walk(DERIVATIVES_FOLDER):
+        if os.path.realpath(root) == os.path.realpath(MANIFESTS_FOLDER):
+            dirs[:] = []
+            continue
+        for name in files:
+            path = os.path.join(root, name)
+            if root != DERIVATIVES_FOLDER and _static_relative(path) not in referenced:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+@click.group('image-derivatives')
+def image_derivatives_cli():
+    """Resized and WebP variants of uploaded pictures."""
+
+
+@image_derivatives_cli.command('backfill')
+@click.option('--force', is_flag=True, help='Re-encode variants that already exist.')
+@click.option('--prune', is_flag=True, help='Then delete variants and manifests of removed uploads.')
+def backfill_command(force, prune):
+    """Generate derivatives for every picture already under static/uploads/."""
+    if Image is None:
+        raise click.ClickException("Pillow is not installed; pip install Pillow first.")
+    started = time.perf_counter()
+    generated = skipped = failed = 0
+    for path in _source_files():
+        static_path = _static_relative(path)
+        if not force and derivative_manifest(static_path):
+            skipped += 1
+            continue
+        try:
+            if generate_derivatives(path, force=force):
+                generated += 1
+            else:
+                skipped += 1
+        except Exception as e:
+            failed += 1
+            click.echo(f"  {static_path}: {e}", err=True)
+    click.echo(f"Generated {generated}, skipped {skipped}, failed {failed} in {time.perf_counter() - started:.1f}s.")
+    if prune:
+        click.echo(f"Pruned {prune_derivatives()} files.")
+
+
+def init_image_derivatives(app):
+    app.cli.add_command(image_derivatives_cli)
+    if Image is None and IMAGE_DERIVATIVES_ENABLED:
+        app.logger.info("Pillow not installed; uploaded images are served without resized variants.")
@@ -0,0 +1,126 @@
+# utils/intervals.py
+"""
+Interval arithmetic on integer minutes.
+
+An IntervalSet holds sorted, disjoint, half-open intervals [start, end).
+Touching intervals are merged on construction, so (540, 600) and (600, 660)
+become (540, 660). Point queries (overlaps / contains) use bisect and are
+O(log n); union, subtract and intersect are linear merges of the two sets.
+"""
+from bisect import bisect_right
+
+
+def _normalize(intervals):
+    merged = []
+    for start, end in sorted((s, e) for s, e in intervals if s < e):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(s, e) for s, e in merged]
+
+
+class IntervalSet:
+    __slots__ = ("_intervals", "_starts")
+
+    def __init__(self, intervals=()):
+        self._set(_normalize(intervals))
+
+    def _set(self, normalized):
+        self._intervals = normalized
+        self._starts = [s for s, _ in normalized]
+
+    @classmethod
+    def _from_normalized(cls, normalized):
+        obj = cls.__new__(cls)
+        obj._set(normalized)
+        return obj
+
+    # --- Container protocol ---
+    def __iter__(self):
+        return iter(self._intervals)
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def __bool__(self):
+        return bool(self._intervals)
+
+    def __eq__(self, other):
+        if not isinstance(other, IntervalSet):
+            return NotImplemented
+        return self._intervals == other._intervals
+
+    def __repr__(self):
+        return f"IntervalSet({self._intervals!r})"
+
+    @property
+    def total(self):
+        """Sum of interval lengths."""
+        return sum(e - s for s, e in self._intervals)
+
+    # --- Queries ---
+    def _index_at_or_before(self, point):
+        return bisect_right(self._starts, point) - 1
+
+    def overlaps(self, start, end):
+        """True when [start, end) shares at least one minute with the set."""
+        if start >= end or not self._intervals:
+            return False
+        # The only candidates are the last interval starting before `end`.
+        i = bisect_right(self._starts, end - 1) - 1
+        return i >= 0 and self._intervals[i][1] > start
+
+    def contains(self, start, end):
+        """True when [start, end) lies entirely inside one interval of the set."""
+        if start >= end:
+            return False
+        i = self._index_at_or_before(start)
+        return i >= 0 and self._intervals[i][1] >= end
+
+    # --- Set operations ---
+    def union(self, other):
+        other = other if isinstance(other, IntervalSet) else IntervalSet(other)
+        return IntervalSet._from_normalized(_normalize(self._intervals + other._intervals))
+
+    def intersect(self, other):
+        other = other if isinstance(other, IntervalSet) else IntervalSet(other)
+        a, b = self._intervals, other._intervals
+        i = j = 0
+        result = []
+        while i < len(a) and j < len(b):
+            start = max(a[i][0], b[j][0])
+            end = min(a[i][1], b[j][1])
+            if start < end:
+                result.append((start, end))
+            if a[i][1] < b[j][1]:
+                i += 1
+            else:
+                j += 1
+        return IntervalSet._from_normalized(result)
+
+    def subtract(self, other):
+        other = other if isinstance(other, IntervalSet) else IntervalSet(other)
+        cuts = other._intervals
+        result = []
+        j = 0
+        for start, end in self._intervals:
+            while j < len(cuts) and cuts[j][1] <= start:
+                j += 1
+            k = j
+            current = start
+            while k < len(cuts) and cuts[k][0] < end:
+                if cuts[k][0] > current:
+                    result.append((current, cuts[k][0]))
+                current = max(current, cuts[k][1])
+                if current >= end:
+                    break
+                k += 1
+            if current < end:
+                result.append((current, end))
+        return IntervalSet._from_normalized(result)
+
+    __or__ = union
+    __and__ = intersect
+    __sub__ = subtract
@@ -1,94 +1,378 @@
+"""
+Logging pipeline.
+
+Request threads only put records on a bounded in-memory queue (one
+QueueHandler on the root logger). A single QueueListener thread owns every
+sink and is the only thread that touches the disk:
+
+  app.log       application loggers (app.logger and module loggers), JSON lines
+  error.log     ERROR and above from the application loggers, JSON lines
+  activity.log  log_user_activity() events
+  security.log  log_security_event() events
+  access.log    log_api_request() / log_query_summary() / log_database_query()
+  stderr        application loggers, plain text
+
+Each file sink keeps one handle open and is flushed when the listener has
+drained the queue, or every LOG_FLUSH_BATCH records under sustained load.
+If the queue fills up (LOG_QUEUE_MAX_RECORDS), records are dropped rather
+than blocking the request. The count of dropped records is written to
+app.log at the next flush.
+
+Several processes (gunicorn workers) can share the files. Before each
+record a sink reopens its file if another process rotated it. Rotation
+itself runs under a lock file (<name>.log.lock), so only one process
+renames the backups.
+
+LOG_LEVEL applies to the application loggers (app.logger and the db, routes
+and utils modules). The root logger stays at WARNING, so third-party libraries
+(mysql.connector, werkzeug, urllib3...) only report warnings and errors.
+
+JSON lines always carry timestamp, level, logger and message. Event helpers
+add their own fixed fields, e.g. an access line:
+
+  {"timestamp": "...", "level": "INFO", "logger": "access", "message": "request",
+   "method": "GET", "path": "/", "status": 200, "duration_ms": 4.2, "user_id": null, "ip_address": "..."}
+"""
+import atexit
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
-from datetime import datetime
+import queue
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+try:
+    import fcntl
+except ImportError:  # Windows: rotation is then only coordinated within one process
+    fcntl = None
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-LOG_DIR = os.path.join(BASE_DIR, "logs")
+LOG_DIR = os.environ.get("LOG_DIR") or os.path.join(BASE_DIR, "logs")
 os.makedirs(LOG_DIR, exist_ok=True)
 
 LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s - %(message)s"
 DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_QUEUE_MAX_RECORDS = int(os.environ.get("LOG_QUEUE_MAX_RECORDS", 10000))
+LOG_FLUSH_BATCH = int(os.environ.get("LOG_FLUSH_BATCH", 200))
 
+# Top-level names of this project's module loggers (logging.getLogger(__name__)); they get LOG_LEVEL.
+APP_LOGGERS = ("db", "routes", "utils")
 
-def setup_logging(app):
-    log_level = logging.getLevelName(os.environ.get("LOG_LEVEL", "INFO"))
+# Event loggers and the sink each one writes to; everything else is an application logger.
+EVENT_LOGGERS = {
+    "activity": "activity.log",
+    "security": "security.log",
+    "access": "access.log",
+    "database": "access.log",
+}
 
-    app.logger.setLevel(log_level)
-    app.logger.handlers.clear()
+# Attributes every LogRecord has; anything else on a record came from `extra=`.
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
 
-    file_handler = RotatingFileHandler(
-        os.path.join(LOG_DIR, "app.log"), maxBytes=10 * 1024 * 1024, backupCount=5
-    )
-    file_handler.setLevel(log_level)
-    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
-    app.logger.addHandler(file_handler)
 
-    error_handler = RotatingFileHandler(
-        os.path.join(LOG_DIR, "error.log"), maxBytes=10 * 1024 * 1024, backupCount=5
+# --- Formatting ---
+class JsonLineFormatter(logging.Formatter):
+    """One JSON object per record: timestamp, level, logger, message, then any extra= fields."""
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _LoggerFilter(logging.Filter):
+    """Passes records from `names` (and their children), or from every non-event logger when names is None."""
+
+    def __init__(self, names=None):
+        super().__init__()
+        self.names = tuple(names) if names else None
+
+    def filter(self, record):
+        root_name = record.name.split(".", 1)[0]
+        if self.names is None:
+            return root_name not in EVENT_LOGGERS
+        return root_name in self.names
+
+
+# --- Handlers ---
+class _BatchedFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler that only flushes when the listener says so, and that
+    shares its file safely with the same handler in other processes:
+    - it reopens the file when the path no longer points at the file it has
+      open, as WatchedFileHandler does, so it never keeps appending to a
+      backup another process renamed;
+    - the size check uses the size on disk, which includes other processes'
+      writes;
+    - rotation holds an exclusive lock on <file>.lock. A process that gets the
+      lock after another one rotated only reopens, so the backups are never
+      shifted twice or overwritten.
+    """
+
+    def _open(self):
+        stream = super()._open()
+        self._inode = os.fstat(stream.fileno()).st_ino
+        return stream
+
+    def _replaced(self):
+        try:
+            return os.stat(self.baseFilename).st_ino != self._inode
+        except FileNotFoundError:
+            return True
+
+    def _reopen(self):
+        self.flush_batch()
+        self.stream.close()
+        self.stream = self._open()
+
+    @contextmanager
+    def _rotation_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.baseFilename + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def shouldRollover(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+        elif self._replaced():
+            self._reopen()
+        return self.maxBytes > 0 and os.fstat(self.stream.fileno()).st_size >= self.maxBytes
+
+    def doRollover(self):
+        with self._rotation_lock():
+            if self._replaced():
+                self._reopen()  # another process rotated while we waited for the lock
+                return
+            self.flush_batch()
+            super().doRollover()
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        with self.lock:
+            if self.stream and hasattr(self.stream, "flush"):
+                self.stream.flush()
+
+    def close(self):
+        self.flush_batch()
+        super().close()
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Drops the record instead of waiting when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Resolve the message and traceback here, as QueueHandler does, but keep extra= fields intact.
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _BatchingQueueListener(QueueListener):
+    """Flushes the file sinks when the queue is drained or every LOG_FLUSH_BATCH records."""
+
+    def __init__(self, log_queue, queue_handler, *handlers):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self._pending = 0
+
+    def handle(self, record):
+        super().handle(record)
+        self._pending += 1
+        if self._pending >= LOG_FLUSH_BATCH or self.queue.empty():
+            self.flush()
+
+    def flush(self):
+        dropped, self.queue_handler.dropped = self.queue_handler.dropped, 0
+        if dropped:
+            super().handle(logging.makeLogRecord({
+                "name": "utils.logging_config", "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": f"Log queue full: dropped {dropped} records.", "dropped_records": dropped,
+            }))
+        for handler in self.handlers:
+            if isinstance(handler, _BatchedFileHandler):
+                handler.flush_batch()
+            else:
+                handler.flush()
+        self._pending = 0
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _file_sink(file_name, level, names=None):
+    handler = _BatchedFileHandler(
+        os.path.join(LOG_DIR, file_name), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
     )
-    error_handler.setLevel(logging.ERROR)
-    error_handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
-    app.logger.addHandler(error_handler)
+    handler.setLevel(level)
+    handler.setFormatter(JsonLineFormatter())
+    handler.addFilter(_LoggerFilter(names))
+    return handler
+
+
+def _build_sinks(log_level):
+    sinks = [
+        _file_sink("app.log", log_level),
+        _file_sink("error.log", logging.ERROR),
+    ]
+    for file_name in dict.fromkeys(EVENT_LOGGERS.values()):
+        names = [name for name, sink in EVENT_LOGGERS.items() if sink == file_name]
+        sinks.append(_file_sink(file_name, logging.INFO, names))
 
     console_handler = logging.StreamHandler()
     console_handler.setLevel(log_level)
     console_handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
-    app.logger.addHandler(console_handler)
+    console_handler.addFilter(_LoggerFilter())
+    sinks.append(console_handler)
+    return sinks
+
+
+def _start_listener(log_level):
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            logging.getLogger().removeHandler(_listener.queue_handler)
+
+        queue_handler = _NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_MAX_RECORDS))
+        _listener = _BatchingQueueListener(queue_handler.queue, queue_handler, *_build_sinks(log_level))
+        logging.getLogger().addHandler(queue_handler)
+        _listener.start()
+
+
+def _restart_after_fork():
+    # The listener thread does not survive fork(); a forked worker gets its own,
+    # with a fresh queue since the parent's may have been locked mid-put.
+    global _listener_lock
+    _listener_lock = threading.Lock()
+    if _listener is not None and _listener._thread is not None:
+        _listener.queue = _listener.queue_handler.queue = queue.Queue(LOG_QUEUE_MAX_RECORDS)
+        _listener._thread = None
+        _listener.start()
+
+
+def shutdown_logging():
+    """Writes out everything still queued. Registered with atexit."""
+    with _listener_lock:
+        if _listener is not None and _listener._thread is not None:
+            _listener.stop()
+            _listener.flush()
+
+
+atexit.register(shutdown_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
 
-    app.logger.info(f"Logging initialized at {datetime.utcnow().isoformat()}Z")
 
+def setup_logging(app):
+    log_level = logging.getLevelName(os.environ.get("LOG_LEVEL", "INFO"))
+
+    # Module loggers and app.logger propagate to the root logger's queue handler.
+    logging.getLogger().setLevel(logging.WARNING)
+    for name in APP_LOGGERS:
+        logging.getLogger(name).setLevel(log_level)
+    app.logger.setLevel(log_level)
+    app.logger.handlers.clear()
+    for name in EVENT_LOGGERS:
+        logging.getLogger(name).setLevel(logging.INFO)
+    _start_listener(log_level)
 
+    app.logger.info(f"Logging initialized at {datetime.now(timezone.utc).isoformat()}")
+
+
+# --- Event Helpers ---
 def log_user_activity(user_id, action, details=None, ip_address=None):
-    logger = logging.getLogger("activity")
-    activity_log = {
-        "timestamp": datetime.utcnow().isoformat() + "Z",
-        "user_id": user_id,
-        "action": action,
-        "details": details or {},
-        "ip_address": ip_address,
-    }
-    with open(os.path.join(LOG_DIR, "activity.log"), "a") as f:
-        f.write(f"{activity_log}\n")
-    logging.getLogger("activity").info(f"USER_ACTIVITY: {activity_log}")
+    logging.getLogger("activity").info(
+        "user_activity",
+        extra={"user_id": user_id, "action": action, "details": details or {}, "ip_address": ip_address},
+    )
 
 
 def log_security_event(event_type, user_id=None, ip_address=None, details=None):
-    logger = logging.getLogger("security")
-    security_log = {
-        "timestamp": datetime.utcnow().isoformat() + "Z",
-        "event_type": event_type,
-        "user_id": user_id,
-        "ip_address": ip_address,
-        "details": details or {},
-    }
-    with open(os.path.join(LOG_DIR, "security.log"), "a") as f:
-        f.write(f"{security_log}\n")
-    logging.getLogger("security").warning(f"SECURITY_EVENT: {security_log}")
+    logging.getLogger("security").warning(
+        "security_event",
+        extra={"event_type": event_type, "user_id": user_id, "ip_address": ip_address, "details": details or {}},
+    )
 
 
 def log_api_request(
     method, path, status_code, duration_ms, user_id=None, ip_address=None
 ):
+    logging.getLogger("access").info(
+        "request",
+        extra={
+            "method": method,
+            "path": path,
+            "status": status_code,
+            "duration_ms": round(duration_ms, 2),
+            "user_id": user_id,
+            "ip_address": ip_address,
+        },
+    )
+
+
+def log_query_summary(method, path, query_count, total_ms, repeated=None):
     logger = logging.getLogger("access")
-    access_log = [
-        datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
-        method,
-        path,
-        str(status_code),
-        f"{duration_ms:.2f}ms",
-    ]
-    logger.info(" ".join(access_log))
+    fields = {
+        "method": method,
+        "path": path,
+        "queries": query_count,
+        "db_time_ms": round(total_ms, 2),
+        "n_plus_one": [{"count": count, "shape": shape[:120]} for shape, count in repeated or []],
+    }
+    if repeated:
+        logger.warning("sql_summary", extra=fields)
+    else:
+        logger.info("sql_summary", extra=fields)
 
 
 def log_database_query(query_type, table, duration_ms, rows_affected=0, error=None):
-    logger = logging.getLogger("database")
-    db_log = {
-        "timestamp": datetime.utcnow().isoformat() + "Z",
-        "query_type": query_type,
-        "table": table,
-        "duration_ms": duration_ms,
-        "rows_affected": rows_affected,
-        "error": str(error) if error else None,
-    }
-    logger.info(f"DB_QUERY: {db_log}")
+    logging.getLogger("database").info(
+        "db_query",
+        extra={
+            "query_type": query_type,
+            "table": table,
+            "duration_ms": duration_ms,
+            "rows_affected": rows_affected,
+            "error": str(error) if error else None,
+        },
+    )
@@ -0,0 +1,251 @@
+# utils/media_serving.py
+"""
+File responses for uploaded media: condition images and videos, chat
+attachments, doctor documents.
+
+send_media() replaces send_from_directory() for these routes:
+
+  * Conditional GET: strong ETag (mtime + size) and Last-Modified; a
+    matching If-None-Match / If-Modified-Since gets a 304 without opening
+    the file.
+  * Range requests: a single byte range (honouring If-Range) gets a 206 with
+    exactly those bytes; unsatisfiable ranges get a 416. Open-ended ranges
+    ("bytes=N-", what <video> sends when seeking) are capped at
+    MEDIA_MAX_OPEN_RANGE_BYTES, so a seek in a large video streams one chunk
+    and the browser asks for the next one. The worker is not tied up
+    streaming the rest of the file.
+  * Zero-copy: when the body runs to the end of the file (whole files and
+    tail ranges) and the WSGI server offers wsgi.file_wrapper, the open file
+    is handed to the server. Any other range is read in MEDIA_CHUNK_SIZE
+    pieces and stops at its end: a server may iterate the wrapper to EOF
+    (gunicorn does under TLS or with sendfile off), which for a seek near
+    the start of a large video would read the whole file.
+  * Offload (MEDIA_OFFLOAD): 'x-accel-redirect' answers with an empty
+    response and an X-Accel-Redirect header so nginx streams the file (and
+    handles ranges) itself. MEDIA_ACCEL_REDIRECT_MAP maps directories to
+    internal nginx locations, e.g.
+        /app/static=/_protected/static
+    'x-sendfile' sends the absolute path in X-Sendfile (Apache, lighttpd).
+    Files outside every mapped directory are served by the app.
+
+cached_authorization() keeps positive authorization results (attachment id
+-> filename, document path -> allowed) for MEDIA_AUTH_CACHE_TTL_SECONDS, so
+the range requests a video or PDF viewer fires do not each repeat the
+database lookup. Denials are never cached.
+"""
+import logging
+import mimetypes
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from flask import Response, request
+from werkzeug.datastructures import Headers
+from werkzeug.http import http_date, is_resource_modified, parse_if_range_header, parse_range_header, quote_etag
+from werkzeug.security import safe_join
+
+from utils.metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+MEDIA_OFFLOAD = os.environ.get('MEDIA_OFFLOAD', '').strip().lower()  # '', 'x-accel-redirect' or 'x-sendfile'
+MEDIA_ACCEL_REDIRECT_MAP = os.environ.get('MEDIA_ACCEL_REDIRECT_MAP', '')
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE', 'True').lower() in ['true', '1', 't']
+MEDIA_CHUNK_SIZE = int(os.environ.get('MEDIA_CHUNK_SIZE', 256 * 1024))
+MEDIA_MAX_OPEN_RANGE_BYTES = int(os.environ.get('MEDIA_MAX_OPEN_RANGE_BYTES', 8 * 1024 * 1024))
+MEDIA_AUTH_CACHE_TTL_SECONDS = float(os.environ.get('MEDIA_AUTH_CACHE_TTL_SECONDS', 30))
+MEDIA_AUTH_CACHE_MAX_ENTRIES = 10000
+
+_UNSATISFIABLE = object()
+
+
+# --- Authorization Cache ---
+class _AuthorizationCache:
+    def __init__(self, ttl=MEDIA_AUTH_CACHE_TTL_SECONDS, max_entries=MEDIA_AUTH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def set(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[key] = (now + self.ttl, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+_authorization_cache = _AuthorizationCache()
+
+
+def cached_authorization(key, loader):
+    """loader()'s result for `key`, cached briefly when truthy. Include the user in the key."""
+    if _authorization_cache.ttl <= 0:
+        return loader()
+    value = _authorization_cache.get(key)
+    CACHE_LOOKUPS.inc(cache='media_authorization', result='miss' if value is None else 'hit')
+    if value is None:
+        value = loader()
+        if value:
+            _authorization_cache.set(key, value)
+    return value
+
+
+def invalidate_authorization(key):
+    _authorization_cache.invalidate(key)
+
+
+# --- Offload ---
+def _parse_accel_map(raw):
+    mapping = []
+    for item in raw.replace(';', ',').split(','):
+        if '=' not in item:
+            continue
+        directory, location = item.split('=', 1)
+        mapping.append((os.path.realpath(directory.strip()), '/' + location.strip().strip('/')))
+    return mapping
+
+
+_ACCEL_LOCATIONS = _parse_accel_map(MEDIA_ACCEL_REDIRECT_MAP)
+
+
+def _accel_location(path):
+    real_path = os.path.realpath(path)
+    for directory, location in _ACCEL_LOCATIONS:
+        if real_path.startswith(directory + os.sep):
+            return location + '/' + quote(os.path.relpath(real_path, directory).replace(os.sep, '/'))
+    return None
+
+
+def _offload_response(path, headers, mimetype):
+    if MEDIA_OFFLOAD == 'x-sendfile':
+        headers['X-Sendfile'] = os.path.realpath(path)
+    elif MEDIA_OFFLOAD == 'x-accel-redirect':
+        location = _accel_location(path)
+        if location is None:
+            logger.debug(f"No MEDIA_ACCEL_REDIRECT_MAP entry covers {path}; serving it from the app.")
+            return None
+        headers['X-Accel-Redirect'] = location
+    else:
+        return None
+    return Response(status=200, headers=headers, mimetype=mimetype)
+
+
+# --- Ranges ---
+def _requested_range(environ, etag, last_modified, size):
+    """(start, stop) for a satisfiable single range, None for a full response, or _UNSATISFIABLE."""
+    byte_range = parse_range_header(environ.get('HTTP_RANGE'))
+    if byte_range is None or byte_range.units != 'bytes' or len(byte_range.ranges) != 1:
+        return None  # absent, malformed or multipart: send the whole file
+    if_range = parse_if_range_header(environ.get('HTTP_IF_RANGE'))
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None and if_range.date != last_modified:
+        return None
+
+    start, stop = byte_range.ranges[0]
+    if stop is None:
+        if start < 0:
+            start = max(size + start, 0)  # suffix range: the last N bytes
+        elif MEDIA_MAX_OPEN_RANGE_BYTES > 0:
+            stop = start + MEDIA_MAX_OPEN_RANGE_BYTES
+    if start >= size:
+        return _UNSATISFIABLE
+    return start, min(stop if stop is not None else size, size)
+
+
+def _read_range(file, length):
+    try:
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(MEDIA_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def _file_body(environ, file, length, to_eof):
+    file_wrapper = environ.get('wsgi.file_wrapper')
+    # File wrappers may read until EOF, so they only serve bodies that end there.
+    if MEDIA_SENDFILE and file_wrapper is not None and to_eof:
+        return file_wrapper(file, MEDIA_CHUNK_SIZE)
+    return _read_range(file, length)
+
+
+# --- Responses ---
+def send_media(directory, filename, as_attachment=False, download_name=None, max_age=0, public=False):
+    """
+    Response for `filename` inside `directory`. Raises FileNotFoundError if the
+    path escapes the directory or is not a regular file.
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        raise FileNotFoundError(filename)
+    stat = os.stat(path)
+
+    etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+    download_name = download_name or os.path.basename(filename)
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+    headers = Headers()
+    headers['Accept-Ranges'] = 'bytes'
+    headers['ETag'] = quote_etag(etag)
+    headers['Last-Modified'] = http_date(last_modified)
+    headers['Cache-Control'] = f"{'public' if public else 'private'}, max-age={max_age}"
+    headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline', filename=download_name)
+
+    environ = request.environ
+    if not is_resource_modified(environ, etag=etag, last_modified=last_modified):
+        return Response(status=304, headers=headers)
+
+    if MEDIA_OFFLOAD:
+        response = _offload_response(path, headers, mimetype)
+        if response is not None:
+            return response
+
+    size = stat.st_size
+    byte_range = _requested_range(environ, etag, last_modified, size)
+    if byte_range is _UNSATISFIABLE:
+        headers['Content-Range'] = f"bytes */{size}"
+        return Response(status=416, headers=headers)
+    start, stop = byte_range or (0, size)
+    status = 206 if byte_range else 200
+    if byte_range:
+        headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+    if environ.get('REQUEST_METHOD') == 'HEAD':
+        response = Response(status=status, headers=headers, mimetype=mimetype)
+        response.content_length = stop - start
+        return response
+
+    file = open(path, 'rb')
+    try:
+        file.seek(start)
+        body = _file_body(environ, file, stop - start, stop == size)
+    except Exception:
+        file.close()
+        raise
+    response = Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
+    response.content_length = stop - start
+    return response
@@ -0,0 +1,439 @@
+# utils/metrics.py
+"""
+In-process metrics registry exposed on /metrics in the Prometheus text format.
+
+Modules declare their metrics at import time and update them where the event
+happens:
+
+    DB_CONNECTIONS_OPENED = metrics.Counter('db_connections_opened_total', '...', ['pool'])
+    DB_CONNECTIONS_OPENED.inc(pool=self.name)
+
+Counter, Histogram and Gauge are enough for what the app reports. Histograms
+keep fixed buckets, so latency percentiles come from the scraper, e.g.
+
+    histogram_quantile(0.95, sum by (le, endpoint) (rate(http_request_duration_seconds_bucket[5m])))
+
+register_collector() adds a callback that sets gauges from state kept
+elsewhere (pool sizes, cache entries). Callbacks run just before each scrape.
+
+init_metrics() records, for every request, the endpoint (the Flask endpoint
+name, never the raw path), method, status, latency and the number of SQL
+statements it ran.
+
+Multi-process deployments (gunicorn workers) set METRICS_MULTIPROC_DIR to a
+directory shared by the workers, emptied before the server starts. Each
+process then keeps its values in an mmap'd file there (metrics_<pid>.db)
+instead of in a dict. /metrics, whichever worker answers it, sums the files:
+  * counters and histograms over every file, so a restarted worker's counts
+    are not lost;
+  * gauges over the files of processes that are still alive.
+Workers refresh their collector gauges at most every
+METRICS_GAUGE_REFRESH_SECONDS while serving requests, since only the
+scraped worker runs its callbacks at scrape time. When a worker exits,
+mark_process_dead() (gunicorn's child_exit hook) folds its counts into
+metrics_archive.db, so recycled workers do not leave a file each behind.
+
+/metrics is not public by default. With METRICS_TOKEN set, a scrape needs
+"Authorization: Bearer <token>". Without a token, only loopback clients are
+answered, unless METRICS_PUBLIC opens the endpoint explicitly (e.g. on a
+network only the scraper can reach). Refused scrapes get a 403 when a token
+is configured and a 404 otherwise. Behind a reverse proxy on the same host
+every client looks local, so set a token there.
+"""
+import bisect
+import hmac
+import ipaddress
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+from flask import Response, abort, g, request
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() in ['true', '1', 't']
+METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR', '').strip()
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '').strip()
+METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', 'False').lower() in ['true', '1', 't']
+METRICS_GAUGE_REFRESH_SECONDS = float(os.environ.get('METRICS_GAUGE_REFRESH_SECONDS', 5))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+_METRIC_NAME = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*$')
+_FILE_NAME = re.compile(r'^metrics_(\d+|archive)\.db$')
+
+
+# --- Value Stores ---
+class _LocalValues:
+    """Values of this process in a dict. Keys are (family, sample, ((label, value), ...))."""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def add(self, increments):
+        with self._lock:
+            for key, amount in increments:
+                self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = float(value)
+
+    def items(self):
+        with self._lock:
+            return list(self._values.items())
+
+
+class _MmapValues(_LocalValues):
+    """
+    Values of this process in <dir>/metrics_<pid>.db. Layout: the number of
+    bytes in use (8 bytes), then entries of key length (4 bytes), JSON key
+    padded to 8 bytes, float64 value. The used count is written after the
+    entry, so a reader never sees a half-written key.
+    """
+    INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, directory, name=None):
+        super().__init__()
+        self.path = os.path.join(directory, f"metrics_{name or os.getpid()}.db")
+        self._positions = {}
+        self._file = open(self.path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size < self.INITIAL_SIZE:
+            self._file.truncate(self.INITIAL_SIZE)
+        self._capacity = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), self._capacity)
+        self._used = struct.unpack_from('q', self._map, 0)[0] or 8
+        for key, _, position in _read_entries(self._map, self._used):
+            self._positions[key] = position
+
+    def _position(self, key):
+        position = self._positions.get(key)
+        if position is None:
+            encoded = json.dumps([key[0], key[1], key[2]]).encode('utf-8')
+            padded_length = len(encoded) + (-(4 + len(encoded)) % 8)
+            entry_size = 4 + padded_length + 8
+            while self._used + entry_size > self._capacity:
+                self._capacity *= 2
+                self._map.close()
+                self._file.truncate(self._capacity)
+                self._map = mmap.mmap(self._file.fileno(), self._capacity)
+            struct.pack_into(f'i{padded_length}sd', self._map, self._used, len(encoded), encoded, 0.0)
+            position = self._used + 4 + padded_length
+            self._used += entry_size
+            struct.pack_into('q', self._map, 0, self._used)
+            self._positions[key] = position
+        return position
+
+    def add(self, increments):
+        with self._lock:
+            for key, amount in increments:
+                position = self._position(key)
+                struct.pack_into('d', self._map, position, struct.unpack_from('d', self._map, position)[0] + amount)
+
+    def set(self, key, value):
+        with self._lock:
+            struct.pack_into('d', self._map, self._position(key), float(value))
+
+    def items(self):
+        with self._lock:
+            return [(key, value) for key, value, _ in _read_entries(self._map, self._used)]
+
+
+def _read_entries(data, used):
+    """(key, value, value offset) for each entry of a metrics file's bytes."""
+    position = 8
+    while position < used:
+        key_length = struct.unpack_from('i', data, position)[0]
+        padded_length = key_length + (-(4 + key_length) % 8)
+        family, sample, labels = json.loads(bytes(data[position + 4:position + 4 + key_length]).decode('utf-8'))
+        value_position = position + 4 + padded_length
+        yield (family, sample, tuple(tuple(pair) for pair in labels)), struct.unpack_from('d', data, value_position)[0], value_position
+        position = value_position + 8
+
+
+def _read_file(path):
+    """[(key, value)] from another process's metrics file, or None if it cannot be read."""
+    try:
+        with open(path, 'rb') as metrics_file:
+            data = metrics_file.read()
+    except OSError:
+        return None
+    if len(data) < 8:
+        return []
+    used = min(struct.unpack_from('q', data, 0)[0], len(data))
+    return [(key, value) for key, value, _ in _read_entries(data, used)]
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _new_store():
+    if METRICS_MULTIPROC_DIR:
+        os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+        return _MmapValues(METRICS_MULTIPROC_DIR)
+    return _LocalValues()
+
+
+_store = _new_store()
+
+
+def _reset_after_fork():
+    # A forked worker writes its own file; the parent's values stay in the parent's.
+    global _store
+    if METRICS_MULTIPROC_DIR:
+        _store = _new_store()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# --- Metric Types ---
+_registry = {}
+_collectors = []
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        if not _METRIC_NAME.match(name) or name in _registry:
+            raise ValueError(f"Invalid or duplicate metric name: {name!r}")
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry[name] = self
+
+    def _labels(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount:
+            _store.add([((self.name, self.name, self._labels(labels)), amount)])
+
+
+class Gauge(_Metric):
+    """Per-process value; in multi-process mode the live processes' values are summed."""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        _store.set((self.name, self.name, self._labels(labels)), value)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(bound) for bound in buckets))
+        self._bucket_labels = tuple(_format_value(bound) for bound in self.buckets) + ('+Inf',)
+
+    def observe(self, value, **labels):
+        label_pairs = self._labels(labels)
+        bound = self._bucket_labels[bisect.bisect_left(self.buckets, value)]
+        _store.add([
+            ((self.name, f"{self.name}_bucket", label_pairs + (('le', bound),)), 1),
+            ((self.name, f"{self.name}_sum", label_pairs), value),
+            ((self.name, f"{self.name}_count", label_pairs), 1),
+        ])
+
+
+def register_collector(callback):
+    """callback() is run before each scrape to set gauges from state kept elsewhere."""
+    _collectors.append(callback)
+    return callback
+
+
+def _run_collectors():
+    for callback in _collectors:
+        try:
+            callback()
+        except Exception as e:
+            logger.warning(f"Metrics collector {getattr(callback, '__name__', callback)} failed: {e}")
+
+
+# --- Exposition ---
+def _format_value(value):
+    value = float(value)
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if value.is_integer() and abs(value) < 1e15 else repr(value)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _sample_line(sample, label_pairs, value):
+    labels = ','.join(f'{name}="{_escape(label)}"' for name, label in label_pairs)
+    return f"{sample}{{{labels}}} {_format_value(value)}" if labels else f"{sample} {_format_value(value)}"
+
+
+def _collect_samples():
+    """{(family, sample, labels): value} for this process, or summed over METRICS_MULTIPROC_DIR."""
+    if not METRICS_MULTIPROC_DIR:
+        return dict(_store.items())
+    totals = {}
+    for file_name in os.listdir(METRICS_MULTIPROC_DIR):
+        match = _FILE_NAME.match(file_name)
+        if not match:
+            continue
+        pid = int(match.group(1)) if match.group(1).isdigit() else None
+        if pid == os.getpid():
+            entries = _store.items()
+        else:
+            entries = _read_file(os.path.join(METRICS_MULTIPROC_DIR, file_name)) or []
+        alive = None
+        for key, value in entries:
+            if _is_gauge(key):
+                alive = pid is not None and _process_alive(pid) if alive is None else alive
+                if not alive:
+                    continue
+            totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+def _is_gauge(key):
+    metric = _registry.get(key[0])
+    return metric is not None and metric.kind == 'gauge'
+
+
+_archive = None
+
+
+def mark_process_dead(pid):
+    """
+    Folds the counters and histograms of exited process `pid` into
+    metrics_archive.db and removes its file. Call from the process manager
+    (gunicorn's child_exit), never from two processes at once.
+    """
+    global _archive
+    if not METRICS_MULTIPROC_DIR:
+        return
+    path = os.path.join(METRICS_MULTIPROC_DIR, f"metrics_{pid}.db")
+    entries = _read_file(path)
+    if entries is None:
+        return
+    if _archive is None:
+        _archive = _MmapValues(METRICS_MULTIPROC_DIR, 'archive')
+    _archive.add([(key, value) for key, value in entries if not _is_gauge(key)])
+    os.remove(path)
+
+
+def render_metrics():
+    """All registered metrics in the Prometheus text exposition format (0.0.4)."""
+    _run_collectors()
+    samples = {}
+    for (family, sample, label_pairs), value in _collect_samples().items():
+        samples.setdefault(family, []).append((sample, label_pairs, value))
+
+    lines = []
+    for name, metric in _registry.items():
+        lines.append(f"# HELP {name} {_escape(metric.documentation)}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        family = sorted(samples.get(name, []))
+        if metric.kind != 'histogram':
+            lines.extend(_sample_line(sample, label_pairs, value) for sample, label_pairs, value in family)
+            continue
+        # Buckets are stored per bucket; the format wants them cumulative.
+        series = {}
+        for sample, label_pairs, value in family:
+            if sample.endswith('_bucket'):
+                bucket = dict(label_pairs)['le']
+                base_labels = tuple(pair for pair in label_pairs if pair[0] != 'le')
+                series.setdefault(base_labels, {}).setdefault('buckets', {})[bucket] = value
+            else:
+                series.setdefault(label_pairs, {})[sample] = value
+        for label_pairs, values in sorted(series.items()):
+            cumulative = 0.0
+            for bound in metric._bucket_labels:
+                cumulative += values.get('buckets', {}).get(bound, 0.0)
+                lines.append(_sample_line(f"{name}_bucket", label_pairs + (('le', bound),), cumulative))
+            lines.append(_sample_line(f"{name}_sum", label_pairs, values.get(f"{name}_sum", 0.0)))
+            lines.append(_sample_line(f"{name}_count", label_pairs, values.get(f"{name}_count", 0.0)))
+    return '\n'.join(lines) + '\n'
+
+
+# --- Request Metrics ---
+HTTP_REQUESTS = Counter(
+    'http_requests_total', 'HTTP requests by Flask endpoint, method and status code.', ['endpoint', 'method', 'status'])
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Time from before_request to after_request, by Flask endpoint.',
+    ['endpoint', 'method'])
+HTTP_REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'SQL statements run on the request connection, per request.', ['endpoint'],
+    buckets=QUERY_COUNT_BUCKETS)
+
+# Shared by the in-process caches; hit rate = hit / (hit + miss) per cache.
+CACHE_LOOKUPS = Counter('cache_lookups_total', 'Cache lookups by cache and result (hit, shared_hit, miss).',
+                        ['cache', 'result'])
+CACHE_ENTRIES = Gauge('cache_entries', 'Entries held by an in-process cache.', ['cache'])
+
+_last_gauge_refresh = 0.0
+
+
+def _start_timer():
+    g._metrics_started = time.perf_counter()
+
+
+def _record_request(response):
+    global _last_gauge_refresh
+    started = g.pop('_metrics_started', None)
+    if started is None:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+    HTTP_REQUEST_QUERIES.observe(g.get('_query_count', 0), endpoint=endpoint)
+    if METRICS_MULTIPROC_DIR and time.monotonic() - _last_gauge_refresh > METRICS_GAUGE_REFRESH_SECONDS:
+        _last_gauge_refresh = time.monotonic()
+        _run_collectors()
+    return response
+
+
+def _is_loopback(address):
+    try:
+        return ipaddress.ip_address(address or '').is_loopback
+    except ValueError:
+        return False
+
+
+def _scrape_allowed():
+    if METRICS_TOKEN:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}")
+    return METRICS_PUBLIC or _is_loopback(request.remote_addr)
+
+
+def metrics_view():
+    if not _scrape_allowed():
+        abort(403 if METRICS_TOKEN else 404)
+    return Response(render_metrics(), mimetype='text/plain', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_metrics(app):
+    app.config.setdefault('METRICS_ENABLED', METRICS_ENABLED)
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
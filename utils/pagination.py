@@ -0,0 +1,206 @@
+# utils/pagination.py
+"""
+Keyset (seek) pagination and cached row counts.
+
+seek_page() pages on (sort column, id) instead of OFFSET: the next page is
+"rows after the last one shown", so page 500 costs the same as page 1 when
+the sort column is indexed. Cursors are opaque URL-safe tokens holding the
+boundary row's sort value and id; views pass them around as ?after= and
+?before= query arguments. Sort columns may be nullable: NULL sorts first in
+ascending order and last in descending order, as MySQL does.
+
+count_rows() replaces SQL_CALC_FOUND_ROWS / FOUND_ROWS() (deprecated in
+MySQL 8, and it forces the page query to visit every matching row) with a
+separate COUNT(*) that is cached per query and parameters for
+PAGINATION_COUNT_TTL_SECONDS. Totals shown next to pagers can therefore lag
+writes by up to that long; page contents never do.
+"""
+import base64
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+COUNT_CACHE_TTL_SECONDS = float(os.environ.get('PAGINATION_COUNT_TTL_SECONDS', 30))
+COUNT_CACHE_MAX_ENTRIES = 2000
+
+
+# --- Cursors ---
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    if isinstance(value, timedelta):
+        return {'td': value.total_seconds()}
+    if isinstance(value, Decimal):
+        return {'dec': str(value)}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+        if 'td' in value:
+            return timedelta(seconds=value['td'])
+        if 'dec' in value:
+            return Decimal(value['dec'])
+        raise ValueError("unknown cursor value")
+    return value
+
+
+def encode_cursor(sort_value, row_id):
+    raw = json.dumps([_encode_value(sort_value), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """(sort_value, row_id) for a token from encode_cursor(), or None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return _decode_value(sort_value), int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+# --- Seek Pagination ---
+class Page:
+    """One page of rows plus the cursors to its neighbours (None when there is no neighbour)."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _seek_clause(sort_column, id_column, sort_value, row_id, descending):
+    """SQL + params selecting rows strictly after (sort_value, row_id) in the given order."""
+    id_op = '<' if descending else '>'
+    if sort_column is None:
+        return f"{id_column} {id_op} %s", [row_id]
+    if sort_value is None:
+        # NULLs sort first ascending, last descending.
+        if descending:
+            return f"({sort_column} IS NULL AND {id_column} < %s)", [row_id]
+        return f"(({sort_column} IS NULL AND {id_column} > %s) OR {sort_column} IS NOT NULL)", [row_id]
+    sort_op = '<' if descending else '>'
+    clause = f"({sort_column} {sort_op} %s OR ({sort_column} = %s AND {id_column} {id_op} %s)"
+    clause += f" OR {sort_column} IS NULL)" if descending else ")"
+    return clause, [sort_value, sort_value, row_id]
+
+
+def seek_page(cursor, select_sql, where_sql, params, id_column, id_key, per_page,
+              sort_column=None, sort_key=None, descending=False, after=None, before=None, offset=0):
+    """
+    Fetches one page ordered by (sort_column, id_column).
+
+    select_sql: "SELECT ... FROM ... JOIN ..." without WHERE/ORDER/LIMIT.
+    where_sql / params: the filter (use "1=1" for none).
+    id_key / sort_key: the keys of id_column / sort_column in the result rows.
+    after / before: cursor tokens; `after` wins if both are given. Without
+    either, the first page is returned, skipping `offset` rows (for numbered
+    page links, which are fine for shallow pages).
+    """
+    after_key = decode_cursor(after)
+    before_key = None if after_key else decode_cursor(before)
+    boundary = after_key or before_key
+    # Walking backwards means reading in the opposite order and flipping the rows afterwards.
+    read_descending = descending if before_key is None else not descending
+
+    clauses = [f"({where_sql})"]
+    query_params = list(params)
+    if boundary is not None:
+        seek_sql, seek_params = _seek_clause(sort_column, id_column, boundary[0], boundary[1], read_descending)
+        clauses.append(seek_sql)
+        query_params.extend(seek_params)
+    direction = 'DESC' if read_descending else 'ASC'
+    order_sql = f"{id_column} {direction}" if sort_column is None else f"{sort_column} {direction}, {id_column} {direction}"
+    query = f"{select_sql} WHERE {' AND '.join(clauses)} ORDER BY {order_sql} LIMIT %s"
+    query_params.append(per_page + 1)
+    if boundary is None and offset:
+        query += " OFFSET %s"
+        query_params.append(offset)
+
+    cursor.execute(query, tuple(query_params))
+    rows = cursor.fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before_key is not None:
+        rows.reverse()
+
+    def token(row):
+        return encode_cursor(row[sort_key] if sort_key else None, row[id_key])
+
+    if not rows:
+        return Page([])
+    if before_key is not None:
+        return Page(rows, next_cursor=token(rows[-1]), prev_cursor=token(rows[0]) if has_more else None)
+    has_prev = after_key is not None or offset > 0
+    return Page(rows, next_cursor=token(rows[-1]) if has_more else None,
+                prev_cursor=token(rows[0]) if has_prev else None)
+
+
+# --- Cached Counts ---
+class _CountCache:
+    def __init__(self, ttl=COUNT_CACHE_TTL_SECONDS, max_entries=COUNT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_count_cache = _CountCache()
+
+
+def count_rows(cursor, count_sql, params=()):
+    """
+    Runs a "SELECT COUNT(*) AS total FROM ... WHERE ..." query, caching the
+    result per (query, params) for PAGINATION_COUNT_TTL_SECONDS.
+    """
+    key = (count_sql, tuple(params))
+    if _count_cache.ttl > 0:
+        cached = _count_cache.get(key)
+        if cached is not None:
+            return cached
+    cursor.execute(count_sql, tuple(params))
+    row = cursor.fetchone()
+    if row is None:
+        total = 0
+    elif isinstance(row, dict):
+        total = int(row['total'])
+    else:
+        total = int(row[0])
+    if _count_cache.ttl > 0:
+        _count_cache.set(key, total)
+    return total
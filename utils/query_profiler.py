@@ -0,0 +1,174 @@
+# utils/query_profiler.py
+import os
+import re
+import time
+from collections import Counter
+
+from flask import g, has_request_context, current_app, request
+
+from utils.logging_config import log_database_query, log_query_summary
+
+# --- Statement Normalization ---
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_RE = re.compile(r"%\(\w+\)s|%s")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+`?(\w+)`?", re.IGNORECASE)
+
+
+def normalize_statement(statement):
+    """Reduces a SQL statement to its shape: literals and placeholders become '?'."""
+    if isinstance(statement, (bytes, bytearray)):
+        statement = statement.decode("utf-8", "replace")
+    shape = _COMMENT_RE.sub(" ", statement or "")
+    shape = _STRING_RE.sub("?", shape)
+    shape = _PLACEHOLDER_RE.sub("?", shape)
+    shape = _NUMBER_RE.sub("?", shape)
+    shape = _IN_LIST_RE.sub("IN (...)", shape)
+    return _WHITESPACE_RE.sub(" ", shape).strip().rstrip(";")
+
+
+def _statement_type_and_table(shape):
+    query_type = shape.split(" ", 1)[0].upper() if shape else ""
+    table_match = _TABLE_RE.search(shape)
+    return query_type, table_match.group(1) if table_match else None
+
+
+# --- Per-request Profile ---
+class QueryProfile:
+    def __init__(self):
+        self.statements = []  # (shape, duration_ms, rowcount)
+
+    def record(self, shape, duration_ms, rowcount):
+        self.statements.append((shape, duration_ms, rowcount))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def total_ms(self):
+        return sum(duration for _, duration, _ in self.statements)
+
+    def repeated_shapes(self, threshold):
+        """Statement shapes executed at least `threshold` times: likely N+1 loops."""
+        counts = Counter(shape for shape, _, _ in self.statements)
+        return [(shape, n) for shape, n in counts.most_common() if n >= threshold]
+
+
+def is_enabled():
+    return has_request_context() and current_app.config.get("SQL_PROFILING", False)
+
+
+def _count_query():
+    # Read by utils.metrics for the per-request query histogram.
+    g._query_count = g.get("_query_count", 0) + 1
+
+
+def get_profile():
+    profile = g.get("_query_profile")
+    if profile is None:
+        profile = QueryProfile()
+        g._query_profile = profile
+    return profile
+
+
+class ProfiledCursor:
+    """Cursor proxy that times every execute() and records it on the request's QueryProfile."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._cursor.close()
+        return False
+
+    def _timed(self, method, statement, *args, **kwargs):
+        started = time.perf_counter()
+        error = None
+        try:
+            return method(statement, *args, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            _count_query()
+            shape = normalize_statement(statement)
+            rowcount = getattr(self._cursor, "rowcount", -1)
+            get_profile().record(shape, duration_ms, rowcount)
+            query_type, table = _statement_type_and_table(shape)
+            log_database_query(query_type, table, round(duration_ms, 2), rowcount, error)
+
+    def execute(self, statement, *args, **kwargs):
+        return self._timed(self._cursor.execute, statement, *args, **kwargs)
+
+    def executemany(self, statement, *args, **kwargs):
+        return self._timed(self._cursor.executemany, statement, *args, **kwargs)
+
+
+class CountingCursor(ProfiledCursor):
+    """Cursor proxy that only counts statements, used for metrics when full profiling is off."""
+
+    def execute(self, statement, *args, **kwargs):
+        _count_query()
+        return self._cursor.execute(statement, *args, **kwargs)
+
+    def executemany(self, statement, *args, **kwargs):
+        _count_query()
+        return self._cursor.executemany(statement, *args, **kwargs)
+
+
+def profile_cursor(cursor):
+    """Wraps `cursor` when SQL profiling, or just query counting for metrics, is enabled for the current request."""
+    if not has_request_context():
+        return cursor
+    if current_app.config.get("SQL_PROFILING", False):
+        return ProfiledCursor(cursor)
+    if current_app.config.get("METRICS_ENABLED", False):
+        return CountingCursor(cursor)
+    return cursor
+
+
+# --- Flask Integration ---
+def _emit_profile(response):
+    profile = g.get("_query_profile")
+    if profile is None or not current_app.config.get("SQL_PROFILING", False):
+        return response
+
+    threshold = current_app.config.get("SQL_N_PLUS_ONE_THRESHOLD", 5)
+    repeated = profile.repeated_shapes(threshold)
+    log_query_summary(
+        method=request.method,
+        path=request.path,
+        query_count=profile.count,
+        total_ms=profile.total_ms,
+        repeated=repeated,
+    )
+    if current_app.config.get("SQL_PROFILING_HEADER", False):
+        response.headers["X-Query-Profile"] = (
+            f"count={profile.count}; time={profile.total_ms:.2f}ms; n_plus_one={len(repeated)}"
+        )
+    return response
+
+
+def init_query_profiler(app):
+    app.config.setdefault(
+        "SQL_PROFILING", os.environ.get("SQL_PROFILING", "False").lower() in ["true", "1", "t"]
+    )
+    app.config.setdefault(
+        "SQL_PROFILING_HEADER", os.environ.get("SQL_PROFILING_HEADER", "False").lower() in ["true", "1", "t"]
+    )
+    app.config.setdefault("SQL_N_PLUS_ONE_THRESHOLD", int(os.environ.get("SQL_N_PLUS_ONE_THRESHOLD", 5)))
+    app.after_request(_emit_profile)
@@ -0,0 +1,166 @@
+# utils/schema_metadata.py
+"""
+In-memory cache of ENUM column definitions.
+
+Forms render ENUM columns as dropdowns (gender, blood_type, plan_type,
+account_status...) and validate submissions against them. get_enum_values()
+serves them from memory. One information_schema query loads every ENUM
+column of the current schema at once. It runs during warm-up (in the
+gunicorn master, so workers inherit the result) or on first use.
+
+Values are parsed from COLUMN_TYPE with MySQL's quoting rules, so a value
+containing a comma or a doubled quote ('') comes back intact.
+
+The definitions only change with a migration. After one, run
+
+    flask --app app schema-metadata refresh
+
+It reloads the definitions, prints them and touches SCHEMA_METADATA_STAMP_FILE.
+Every process on the host stats that file at most every
+SCHEMA_METADATA_CHECK_SECONDS and reloads when it is newer than its
+own load. A (table, column) pair that is not cached, e.g. a column added
+without a refresh, triggers a reload at most once per
+SCHEMA_METADATA_CHECK_SECONDS.
+"""
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+import click
+import mysql.connector
+
+import db
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_METADATA_STAMP_FILE = os.environ.get(
+    'SCHEMA_METADATA_STAMP_FILE', os.path.join(tempfile.gettempdir(), 'health_guide_schema_metadata.stamp')
+)
+SCHEMA_METADATA_CHECK_SECONDS = float(os.environ.get('SCHEMA_METADATA_CHECK_SECONDS', 30))
+
+_ENUM_VALUE = re.compile(r"'((?:[^'\\]|''|\\.)*)'")
+
+
+def parse_enum_definition(column_type):
+    """['a', 'b'] from "enum('a','b')"; [] if column_type is not an ENUM."""
+    if isinstance(column_type, (bytes, bytearray)):
+        column_type = column_type.decode('utf-8')
+    if not column_type or not column_type.lower().startswith('enum(') or not column_type.endswith(')'):
+        return []
+    return [value.replace("''", "'").replace("\\\\", "\\") for value in _ENUM_VALUE.findall(column_type[5:-1])]
+
+
+class SchemaMetadata:
+    def __init__(self, stamp_file=SCHEMA_METADATA_STAMP_FILE, check_interval=SCHEMA_METADATA_CHECK_SECONDS):
+        self.stamp_file = stamp_file
+        self.check_interval = check_interval
+        self._enums = None  # (table, column) -> tuple of values
+        self._loaded_at = 0.0  # wall clock, compared with the stamp file's mtime
+        self._next_check = 0.0
+        self._next_miss_reload = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Reads every ENUM column of the current schema in one query. Returns the number of columns."""
+        loaded_at = time.time()
+        with db.connection(dedicated=True, read_only=True) as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE FROM information_schema.COLUMNS
+                    WHERE TABLE_SCHEMA = DATABASE() AND DATA_TYPE = 'enum'
+                """)
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+        enums = {(table, column): tuple(parse_enum_definition(column_type)) for table, column, column_type in rows}
+        with self._lock:
+            self._enums = enums
+            self._loaded_at = loaded_at
+            self._next_check = time.monotonic() + self.check_interval
+        logger.info(f"Schema metadata: loaded {len(enums)} ENUM columns.")
+        return len(enums)
+
+    def _stamp_is_newer(self):
+        try:
+            return os.path.getmtime(self.stamp_file) > self._loaded_at
+        except OSError:
+            return False
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._enums is not None and now < self._next_check:
+            return
+        with self._lock:
+            if self._enums is not None and now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            stale = self._enums is None or self._stamp_is_newer()
+        if stale:
+            self.load()
+
+    def enum_values(self, table_name, column_name):
+        """Allowed values of table_name.column_name, or [] if it is not an ENUM column or the schema cannot be read."""
+        try:
+            self._ensure_fresh()
+            values = self._enums.get((table_name, column_name))
+            if values is None and time.monotonic() >= self._next_miss_reload:
+                self._next_miss_reload = time.monotonic() + self.check_interval
+                self.load()
+                values = self._enums.get((table_name, column_name))
+        except mysql.connector.Error as e:
+            logger.error(f"Schema metadata: could not load ENUM definitions ({table_name}.{column_name}): {e}")
+            return []
+        if values is None:
+            logger.warning(f"Schema metadata: {table_name}.{column_name} is not an ENUM column.")
+            return []
+        return list(values)
+
+    def enum_columns(self):
+        self._ensure_fresh()
+        with self._lock:
+            return dict(self._enums)
+
+    def touch_stamp(self):
+        """Tells every process sharing the stamp file to reload on its next check."""
+        with open(self.stamp_file, 'a'):
+            pass
+        os.utime(self.stamp_file, None)
+
+
+schema_metadata = SchemaMetadata()
+
+
+def get_enum_values(table_name, column_name):
+    """Allowed values of an ENUM column, from the in-memory schema metadata."""
+    return schema_metadata.enum_values(table_name, column_name)
+
+
+def warm_schema_metadata():
+    try:
+        schema_metadata.load()
+    except mysql.connector.Error as e:
+        logger.warning(f"Schema metadata: not loaded at startup, will load on first use: {e}")
+
+
+# --- CLI ---
+@click.group('schema-metadata')
+def schema_metadata_cli():
+    """Maintain the in-memory schema metadata (ENUM definitions)."""
+
+
+@schema_metadata_cli.command('refresh')
+def refresh_command():
+    """Reload ENUM definitions after a migration and signal running workers to do the same."""
+    schema_metadata.load()
+    schema_metadata.touch_stamp()
+    for (table, column), values in sorted(schema_metadata.enum_columns().items()):
+        click.echo(f"{table}.{column}: {', '.join(values)}")
+    click.echo(f"Touched {schema_metadata.stamp_file}; workers reload within {schema_metadata.check_interval:.0f}s.")
+
+
+def init_schema_metadata(app):
+    app.cli.add_command(schema_metadata_cli)
@@ -0,0 +1,119 @@
+# utils/startup_profile.py
+"""
+Cold-start profiler:
+
+    flask --app app startup profile [--top 30] [--warm-up]
+
+Starts a fresh interpreter with `python -X importtime` and builds the app in
+it, as a worker would: import app, create_app(), register_blueprints() and,
+with --warm-up, warm_up(). It then reports:
+
+  * how long each phase took,
+  * the modules with the largest import time, cumulative (including what
+    they import) and self (their own top-level code),
+  * import time per top-level package (routes, utils, flask, mysql, PIL...).
+
+Run it before and after touching startup code; module-level work such as
+building large constants, creating directories or opening connections
+shows up as self time.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import click
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+_PHASE_MARKER = 'STARTUP_PHASES '
+_PROFILE_SCRIPT = '''
+import json, time
+started = time.perf_counter()
+from app import create_app, register_blueprints, warm_up
+imported = time.perf_counter()
+app = create_app({"BACKGROUND_TASKS": False, "LAZY_BLUEPRINTS": True})
+created = time.perf_counter()
+register_blueprints(app)
+registered = time.perf_counter()
+if WARM_UP:
+    warm_up(app)
+finished = time.perf_counter()
+print("STARTUP_PHASES " + json.dumps({
+    "import app": imported - started,
+    "create_app()": created - imported,
+    "register_blueprints()": registered - created,
+    "warm_up()": finished - registered if WARM_UP else None,
+}))
+'''
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us)] from `python -X importtime` output, in import order."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        try:
+            self_us, cumulative_us, module = line[len('import time:'):].split('|', 2)
+            imports.append((module.strip(), int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue
+    return imports
+
+
+def profile_startup(warm_up=False):
+    """Runs the startup in a child interpreter; returns (phases in seconds, imports)."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"WARM_UP = {bool(warm_up)}\n{_PROFILE_SCRIPT}"],
+        cwd=BASE_DIR, capture_output=True, text=True,
+    )
+    phases = None
+    for line in result.stdout.splitlines():
+        if line.startswith(_PHASE_MARKER):
+            phases = json.loads(line[len(_PHASE_MARKER):])
+    if result.returncode != 0 or phases is None:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith('import time:')]
+        raise click.ClickException("Startup failed in the profiling interpreter:\n" + '\n'.join(errors[-20:]))
+    return phases, parse_importtime(result.stderr)
+
+
+# --- CLI ---
+@click.group('startup')
+def startup_cli():
+    """Measure application cold start."""
+
+
+@startup_cli.command('profile')
+@click.option('--top', default=25, show_default=True, help='Modules listed per table.')
+@click.option('--warm-up', is_flag=True, help='Include warm_up() (template compilation) in the run.')
+def profile_command(top, warm_up):
+    """Per-phase and per-module import time of a fresh app start."""
+    phases, imports = profile_startup(warm_up)
+
+    click.echo("Phase                      seconds")
+    for phase, seconds in phases.items():
+        if seconds is not None:
+            click.echo(f"{phase:<26} {seconds:>7.3f}")
+
+    click.echo(f"\nSlowest imports, cumulative (of {len(imports)} modules)")
+    click.echo(f"{'cumul ms':>9} {'self ms':>8}  module")
+    for module, self_us, cumulative_us in sorted(imports, key=lambda item: -item[2])[:top]:
+        click.echo(f"{cumulative_us / 1000:>9.1f} {self_us / 1000:>8.1f}  {module}")
+
+    click.echo("\nSlowest module bodies, self time")
+    click.echo(f"{'self ms':>8}  module")
+    for module, self_us, _ in sorted(imports, key=lambda item: -item[1])[:top]:
+        click.echo(f"{self_us / 1000:>8.1f}  {module}")
+
+    by_package = {}
+    for module, self_us, _ in imports:
+        package = module.split('.', 1)[0]
+        by_package[package] = by_package.get(package, 0) + self_us
+    click.echo("\nSelf time by top-level package")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        click.echo(f"{self_us / 1000:>8.1f}  {package}")
+
+
+def init_startup_profiler(app):
+    app.cli.add_command(startup_cli)
@@ -0,0 +1,60 @@
+# utils/stream_slots.py
+"""
+Per-process cap on open Server-Sent Events streams (chat and upcoming alerts).
+
+Under gunicorn's gthread workers every open stream holds a worker thread for
+up to STREAM_MAX_SECONDS. gunicorn.conf.py gives each worker
+GUNICORN_STREAM_THREADS threads on top of the GUNICORN_THREADS that serve
+ordinary requests, and sets MAX_OPEN_STREAMS to the same number. Streams
+therefore never take the ordinary request threads. Without MAX_OPEN_STREAMS
+there is no cap, as under the development server, which starts a thread
+per connection.
+
+A stream that finds every slot taken is answered briefly instead of held
+open. The chat stream sends its backlog and ends with a longer retry, so the
+browser reconnects later and falls back to polling. The alert stream answers
+204, so the client polls the JSON endpoint.
+"""
+import os
+import threading
+
+from utils.metrics import Counter, Gauge, register_collector
+
+MAX_OPEN_STREAMS = int(os.environ['MAX_OPEN_STREAMS']) if os.environ.get('MAX_OPEN_STREAMS') else None
+
+SSE_STREAMS_OPEN = Gauge('sse_streams_open', 'Server-Sent Events streams held open by this process.')
+SSE_STREAMS_REFUSED = Counter('sse_streams_refused_total', 'Streams answered without holding a thread because '
+                              'MAX_OPEN_STREAMS was reached, by stream.', ['stream'])
+
+
+class StreamSlots:
+    def __init__(self, limit=MAX_OPEN_STREAMS):
+        self.limit = limit
+        self._open = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, stream):
+        """Takes a slot; False (and counted as refused) when all MAX_OPEN_STREAMS are in use."""
+        with self._lock:
+            if self.limit is None or self._open < self.limit:
+                self._open += 1
+                return True
+        SSE_STREAMS_REFUSED.inc(stream=stream)
+        return False
+
+    def release(self):
+        with self._lock:
+            self._open -= 1
+
+    @property
+    def open(self):
+        with self._lock:
+            return self._open
+
+
+stream_slots = StreamSlots()
+
+
+@register_collector
+def _collect_stream_metrics():
+    SSE_STREAMS_OPEN.set(stream_slots.open)
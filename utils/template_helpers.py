@@ -1,5 +1,6 @@
 # utils/template_helpers.py
 from datetime import datetime, date, time, timedelta
+from utils.image_derivatives import image_srcset
 # No need to import 'builtins' for hasattr as it's a standard built-in function
 # and Flask/Jinja usually make these accessible or you pass the function itself.
 
@@ -81,6 +82,7 @@ def register_template_helpers(app):
     
     # --- ADD HASATTR TO JINJA GLOBALS ---
     app.jinja_env.globals['hasattr'] = hasattr
+    app.jinja_env.globals['image_srcset'] = image_srcset # srcset/sizes for resized upload variants
 
     if app.logger:
-        app.logger.info("Registered Jinja globals: enumerate, timedelta, datetime, date, time, get_current_year, hasattr")
\ No newline at end of file
+        app.logger.info("Registered Jinja globals: enumerate, timedelta, datetime, date, time, get_current_year, hasattr, image_srcset")
\ No newline at end of file
@@ -0,0 +1,232 @@
+# utils/upload_store.py
+"""
+Content-addressed storage for uploaded files.
+
+store_upload() streams an upload to a temporary file in its target folder,
+hashing it as it goes. The file is then kept as <sha256>.<ext> in that
+folder. Uploading the same bytes to the same folder again costs one hash and
+one row update: the temporary copy is dropped and the stored file is shared.
+The folders stay as before (profile_pics, doctor_docs, chat_attachments...).
+So the paths saved in the database, url_for('static', ...) and the
+authorization routes work unchanged, and private folders are never shared
+with public ones.
+
+upload_blobs (migrations/004_upload_blobs.sql) counts the database rows that
+point at each stored file. Every store_upload() takes a reference. The delete
+helpers call release_upload(), which unlinks the file only when the last
+reference goes. Files saved before this store existed have no upload_blobs
+row; release_upload() unlinks them directly, as the old helpers did.
+
+Reference changes run on a dedicated connection and commit at once, so they
+do not depend on the caller's transaction. A route whose insert fails gives
+its reference back with release_upload(), like it used to delete the file.
+Ordering prevents a concurrent upload and delete of the same file from
+losing it. store_upload() takes its reference before putting the file in
+place. release_upload() unlinks while it holds the row lock, so the
+uploader's increment waits until the unlink is done and then writes the file
+again.
+
+If the counts drift (rows edited by hand, a crash between the upload and the
+insert), recount them from the referencing columns with:
+
+    flask --app app uploads repair [--prune]
+"""
+import hashlib
+import logging
+import os
+import re
+import time
+import uuid
+
+import click
+from werkzeug.utils import secure_filename
+
+import db
+from utils.directory_configs import (
+    UPLOAD_FOLDER_ATTACHMENTS, UPLOAD_FOLDER_BASE, UPLOAD_FOLDER_CONDITION_VIDEOS, UPLOAD_FOLDER_CONDITIONS,
+    UPLOAD_FOLDER_DEPARTMENTS, UPLOAD_FOLDER_DOCS, UPLOAD_FOLDER_PROFILE, UPLOAD_FOLDER_VACCINE_CATEGORY_IMAGES,
+)
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 256 * 1024))
+
+# Columns that point at stored files, per folder; `uploads repair` counts references from these.
+# Values are compared by file name, so bare names and 'uploads/<folder>/<name>' paths both match.
+REFERENCE_COLUMNS = {
+    UPLOAD_FOLDER_PROFILE: [('doctors', 'profile_photo_url'), ('users', 'profile_picture')],
+    UPLOAD_FOLDER_DOCS: [('doctor_documents', 'file_path')],
+    UPLOAD_FOLDER_DEPARTMENTS: [('departments', 'image_filename')],
+    UPLOAD_FOLDER_CONDITIONS: [('conditions', 'condition_image_filename')],
+    UPLOAD_FOLDER_CONDITION_VIDEOS: [('conditions', 'condition_video_filename')],
+    UPLOAD_FOLDER_ATTACHMENTS: [('message_attachments', 'file_path')],
+    UPLOAD_FOLDER_VACCINE_CATEGORY_IMAGES: [('vaccine_categories', 'image_filename')],
+}
+
+_STORED_NAME = re.compile(r'^[0-9a-f]{64}(\.[a-z0-9]+)?$')
+
+
+# --- Paths ---
+def _storage_key(path):
+    return os.path.relpath(os.path.abspath(path), UPLOAD_FOLDER_BASE).replace(os.path.sep, '/')
+
+
+def upload_extension(filename):
+    """Lowercase extension of `filename` after secure_filename(), or ''."""
+    safe_name = secure_filename(filename or '')
+    return safe_name.rsplit('.', 1)[1].lower() if '.' in safe_name else ''
+
+
+# --- References ---
+def _add_reference(key, digest, size):
+    with db.connection(dedicated=True) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                INSERT INTO upload_blobs (storage_path, sha256, size_bytes, ref_count) VALUES (%s, %s, %s, 1)
+                ON DUPLICATE KEY UPDATE ref_count = ref_count + 1
+            """, (key, digest, size))
+            conn.commit()
+        finally:
+            cursor.close()
+
+
+def store_upload(file_storage, folder, extension=None):
+    """
+    Saves the uploaded `file_storage` in `folder` as <sha256>.<extension>,
+    takes a reference to it and returns its absolute path. Give the reference
+    back with release_upload(path) when the row pointing at the file is
+    deleted or replaced, or if inserting that row fails.
+    """
+    if extension is None:
+        extension = upload_extension(file_storage.filename)
+    os.makedirs(folder, exist_ok=True)
+    temp_path = os.path.join(folder, f".upload-{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, 'xb') as temp_file:
+            for chunk in iter(lambda: file_storage.stream.read(UPLOAD_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                temp_file.write(chunk)
+                size += len(chunk)
+        hex_digest = digest.hexdigest()
+        path = os.path.join(folder, f"{hex_digest}.{extension}" if extension else hex_digest)
+        _add_reference(_storage_key(path), hex_digest, size)
+        try:
+            if os.path.isfile(path):
+                logger.info(f"Upload deduplicated: {_storage_key(path)} ({size} bytes) is already stored.")
+            else:
+                os.replace(temp_path, path)
+        except OSError:
+            release_upload(path)
+            raise
+        return path
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def release_upload(path):
+    """
+    Gives back one reference to the stored file at `path` and unlinks the file
+    if that was the last one. Returns False only when there was neither a
+    reference nor a file to remove.
+    """
+    key = _storage_key(path)
+    with db.connection(dedicated=True) as conn:
+        cursor = conn.cursor(buffered=True)
+        try:
+            conn.start_transaction()
+            cursor.execute("SELECT ref_count FROM upload_blobs WHERE storage_path = %s FOR UPDATE", (key,))
+            row = cursor.fetchone()
+            if row is not None and row[0] > 1:
+                cursor.execute("UPDATE upload_blobs SET ref_count = ref_count - 1 WHERE storage_path = %s", (key,))
+                conn.commit()
+                return True
+            if row is not None:
+                cursor.execute("DELETE FROM upload_blobs WHERE storage_path = %s", (key,))
+            removed = False
+            if os.path.isfile(path):
+                os.remove(path)  # while the row lock is held; see the module docstring
+                removed = True
+            conn.commit()
+        finally:
+            cursor.close()
+    if removed:
+        logger.info(f"Upload {key} removed; no references left.")
+    return removed or row is not None
+
+
+# --- Repair ---
+def _referenced_names(cursor, folder):
+    counts = {}
+    for table, column in REFERENCE_COLUMNS.get(folder, []):
+        cursor.execute(f"""
+            SELECT SUBSTRING_INDEX({column}, '/', -1) AS name, COUNT(*) FROM {table}
+            WHERE {column} IS NOT NULL AND {column} != '' GROUP BY name
+        """)
+        for name, count in cursor.fetchall():
+            counts[name] = counts.get(name, 0) + count
+    return counts
+
+
+def repair_upload_references(prune=False):
+    """
+    Recounts references for every stored file from REFERENCE_COLUMNS. With
+    prune, stored files nothing points at are deleted. Returns (corrected, pruned).
+    """
+    corrected = pruned = 0
+    with db.connection(dedicated=True) as conn:
+        cursor = conn.cursor(buffered=True)
+        try:
+            cursor.execute("SELECT storage_path, ref_count FROM upload_blobs")
+            recorded = dict(cursor.fetchall())
+            for folder in REFERENCE_COLUMNS:
+                counts = _referenced_names(cursor, folder)
+                names = [name for name in os.listdir(folder) if _STORED_NAME.match(name)] if os.path.isdir(folder) else []
+                for name in names:
+                    path = os.path.join(folder, name)
+                    key = _storage_key(path)
+                    references = counts.get(name, 0)
+                    if references == 0 and prune:
+                        cursor.execute("DELETE FROM upload_blobs WHERE storage_path = %s", (key,))
+                        os.remove(path)
+                        pruned += 1
+                    elif recorded.get(key) != references:
+                        cursor.execute("""
+                            INSERT INTO upload_blobs (storage_path, sha256, size_bytes, ref_count) VALUES (%s, %s, %s, %s)
+                            ON DUPLICATE KEY UPDATE ref_count = VALUES(ref_count)
+                        """, (key, name.split('.', 1)[0], os.path.getsize(path), references))
+                        corrected += 1
+                    recorded.pop(key, None)
+                    conn.commit()
+            for key in recorded:
+                if not os.path.isfile(os.path.join(UPLOAD_FOLDER_BASE, *key.split('/'))):
+                    cursor.execute("DELETE FROM upload_blobs WHERE storage_path = %s", (key,))
+                    corrected += 1
+            conn.commit()
+        finally:
+            cursor.close()
+    if corrected:
+        logger.warning(f"Upload store: corrected {corrected} reference counts.")
+    return corrected, pruned
+
+
+# --- CLI ---
+@click.group('uploads')
+def uploads_cli():
+    """Maintain the content-addressed upload store."""
+
+
+@uploads_cli.command('repair')
+@click.option('--prune', is_flag=True, help='Delete stored files that nothing references.')
+def repair_command(prune):
+    """Recount upload_blobs references from the tables that point at uploaded files. Run while no uploads are in flight."""
+    started = time.perf_counter()
+    corrected, pruned = repair_upload_references(prune)
+    click.echo(f"Corrected {corrected} reference counts, pruned {pruned} files in {time.perf_counter() - started:.1f}s.")
+
+
+def init_upload_store(app):
+    app.cli.add_command(uploads_cli)
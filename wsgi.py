@@ -0,0 +1,16 @@
+# wsgi.py
+"""
+Production entry point:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn preloads this module in the master and forks the workers from it.
+So templates compiled by warm_up() here are shared by every worker. The
+scheduler threads are left to gunicorn.conf.py's post_worker_init hook,
+because threads started in the master do not survive the fork. Under a
+server that does not fork, call app.start_background_tasks(app) after import.
+"""
+from app import create_app, warm_up
+
+app = create_app({"BACKGROUND_TASKS": False})
+warm_up(app)